@@ -0,0 +1,64 @@
+import multiprocessing
+import socket
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from src.benchmarks.bench_ping_flood import DURATION, NUM_CLIENTS, PIPELINE
+from src.whodis.aof import AppendFsync
+from src.whodis.config import Config
+from src.whodis.server import WhodisServer
+
+if TYPE_CHECKING:
+    from multiprocessing.sharedctypes import Synchronized
+
+OK = b"+OK\r\n"
+
+
+def flood(port: int, client_id: int, deadline: float, count: "Synchronized[int]") -> None:
+    key = b"client:%d" % client_id
+    request = b"*3\r\n$3\r\nSET\r\n$%d\r\n%s\r\n$5\r\nvalue\r\n" % (len(key), key) * PIPELINE
+    expected = len(OK) * PIPELINE
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        while time.perf_counter() < deadline:
+            s.sendall(request)
+            received = 0
+            while received < expected:
+                received += len(s.recv(65536))
+
+            with count.get_lock():
+                count.value += PIPELINE
+
+
+def run(config: Config) -> float:
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+
+    count = multiprocessing.Value("q", 0)
+    deadline = time.perf_counter() + DURATION
+    clients = [
+        multiprocessing.Process(target=flood, args=(server.bound_port, i, deadline, count)) for i in range(NUM_CLIENTS)
+    ]
+    for client in clients:
+        client.start()
+
+    for client in clients:
+        client.join()
+
+    server.stop()
+    return count.value / DURATION
+
+
+def main() -> None:
+    print(f"{NUM_CLIENTS} clients, pipeline {PIPELINE}")
+    print(f"no AOF: {run(Config()):,.0f} SET/s")
+    with tempfile.TemporaryDirectory() as directory:
+        for policy in AppendFsync:
+            path = Path(directory) / f"{policy}.aof"
+            config = Config(appendonly=True, appendfilename=str(path), appendfsync=policy)
+            print(f"appendfsync {policy}: {run(config):,.0f} SET/s")
+
+
+if __name__ == "__main__":
+    main()
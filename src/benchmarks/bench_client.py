@@ -0,0 +1,72 @@
+import asyncio
+import socket
+import time
+
+from src.whodis.client import AsyncClient, Client
+from src.whodis.serialise import encode_command
+from src.whodis.server import WhodisServer
+
+NUM_REQUESTS = 10_000
+PIPELINE = 100
+CONCURRENCY = 100
+
+
+def report(name: str, elapsed: float) -> None:
+    print(f"{name}: {NUM_REQUESTS / elapsed:,.0f} requests/s")
+
+
+def connect_per_request(port: int) -> None:
+    # What an application without a pool pays: a TCP handshake per request
+    request = encode_command(["SET", "k", "v"])
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS):
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(request)
+            s.recv(1024)
+    report("new connection per request", time.perf_counter() - start)
+
+
+def pooled(client: Client) -> None:
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS):
+        client.execute("SET", "k", "v")
+    report("pooled connection", time.perf_counter() - start)
+
+
+def pipelined(client: Client) -> None:
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS // PIPELINE):
+        pipe = client.pipeline()
+        for _ in range(PIPELINE):
+            pipe.command("SET", "k", "v")
+        pipe.execute()
+    report(f"pipelines of {PIPELINE}", time.perf_counter() - start)
+
+
+async def multiplexed(port: int) -> None:
+    # Concurrent coroutines each making requests one at a time, sharing one
+    # connection
+    async def worker(client: AsyncClient) -> None:
+        for _ in range(NUM_REQUESTS // CONCURRENCY):
+            await client.execute("SET", "k", "v")
+
+    async with AsyncClient(port=port) as client:
+        await client.connect()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(CONCURRENCY)))
+        report(f"{CONCURRENCY} coroutines multiplexed on one connection", time.perf_counter() - start)
+
+
+def main() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+    connect_per_request(server.bound_port)
+    with Client(port=server.bound_port) as client:
+        pooled(client)
+        pipelined(client)
+    asyncio.run(multiplexed(server.bound_port))
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import timeit
+
+from src.whodis.commands import handle_command
+from src.whodis.keyspace import Keyspace
+from src.whodis.serialise import ReplyWriter
+
+NUMBER = 200_000
+
+CASES = (
+    ["PING"],
+    ["ping"],
+    ["GET", "key:1"],
+    ["SET", "key:1", "value"],
+    ["EXISTS", "key:1"],
+    ["INCR", "counter"],
+    ["STRLEN", "key:1"],
+)
+
+
+def main() -> None:
+    keyspace = Keyspace()
+    keyspace.set("key:1", "value")
+
+    for cmd in CASES:
+        out = ReplyWriter()
+
+        def run(cmd: list[str] = cmd, out: ReplyWriter = out) -> None:
+            handle_command(keyspace, cmd, out)
+
+        elapsed = min(timeit.repeat(run, number=NUMBER, repeat=3)) / NUMBER
+        print(f"{' '.join(cmd):<24} {elapsed * 1e9:8.1f} ns/command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import timeit
+from functools import partial
+
+from src.whodis.deserialise import deserialise
+
+SIZES = (1_000, 10_000, 100_000)
+
+
+def build_mset(num_args: int) -> bytes:
+    parts = [f"*{num_args + 1}\r\n$4\r\nMSET\r\n".encode()]
+    for i in range(num_args):
+        arg = f"key:{i:08d}".encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+    return b"".join(parts)
+
+
+def main() -> None:
+    # Time per argument should stay flat as the message grows if parsing is linear
+    for size in SIZES:
+        msg = build_mset(size)
+        runs = max(1, 200_000 // size)
+        elapsed = min(timeit.repeat(partial(deserialise, msg), number=runs, repeat=3)) / runs
+        print(f"{size:>8} args  {elapsed * 1e3:10.3f} ms/message  {elapsed / size * 1e9:8.1f} ns/arg")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import multiprocessing
+import resource
+import sys
+from collections.abc import Callable
+
+from src.whodis.keyspace import Keyspace
+
+DEFAULT_NUM_KEYS = 10_000_000
+
+# Small keys with the kinds of value caches hold most of
+WORKLOADS: dict[str, Callable[[int], str]] = {
+    "short strings": lambda i: f"value:{i}",
+    "integers": lambda i: str(i * 7919),
+    "flags": lambda i: str(i % 2),
+}
+
+
+def _max_rss() -> int:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _fill(workload: str, num_keys: int, results: "multiprocessing.Queue[tuple[int, int]]") -> None:
+    # Runs in a fresh process, so the growth in peak RSS is all the keyspace's
+    value = WORKLOADS[workload]
+    before = _max_rss()
+    keyspace = Keyspace()
+    for i in range(num_keys):
+        keyspace.set(f"key:{i:012d}", value(i))
+
+    results.put((_max_rss() - before, keyspace.used_memory))
+
+
+def measure(workload: str, num_keys: int) -> tuple[float, float]:
+    # Bytes per key, as measured and as the keyspace accounts for them
+    results: multiprocessing.Queue[tuple[int, int]] = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_fill, args=(workload, num_keys, results))
+    process.start()
+    rss, used_memory = results.get()
+    process.join()
+    return rss / num_keys, used_memory / num_keys
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Measures the memory used per key")
+    parser.add_argument("-n", "--keys", type=int, default=DEFAULT_NUM_KEYS)
+    args = parser.parse_args(argv)
+
+    print(f"{args.keys:,} keys of 16 characters")
+    for workload in WORKLOADS:
+        rss, used_memory = measure(workload, args.keys)
+        print(f"{workload:<14} {rss:6.1f} bytes/key, used_memory {used_memory:6.1f} bytes/key")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import json
+import platform
+import sys
+import timeit
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
+
+from src.whodis.commands import handle_command
+from src.whodis.deserialise import deserialise
+from src.whodis.keyspace import Keyspace
+from src.whodis.serialise import ReplyWriter, encode_command, encode_reply
+
+BASELINES = Path(__file__).with_name("baselines.json")
+REPEAT = 5
+# A case fails if it is this much slower than its baseline. Timings vary from
+# run to run by a few percent, so smaller regressions can't be told from noise
+DEFAULT_TOLERANCE = 0.2
+
+_LARGE_VALUE = "x" * 64 * 1024
+
+
+def _command(*args: str) -> bytes:
+    return encode_command(list(args))
+
+
+def _handle(keyspace: Keyspace, cmd: list[str]) -> Callable[[], None]:
+    out = ReplyWriter()
+
+    def run() -> None:
+        handle_command(keyspace, cmd, out)
+        out.take()
+
+    return run
+
+
+def cases() -> dict[str, Callable[[], object]]:
+    keyspace = Keyspace()
+    keyspace.set("key:1", "value")
+    keyspace.set("large", _LARGE_VALUE)
+    for i in range(10):
+        keyspace.set(f"key:{i}", "value")
+
+    out = ReplyWriter()
+    handle_command(keyspace, ["HSET", "hash", *(f"field:{i}" for i in range(200))], out)
+    handle_command(keyspace, ["RPUSH", "list", *(f"element:{i}" for i in range(1_000))], out)
+    handle_command(keyspace, ["SADD", "intset", *(str(i) for i in range(100))], out)
+    handle_command(keyspace, ["SADD", "set", *(f"member:{i}" for i in range(100))], out)
+    handle_command(keyspace, ["ZADD", "zset", *(arg for i in range(1_000) for arg in (str(i), f"member:{i}"))], out)
+
+    mset = _command("MSET", *(arg for i in range(100) for arg in (f"key:{i:08d}", "value")))
+    return {
+        "deserialise/ping": partial(deserialise, _command("PING")),
+        "deserialise/set": partial(deserialise, _command("SET", "key:1", "value")),
+        "deserialise/mset_100": partial(deserialise, mset),
+        "deserialise/set_64k": partial(deserialise, _command("SET", "key:1", _LARGE_VALUE)),
+        "serialise/ok": partial(encode_reply, "OK"),
+        "serialise/integer": partial(encode_reply, 123_456),
+        "serialise/bulk": partial(encode_reply, "value"),
+        "serialise/array_100": partial(encode_reply, [f"key:{i:08d}" for i in range(100)]),
+        "serialise/command": partial(encode_command, ["SET", "key:1", "value"]),
+        "handle_command/ping": _handle(keyspace, ["PING"]),
+        "handle_command/get": _handle(keyspace, ["GET", "key:1"]),
+        "handle_command/get_missing": _handle(keyspace, ["GET", "missing"]),
+        "handle_command/get_64k": _handle(keyspace, ["GET", "large"]),
+        "handle_command/set": _handle(keyspace, ["SET", "key:1", "value"]),
+        "handle_command/incr": _handle(keyspace, ["INCR", "counter"]),
+        "handle_command/mget_10": _handle(keyspace, ["MGET", *(f"key:{i}" for i in range(10))]),
+        "handle_command/hget": _handle(keyspace, ["HGET", "hash", "field:98"]),
+        "handle_command/hgetall_100": _handle(keyspace, ["HGETALL", "hash"]),
+        "handle_command/lindex_middle": _handle(keyspace, ["LINDEX", "list", "500"]),
+        "handle_command/lrange_100": _handle(keyspace, ["LRANGE", "list", "450", "549"]),
+        "handle_command/sismember": _handle(keyspace, ["SISMEMBER", "intset", "50"]),
+        "handle_command/smembers_100": _handle(keyspace, ["SMEMBERS", "set"]),
+        "handle_command/scan_100": _handle(keyspace, ["SCAN", "0", "COUNT", "100"]),
+        "handle_command/scan_match_100": _handle(keyspace, ["SCAN", "0", "MATCH", "key:*", "COUNT", "100"]),
+        "handle_command/hscan_100": _handle(keyspace, ["HSCAN", "hash", "150", "COUNT", "100"]),
+        "handle_command/zadd_update": _handle(keyspace, ["ZADD", "zset", "500.5", "member:500"]),
+        "handle_command/zscore": _handle(keyspace, ["ZSCORE", "zset", "member:500"]),
+        "handle_command/zrank": _handle(keyspace, ["ZRANK", "zset", "member:500"]),
+        "handle_command/zrange_100": _handle(keyspace, ["ZRANGE", "zset", "450", "549", "WITHSCORES"]),
+        "handle_command/zrangebyscore_100": _handle(keyspace, ["ZRANGEBYSCORE", "zset", "450", "(550"]),
+    }
+
+
+def measure(case: Callable[[], object]) -> float:
+    # Nanoseconds per call, taking the fastest of several runs as the others
+    # are slowed by whatever else the machine was doing
+    timer = timeit.Timer(case)
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number * 1e9
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Times the parser, serialiser and command handlers")
+    parser.add_argument("--save", action="store_true", help=f"store the results as the baselines in {BASELINES.name}")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose names contain this")
+    args = parser.parse_args(argv)
+
+    # Baselines are only comparable on the machine and Python that made them,
+    # so regenerate them with --save after changing either
+    stored = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    baselines: dict[str, float] = stored.get("cases", {})
+    if stored and not args.save:
+        print(f"Comparing with baselines from Python {stored['python']} on {stored['machine']}")
+
+    results: dict[str, float] = {}
+    regressions = []
+    for name, case in cases().items():
+        if args.filter not in name:
+            continue
+
+        elapsed = results[name] = measure(case)
+        baseline = baselines.get(name)
+        if baseline is None or args.save:
+            print(f"{name:<28} {elapsed:10.1f} ns")
+            continue
+
+        change = elapsed / baseline - 1
+        regressed = change > args.tolerance
+        print(f"{name:<28} {elapsed:10.1f} ns  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+
+    if args.save:
+        stored = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cases": {**baselines, **results},
+        }
+        BASELINES.write_text(json.dumps(stored, indent=2) + "\n")
+        print(f"Saved baselines to {BASELINES}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) more than {args.tolerance:.0%} slower than their baselines")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
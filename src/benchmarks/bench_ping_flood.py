@@ -0,0 +1,55 @@
+import multiprocessing
+import socket
+import time
+from typing import TYPE_CHECKING
+
+from src.whodis.server import WhodisServer
+
+if TYPE_CHECKING:
+    from multiprocessing.sharedctypes import Synchronized
+
+NUM_CLIENTS = 8
+PIPELINE = 64
+DURATION = 3.0
+
+PING = b"*1\r\n$4\r\nPING\r\n"
+PONG = b"+PONG\r\n"
+
+
+def flood(port: int, deadline: float, count: "Synchronized[int]") -> None:
+    request = PING * PIPELINE
+    expected = len(PONG) * PIPELINE
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        while time.perf_counter() < deadline:
+            s.sendall(request)
+            received = 0
+            while received < expected:
+                received += len(s.recv(65536))
+
+            with count.get_lock():
+                count.value += PIPELINE
+
+
+def main() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    # Clients run in their own processes so they don't compete with the
+    # server for the GIL
+    count = multiprocessing.Value("q", 0)
+    deadline = time.perf_counter() + DURATION
+    clients = [
+        multiprocessing.Process(target=flood, args=(server.bound_port, deadline, count)) for _ in range(NUM_CLIENTS)
+    ]
+    for client in clients:
+        client.start()
+
+    for client in clients:
+        client.join()
+
+    server.stop()
+    print(f"{NUM_CLIENTS} clients, pipeline {PIPELINE}: {count.value / DURATION:,.0f} PING/s")
+
+
+if __name__ == "__main__":
+    main()
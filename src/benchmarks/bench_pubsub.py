@@ -0,0 +1,160 @@
+import multiprocessing
+import selectors
+import socket
+import time
+import timeit
+from typing import TYPE_CHECKING, cast
+
+from src.whodis.glob import compile_glob
+from src.whodis.pubsub import PubSub, message_frame
+from src.whodis.serialise import encode_command
+from src.whodis.server import WhodisServer
+
+if TYPE_CHECKING:
+    from multiprocessing.synchronize import Barrier
+
+NUM_SUBSCRIBERS = 10_000
+# Subscribers are spread over several processes, each with its own sockets
+NUM_PROCESSES = 4
+NUM_MESSAGES = 100
+MESSAGE = "x" * 100
+NUM_PATTERNS = 10_000
+ROUNDS = 5
+
+
+class _Subscriber:
+    __slots__ = ("received",)
+
+    def __init__(self) -> None:
+        self.received = 0
+
+    def deliver(self, frame: bytes) -> None:
+        self.received += len(frame)
+
+
+def fan_out_cost() -> None:
+    # The server-side cost of a PUBLISH to 10k subscribers, with delivery
+    # reduced to a method call, against encoding the frame for each of them
+    pubsub = PubSub()
+    subscribers = [_Subscriber() for _ in range(NUM_SUBSCRIBERS)]
+    for subscriber in subscribers:
+        pubsub.subscribe(subscriber, "news")
+
+    def encode_each() -> None:
+        for subscriber in subscribers:
+            subscriber.deliver(message_frame("news", MESSAGE))
+
+    shared = min(timeit.repeat(lambda: pubsub.publish("news", MESSAGE), number=10, repeat=ROUNDS)) / 10
+    each = min(timeit.repeat(encode_each, number=10, repeat=ROUNDS)) / 10
+    print(
+        f"PUBLISH to {NUM_SUBSCRIBERS:,} subscribers: {shared * 1e3:.2f} ms with one shared frame, "
+        f"{each * 1e3:.2f} ms encoding a frame per subscriber",
+    )
+
+
+def pattern_matching_cost() -> None:
+    # Publishing to a channel with 10k patterns subscribed, one per user, of
+    # which one matches
+    pubsub = PubSub()
+    subscriber = _Subscriber()
+    patterns = [f"user:{i}:*" for i in range(NUM_PATTERNS)]
+    for pattern in patterns:
+        pubsub.psubscribe(subscriber, pattern)
+    regexes = [compile_glob(pattern) for pattern in patterns]
+    channel = f"user:{NUM_PATTERNS // 2}:inbox"
+
+    def linear_scan() -> None:
+        for regex in regexes:
+            if regex.fullmatch(channel):
+                subscriber.deliver(b"")
+
+    number = 1000
+    indexed = min(timeit.repeat(lambda: pubsub.publish(channel, MESSAGE), number=number, repeat=ROUNDS)) / number
+    scanned = min(timeit.repeat(linear_scan, number=10, repeat=ROUNDS)) / 10
+    print(
+        f"PUBLISH with {NUM_PATTERNS:,} patterns: {indexed * 1e6:.1f} us through the prefix index, "
+        f"{scanned * 1e6:.1f} us matching every pattern",
+    )
+
+
+def subscribe(port: int, num_subscribers: int, expected: int, ready: "Barrier", done: "Barrier") -> None:
+    confirmation = b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n"
+    sockets = []
+    for _ in range(num_subscribers):
+        s = socket.create_connection(("127.0.0.1", port))
+        s.sendall(encode_command(["SUBSCRIBE", "news"]))
+        sockets.append(s)
+    for s in sockets:
+        received = b""
+        while len(received) < len(confirmation):
+            received += s.recv(len(confirmation) - len(received))
+        s.setblocking(False)  # noqa: FBT003
+
+    ready.wait()
+    selector = selectors.DefaultSelector()
+    remaining = {}
+    for s in sockets:
+        selector.register(s, selectors.EVENT_READ)
+        remaining[s] = expected
+    while remaining:
+        for key, _ in selector.select():
+            s = cast("socket.socket", key.fileobj)
+            remaining[s] -= len(s.recv(65536))
+            if not remaining[s]:
+                selector.unregister(s)
+                del remaining[s]
+
+    done.wait()
+    for s in sockets:
+        s.close()
+
+
+def end_to_end() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    frame = message_frame("news", MESSAGE)
+    per_process = NUM_SUBSCRIBERS // NUM_PROCESSES
+    ready = multiprocessing.Barrier(NUM_PROCESSES + 1)
+    done = multiprocessing.Barrier(NUM_PROCESSES + 1)
+    processes = [
+        multiprocessing.Process(
+            target=subscribe,
+            args=(server.bound_port, per_process, len(frame) * NUM_MESSAGES, ready, done),
+        )
+        for _ in range(NUM_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+
+    ready.wait()
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as publisher:
+        start = time.perf_counter()
+        request = encode_command(["PUBLISH", "news", MESSAGE])
+        for _ in range(NUM_MESSAGES):
+            publisher.sendall(request)
+            publisher.recv(1024)
+        publish_elapsed = time.perf_counter() - start
+        done.wait()
+        elapsed = time.perf_counter() - start
+
+    for process in processes:
+        process.join()
+    server.stop()
+
+    deliveries = NUM_SUBSCRIBERS * NUM_MESSAGES
+    print(
+        f"{NUM_MESSAGES} messages to {NUM_SUBSCRIBERS:,} subscribers over TCP: "
+        f"{publish_elapsed / NUM_MESSAGES * 1e3:.1f} ms per PUBLISH, "
+        f"{deliveries / elapsed:,.0f} deliveries/s until all were received",
+    )
+
+
+def main() -> None:
+    fan_out_cost()
+    pattern_matching_cost()
+    end_to_end()
+
+
+if __name__ == "__main__":
+    main()
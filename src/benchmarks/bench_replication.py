@@ -0,0 +1,119 @@
+import multiprocessing
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+from src.benchmarks.bench_aof import flood
+from src.benchmarks.bench_ping_flood import DURATION, NUM_CLIENTS, PIPELINE
+from src.whodis.config import Config
+from src.whodis.serialise import encode_command
+from src.whodis.server import WhodisServer
+
+NUM_KEYS = 100_000
+
+
+def request(port: int, *cmd: str) -> bytes:
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(encode_command(list(cmd)))
+        # Every reply used here fits in one read
+        return s.recv(65536)
+
+
+def replication_info(port: int) -> dict[str, str]:
+    reply = request(port, "INFO", "replication").decode()
+    return dict(line.split(":", 1) for line in reply.splitlines()[1:] if ":" in line)
+
+
+def start(directory: str, name: str) -> WhodisServer:
+    server = WhodisServer(host="", port=0, config=Config(dbfilename=str(Path(directory) / f"{name}.wdb")))
+    server.start()
+    return server
+
+
+def wait_for_link(replica: WhodisServer) -> float:
+    start = time.perf_counter()
+    while replication_info(replica.bound_port).get("master_link_status") != "up":
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def wait_until_caught_up(primary: WhodisServer, replica: WhodisServer) -> float:
+    start = time.perf_counter()
+    target = replication_info(primary.bound_port)["master_repl_offset"]
+    while replication_info(replica.bound_port)["slave_repl_offset"] != target:
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def write_throughput(directory: str, *, with_replica: bool) -> None:
+    # SETs per second on the primary, and how long the replica takes to apply
+    # the last of them once the clients stop
+    primary = start(directory, "primary")
+    replica = None
+    if with_replica:
+        replica = start(directory, "replica")
+        request(replica.bound_port, "REPLICAOF", "127.0.0.1", str(primary.bound_port))
+        wait_for_link(replica)
+
+    count = multiprocessing.Value("q", 0)
+    deadline = time.perf_counter() + DURATION
+    clients = [
+        multiprocessing.Process(target=flood, args=(primary.bound_port, i, deadline, count)) for i in range(NUM_CLIENTS)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    result = f"{count.value / DURATION:,.0f} SET/s"
+    if replica is not None:
+        lag = wait_until_caught_up(primary, replica)
+        streamed = int(replication_info(primary.bound_port)["master_repl_offset"])
+        result += f", {streamed / DURATION / 1e6:.1f} MB/s streamed, replica caught up {lag * 1e3:.0f} ms later"
+        replica.stop()
+    primary.stop()
+    print(f"{'one replica' if with_replica else 'no replicas'}: {result}")
+
+
+def resync_cost(directory: str) -> None:
+    # A replica that reconnects resumes from the backlog instead of being sent
+    # a snapshot of every key
+    primary = start(directory, "primary")
+    with socket.create_connection(("127.0.0.1", primary.bound_port)) as s:
+        batch = 1000
+        for i in range(0, NUM_KEYS, batch):
+            s.sendall(b"".join(encode_command(["SET", f"key:{j}", "x" * 32]) for j in range(i, i + batch)))
+            received = 0
+            while received < batch * len(b"+OK\r\n"):
+                received += len(s.recv(65536))
+
+    replica = start(directory, "replica")
+    request(replica.bound_port, "REPLICAOF", "127.0.0.1", str(primary.bound_port))
+    full = wait_for_link(replica)
+
+    # Following another primary keeps the data and offset, so coming back to
+    # this one can carry on from where the replica left off
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        unused = s.getsockname()[1]
+    request(replica.bound_port, "REPLICAOF", "127.0.0.1", str(unused))
+    request(primary.bound_port, "SET", "missed", "x")
+    request(replica.bound_port, "REPLICAOF", "127.0.0.1", str(primary.bound_port))
+    partial = wait_for_link(replica)
+
+    replica.stop()
+    primary.stop()
+    print(f"resync with {NUM_KEYS:,} keys: full {full * 1e3:.0f} ms, partial {partial * 1e3:.0f} ms")
+
+
+def main() -> None:
+    print(f"{NUM_CLIENTS} clients, pipeline {PIPELINE}")
+    with tempfile.TemporaryDirectory() as directory:
+        write_throughput(directory, with_replica=False)
+        write_throughput(directory, with_replica=True)
+        resync_cost(directory)
+
+
+if __name__ == "__main__":
+    main()
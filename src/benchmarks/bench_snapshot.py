@@ -0,0 +1,75 @@
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from src.whodis.aof import AppendOnlyFile, rewrite_commands
+from src.whodis.keyspace import Keyspace
+from src.whodis.snapshot import load_snapshot, save_snapshot
+
+DATASET_SIZES = (100_000, 1_000_000)
+VALUE_SIZE = 32
+# A tenth of the keys have an expiry, well in the future
+EXPIRING_EVERY = 10
+
+
+def _dataset(num_keys: int) -> Keyspace:
+    keyspace = Keyspace()
+    expire_at = keyspace.now_ms() + 3_600_000
+    value = "v" * VALUE_SIZE
+    for i in range(num_keys):
+        keyspace.set(f"key:{i:08d}", value, expire_at if i % EXPIRING_EVERY == 0 else None)
+
+    return keyspace
+
+
+def _timed(load: Callable[[Keyspace], object]) -> tuple[float, int]:
+    keyspace = Keyspace()
+    start = time.perf_counter()
+    load(keyspace)
+    return time.perf_counter() - start, len(keyspace)
+
+
+def _load_aof(path: Path, keyspace: Keyspace) -> None:
+    aof = AppendOnlyFile(path)
+    aof.load(keyspace)
+    aof.close()
+
+
+def run(num_keys: int, directory: Path) -> None:
+    keyspace = _dataset(num_keys)
+    snapshot_path = directory / f"dump-{num_keys}.wdb"
+    aof_path = directory / f"appendonly-{num_keys}.aof"
+
+    start = time.perf_counter()
+    save_snapshot(snapshot_path, keyspace)
+    save_elapsed = time.perf_counter() - start
+
+    # The AOF a rewrite would produce, which is the smallest log for the data
+    aof = AppendOnlyFile(aof_path)
+    for cmd in rewrite_commands(keyspace):
+        aof.feed(cmd)
+    aof.close()
+
+    snapshot_elapsed, snapshot_keys = _timed(lambda ks: load_snapshot(snapshot_path, ks))
+    aof_elapsed, aof_keys = _timed(lambda ks: _load_aof(aof_path, ks))
+    if not snapshot_keys == aof_keys == num_keys:
+        msg = f"Loaded {snapshot_keys} keys from the snapshot and {aof_keys} from the AOF, expected {num_keys}"
+        raise RuntimeError(msg)
+
+    snapshot_mib = snapshot_path.stat().st_size / 2**20
+    aof_mib = aof_path.stat().st_size / 2**20
+    print(f"{num_keys:,} keys:")
+    print(f"  snapshot save  {save_elapsed:6.2f}s  {snapshot_mib:7.1f} MiB")
+    print(f"  snapshot load  {snapshot_elapsed:6.2f}s  {num_keys / snapshot_elapsed:,.0f} keys/s")
+    print(f"  AOF replay     {aof_elapsed:6.2f}s  {num_keys / aof_elapsed:,.0f} keys/s  ({aof_mib:.1f} MiB)")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        for num_keys in DATASET_SIZES:
+            run(num_keys, Path(directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import math
+import multiprocessing
+import time
+import timeit
+
+from src.benchmarks.bench_ping_flood import DURATION, NUM_CLIENTS, PIPELINE, flood
+from src.whodis.commands import COMMAND_TABLE, handle_command
+from src.whodis.config import Config
+from src.whodis.keyspace import Keyspace
+from src.whodis.serialise import ReplyWriter
+from src.whodis.server import WhodisServer
+from src.whodis.stats import ServerStats
+
+# Configurations are run alternately, keeping the best of each, so that noise
+# from the rest of the machine affects both alike
+ROUNDS = 3
+NUMBER = 200_000
+
+
+def run(config: Config) -> float:
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+
+    count = multiprocessing.Value("q", 0)
+    deadline = time.perf_counter() + DURATION
+    clients = [
+        multiprocessing.Process(target=flood, args=(server.bound_port, deadline, count)) for _ in range(NUM_CLIENTS)
+    ]
+    for client in clients:
+        client.start()
+
+    for client in clients:
+        client.join()
+
+    server.stop()
+    return count.value / DURATION
+
+
+def recording_cost() -> float:
+    # Nanoseconds to time and record a command as the server does, including
+    # its share of the cron's aggregation
+    stats = ServerStats(COMMAND_TABLE)
+    cmd = ["PING"]
+
+    def record() -> None:
+        start = time.perf_counter_ns()
+        stats.record_command(cmd, time.perf_counter_ns() - start)
+
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(NUMBER):
+            record()
+        stats.aggregate()
+        elapsed = min(elapsed or math.inf, time.perf_counter() - start)
+
+    return elapsed / NUMBER * 1e9
+
+
+def handling_cost() -> float:
+    keyspace = Keyspace()
+    out = ReplyWriter()
+    cmd = ["PING"]
+
+    def handle() -> None:
+        handle_command(keyspace, cmd, out)
+        out.take()
+
+    return min(timeit.repeat(handle, number=NUMBER, repeat=ROUNDS)) / NUMBER * 1e9
+
+
+def main() -> None:
+    record_ns = recording_cost()
+    print(f"handle_command PING: {handling_cost():.0f} ns, timing and recording it: {record_ns:.0f} ns")
+
+    # Call counts and timings are always kept; latency histograms and the slow
+    # log can be turned off
+    configs = {
+        "latency tracking and slow log off": Config(latency_tracking=False, slowlog_log_slower_than=-1),
+        "latency tracking and slow log on": Config(),
+    }
+    best = dict.fromkeys(configs, 0.0)
+    for _ in range(ROUNDS):
+        for name, config in configs.items():
+            best[name] = max(best[name], run(config))
+
+    print(f"{NUM_CLIENTS} clients, pipeline {PIPELINE}, best of {ROUNDS}")
+    for name, throughput in best.items():
+        # The share of the time spent on each PING, server and clients
+        # included, that goes on recording it
+        print(f"{name}: {throughput:,.0f} PING/s, recording is {record_ns * 1e-9 * throughput:.1%} of each PING")
+
+
+if __name__ == "__main__":
+    main()
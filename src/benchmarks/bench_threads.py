@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from src.whodis.benchmark import Workload, parse_mix, run_workload
+from src.whodis.commands import command_keys, handle_command
+from src.whodis.keyspace import Keyspace
+from src.whodis.serialise import ReplyWriter
+from src.whodis.server import ThreadedServer
+from src.whodis.sharding import DEFAULT_SHARDS, ShardedKeyspace
+
+if TYPE_CHECKING:
+    from multiprocessing.queues import Queue
+    from multiprocessing.synchronize import Event
+
+THREAD_COUNTS = (1, 2, 4, 8)
+NUM_KEYS = 100_000
+DURATION = 2.0
+# Load comes from other processes, so the clients don't compete with the
+# server's threads for the interpreter
+CLIENT_PROCESSES = 4
+NUM_CLIENTS = 64
+NUM_REQUESTS = 200_000
+
+
+def execute(keyspace: ShardedKeyspace, deadline: float, seed: int, counts: list[int]) -> None:
+    # GETs and SETs of random keys, with an MSET across shards one time in ten
+    rng = random.Random(seed)  # noqa: S311
+    out = ReplyWriter()
+    done = 0
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            key = f"key:{rng.randrange(NUM_KEYS)}"
+            choice = rng.randrange(10)
+            if choice == 0:
+                cmd = ["MSET", key, "v", f"key:{rng.randrange(NUM_KEYS)}", "v"]
+            elif choice < 5:  # noqa: PLR2004
+                cmd = ["SET", key, "v"]
+            else:
+                cmd = ["GET", key]
+            with keyspace.locked(command_keys(cmd)) as locked:
+                handle_command(locked, cmd, out)
+            out.take()
+        done += 100
+    counts[seed] = done
+
+
+def in_process(num_threads: int) -> float:
+    # Commands run straight against the sharded keyspace, without sockets
+    keyspace = ShardedKeyspace(DEFAULT_SHARDS, Keyspace)
+    counts = [0] * num_threads
+    deadline = time.perf_counter() + DURATION
+    threads = [threading.Thread(target=execute, args=(keyspace, deadline, i, counts)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / DURATION
+
+
+def serve(num_threads: int, ports: "Queue[int]", stop: "Event") -> None:
+    server = ThreadedServer(host="", port=0, threads=num_threads)
+    server.start()
+    ports.put(server.bound_port)
+    stop.wait()
+    server.stop()
+
+
+def over_tcp(num_threads: int) -> float:
+    context = multiprocessing.get_context("spawn")
+    ports: Queue[int] = context.Queue()
+    stop = context.Event()
+    process = context.Process(target=serve, args=(num_threads, ports, stop))
+    process.start()
+    port = ports.get()
+
+    workload = Workload(name="get:1,set:1", mix=parse_mix("get:1,set:1"), keyspace=NUM_KEYS)
+    result = run_workload(
+        "127.0.0.1",
+        port,
+        workload,
+        clients=NUM_CLIENTS,
+        requests=NUM_REQUESTS,
+        processes=CLIENT_PROCESSES,
+    )
+    stop.set()
+    process.join()
+    return result.ops_per_second
+
+
+def main() -> None:
+    gil = "enabled" if sys._is_gil_enabled() else "disabled"  # noqa: SLF001
+    print(f"Python {sys.version.split()[0]}, GIL {gil}, {os.cpu_count()} CPUs, {DEFAULT_SHARDS} shards")
+    for num_threads in THREAD_COUNTS:
+        direct = in_process(num_threads)
+        tcp = over_tcp(num_threads)
+        print(f"{num_threads} threads: {direct:,.0f} commands/s in process, {tcp:,.0f} requests/s over TCP")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import socket
+import time
+from typing import TYPE_CHECKING
+
+from src.whodis.workers import Supervisor
+
+if TYPE_CHECKING:
+    from multiprocessing.sharedctypes import Synchronized
+
+WORKER_COUNTS = (1, 2, 4)
+NUM_CLIENTS = 8
+NUM_KEYS = 1_000
+PIPELINE = 64
+DURATION = 3.0
+
+
+def _get(i: int) -> bytes:
+    key = b"key:%04d" % (i % NUM_KEYS)
+    return b"*2\r\n$3\r\nGET\r\n$%d\r\n%s\r\n" % (len(key), key)
+
+
+def _reply(i: int) -> bytes:
+    return b"$4\r\n%04d\r\n" % (i % NUM_KEYS)
+
+
+def load(port: int) -> None:
+    requests = b"".join(b"*3\r\n$3\r\nSET\r\n$8\r\nkey:%04d\r\n$4\r\n%04d\r\n" % (i, i) for i in range(NUM_KEYS))
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.sendall(requests)
+        expected = len(b"+OK\r\n") * NUM_KEYS
+        received = 0
+        while received < expected:
+            received += len(s.recv(65536))
+
+
+def flood(port: int, client_id: int, deadline: float, count: "Synchronized[int]") -> None:
+    # Each client reads a different run of keys, most of which are owned by
+    # another worker when there are several
+    offset = client_id * PIPELINE
+    request = b"".join(_get(offset + i) for i in range(PIPELINE))
+    expected = sum(len(_reply(offset + i)) for i in range(PIPELINE))
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        while time.perf_counter() < deadline:
+            s.sendall(request)
+            received = 0
+            while received < expected:
+                received += len(s.recv(65536))
+
+            with count.get_lock():
+                count.value += PIPELINE
+
+
+def run(num_workers: int) -> float:
+    supervisor = Supervisor(host="127.0.0.1", port=0, num_workers=num_workers)
+    supervisor.start()
+    load(supervisor.bound_port)
+
+    count = multiprocessing.Value("q", 0)
+    deadline = time.perf_counter() + DURATION
+    clients = [
+        multiprocessing.Process(target=flood, args=(supervisor.bound_port, i, deadline, count))
+        for i in range(NUM_CLIENTS)
+    ]
+    for client in clients:
+        client.start()
+
+    for client in clients:
+        client.join()
+
+    supervisor.stop()
+    return count.value / DURATION
+
+
+def main() -> None:
+    # Throughput only scales while there are spare cores for the workers and
+    # for the client processes generating the load
+    print(f"{os.cpu_count()} CPUs, {NUM_CLIENTS} clients, pipeline {PIPELINE}")
+    for num_workers in WORKER_COUNTS:
+        print(f"{num_workers} worker(s): {run(num_workers):,.0f} GET/s")
+
+
+if __name__ == "__main__":
+    main()
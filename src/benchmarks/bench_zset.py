@@ -0,0 +1,127 @@
+import argparse
+import bisect
+import random
+import time
+from collections.abc import Callable, Iterator
+
+from src.whodis.datatypes import EncodingLimits, ZSet
+
+DEFAULT_NUM_MEMBERS = 1_000_000
+NUM_OPERATIONS = 10_000
+RANGE_LENGTH = 100
+LIMITS = EncodingLimits()
+
+
+class SortedListZSet:
+    # The naive baseline: (score, member) pairs in one sorted list, with a dict
+    # for scores. Ranks are a bisect, but every update moves half the list
+    def __init__(self) -> None:
+        self._entries: list[tuple[float, bytes]] = []
+        self._scores: dict[bytes, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def score(self, member: bytes) -> float | None:
+        return self._scores.get(member)
+
+    def add(self, member: bytes, score: float, limits: EncodingLimits) -> bool:  # noqa: ARG002
+        old = self._scores.get(member)
+        if old is not None:
+            del self._entries[bisect.bisect_left(self._entries, (old, member))]
+        bisect.insort(self._entries, (score, member))
+        self._scores[member] = score
+        return old is None
+
+    def rank(self, member: bytes) -> int | None:
+        score = self._scores.get(member)
+        return None if score is None else bisect.bisect_left(self._entries, (score, member))
+
+    def count_below(self, score: float, *, inclusive: bool) -> int:
+        if inclusive:
+            return bisect.bisect_right(self._entries, (score, b"\xff" * 64))
+        return bisect.bisect_left(self._entries, (score, b""))
+
+    def range(self, start: int, count: int) -> Iterator[tuple[bytes, float]]:
+        return ((member, score) for score, member in self._entries[start : start + count])
+
+
+ZSetLike = ZSet | SortedListZSet
+
+
+def _build(zset: ZSetLike, num_members: int, rng: random.Random) -> float:
+    # Members are added in random order, as a leaderboard fills up; the sorted
+    # list is built by sorting once, as inserting each would take quadratic time
+    start = time.perf_counter()
+    if isinstance(zset, SortedListZSet):
+        zset._scores = {b"player:%d" % i: rng.random() * num_members for i in range(num_members)}  # noqa: SLF001
+        zset._entries = sorted((score, member) for member, score in zset._scores.items())  # noqa: SLF001
+    else:
+        for i in range(num_members):
+            zset.add(b"player:%d" % i, rng.random() * num_members, LIMITS)
+
+    return time.perf_counter() - start
+
+
+def _operations(zset: ZSetLike, num_members: int, rng: random.Random) -> dict[str, Callable[[], object]]:
+    def zadd_new() -> None:
+        zset.add(b"new:%d" % rng.randrange(2**40), rng.random() * num_members, LIMITS)
+
+    def zincrby() -> None:
+        member = b"player:%d" % rng.randrange(num_members)
+        zset.add(member, (zset.score(member) or 0) + rng.random() * 100, LIMITS)
+
+    def zrank() -> None:
+        zset.rank(b"player:%d" % rng.randrange(num_members))
+
+    def zrange() -> None:
+        for _ in zset.range(rng.randrange(num_members - RANGE_LENGTH), RANGE_LENGTH):
+            pass
+
+    def zrangebyscore() -> None:
+        low = rng.random() * (num_members - RANGE_LENGTH)
+        start = zset.count_below(low, inclusive=False)
+        count = zset.count_below(low + RANGE_LENGTH, inclusive=True) - start
+        for _ in zset.range(start, count):
+            pass
+
+    return {
+        "ZADD new member": zadd_new,
+        "ZINCRBY": zincrby,
+        "ZRANK": zrank,
+        f"ZRANGE {RANGE_LENGTH}": zrange,
+        f"ZRANGEBYSCORE ~{RANGE_LENGTH}": zrangebyscore,
+    }
+
+
+def measure(zset: ZSetLike, num_members: int) -> tuple[float, dict[str, float]]:
+    # Seconds to build the set, and microseconds per operation on it
+    rng = random.Random(42)  # noqa: S311
+    build = _build(zset, num_members, rng)
+    timings = {}
+    for name, operation in _operations(zset, num_members, rng).items():
+        start = time.perf_counter()
+        for _ in range(NUM_OPERATIONS):
+            operation()
+        timings[name] = (time.perf_counter() - start) / NUM_OPERATIONS * 1e6
+
+    return build, timings
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compares sorted sets with a sorted list baseline")
+    parser.add_argument("-n", "--members", type=int, default=DEFAULT_NUM_MEMBERS)
+    args = parser.parse_args(argv)
+
+    skiplist_build, skiplist = measure(ZSet(), args.members)
+    baseline_build, baseline = measure(SortedListZSet(), args.members)
+
+    print(f"{args.members:,} members, {NUM_OPERATIONS:,} operations each")
+    print(f"{'':<20} {'skiplist':>12} {'sorted list':>12}")
+    print(f"{'build':<20} {skiplist_build:11.2f}s {baseline_build:11.2f}s")
+    for name, elapsed in skiplist.items():
+        print(f"{name:<20} {elapsed:10.2f}us {baseline[name]:10.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import socket
+import time
+from pathlib import Path
+
+import pytest
+
+from src.whodis.aof import AOF_FSYNC_INTERVAL, AppendFsync, AppendOnlyFile, with_absolute_expiry
+from src.whodis.commands import handle_command
+from src.whodis.config import Config
+from src.whodis.datatypes import ZSet
+from src.whodis.eviction import EvictionPolicy
+from src.whodis.keyspace import Keyspace
+from src.whodis.serialise import ReplyWriter, encode_command
+from src.whodis.server import WhodisServer
+
+NUM_WRITES = 100
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _run(keyspace: Keyspace, aof: AppendOnlyFile, *cmds: list[str]) -> None:
+    # Logs commands the way the server does, if they change the keyspace
+    out = ReplyWriter()
+    for cmd in cmds:
+        dirty = keyspace.dirty
+        handle_command(keyspace, cmd, out)
+        if keyspace.dirty != dirty:
+            aof.feed(with_absolute_expiry(cmd, keyspace))
+
+
+def _load(path: Path, clock: _FakeClock | None = None) -> Keyspace:
+    keyspace = Keyspace() if clock is None else Keyspace(clock=clock)
+    aof = AppendOnlyFile(path)
+    aof.load(keyspace)
+    aof.close()
+    return keyspace
+
+
+def test_replay_restores_keyspace(tmp_path: Path) -> None:
+    path = tmp_path / "appendonly.aof"
+    keyspace = Keyspace()
+    aof = AppendOnlyFile(path)
+    _run(
+        keyspace,
+        aof,
+        ["SET", "a", "1"],
+        ["INCR", "a"],
+        ["APPEND", "b", "x"],
+        ["APPEND", "b", "y"],
+        ["MSET", "c", "3", "d", "4"],
+        ["DEL", "c"],
+        ["SET", "a", "ignored", "NX"],
+        ["GET", "a"],
+    )
+    aof.close()
+
+    loaded = _load(path)
+
+    assert len(loaded) == len(keyspace)
+    assert [loaded.get(key) for key in "abcd"] == [2, b"xy", None, 4]
+
+
+@pytest.mark.parametrize(
+    ("cmd", "expected"),
+    [
+        pytest.param(["SET", "k", "v", "EX", "10"], ["SET", "k", "v", "PXAT", "1000010000"], id="set_ex"),
+        pytest.param(["set", "k", "v", "px", "500", "XX"], ["set", "k", "v", "PXAT", "1000000500", "XX"], id="set_px"),
+        pytest.param(["EXPIRE", "k", "10"], ["PEXPIREAT", "k", "1000010000"], id="expire"),
+        pytest.param(["PEXPIRE", "k", "10"], ["PEXPIREAT", "k", "1000000010"], id="pexpire"),
+        pytest.param(["EXPIRE", "k", "-1"], ["DEL", "k"], id="expire_past"),
+        pytest.param(["SET", "k", "v"], ["SET", "k", "v"], id="no_expiry"),
+    ],
+)
+def test_relative_expiry_is_logged_as_absolute(cmd: list[str], expected: list[str]) -> None:
+    keyspace = Keyspace(clock=_FakeClock())
+    handle_command(keyspace, ["SET", "k", "v"], ReplyWriter())
+    handle_command(keyspace, cmd, ReplyWriter())
+
+    assert with_absolute_expiry(cmd, keyspace) == expected
+
+
+def test_replayed_expiry_is_not_extended(tmp_path: Path) -> None:
+    path = tmp_path / "appendonly.aof"
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    aof = AppendOnlyFile(path)
+    _run(keyspace, aof, ["SET", "a", "1", "EX", "10"], ["SET", "b", "2"], ["EXPIRE", "b", "20"])
+    aof.close()
+
+    clock.now += 15
+    loaded = _load(path, clock)
+
+    assert loaded.get("a") is None
+    assert loaded.get("b") == 2  # noqa: PLR2004
+
+
+def test_truncated_command_is_dropped(tmp_path: Path) -> None:
+    path = tmp_path / "appendonly.aof"
+    complete = b"*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n"
+    path.write_bytes(complete + b"*3\r\n$3\r\nSET\r\n$1\r\nb")
+
+    keyspace = Keyspace()
+    aof = AppendOnlyFile(path)
+    loaded = aof.load(keyspace)
+    # Later writes follow on from the last complete command
+    _run(keyspace, aof, ["SET", "c", "3"])
+    aof.close()
+
+    assert loaded == 1
+    assert path.read_bytes() == complete + b"*3\r\n$3\r\nSET\r\n$1\r\nc\r\n$1\r\n3\r\n"
+
+
+@pytest.mark.parametrize(
+    ("policy", "expected_fsyncs"),
+    [
+        pytest.param(AppendFsync.ALWAYS, range(10, 11), id="always"),
+        # Flushes happen every 0.25s, so at most one in four is followed by an
+        # fsync (fewer if a background fsync is still running)
+        pytest.param(AppendFsync.EVERYSEC, range(1, 3), id="everysec"),
+        pytest.param(AppendFsync.NO, range(1), id="no"),
+    ],
+)
+def test_fsync_policy(tmp_path: Path, policy: AppendFsync, expected_fsyncs: range) -> None:
+    clock = _FakeClock()
+    keyspace = Keyspace()
+    aof = AppendOnlyFile(tmp_path / "appendonly.aof", policy, clock=clock)
+    for i in range(10):
+        # Each flush is one group commit, covering all of its writes
+        _run(keyspace, aof, *(["SET", f"key:{i}:{j}", "v"] for j in range(NUM_WRITES)))
+        aof.flush()
+        clock.now += AOF_FSYNC_INTERVAL / 4
+
+    fsyncs = aof.fsyncs
+    aof.close()
+
+    assert fsyncs in expected_fsyncs
+
+
+def _wait_for_rewrite(aof: AppendOnlyFile) -> None:
+    deadline = time.monotonic() + 10
+    while not aof.poll_rewrite():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_rewrite_compacts_log(tmp_path: Path) -> None:
+    path = tmp_path / "appendonly.aof"
+    keyspace = Keyspace()
+    aof = AppendOnlyFile(path)
+    _run(keyspace, aof, *(["INCR", "counter"] for _ in range(1_000)), ["SET", "gone", "x"], ["DEL", "gone"])
+    aof.flush()
+    size_before = path.stat().st_size
+
+    assert aof.start_rewrite(keyspace)
+    assert not aof.start_rewrite(keyspace)
+    # Writes made while the child runs are added to the new file
+    _run(keyspace, aof, ["INCR", "counter"], ["SET", "during", "rewrite"])
+    aof.flush()
+    _wait_for_rewrite(aof)
+    _run(keyspace, aof, ["SET", "after", "rewrite"])
+    aof.close()
+
+    loaded = _load(path)
+
+    assert path.stat().st_size < size_before / 10
+    assert loaded.get("counter") == 1001  # noqa: PLR2004
+    assert loaded.get("during") == b"rewrite"
+    assert loaded.get("after") == b"rewrite"
+    assert loaded.get("gone") is None
+
+
+def test_rewrite_splits_large_collections(tmp_path: Path) -> None:
+    path = tmp_path / "appendonly.aof"
+    keyspace = Keyspace()
+    aof = AppendOnlyFile(path)
+    _run(
+        keyspace,
+        aof,
+        ["RPUSH", "list", *(f"{i}" for i in range(100))],
+        ["HSET", "hash", *(f"{i}" for i in range(200))],
+        ["SADD", "set", "a", "b"],
+        ["PEXPIRE", "set", "100000"],
+        ["ZADD", "zset", *(arg for i in range(100) for arg in (str(i / 7), f"{i}"))],
+    )
+
+    aof.start_rewrite(keyspace)
+    _wait_for_rewrite(aof)
+    aof.close()
+
+    loaded = _load(path)
+    commands = path.read_bytes().count(b"*")
+
+    # Two each of RPUSH, HSET and ZADD, and SADD and PEXPIREAT for the set
+    assert commands == 8  # noqa: PLR2004
+    assert loaded.memory_usage("list") == keyspace.memory_usage("list")
+    assert loaded.memory_usage("hash") == keyspace.memory_usage("hash")
+    assert loaded.get_expire("set") == keyspace.get_expire("set")
+    zset, loaded_zset = keyspace.get("zset"), loaded.get("zset")
+    assert isinstance(zset, ZSet)
+    assert isinstance(loaded_zset, ZSet)
+    assert list(loaded_zset.items()) == list(zset.items())
+
+
+def test_rewrite_drops_expired_keys(tmp_path: Path) -> None:
+    path = tmp_path / "appendonly.aof"
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    aof = AppendOnlyFile(path)
+    _run(keyspace, aof, ["SET", "a", "1", "PX", "100"], ["SET", "b", "2", "EX", "100"])
+    clock.now += 1
+
+    aof.start_rewrite(keyspace)
+    _wait_for_rewrite(aof)
+    aof.close()
+
+    assert path.read_bytes() == b"*5\r\n$3\r\nSET\r\n$1\r\nb\r\n$1\r\n2\r\n$4\r\nPXAT\r\n$10\r\n1000100000\r\n"
+
+
+def _recv_exactly(s: socket.socket, num_bytes: int) -> bytes:
+    received = b""
+    while len(received) < num_bytes:
+        chunk = s.recv(num_bytes - len(received))
+        if not chunk:
+            break
+        received += chunk
+
+    return received
+
+
+def test_server_restores_data_after_restart(tmp_path: Path) -> None:
+    config = Config(appendonly=True, appendfilename=str(tmp_path / "appendonly.aof"), appendfsync=AppendFsync.ALWAYS)
+    writes = b"".join(b"*3\r\n$3\r\nSET\r\n$7\r\nkey:%03d\r\n$1\r\n%d\r\n" % (i, i % 10) for i in range(NUM_WRITES))
+
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(writes)
+        assert _recv_exactly(s, 5 * NUM_WRITES) == b"+OK\r\n" * NUM_WRITES
+        started = b"+Background append only file rewriting started\r\n"
+        s.sendall(b"*1\r\n$12\r\nBGREWRITEAOF\r\n")
+        assert _recv_exactly(s, len(started)) == started
+    server.stop()
+
+    expected = b"*2\r\n$1\r\n0\r\n$1\r\n9\r\n"
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(b"*3\r\n$4\r\nMGET\r\n$7\r\nkey:000\r\n$7\r\nkey:099\r\n")
+        response = _recv_exactly(s, len(expected))
+    server.stop()
+
+    assert response == expected
+
+
+def test_evictions_are_logged(tmp_path: Path) -> None:
+    config = Config(
+        appendonly=True,
+        appendfilename=str(tmp_path / "appendonly.aof"),
+        maxmemory=100_000,
+        maxmemory_policy=EvictionPolicy.ALLKEYS_LRU,
+    )
+    num_keys = 2_000
+    writes = b"".join(encode_command(["SET", f"k{i}", "v" * 50]) for i in range(num_keys))
+
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(writes)
+        assert _recv_exactly(s, 5 * num_keys) == b"+OK\r\n" * num_keys
+    keys = {key for key, _ in server._keyspace.items()}  # noqa: SLF001
+    server.stop()
+
+    # Replaying the log removes the evicted keys again, rather than leaving
+    # them to be evicted afresh
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    reloaded = {key for key, _ in server._keyspace.items()}  # noqa: SLF001
+    server.stop()
+
+    assert 0 < len(keys) < num_keys
+    assert reloaded == keys
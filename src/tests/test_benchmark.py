@@ -0,0 +1,70 @@
+import socket
+from collections import Counter
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.benchmark import BenchmarkResult, Workload, parse_mix, run_workload
+from src.whodis.server import WhodisServer
+
+NUM_REQUESTS = 1_000
+
+
+@pytest.fixture
+def server() -> Iterator[WhodisServer]:
+    server = WhodisServer(host="", port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        pytest.param("get", (("get", 1),), id="single"),
+        pytest.param("GET:9, set:1", (("get", 9), ("set", 1)), id="weighted"),
+        pytest.param("ping,incr:2", (("ping", 1), ("incr", 2)), id="default_weight"),
+    ],
+)
+def test_parse_mix(value: str, expected: tuple[tuple[str, int], ...]) -> None:
+    assert parse_mix(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "flushall", "get:0", "get:x", "get:-1"])
+def test_parse_mix_invalid(value: str) -> None:
+    with pytest.raises(ValueError, match="Invalid command mix"):
+        parse_mix(value)
+
+
+def test_percentiles() -> None:
+    # 90 requests took 100us and 10 took 1ms
+    result = BenchmarkResult(requests=100, latencies=Counter({100: 90, 1_000: 10}))
+
+    assert result.percentile(50) == 100  # noqa: PLR2004
+    assert result.percentile(90) == 100  # noqa: PLR2004
+    assert result.percentile(99) == 1_000  # noqa: PLR2004
+
+
+@pytest.mark.parametrize("pipeline", [1, 16])
+def test_run_workload(server: WhodisServer, pipeline: int) -> None:
+    workload = Workload(name="mix", mix=parse_mix("set:1,get:1,mset:1,mget:1,incr:1,ping:1"), keyspace=100)
+    result = run_workload("127.0.0.1", server.bound_port, workload, clients=4, requests=NUM_REQUESTS, pipeline=pipeline)
+
+    assert result.requests == NUM_REQUESTS
+    assert result.errors == 0
+    assert result.latencies.total() == NUM_REQUESTS
+    assert result.ops_per_second > 0
+
+
+def test_errors_are_counted(server: WhodisServer) -> None:
+    # INCR fails on a counter holding a value that isn't a number
+    key = "counter:key:000000000000"
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(b"*3\r\n$3\r\nSET\r\n$%d\r\n%s\r\n$3\r\nabc\r\n" % (len(key), key.encode()))
+        assert s.recv(5) == b"+OK\r\n"
+
+    workload = Workload(name="incr", mix=(("incr", 1),))
+    result = run_workload("127.0.0.1", server.bound_port, workload, clients=2, requests=NUM_REQUESTS, pipeline=8)
+
+    assert result.errors == NUM_REQUESTS
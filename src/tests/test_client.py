@@ -0,0 +1,124 @@
+import asyncio
+import threading
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.client import AsyncClient, Client, ConnectionPool, ResponseError
+from src.whodis.deserialise import ErrorReply
+from src.whodis.server import WhodisServer
+
+
+@pytest.fixture
+def server() -> Iterator[WhodisServer]:
+    server = WhodisServer(host="", port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server: WhodisServer) -> Iterator[Client]:
+    with Client(port=server.bound_port) as client:
+        yield client
+
+
+def test_execute(client: Client) -> None:
+    assert client.execute("SET", "k", "v") == "OK"
+    assert client.execute("GET", "k") == "v"
+    assert client.execute("EXPIRE", "k", 100) == 1
+    assert client.execute("MGET", "k", "missing") == ["v", None]
+    assert client.execute("GET", "missing") is None
+
+
+def test_error_reply_raises_and_keeps_connection(client: Client) -> None:
+    client.execute("SET", "k", "v")
+    with pytest.raises(ResponseError, match="WRONGTYPE"):
+        client.execute("LPUSH", "k", "x")
+
+    assert client.execute("GET", "k") == "v"
+
+
+def test_pipeline(client: Client) -> None:
+    with client.pipeline() as pipe:
+        for i in range(100):
+            pipe.command("SET", f"k{i}", i)
+        pipe.command("GET", "k99")
+        assert len(pipe) == 101  # noqa: PLR2004
+        replies = pipe.execute()
+
+    assert replies == ["OK"] * 100 + ["99"]
+    assert client.pipeline().execute() == []
+
+
+def test_pipeline_errors(client: Client) -> None:
+    client.execute("SET", "k", "v")
+    pipe = client.pipeline().command("INCR", "k").command("GET", "k")
+    with pytest.raises(ResponseError, match="not an integer"):
+        pipe.execute()
+
+    # Every reply was read, so the connection can be reused
+    assert client.execute("GET", "k") == "v"
+    replies = client.pipeline().command("INCR", "k").command("GET", "k").execute(raise_on_error=False)
+    assert isinstance(replies[0], ErrorReply)
+    assert replies[1] == "v"
+
+
+def test_pool_reuses_connections_between_threads(server: WhodisServer) -> None:
+    pool = ConnectionPool(port=server.bound_port, max_connections=2)
+    client = Client(pool=pool)
+
+    def increment() -> None:
+        for _ in range(200):
+            client.execute("INCR", "n")
+
+    threads = [threading.Thread(target=increment) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert client.execute("GET", "n") == "1600"
+    assert server._stats.total_connections_received <= 2  # noqa: SLF001, PLR2004
+    client.close()
+
+
+def test_pool_replaces_broken_connections(server: WhodisServer, client: Client) -> None:
+    with client.pool.connection() as conn:
+        conn.close()
+    with pytest.raises(OSError, match="Bad file descriptor"):
+        client.execute("PING")
+
+    assert client.execute("PING") == "PONG"
+    assert server._stats.total_connections_received == 2  # noqa: SLF001, PLR2004
+
+
+def test_pool_wait_timeout(server: WhodisServer) -> None:
+    pool = ConnectionPool(port=server.bound_port, max_connections=1, wait_timeout=0.1)
+    with pool.connection(), pytest.raises(ConnectionError, match="No connection available"):
+        pool.acquire()
+    pool.close()
+
+
+def test_async_requests_are_multiplexed(server: WhodisServer) -> None:
+    async def run() -> list[object]:
+        async with AsyncClient(port=server.bound_port) as client:
+            replies = await asyncio.gather(*(client.execute("INCR", "n") for _ in range(100)))
+            pipe = client.pipeline().command("GET", "n").command("GET", "missing")
+            return [replies, await pipe.execute()]
+
+    replies, piped = asyncio.run(run())
+    assert replies == list(range(1, 101))
+    assert piped == ["100", None]
+    assert server._stats.total_connections_received == 1  # noqa: SLF001
+
+
+def test_async_errors(server: WhodisServer) -> None:
+    async def run() -> object:
+        async with AsyncClient(port=server.bound_port, connections=2) as client:
+            await client.execute("SET", "k", "v")
+            with pytest.raises(ResponseError, match="WRONGTYPE"):
+                await client.execute("HGET", "k", "f")
+            return await client.execute("GET", "k")
+
+    assert asyncio.run(run()) == "v"
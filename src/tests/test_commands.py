@@ -0,0 +1,539 @@
+import pytest
+
+from src.whodis.commands import CommandError, UnsupportedCommandError, handle_command
+from src.whodis.keyspace import Keyspace
+from src.whodis.lazyfree import LAZYFREE_THRESHOLD_BYTES, lazyfree
+from src.whodis.serialise import ReplyWriter
+
+
+def _run(keyspace: Keyspace, *cmds: list[str]) -> bytes:
+    out = ReplyWriter()
+    for cmd in cmds:
+        handle_command(keyspace, cmd, out)
+
+    return out.getvalue()
+
+
+@pytest.mark.parametrize(
+    ("cmds", "expected_reply"),
+    [
+        pytest.param([["PING"]], b"+PONG\r\n", id="ping"),
+        pytest.param([["ping"]], b"+PONG\r\n", id="ping_lower_case"),
+        pytest.param([["PiNg"]], b"+PONG\r\n", id="ping_mixed_case"),
+        pytest.param([["PING", "hello"]], b"$5\r\nhello\r\n", id="ping_message"),
+        pytest.param([["GET", "k"]], b"$-1\r\n", id="get_missing"),
+        pytest.param([["SET", "k", "v"]], b"+OK\r\n", id="set"),
+        pytest.param([["SET", "k", "v"], ["GET", "k"]], b"+OK\r\n$1\r\nv\r\n", id="set_get"),
+        pytest.param(
+            [["SET", "k", "v"], ["SET", "k", "w"], ["GET", "k"]],
+            b"+OK\r\n+OK\r\n$1\r\nw\r\n",
+            id="set_overwrite",
+        ),
+        pytest.param([["SET", "a", "1"], ["SET", "b", "2"], ["DEL", "a", "b", "c"]], b"+OK\r\n+OK\r\n:2\r\n", id="del"),
+        pytest.param([["SET", "a", "1"], ["EXISTS", "a", "a", "b"]], b"+OK\r\n:2\r\n", id="exists_counts_repeats"),
+        pytest.param([["INCR", "n"], ["INCR", "n"]], b":1\r\n:2\r\n", id="incr_missing"),
+        pytest.param([["SET", "n", "-5"], ["INCR", "n"]], b"+OK\r\n:-4\r\n", id="incr_negative"),
+        pytest.param(
+            [["APPEND", "k", "ab"], ["APPEND", "k", "cd"], ["GET", "k"]],
+            b":2\r\n:4\r\n$4\r\nabcd\r\n",
+            id="append",
+        ),
+        pytest.param([["SET", "k", "hello"], ["STRLEN", "k"], ["STRLEN", "x"]], b"+OK\r\n:5\r\n:0\r\n", id="strlen"),
+        pytest.param([["SET", "k", "h\u00e9llo"], ["STRLEN", "k"]], b"+OK\r\n:6\r\n", id="strlen_counts_bytes"),
+        pytest.param([["SET", "n", "-12"], ["STRLEN", "n"]], b"+OK\r\n:3\r\n", id="strlen_integer"),
+        pytest.param(
+            [["SET", "n", "12"], ["APPEND", "n", "3"], ["INCR", "n"], ["GET", "n"]],
+            b"+OK\r\n:3\r\n:124\r\n$3\r\n124\r\n",
+            id="append_to_integer",
+        ),
+        pytest.param(
+            [
+                ["MSET", "a", "12", "b", "012", "c", "hello", "d", "x" * 45],
+                ["OBJECT", "ENCODING", "a"],
+                ["object", "encoding", "b"],
+                ["OBJECT", "ENCODING", "c"],
+                ["OBJECT", "ENCODING", "d"],
+                ["OBJECT", "ENCODING", "missing"],
+            ],
+            b"+OK\r\n$3\r\nint\r\n$6\r\nembstr\r\n$6\r\nembstr\r\n$3\r\nraw\r\n$-1\r\n",
+            id="object_encoding",
+        ),
+        pytest.param([["MEMORY", "USAGE", "missing", "SAMPLES", "5"]], b"$-1\r\n", id="memory_usage_missing"),
+        pytest.param(
+            [["MSET", "a", "1", "b", "22"], ["MGET", "a", "missing", "b"]],
+            b"+OK\r\n*3\r\n$1\r\n1\r\n$-1\r\n$2\r\n22\r\n",
+            id="mset_mget",
+        ),
+        pytest.param([["MSET", "a", "1", "a", "2"], ["GET", "a"]], b"+OK\r\n$1\r\n2\r\n", id="mset_last_wins"),
+        pytest.param(
+            [["MSETNX", "a", "1", "b", "2"], ["MSETNX", "b", "3", "c", "4"], ["MGET", "a", "b", "c"]],
+            b":1\r\n:0\r\n*3\r\n$1\r\n1\r\n$1\r\n2\r\n$-1\r\n",
+            id="msetnx",
+        ),
+        pytest.param(
+            [["MSET", "a", "1", "b", "2"], ["UNLINK", "a", "b", "c"], ["EXISTS", "a", "b"]],
+            b"+OK\r\n:2\r\n:0\r\n",
+            id="unlink",
+        ),
+        pytest.param(
+            [["HSET", "h", "a", "1", "b", "2"], ["HSET", "h", "a", "3"], ["HGET", "h", "a"], ["HGET", "h", "x"]],
+            b":2\r\n:0\r\n$1\r\n3\r\n$-1\r\n",
+            id="hset_hget",
+        ),
+        pytest.param(
+            [["HSET", "h", "a", "1", "b", "2"], ["HGETALL", "h"], ["HGETALL", "missing"]],
+            b":2\r\n*4\r\n$1\r\na\r\n$1\r\n1\r\n$1\r\nb\r\n$1\r\n2\r\n*0\r\n",
+            id="hgetall",
+        ),
+        pytest.param(
+            [
+                ["HSET", "h", "a", "1", "b", "2"],
+                ["HDEL", "h", "a", "x"],
+                ["HLEN", "h"],
+                ["HDEL", "h", "b"],
+                ["TYPE", "h"],
+            ],
+            b":2\r\n:1\r\n:1\r\n:1\r\n+none\r\n",
+            id="hdel_deletes_empty_hash",
+        ),
+        pytest.param(
+            [["RPUSH", "l", "b", "c"], ["LPUSH", "l", "a", "z"], ["LRANGE", "l", "0", "-1"], ["LLEN", "l"]],
+            b":2\r\n:4\r\n*4\r\n$1\r\nz\r\n$1\r\na\r\n$1\r\nb\r\n$1\r\nc\r\n:4\r\n",
+            id="push_lrange",
+        ),
+        pytest.param(
+            [
+                ["RPUSH", "l", "a", "b", "c"],
+                ["LRANGE", "l", "-2", "10"],
+                ["LRANGE", "l", "2", "1"],
+                ["LINDEX", "l", "-1"],
+            ],
+            b":3\r\n*2\r\n$1\r\nb\r\n$1\r\nc\r\n*0\r\n$1\r\nc\r\n",
+            id="lrange_clamps",
+        ),
+        pytest.param(
+            [["RPUSH", "l", "a", "b", "c"], ["LPOP", "l"], ["RPOP", "l", "5"], ["LPOP", "l"], ["LPOP", "l", "2"]],
+            b":3\r\n$1\r\na\r\n*2\r\n$1\r\nc\r\n$1\r\nb\r\n$-1\r\n*-1\r\n",
+            id="pop",
+        ),
+        pytest.param(
+            [["RPUSH", "l", "a"], ["LPOP", "l", "0"], ["LLEN", "l"]],
+            b":1\r\n*0\r\n:1\r\n",
+            id="pop_zero",
+        ),
+        pytest.param(
+            [["SADD", "s", "1", "2", "1"], ["SISMEMBER", "s", "2"], ["SISMEMBER", "s", "3"], ["SMEMBERS", "s"]],
+            b":2\r\n:1\r\n:0\r\n*2\r\n$1\r\n1\r\n$1\r\n2\r\n",
+            id="sadd_smembers",
+        ),
+        pytest.param(
+            [["SADD", "s", "a", "b"], ["SREM", "s", "a", "x"], ["SCARD", "s"], ["SMEMBERS", "missing"]],
+            b":2\r\n:1\r\n:1\r\n*0\r\n",
+            id="srem",
+        ),
+        pytest.param(
+            [["SET", "k", "v"], ["SADD", "s", "1"], ["MGET", "k", "s"], ["TYPE", "k"], ["TYPE", "s"]],
+            b"+OK\r\n:1\r\n*2\r\n$1\r\nv\r\n$-1\r\n+string\r\n+set\r\n",
+            id="type",
+        ),
+        pytest.param(
+            [["ZADD", "z", "2", "b", "1", "a", "2", "c"], ["ZRANGE", "z", "0", "-1", "WITHSCORES"]],
+            b":3\r\n*6\r\n$1\r\na\r\n$1\r\n1\r\n$1\r\nb\r\n$1\r\n2\r\n$1\r\nc\r\n$1\r\n2\r\n",
+            id="zadd_zrange",
+        ),
+        pytest.param(
+            [["ZADD", "z", "1", "a", "2", "b", "3", "c"], ["ZRANGE", "z", "-2", "100"], ["ZRANGE", "z", "2", "1"]],
+            b":3\r\n*2\r\n$1\r\nb\r\n$1\r\nc\r\n*0\r\n",
+            id="zrange_clamps",
+        ),
+        pytest.param(
+            [
+                ["ZADD", "z", "1", "a", "2", "b"],
+                ["ZADD", "z", "NX", "5", "a", "3", "c"],
+                ["ZADD", "z", "XX", "CH", "5", "a", "4", "d"],
+                ["ZADD", "z", "GT", "CH", "1", "a", "3", "b"],
+                ["ZSCORE", "z", "a"],
+                ["ZSCORE", "z", "d"],
+            ],
+            b":2\r\n:1\r\n:1\r\n:1\r\n$1\r\n5\r\n$-1\r\n",
+            id="zadd_flags",
+        ),
+        pytest.param(
+            [
+                ["ZADD", "z", "INCR", "1.5", "a"],
+                ["ZADD", "z", "INCR", "NX", "1", "a"],
+                ["ZINCRBY", "z", "-0.5", "a"],
+                ["ZINCRBY", "z", "inf", "b"],
+            ],
+            b"$3\r\n1.5\r\n$-1\r\n$1\r\n1\r\n$3\r\ninf\r\n",
+            id="zincrby",
+        ),
+        pytest.param(
+            [
+                ["ZADD", "z", "1", "a", "2", "b", "3", "c"],
+                ["ZRANK", "z", "c"],
+                ["ZREVRANK", "z", "c"],
+                ["ZRANK", "z", "x"],
+                ["ZRANK", "missing", "x"],
+            ],
+            b":3\r\n:2\r\n:0\r\n$-1\r\n$-1\r\n",
+            id="zrank",
+        ),
+        pytest.param(
+            [
+                ["ZADD", "z", "1", "a", "2", "b", "3", "c", "4", "d"],
+                ["ZRANGEBYSCORE", "z", "(1", "3"],
+                ["ZRANGEBYSCORE", "z", "-inf", "+inf", "LIMIT", "1", "2", "WITHSCORES"],
+                ["ZRANGEBYSCORE", "z", "3", "(3"],
+            ],
+            b":4\r\n*2\r\n$1\r\nb\r\n$1\r\nc\r\n*4\r\n$1\r\nb\r\n$1\r\n2\r\n$1\r\nc\r\n$1\r\n3\r\n*0\r\n",
+            id="zrangebyscore",
+        ),
+        pytest.param(
+            [
+                ["ZADD", "z", "1", "a", "2", "b"],
+                ["ZREM", "z", "a", "x"],
+                ["ZCARD", "z"],
+                ["ZREM", "z", "b"],
+                ["TYPE", "z"],
+            ],
+            b":2\r\n:1\r\n:1\r\n:1\r\n+none\r\n",
+            id="zrem",
+        ),
+        pytest.param(
+            [["MSET", "user:1", "a", "user:2", "b", "other", "c"], ["SCAN", "0", "MATCH", "user:*"]],
+            b"+OK\r\n*2\r\n$1\r\n0\r\n*2\r\n$6\r\nuser:2\r\n$6\r\nuser:1\r\n",
+            id="scan_match",
+        ),
+        pytest.param(
+            [["MSET", "a", "1", "b", "2", "c", "3"], ["SCAN", "0", "COUNT", "2"], ["SCAN", "1", "COUNT", "2"]],
+            b"+OK\r\n*2\r\n$1\r\n1\r\n*2\r\n$1\r\nc\r\n$1\r\nb\r\n*2\r\n$1\r\n0\r\n*1\r\n$1\r\na\r\n",
+            id="scan_count",
+        ),
+        pytest.param(
+            [["SET", "s", "v"], ["SADD", "set", "m"], ["SCAN", "0", "TYPE", "SET"]],
+            b"+OK\r\n:1\r\n*2\r\n$1\r\n0\r\n*1\r\n$3\r\nset\r\n",
+            id="scan_type",
+        ),
+        pytest.param(
+            [["HSET", "h", "a", "1", "b", "2"], ["HSCAN", "h", "0", "MATCH", "b"], ["HSCAN", "missing", "0"]],
+            b":2\r\n*2\r\n$1\r\n0\r\n*2\r\n$1\r\nb\r\n$1\r\n2\r\n*2\r\n$1\r\n0\r\n*0\r\n",
+            id="hscan",
+        ),
+        pytest.param(
+            [["SADD", "s", "1", "2", "3"], ["SSCAN", "s", "0", "MATCH", "[12]"]],
+            b":3\r\n*2\r\n$1\r\n0\r\n*2\r\n$1\r\n1\r\n$1\r\n2\r\n",
+            id="sscan",
+        ),
+        pytest.param(
+            [["ZADD", "z", "1.5", "a"], ["ZSCAN", "z", "0"]],
+            b":1\r\n*2\r\n$1\r\n0\r\n*2\r\n$1\r\na\r\n$3\r\n1.5\r\n",
+            id="zscan",
+        ),
+        pytest.param(
+            [
+                ["SADD", "ints", "1", "2"],
+                ["SADD", "strs", "a"],
+                ["HSET", "h", "f", "v"],
+                ["RPUSH", "l", "a"],
+                ["OBJECT", "ENCODING", "ints"],
+                ["OBJECT", "ENCODING", "strs"],
+                ["OBJECT", "ENCODING", "h"],
+                ["OBJECT", "ENCODING", "l"],
+                ["ZADD", "z", "1", "a"],
+                ["OBJECT", "ENCODING", "z"],
+                ["TYPE", "z"],
+            ],
+            b":2\r\n:1\r\n:1\r\n:1\r\n$6\r\nintset\r\n$8\r\nlistpack\r\n$8\r\nlistpack\r\n$8\r\nlistpack\r\n"
+            b":1\r\n$8\r\nlistpack\r\n+zset\r\n",
+            id="object_encoding_collections",
+        ),
+    ],
+)
+def test_valid_commands(cmds: list[list[str]], expected_reply: bytes) -> None:
+    assert _run(Keyspace(), *cmds) == expected_reply
+
+
+@pytest.mark.parametrize(
+    ("setup", "cmd", "expected_error"),
+    [
+        pytest.param([], ["GET"], "ERR wrong number of arguments for 'get' command", id="get_arity"),
+        pytest.param([], ["SET", "k"], "ERR wrong number of arguments for 'set' command", id="set_arity"),
+        pytest.param([], ["PING", "a", "b"], "ERR wrong number of arguments for 'ping' command", id="ping_arity"),
+        pytest.param([], ["MSET", "a", "1", "b"], "ERR wrong number of arguments for 'mset' command", id="mset_odd"),
+        pytest.param([], ["MSETNX", "a"], "ERR wrong number of arguments for 'msetnx' command", id="msetnx_arity"),
+        pytest.param(
+            [["SET", "n", "abc"]],
+            ["INCR", "n"],
+            "ERR value is not an integer or out of range",
+            id="incr_nan",
+        ),
+        pytest.param(
+            [["SET", "n", " 1"]],
+            ["INCR", "n"],
+            "ERR value is not an integer or out of range",
+            id="incr_space",
+        ),
+        pytest.param(
+            [["SET", "n", str(2**63 - 1)]],
+            ["INCR", "n"],
+            "ERR increment or decrement would overflow",
+            id="incr_overflow",
+        ),
+        pytest.param(
+            [["SET", "n", str(2**63)]],
+            ["INCR", "n"],
+            "ERR value is not an integer or out of range",
+            id="incr_out_of_range",
+        ),
+        pytest.param(
+            [],
+            ["OBJECT", "FREQ", "k"],
+            "ERR unknown subcommand or wrong number of arguments for 'FREQ'",
+            id="object_subcommand",
+        ),
+        pytest.param(
+            [],
+            ["MEMORY", "USAGE", "k", "SAMPLE", "5"],
+            "ERR syntax error",
+            id="memory_usage_syntax",
+        ),
+        pytest.param([["SADD", "s", "a"]], ["GET", "s"], "WRONGTYPE", id="get_wrongtype"),
+        pytest.param([["SET", "k", "v"]], ["HSET", "k", "f", "v"], "WRONGTYPE", id="hset_wrongtype"),
+        pytest.param([["HSET", "h", "f", "v"]], ["LRANGE", "h", "0", "-1"], "WRONGTYPE", id="lrange_wrongtype"),
+        pytest.param([["RPUSH", "l", "a"]], ["SADD", "l", "b"], "WRONGTYPE", id="sadd_wrongtype"),
+        pytest.param(
+            [],
+            ["HSET", "h", "f", "v", "g"],
+            "ERR wrong number of arguments for 'hset' command",
+            id="hset_odd",
+        ),
+        pytest.param([], ["ZADD", "z", "1", "a", "2"], "ERR syntax error", id="zadd_odd"),
+        pytest.param([], ["ZADD", "z", "nan", "a"], "ERR value is not a valid float", id="zadd_nan"),
+        pytest.param([], ["ZADD", "z", " 1", "a"], "ERR value is not a valid float", id="zadd_space"),
+        pytest.param(
+            [],
+            ["ZADD", "z", "NX", "XX", "1", "a"],
+            "ERR XX and NX options at the same time are not compatible",
+            id="zadd_nx_xx",
+        ),
+        pytest.param(
+            [],
+            ["ZADD", "z", "GT", "LT", "1", "a"],
+            "ERR GT, LT, and/or NX options at the same time are not compatible",
+            id="zadd_gt_lt",
+        ),
+        pytest.param(
+            [],
+            ["ZADD", "z", "INCR", "1", "a", "2", "b"],
+            "ERR INCR option supports a single increment-element pair",
+            id="zadd_incr_pairs",
+        ),
+        pytest.param(
+            [["ZADD", "z", "inf", "a"]],
+            ["ZINCRBY", "z", "-inf", "a"],
+            r"ERR resulting score is not a number \(NaN\)",
+            id="zincrby_nan",
+        ),
+        pytest.param([], ["ZRANGEBYSCORE", "z", "(", "1"], "ERR min or max is not a float", id="zrangebyscore_bound"),
+        pytest.param([], ["ZRANGE", "z", "0", "1", "REV"], "ERR syntax error", id="zrange_syntax"),
+        pytest.param([["SET", "k", "v"]], ["ZADD", "k", "1", "a"], "WRONGTYPE", id="zadd_wrongtype"),
+        pytest.param([], ["SCAN", "-1"], "ERR invalid cursor", id="scan_negative_cursor"),
+        pytest.param([], ["SCAN", "x"], "ERR invalid cursor", id="scan_cursor"),
+        pytest.param([], ["SCAN", "0", "COUNT", "0"], "ERR syntax error", id="scan_count_zero"),
+        pytest.param([], ["SCAN", "0", "MATCH"], "ERR syntax error", id="scan_missing_option_value"),
+        pytest.param([], ["HSCAN", "h", "0", "TYPE", "hash"], "ERR syntax error", id="hscan_type"),
+        pytest.param([["SET", "k", "v"]], ["SSCAN", "k", "0"], "WRONGTYPE", id="sscan_wrongtype"),
+        pytest.param([], ["LPOP", "l", "-1"], "ERR value is out of range, must be positive", id="lpop_negative"),
+        pytest.param([], ["LRANGE", "l", "0", "x"], "ERR value is not an integer or out of range", id="lrange_nan"),
+        pytest.param(
+            [],
+            ["MEMORY", "DOCTOR"],
+            "ERR unknown subcommand or wrong number of arguments for 'DOCTOR'",
+            id="memory_subcommand",
+        ),
+    ],
+)
+def test_command_errors(setup: list[list[str]], cmd: list[str], expected_error: str) -> None:
+    keyspace = Keyspace()
+    _run(keyspace, *setup)
+
+    with pytest.raises(CommandError, match=expected_error):
+        _run(keyspace, cmd)
+
+
+@pytest.mark.parametrize(
+    "cmd",
+    [
+        pytest.param([], id="unsupported_empty"),
+        pytest.param(["NOPE"], id="unsupported_name"),
+    ],
+)
+def test_unsupported_commands(cmd: list[str]) -> None:
+    with pytest.raises(UnsupportedCommandError):
+        _run(Keyspace(), cmd)
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.mark.parametrize(
+    ("cmds", "advance", "after_cmds", "expected_reply"),
+    [
+        pytest.param([["SET", "k", "v", "EX", "10"]], 9.0, [["GET", "k"]], b"$1\r\nv\r\n", id="set_ex_live"),
+        pytest.param([["SET", "k", "v", "EX", "10"]], 10.0, [["GET", "k"]], b"$-1\r\n", id="set_ex_expired"),
+        pytest.param([["SET", "k", "v", "PX", "1500"]], 1.0, [["PTTL", "k"]], b":500\r\n", id="set_px_pttl"),
+        pytest.param([["SET", "k", "v", "EX", "10"]], 0.4, [["TTL", "k"]], b":10\r\n", id="ttl_rounds"),
+        pytest.param([["SET", "k", "v"]], 0.0, [["TTL", "k"]], b":-1\r\n", id="ttl_no_expiry"),
+        pytest.param([], 0.0, [["TTL", "k"], ["PTTL", "k"]], b":-2\r\n:-2\r\n", id="ttl_missing"),
+        pytest.param([["SET", "k", "v"], ["EXPIRE", "k", "5"]], 5.0, [["EXISTS", "k"]], b":0\r\n", id="expire"),
+        pytest.param([["SET", "k", "v"], ["PEXPIRE", "k", "50"]], 0.049, [["EXISTS", "k"]], b":1\r\n", id="pexpire"),
+        pytest.param([["SET", "k", "v"], ["EXPIRE", "k", "-1"]], 0.0, [["GET", "k"]], b"$-1\r\n", id="expire_past"),
+        pytest.param([], 0.0, [["EXPIRE", "k", "5"]], b":0\r\n", id="expire_missing"),
+        pytest.param([["SET", "k", "v", "PXAT", "1000001500"]], 1.0, [["PTTL", "k"]], b":500\r\n", id="set_pxat"),
+        pytest.param([["SET", "k", "v", "EXAT", "1000010"]], 10.0, [["GET", "k"]], b"$-1\r\n", id="set_exat"),
+        pytest.param([["SET", "k", "v"], ["EXPIREAT", "k", "1000005"]], 4.0, [["TTL", "k"]], b":1\r\n", id="expireat"),
+        pytest.param(
+            [["SET", "k", "v"], ["PEXPIREAT", "k", "999999999"]],
+            0.0,
+            [["GET", "k"]],
+            b"$-1\r\n",
+            id="pexpireat_past",
+        ),
+        pytest.param(
+            [["SET", "k", "v", "EX", "1"], ["PERSIST", "k"]],
+            5.0,
+            [["TTL", "k"], ["PERSIST", "k"]],
+            b":-1\r\n:0\r\n",
+            id="persist",
+        ),
+        pytest.param(
+            [["SET", "k", "v", "EX", "1"], ["SET", "k", "w"]],
+            5.0,
+            [["GET", "k"]],
+            b"$1\r\nw\r\n",
+            id="set_clears_expiry",
+        ),
+        pytest.param(
+            [["SET", "k", "v", "EX", "1"], ["SET", "k", "w", "KEEPTTL"]],
+            5.0,
+            [["GET", "k"]],
+            b"$-1\r\n",
+            id="set_keepttl",
+        ),
+        pytest.param([["SET", "k", "v"]], 0.0, [["SET", "k", "w", "NX"], ["GET", "k"]], b"$-1\r\n$1\r\nv\r\n", id="nx"),
+        pytest.param([], 0.0, [["SET", "k", "w", "XX"], ["GET", "k"]], b"$-1\r\n$-1\r\n", id="xx_missing"),
+        pytest.param(
+            [["SET", "k", "v", "EX", "1"]],
+            2.0,
+            [["SET", "k", "w", "NX"], ["GET", "k"]],
+            b"+OK\r\n$1\r\nw\r\n",
+            id="nx_after_expiry",
+        ),
+    ],
+)
+def test_expiring_commands(
+    cmds: list[list[str]],
+    advance: float,
+    after_cmds: list[list[str]],
+    expected_reply: bytes,
+) -> None:
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    _run(keyspace, *cmds)
+    clock.now += advance
+
+    assert _run(keyspace, *after_cmds) == expected_reply
+
+
+@pytest.mark.parametrize(
+    ("cmd", "expected_error"),
+    [
+        pytest.param(["SET", "k", "v", "EX", "0"], "ERR invalid expire time in 'set' command", id="set_ex_zero"),
+        pytest.param(["SET", "k", "v", "PX", "-5"], "ERR invalid expire time in 'set' command", id="set_px_negative"),
+        pytest.param(["SET", "k", "v", "EX"], "ERR syntax error", id="set_ex_missing"),
+        pytest.param(["SET", "k", "v", "EX", "1", "PX", "1"], "ERR syntax error", id="set_ex_px"),
+        pytest.param(["SET", "k", "v", "NX", "XX"], "ERR syntax error", id="set_nx_xx"),
+        pytest.param(["SET", "k", "v", "EX", "1", "KEEPTTL"], "ERR syntax error", id="set_ex_keepttl"),
+        pytest.param(["SET", "k", "v", "BOGUS"], "ERR syntax error", id="set_unknown_option"),
+        pytest.param(["EXPIRE", "k", "soon"], "ERR value is not an integer or out of range", id="expire_nan"),
+    ],
+)
+def test_expiring_command_errors(cmd: list[str], expected_error: str) -> None:
+    with pytest.raises(CommandError, match=expected_error):
+        _run(Keyspace(), cmd)
+
+
+def test_unlink_frees_large_values_in_background() -> None:
+    keyspace = Keyspace()
+    large = "x" * LAZYFREE_THRESHOLD_BYTES
+    keyspace.set("large", large)
+    keyspace.set("small", "x")
+    del large
+    freed_before = lazyfree.freed
+
+    assert _run(keyspace, ["UNLINK", "large", "small"]) == b":2\r\n"
+    assert lazyfree.wait_idle(timeout=1)
+    assert lazyfree.freed == freed_before + 1
+
+
+def test_memory_usage_reflects_encoding() -> None:
+    keyspace = Keyspace()
+    keyspace.set("flag", "1")
+    keyspace.set("counter", "1234567890")
+    keyspace.set("string", "x" * 100)
+
+    # Missing keys would count as nothing, and so not add up to used_memory
+    usage = {key: keyspace.memory_usage(key) or 0 for key in ("flag", "counter", "string")}
+
+    assert _run(keyspace, ["MEMORY", "USAGE", "string"]) == b":%d\r\n" % usage["string"]
+    assert usage["flag"] < usage["counter"] < usage["string"]
+    assert sum(usage.values()) == keyspace.used_memory
+
+
+def test_collections_account_for_their_memory() -> None:
+    keyspace = Keyspace()
+    _run(
+        keyspace,
+        ["HSET", "h", *(f"{i}" for i in range(400))],
+        ["RPUSH", "l", *(f"element:{i}" for i in range(300))],
+        ["SADD", "s", *(f"{i}" for i in range(600))],
+        ["LPOP", "l", "150"],
+        ["SREM", "s", "1", "2", "3"],
+        ["ZADD", "z", *(arg for i in range(300) for arg in (str(i % 7), f"member:{i}"))],
+        ["ZINCRBY", "z", "100", "member:5"],
+        ["ZREM", "z", "member:6", "member:7"],
+    )
+    usage = {key: keyspace.memory_usage(key) or 0 for key in ("h", "l", "s", "z")}
+
+    assert sum(usage.values()) == keyspace.used_memory
+
+    _run(keyspace, ["HDEL", "h", *(f"{i}" for i in range(0, 400, 2))], ["RPOP", "l", "150"])
+    assert keyspace.get("h") is None
+    assert keyspace.get("l") is None
+    assert keyspace.used_memory == usage["s"] + usage["z"]
+
+
+def test_scan_iterates_large_hashes_incrementally() -> None:
+    keyspace = Keyspace()
+    fields = {f"field:{i}" for i in range(1_000)}
+    _run(keyspace, ["HSET", "h", *(arg for field in fields for arg in (field, "v"))])
+
+    seen: set[str] = set()
+    cursor = "0"
+    steps = 0
+    while True:
+        reply = _run(keyspace, ["HSCAN", "h", cursor, "COUNT", "100"]).split(b"\r\n")
+        cursor = reply[2].decode()
+        seen.update(part.decode() for part in reply[5::4])
+        steps += 1
+        if cursor == "0":
+            break
+
+    assert seen == fields
+    assert steps == 10  # noqa: PLR2004
@@ -0,0 +1,45 @@
+import pytest
+
+from src.whodis.config import OutputBufferLimit, parse_memory, parse_output_buffer_limit, parse_save_points
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        pytest.param("1024", 1024, id="bytes"),
+        pytest.param("1k", 1000, id="k"),
+        pytest.param("1kb", 1024, id="kb"),
+        pytest.param("100mb", 100 * 1024**2, id="mb"),
+        pytest.param("2GB", 2 * 1024**3, id="upper_case"),
+    ],
+)
+def test_parse_memory(value: str, expected: int) -> None:
+    assert parse_memory(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "mb", "1tb", "-1", "1.5gb"])
+def test_parse_memory_invalid(value: str) -> None:
+    with pytest.raises(ValueError, match="Invalid memory size"):
+        parse_memory(value)
+
+
+def test_parse_save_points() -> None:
+    assert parse_save_points("3600 1 300 100") == ((3600, 1), (300, 100))
+    assert parse_save_points("") == ()
+
+
+@pytest.mark.parametrize("value", ["3600", "3600 x", "-1 1"])
+def test_parse_save_points_invalid(value: str) -> None:
+    with pytest.raises(ValueError, match="Invalid save points"):
+        parse_save_points(value)
+
+
+def test_parse_output_buffer_limit() -> None:
+    assert parse_output_buffer_limit("256mb 64mb 60") == OutputBufferLimit(256 * 1024**2, 64 * 1024**2, 60)
+    assert parse_output_buffer_limit("0 0 0") == OutputBufferLimit()
+
+
+@pytest.mark.parametrize("value", ["", "256mb 64mb", "256mb 64mb x", "256mb 64mb -1", "1tb 0 0"])
+def test_parse_output_buffer_limit_invalid(value: str) -> None:
+    with pytest.raises(ValueError, match="Invalid output buffer limit"):
+        parse_output_buffer_limit(value)
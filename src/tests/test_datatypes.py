@@ -0,0 +1,286 @@
+import random
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.datatypes import EncodingLimits, Hash, List, Set, ZSet, format_score, parse_int64, scan_positions
+
+LIMITS = EncodingLimits(
+    hash_max_listpack_entries=4,
+    hash_max_listpack_value=8,
+    set_max_intset_entries=4,
+    set_max_listpack_entries=6,
+    set_max_listpack_value=8,
+    list_max_listpack_size=3,
+    zset_max_listpack_entries=6,
+    zset_max_listpack_value=8,
+)
+
+
+@pytest.mark.parametrize(
+    ("data", "expected"),
+    [
+        pytest.param(b"0", 0, id="zero"),
+        pytest.param(b"-42", -42, id="negative"),
+        pytest.param(b"9223372036854775807", 2**63 - 1, id="max"),
+        pytest.param(b"9223372036854775808", None, id="overflow"),
+        pytest.param(b"012", None, id="leading_zero"),
+        pytest.param(b" 1", None, id="space"),
+        pytest.param(b"1_0", None, id="underscore"),
+        pytest.param(b"", None, id="empty"),
+    ],
+)
+def test_parse_int64(data: bytes, expected: int | None) -> None:
+    assert parse_int64(data) == expected
+
+
+def test_hash_listpack_keeps_fields_apart_from_values() -> None:
+    hash_ = Hash()
+    assert hash_.set(b"a", b"b", LIMITS)
+    # b is a value, not a field, so it must not be found as one
+    assert hash_.get(b"b") is None
+    assert hash_.set(b"b", b"a", LIMITS)
+    assert not hash_.set(b"a", b"c", LIMITS)
+
+    assert dict(hash_.items()) == {b"a": b"c", b"b": b"a"}
+    assert hash_.encoding == "listpack"
+    assert hash_.delete(b"a")
+    assert not hash_.delete(b"a")
+    assert list(hash_.items()) == [(b"b", b"a")]
+
+
+@pytest.mark.parametrize(
+    ("fields", "value", "expected"),
+    [
+        pytest.param(4, b"v", "listpack", id="small"),
+        pytest.param(5, b"v", "hashtable", id="too_many_entries"),
+        pytest.param(1, b"v" * 9, "hashtable", id="value_too_long"),
+    ],
+)
+def test_hash_conversion(fields: int, value: bytes, expected: str) -> None:
+    hash_ = Hash()
+    for i in range(fields):
+        hash_.set(b"field:%d" % i, value, LIMITS)
+
+    assert hash_.encoding == expected
+    assert len(hash_) == fields
+    assert all(hash_.get(b"field:%d" % i) == value for i in range(fields))
+
+
+@pytest.mark.parametrize(
+    ("members", "expected"),
+    [
+        pytest.param([b"3", b"-1", b"2"], "intset", id="intset"),
+        pytest.param([b"1", b"2", b"3", b"4", b"5"], "listpack", id="too_many_integers"),
+        pytest.param([b"1", b"x"], "listpack", id="not_an_integer"),
+        pytest.param([b"01"], "listpack", id="not_canonical"),
+        pytest.param([b"1", b"x" * 9], "hashtable", id="member_too_long"),
+        pytest.param([b"%d" % i for i in range(7)], "hashtable", id="too_many_members"),
+    ],
+)
+def test_set_conversion(members: list[bytes], expected: str) -> None:
+    set_ = Set()
+    for member in members:
+        assert set_.add(member, LIMITS)
+        assert not set_.add(member, LIMITS)
+
+    assert set_.encoding == expected
+    assert sorted(set_) == sorted(members)
+    assert all(member in set_ for member in members)
+    assert b"missing" not in set_
+    assert set_.remove(members[0])
+    assert members[0] not in set_
+
+
+def test_intset_is_sorted() -> None:
+    set_ = Set()
+    for member in (b"5", b"-3", b"10", b"0"):
+        set_.add(member, LIMITS)
+
+    assert list(set_) == [b"-3", b"0", b"5", b"10"]
+    assert b"5" in set_
+    assert b"05" not in set_
+
+
+def test_list_is_chunked() -> None:
+    list_ = List()
+    list_.push_right([b"%d" % i for i in range(5)], LIMITS)
+    list_.push_left([b"-1", b"-2"], LIMITS)
+    elements = [b"-2", b"-1", *(b"%d" % i for i in range(5))]
+
+    assert list_.encoding == "quicklist"
+    assert list(list_) == elements
+    assert [list_.index(i) for i in range(-8, 8)] == [None, *elements, *elements, None]
+    assert all(list_.range(start, stop) == elements[start : stop + 1] for start in range(7) for stop in range(start, 7))
+
+
+def test_list_pops_across_chunks() -> None:
+    list_ = List()
+    list_.push_right([b"%d" % i for i in range(8)], LIMITS)
+
+    assert list_.pop_left(4) == [b"0", b"1", b"2", b"3"]
+    assert list_.pop_right(3) == [b"7", b"6", b"5"]
+    assert list_.pop_right(3) == [b"4"]
+    assert len(list_) == 0
+    assert list_.pop_left(1) == []
+
+
+@pytest.mark.parametrize("size", [5, 300], ids=["listpack", "skiplist"])
+def test_zset_matches_sorted_order(size: int) -> None:
+    rng = random.Random(size)  # noqa: S311
+    zset = ZSet()
+    scores: dict[bytes, float] = {}
+    for _ in range(size * 4):
+        member = b"member:%d" % rng.randrange(size)
+        if rng.random() < 0.2:  # noqa: PLR2004
+            assert zset.remove(member) == (scores.pop(member, None) is not None)
+        else:
+            # Few distinct scores, so members are often ordered among equals
+            score = float(rng.randrange(size // 2))
+            assert zset.add(member, score, LIMITS) == (member not in scores)
+            scores[member] = score
+
+    ordered = sorted(scores.items(), key=lambda item: (item[1], item[0]))
+    assert list(zset.items()) == ordered
+    for rank, (member, score) in enumerate(ordered):
+        assert (zset.rank(member), zset.score(member)) == (rank, score)
+    assert zset.rank(b"missing") is None
+    for start in range(len(ordered)):
+        assert list(zset.range(start, 3)) == ordered[start : start + 3]
+    for score in range(-1, size // 2 + 1):
+        assert zset.count_below(score, inclusive=False) == sum(s < score for s in scores.values())
+        assert zset.count_below(score, inclusive=True) == sum(s <= score for s in scores.values())
+
+
+@pytest.mark.parametrize(
+    ("members", "expected"),
+    [
+        pytest.param([b"a", b"b"], "listpack", id="small"),
+        pytest.param([b"%d" % i for i in range(7)], "skiplist", id="too_many_members"),
+        pytest.param([b"a", b"x" * 9], "skiplist", id="member_too_long"),
+    ],
+)
+def test_zset_conversion(members: list[bytes], expected: str) -> None:
+    zset = ZSet()
+    for score, member in enumerate(members):
+        zset.add(member, float(score), LIMITS)
+
+    assert zset.encoding == expected
+    assert [member for member, _ in zset.items()] == members
+
+
+def test_zset_score_updates_keep_order() -> None:
+    zset = ZSet()
+    for i in range(10):
+        zset.add(b"%d" % i, float(i), LIMITS)
+
+    # In place, then moving past other members in each direction
+    assert not zset.add(b"5", 5.5, LIMITS)
+    assert not zset.add(b"0", 20.0, LIMITS)
+    assert not zset.add(b"9", -1.0, LIMITS)
+
+    assert [member for member, _ in zset.items()] == [b"9", b"1", b"2", b"3", b"4", b"5", b"6", b"7", b"8", b"0"]
+    assert zset.rank(b"5") == 5  # noqa: PLR2004
+
+
+@pytest.mark.parametrize(
+    ("score", "expected"),
+    [
+        pytest.param(3.0, b"3", id="integral"),
+        pytest.param(-0.5, b"-0.5", id="fraction"),
+        pytest.param(0.1 + 0.2, b"0.30000000000000004", id="shortest_round_trip"),
+        pytest.param(1e20, b"1e+20", id="large"),
+        pytest.param(float("inf"), b"inf", id="inf"),
+        pytest.param(float("-inf"), b"-inf", id="negative_inf"),
+    ],
+)
+def test_format_score(score: float, expected: bytes) -> None:
+    assert format_score(score) == expected
+
+
+def test_scan_positions_visits_everything_once() -> None:
+    ordered = list(range(100))
+    seen: list[int] = []
+    cursor = 0
+    while True:
+        cursor, elements = scan_positions(ordered, cursor, 7)
+        seen += elements
+        if cursor == 0:
+            break
+
+    assert seen == list(range(99, -1, -1))
+
+
+def test_scan_survives_removals_and_resizes() -> None:
+    rng = random.Random(3)  # noqa: S311
+    set_ = Set()
+    for i in range(1_000):
+        set_.add(b"m%d" % i, LIMITS)
+    stable = {b"m%d" % i for i in range(0, 1_000, 4)}
+    transient = [b"m%d" % i for i in range(1_000) if b"m%d" % i not in stable]
+    rng.shuffle(transient)
+
+    seen: set[bytes] = set()
+    cursor, added = 0, 1_000
+    while True:
+        cursor, elements = set_.scan(cursor, 10)
+        seen.update(elements)
+        if cursor == 0:
+            break
+        # Adding enough to resize the table, and removing from anywhere, often
+        # enough that the positions are rebuilt during the scan
+        for _ in range(20):
+            set_.add(b"m%d" % added, LIMITS)
+            added += 1
+        for _ in range(30):
+            if transient:
+                set_.remove(transient.pop())
+
+    assert stable <= seen
+    assert not seen & set(transient)
+
+
+class _Unwalkable(dict[bytes, bytes]):
+    # A hash table that fails any attempt to walk it from one end
+    def __iter__(self) -> Iterator[bytes]:
+        raise AssertionError
+
+    def __reversed__(self) -> Iterator[bytes]:
+        raise AssertionError
+
+
+def test_deep_scan_cursor_does_not_walk_the_prefix() -> None:
+    hash_ = Hash()
+    for i in range(10_000):
+        hash_.set(b"field:%d" % i, b"value", LIMITS)
+    items = hash_._items  # noqa: SLF001
+    assert isinstance(items, dict)
+    hash_._items = _Unwalkable(items)  # noqa: SLF001
+
+    # The fields at positions 10 to 14, reached without passing the others
+    cursor, scanned = hash_.scan(15, 5)
+
+    assert cursor == 10  # noqa: PLR2004
+    assert [field for field, _ in scanned] == [b"field:%d" % i for i in range(14, 9, -1)]
+
+
+def test_large_collections_scan_incrementally() -> None:
+    hash_, set_, zset = Hash(), Set(), ZSet()
+    for i in range(20):
+        hash_.set(b"field:%d" % i, b"value", LIMITS)
+        set_.add(b"member:%d" % i, LIMITS)
+        zset.add(b"member:%d" % i, float(i), LIMITS)
+
+    cursor, items = hash_.scan(0, 5)
+    assert (cursor, len(items)) == (15, 5)
+    assert items[0] == (b"field:19", b"value")
+    assert set_.scan(15, 5) == (10, [b"member:14", b"member:13", b"member:12", b"member:11", b"member:10"])
+    assert zset.scan(3, 5) == (0, [(b"member:2", 2.0), (b"member:1", 1.0), (b"member:0", 0.0)])
+
+
+def test_small_collections_scan_in_one_step() -> None:
+    set_ = Set()
+    for member in (b"1", b"2"):
+        set_.add(member, LIMITS)
+
+    assert set_.scan(0, 1) == (0, [b"1", b"2"])
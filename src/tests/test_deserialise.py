@@ -1,6 +1,18 @@
 import pytest
 
-from src.whodis.deserialise import InvalidMessageError, ParseResult, deserialise
+from src.whodis.deserialise import (
+    BIG_BULK_BYTES,
+    MAX_LINE_BYTES,
+    ErrorReply,
+    InvalidMessageError,
+    ParseResult,
+    RequestReader,
+    deserialise,
+    parse_message,
+    parse_reply,
+)
+from src.whodis.serialise import encode_command
+from src.whodis.shared import BulkLengthError, IncompleteMessageError, LineLengthError, RESPDataType
 
 
 @pytest.mark.parametrize(
@@ -136,3 +148,194 @@ def test_valid_arrays(sent_message: str, expected_result: ParseResult) -> None:
 def test_invalid_arrays(sent_message: str) -> None:
     with pytest.raises(InvalidMessageError):
         deserialise(sent_message)
+
+
+@pytest.mark.parametrize(
+    ("sent_message", "expected_result"),
+    [
+        pytest.param("+PING\r\n+PING\r\n", ParseResult("PING", 7), id="stream_trailing_message"),
+        pytest.param("$4\r\nPING\r\n+PI", ParseResult("PING", 10), id="stream_trailing_partial"),
+        pytest.param(
+            "*2\r\n*1\r\n+a\r\n+b\r\n+c\r\n",
+            ParseResult([["a"], "b"], 16),
+            id="stream_nested_array_not_last",
+        ),
+    ],
+)
+def test_stream_messages(sent_message: str, expected_result: ParseResult) -> None:
+    parse_result = parse_message(sent_message)
+    assert parse_result == expected_result
+
+
+@pytest.mark.parametrize(
+    "sent_message",
+    [
+        pytest.param("", id="stream_empty"),
+        pytest.param("*2\r\n+a\r\n", id="stream_array_missing_element"),
+        pytest.param("*2", id="stream_array_missing_prefix_crlf"),
+        pytest.param("$10\r\nbulk", id="stream_bulk_partial_content"),
+        pytest.param("+PI", id="stream_simple_partial"),
+        pytest.param(":12", id="stream_integer_partial"),
+    ],
+)
+def test_incomplete_stream_messages(sent_message: str) -> None:
+    with pytest.raises(IncompleteMessageError):
+        parse_message(sent_message)
+
+
+@pytest.mark.parametrize(
+    "sent_message",
+    [
+        pytest.param(b"*2\r\n$4\r\necho\r\n$2\r\nhi\r\n", id="buffer_bytes"),
+        pytest.param(bytearray(b"*2\r\n$4\r\necho\r\n$2\r\nhi\r\n"), id="buffer_bytearray"),
+        pytest.param(memoryview(b"*2\r\n$4\r\necho\r\n$2\r\nhi\r\n"), id="buffer_memoryview"),
+    ],
+)
+def test_buffer_messages(sent_message: bytes | bytearray | memoryview) -> None:
+    parse_result = deserialise(sent_message)
+    assert parse_result == ParseResult(["echo", "hi"], 22)
+
+
+def test_bulk_string_length_counts_bytes() -> None:
+    parse_result = deserialise("$2\r\né\r\n")
+    assert parse_result == ParseResult("é", 8)
+
+
+def test_stream_message_at_offset() -> None:
+    parse_result = parse_message(b"+PING\r\n$4\r\nPING\r\n", start=7)
+    assert parse_result == ParseResult("PING", 10)
+
+
+def _read_requests(reader: RequestReader, data: bytes, chunk_size: int) -> list[RESPDataType]:
+    # Feeds data through the reader's buffers as a transport would
+    requests: list[RESPDataType] = []
+    pos = 0
+    while pos < len(data):
+        buffer = reader.get_buffer()
+        n = min(len(buffer), chunk_size, len(data) - pos)
+        buffer[:n] = data[pos : pos + n]
+        pos += n
+        reader.buffer_updated(n)
+        while (request := reader.next_request()) is not None:
+            requests.append(request)
+
+    return requests
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_request_reader(chunk_size: int) -> None:
+    large = "x" * BIG_BULK_BYTES
+    data = (
+        encode_command(["SET", "key", "value"])
+        + b"+PING\r\n"
+        + encode_command(["SET", "large", large])
+        + b"$4\r\nPING\r\n"
+        + b"*0\r\n"
+        + encode_command(["GET", "large"])
+    )
+    reader = RequestReader(bytearray(4096), max_bulk_len=1024 * 1024)
+
+    assert _read_requests(reader, data, chunk_size) == [
+        ["SET", "key", "value"],
+        "PING",
+        ["SET", "large", large],
+        "PING",
+        [],
+        ["GET", "large"],
+    ]
+
+
+def test_request_reader_receives_large_bulk_into_its_own_buffer() -> None:
+    read_buffer = bytearray(4096)
+    reader = RequestReader(read_buffer, max_bulk_len=1024 * 1024)
+    value = b"v" * (BIG_BULK_BYTES * 4)
+    data = b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$%d\r\n%s\r\n" % (len(value), value)
+
+    assert _read_requests(reader, data[:100], 100) == []
+    # The rest of the value, with its CRLF, is asked for in one buffer
+    buffer = reader.get_buffer()
+    assert buffer.obj is not read_buffer
+    assert len(buffer) == len(data) - 100
+    buffer.release()
+    assert _read_requests(reader, data[100:], len(data)) == [["SET", "k", value.decode()]]
+    assert reader.get_buffer().obj is read_buffer
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        pytest.param(b"*2\r\n$3\r\nGET\r\n$1048577\r\n", id="element"),
+        pytest.param(b"$1048577\r\n", id="value"),
+    ],
+)
+def test_request_reader_refuses_bulk_over_limit(data: bytes) -> None:
+    reader = RequestReader(bytearray(4096), max_bulk_len=1024 * 1024)
+
+    with pytest.raises(BulkLengthError):
+        _read_requests(reader, data, len(data))
+
+
+@pytest.mark.parametrize(
+    ("prefix", "message"),
+    [
+        pytest.param(b"*", "too big mbulk count string", id="array"),
+        pytest.param(b"*1\r\n$", "too big bulk count string", id="element"),
+        pytest.param(b"$", "too big bulk count string", id="value"),
+        pytest.param(b"+", "too big inline request", id="simple_string"),
+    ],
+)
+def test_request_reader_refuses_line_over_limit(prefix: bytes, message: str) -> None:
+    reader = RequestReader(bytearray(4096), max_bulk_len=1024 * 1024)
+    data = prefix + b"1" * (MAX_LINE_BYTES * 4)
+
+    with pytest.raises(LineLengthError, match=message):
+        _read_requests(reader, data, 4096)
+    # Refused once over the limit, rather than after the whole line
+    assert len(reader._buffer) < MAX_LINE_BYTES + 4096  # noqa: SLF001
+
+
+def test_request_reader_line_at_limit() -> None:
+    reader = RequestReader(bytearray(4096), max_bulk_len=1024 * 1024)
+    data = b"+" + b"x" * (MAX_LINE_BYTES - 3) + b"\r\n"
+
+    assert _read_requests(reader, data, 1000) == ["x" * (MAX_LINE_BYTES - 3)]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        pytest.param(b"*2\r\n$3\r\nGET\r\n:1\r\n", id="integer_element"),
+        pytest.param(b"*1\r\n*1\r\n$4\r\nPING\r\n", id="nested_array"),
+        pytest.param(b"*x\r\n", id="bad_length"),
+        pytest.param(b"*1\r\n$-1\r\n", id="null_element"),
+        pytest.param(b"*1\r\n$40000\r\n" + b"x" * 40000 + b"!!", id="large_bulk_missing_crlf"),
+    ],
+)
+def test_request_reader_invalid_requests(data: bytes) -> None:
+    reader = RequestReader(bytearray(4096), max_bulk_len=1024 * 1024)
+
+    with pytest.raises(InvalidMessageError):
+        _read_requests(reader, data, len(data))
+
+
+@pytest.mark.parametrize(
+    ("data", "expected"),
+    [
+        pytest.param(b"+OK\r\n", "OK", id="simple_string"),
+        pytest.param(b"-ERR no such key\r\n", ErrorReply("ERR no such key"), id="error"),
+        pytest.param(b":42\r\n", 42, id="integer"),
+        pytest.param(b"$5\r\nhello\r\n", "hello", id="bulk_string"),
+        pytest.param(b"$-1\r\n", None, id="null_bulk_string"),
+        pytest.param(b"*-1\r\n", None, id="null_array"),
+        pytest.param(b"*3\r\n$1\r\na\r\n$-1\r\n:1\r\n", ["a", None, 1], id="array_with_null"),
+        pytest.param(b"*2\r\n*1\r\n-ERR x\r\n*0\r\n", [[ErrorReply("ERR x")], []], id="nested_arrays"),
+    ],
+)
+def test_parse_reply(data: bytes, expected: object) -> None:
+    assert parse_reply(b"+first\r\n" + data, 8) == (expected, 8 + len(data))
+
+
+@pytest.mark.parametrize("data", [b"", b"$5\r\nhel", b"$-1\r", b"*2\r\n$-1\r\n", b"-ERR"])
+def test_parse_incomplete_reply(data: bytes) -> None:
+    with pytest.raises(IncompleteMessageError):
+        parse_reply(data)
@@ -0,0 +1,135 @@
+import itertools
+import random
+from collections import OrderedDict
+
+import pytest
+
+from src.whodis.commands import CommandError, handle_command
+from src.whodis.eviction import EvictingKeyspace, EvictionPolicy
+from src.whodis.keyspace import Entry, encode_value, entry_size
+from src.whodis.serialise import ReplyWriter
+
+UNIVERSE = 5_000
+CAPACITY = 500
+ACCESSES = 50_000
+VALUE = "v" * 10
+
+KEYS = [f"key:{i:05d}" for i in range(UNIVERSE)]
+KEY_SIZE = entry_size(KEYS[0], encode_value(VALUE))
+
+
+def _zipf_trace() -> list[int]:
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(UNIVERSE)))
+    return random.Random(42).choices(range(UNIVERSE), cum_weights=cum_weights, k=ACCESSES)  # noqa: S311
+
+
+TRACE = _zipf_trace()
+
+
+class _CountingKeyspace(EvictingKeyspace):
+    def __init__(self, maxmemory: int, policy: EvictionPolicy) -> None:
+        super().__init__(maxmemory, policy)
+        self.sampled = 0
+
+    def sample(self, count: int, *, volatile: bool = False) -> list[tuple[str, Entry]]:
+        samples = super().sample(count, volatile=volatile)
+        self.sampled += len(samples)
+        return samples
+
+
+def _exact_lru_hit_ratio() -> float:
+    cache: OrderedDict[int, None] = OrderedDict()
+    hits = 0
+    for i in TRACE:
+        if i in cache:
+            cache.move_to_end(i)
+            hits += 1
+        else:
+            cache[i] = None
+            if len(cache) > CAPACITY:
+                cache.popitem(last=False)
+
+    return hits / ACCESSES
+
+
+def _run_cache_workload(keyspace: EvictingKeyspace, ttl: int | None = None) -> float:
+    # A read-through cache: every miss is followed by a write of the key
+    hits = 0
+    for i in TRACE:
+        key = KEYS[i]
+        if keyspace.get(key) is not None:
+            hits += 1
+            continue
+
+        keyspace.perform_evictions()
+        keyspace.set(key, VALUE, None if ttl is None else keyspace.now_ms() + ttl)
+        # Eviction happens before a write, so one write may overshoot the limit
+        assert keyspace.used_memory <= keyspace.maxmemory + KEY_SIZE
+
+    return hits / ACCESSES
+
+
+@pytest.mark.parametrize(
+    ("policy", "ttl"),
+    [
+        pytest.param(EvictionPolicy.ALLKEYS_LRU, None, id="allkeys_lru"),
+        pytest.param(EvictionPolicy.ALLKEYS_LFU, None, id="allkeys_lfu"),
+        pytest.param(EvictionPolicy.VOLATILE_TTL, 3_600_000, id="volatile_ttl"),
+    ],
+)
+def test_eviction_cost_is_bounded(policy: EvictionPolicy, ttl: int | None) -> None:
+    keyspace = _CountingKeyspace(CAPACITY * KEY_SIZE, policy)
+    _run_cache_workload(keyspace, ttl)
+
+    assert keyspace.evicted_keys > 0
+    assert keyspace.sampled <= keyspace.evicted_keys * keyspace.samples
+
+
+@pytest.mark.parametrize(
+    ("policy", "min_fraction_of_lru"),
+    [
+        pytest.param(EvictionPolicy.ALLKEYS_LRU, 0.95, id="allkeys_lru"),
+        # LFU suits a stable Zipfian popularity better than recency does
+        pytest.param(EvictionPolicy.ALLKEYS_LFU, 1.0, id="allkeys_lfu"),
+    ],
+)
+def test_sampled_eviction_hit_ratio(policy: EvictionPolicy, min_fraction_of_lru: float) -> None:
+    keyspace = EvictingKeyspace(CAPACITY * KEY_SIZE, policy)
+    hit_ratio = _run_cache_workload(keyspace)
+
+    assert hit_ratio >= _exact_lru_hit_ratio() * min_fraction_of_lru
+
+
+def test_volatile_ttl_evicts_soonest_expiring_keys() -> None:
+    keyspace = EvictingKeyspace(3 * KEY_SIZE, EvictionPolicy.VOLATILE_TTL, samples=50)
+    now = keyspace.now_ms()
+    keyspace.set(KEYS[0], VALUE, now + 1_000)
+    keyspace.set(KEYS[1], VALUE)
+    keyspace.set(KEYS[2], VALUE, now + 60_000)
+    keyspace.set(KEYS[3], VALUE, now + 120_000)
+
+    keyspace.perform_evictions()
+
+    assert [key in keyspace for key in KEYS[:4]] == [False, True, True, True]
+
+
+@pytest.mark.parametrize(
+    "policy",
+    [
+        pytest.param(EvictionPolicy.NOEVICTION, id="noeviction"),
+        pytest.param(EvictionPolicy.VOLATILE_TTL, id="volatile_ttl_without_volatile_keys"),
+    ],
+)
+def test_writes_refused_when_nothing_can_be_evicted(policy: EvictionPolicy) -> None:
+    keyspace = EvictingKeyspace(KEY_SIZE, policy)
+    out = ReplyWriter()
+    handle_command(keyspace, ["SET", KEYS[0], VALUE], out)
+    handle_command(keyspace, ["SET", KEYS[1], VALUE], out)
+
+    with pytest.raises(CommandError, match="OOM command not allowed"):
+        handle_command(keyspace, ["SET", KEYS[2], VALUE], out)
+
+    # Reads and deletes are still allowed
+    handle_command(keyspace, ["GET", KEYS[0]], out)
+    handle_command(keyspace, ["DEL", KEYS[0]], out)
+    assert out.getvalue() == b"+OK\r\n+OK\r\n$10\r\nvvvvvvvvvv\r\n:1\r\n"
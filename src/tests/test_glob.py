@@ -0,0 +1,36 @@
+import pytest
+
+from src.whodis.glob import compile_glob, compile_glob_bytes
+
+
+@pytest.mark.parametrize(
+    ("pattern", "matches", "non_matches"),
+    [
+        pytest.param("*", ["", "anything"], [], id="star"),
+        pytest.param("user:*", ["user:", "user:1:name"], ["users:1", "a:user:1"], id="prefix"),
+        pytest.param("h?llo", ["hello", "hallo"], ["hllo", "heello"], id="question_mark"),
+        pytest.param("h[ae]llo", ["hello", "hallo"], ["hillo"], id="class"),
+        pytest.param("h[^e]llo", ["hallo", "hbllo"], ["hello"], id="negated_class"),
+        pytest.param("h[a-b]llo", ["hallo", "hbllo"], ["hcllo"], id="range"),
+        pytest.param("h[b-a]llo", ["hallo", "hbllo"], ["hcllo"], id="reversed_range"),
+        pytest.param(r"h\*llo", ["h*llo"], ["hello"], id="escaped_star"),
+        pytest.param("a.b+c(", ["a.b+c("], ["aXb+c("], id="regex_characters"),
+        pytest.param("a[]b", [], ["ab", "a]b"], id="empty_class"),
+        pytest.param("a[^]b", ["axb"], ["ab"], id="negated_empty_class"),
+        pytest.param("a[bc", ["ab", "ac"], ["a[bc"], id="unterminated_class"),
+        pytest.param("line*", ["line\nbreak"], [], id="newlines"),
+    ],
+)
+def test_compile_glob(pattern: str, matches: list[str], non_matches: list[str]) -> None:
+    regex = compile_glob(pattern)
+
+    assert all(regex.fullmatch(string) for string in matches)
+    assert not any(regex.fullmatch(string) for string in non_matches)
+
+
+def test_compile_glob_bytes_matches_single_bytes() -> None:
+    regex = compile_glob_bytes("caf?")
+
+    assert regex.fullmatch(b"cafe")
+    # As in Redis, ? is one byte, not one character
+    assert not regex.fullmatch("café".encode())
@@ -0,0 +1,160 @@
+import random
+import time
+
+import pytest
+
+from src.whodis.keyspace import Keyspace, encode_value
+
+NUM_VOLATILE_KEYS = 1_000_000
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(scope="module")
+def half_expired() -> tuple[Keyspace, _FakeClock]:
+    # Half of the keys expire after one second and the rest after an hour
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    now = keyspace.now_ms()
+    for i in range(NUM_VOLATILE_KEYS):
+        keyspace.set(f"key:{i}", "v", now + (1_000 if i % 2 else 3_600_000))
+
+    clock.now += 2
+    return keyspace, clock
+
+
+def test_active_expire_cycle_work_is_bounded(half_expired: tuple[Keyspace, _FakeClock]) -> None:
+    keyspace, _ = half_expired
+    before = len(keyspace)
+
+    result = keyspace.active_expire_cycle(max_samples=500, time_budget=60)
+
+    assert result.sampled <= 500  # noqa: PLR2004
+    assert 0 < result.expired <= result.sampled
+    assert len(keyspace) == before - result.expired
+
+
+def test_active_expire_cycle_latency_is_bounded(half_expired: tuple[Keyspace, _FakeClock]) -> None:
+    keyspace, _ = half_expired
+
+    start = time.perf_counter()
+    result = keyspace.active_expire_cycle(max_samples=NUM_VOLATILE_KEYS, time_budget=0.005)
+    elapsed = time.perf_counter() - start
+
+    # The budget is checked between batches, so allow generous slack for one
+    # batch and a slow machine, far below the cost of a full scan
+    assert elapsed < 0.1  # noqa: PLR2004
+    assert result.sampled < NUM_VOLATILE_KEYS
+
+
+def test_active_expiry_reclaims_expired_keys() -> None:
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    now = keyspace.now_ms()
+    for i in range(1_000):
+        keyspace.set(f"key:{i}", "v", now + 1_000)
+    keyspace.set("persistent", "v")
+
+    clock.now += 2
+    for _ in range(10):
+        keyspace.active_expire_cycle(max_samples=100)
+
+    # Only volatile keys are ever sampled, so every sample here is a hit
+    assert len(keyspace) == 1
+    assert keyspace.get("persistent") == b"v"
+
+
+def test_persist_and_delete_keep_volatile_index_consistent() -> None:
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    now = keyspace.now_ms()
+    for i in range(10):
+        keyspace.set(f"key:{i}", "v", now + 1_000)
+
+    assert keyspace.persist("key:0")
+    assert keyspace.delete("key:5")
+    assert keyspace.get_expire("key:9") == now + 1_000
+
+    clock.now += 2
+    while keyspace.active_expire_cycle().expired:
+        pass
+
+    assert len(keyspace) == 1
+    assert keyspace.get("key:0") == b"v"
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        pytest.param("123", 123, id="integer"),
+        pytest.param("-1", -1, id="negative"),
+        pytest.param(b"42", 42, id="bytes"),
+        pytest.param(str(-(2**63)), -(2**63), id="min"),
+        pytest.param(str(2**63), str(2**63).encode(), id="out_of_range"),
+        pytest.param("0123", b"0123", id="leading_zero"),
+        pytest.param("-0", b"-0", id="negative_zero"),
+        pytest.param(" 1", b" 1", id="whitespace"),
+        pytest.param("1_000", b"1_000", id="underscore"),
+        pytest.param("-", b"-", id="sign_only"),
+        pytest.param("", b"", id="empty"),
+        pytest.param("h\u00e9llo", "h\u00e9llo".encode(), id="non_ascii"),
+    ],
+)
+def test_encode_value(value: str | bytes, expected: int | bytes) -> None:
+    assert encode_value(value) == expected
+
+
+def test_small_integers_are_shared() -> None:
+    keyspace = Keyspace()
+    keyspace.set("a", "5000")
+    keyspace.set("b", 5000)
+
+    assert keyspace.get("a") is keyspace.get("b")
+
+
+def test_scan_returns_keys_present_throughout() -> None:
+    # Keys are deleted and added between every step, which moves keys around
+    # the dense key list, yet none that stays is missed
+    rng = random.Random(7)  # noqa: S311
+    keyspace = Keyspace()
+    for i in range(1_000):
+        keyspace.set(f"key:{i}", "v")
+    stable = {f"key:{i}" for i in range(0, 1_000, 3)}
+    transient = [f"key:{i}" for i in range(1_000) if f"key:{i}" not in stable]
+    rng.shuffle(transient)
+
+    seen: list[str] = []
+    cursor, added = 0, 0
+    while True:
+        cursor, entries = keyspace.scan(cursor, 10)
+        seen += [key for key, _ in entries]
+        if cursor == 0:
+            break
+        for _ in range(3):
+            if transient:
+                keyspace.delete(transient.pop())
+        keyspace.set(f"new:{added}", "v")
+        added += 1
+
+    assert stable <= set(seen)
+    # Work is bounded by the count, so keys are seldom returned twice
+    assert len(seen) < 1_100  # noqa: PLR2004
+
+
+def test_scan_skips_expired_keys() -> None:
+    clock = _FakeClock()
+    keyspace = Keyspace(clock=clock)
+    keyspace.set("expiring", "v", keyspace.now_ms() + 1_000)
+    keyspace.set("plain", "v")
+    clock.now += 2
+
+    cursor, entries = keyspace.scan(0, 10)
+
+    assert cursor == 0
+    assert [key for key, _ in entries] == ["plain"]
@@ -0,0 +1,218 @@
+import socket
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.config import Config, OutputBufferLimit
+from src.whodis.pubsub import PubSub, message_frame
+from src.whodis.serialise import encode_command
+from src.whodis.server import WhodisServer
+
+
+class _Client:
+    def __init__(self) -> None:
+        self.frames: list[bytes] = []
+
+    def deliver(self, frame: bytes) -> None:
+        self.frames.append(frame)
+
+
+def _pmessage(pattern: str, channel: str, message: str) -> bytes:
+    parts = [b"pmessage", pattern.encode(), channel.encode(), message.encode()]
+    return b"*4\r\n" + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+
+
+def test_publish_reuses_one_frame_for_every_subscriber() -> None:
+    pubsub = PubSub()
+    clients = [_Client() for _ in range(3)]
+    for client in clients:
+        pubsub.subscribe(client, "news")
+
+    assert pubsub.publish("news", "hello") == 3  # noqa: PLR2004
+    assert pubsub.publish("other", "hello") == 0
+
+    [frame] = clients[0].frames
+    assert frame == message_frame("news", "hello") == b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$5\r\nhello\r\n"
+    assert all(client.frames[0] is frame for client in clients)
+
+
+@pytest.mark.parametrize(
+    ("pattern", "channel", "matches"),
+    [
+        ("news.*", "news.sport", True),
+        ("news.*", "news", False),
+        ("news.*", "weather.news", False),
+        ("*", "anything", True),
+        ("n?ws", "news", True),
+        ("news.[st]*", "news.tech", True),
+        ("news.[st]*", "news.art", False),
+        ("news\\*", "news*", True),
+        ("news\\*", "newsx", False),
+        ("news", "news", True),
+        ("news", "newsletter", False),
+    ],
+)
+def test_pattern_subscriptions(pattern: str, channel: str, *, matches: bool) -> None:
+    pubsub = PubSub()
+    client = _Client()
+    pubsub.psubscribe(client, pattern)
+
+    assert pubsub.publish(channel, "m") == int(matches)
+    assert client.frames == ([_pmessage(pattern, channel, "m")] if matches else [])
+
+
+def test_patterns_sharing_and_not_sharing_prefixes() -> None:
+    pubsub = PubSub()
+    client = _Client()
+    for pattern in ["a.*", "a.b*", "a.b.c", "b*", "*c"]:
+        pubsub.psubscribe(client, pattern)
+
+    assert pubsub.publish("a.b.c", "m") == 4  # noqa: PLR2004
+    assert {frame.split(b"\r\n")[4] for frame in client.frames} == {b"a.*", b"a.b*", b"a.b.c", b"*c"}
+
+    pubsub.punsubscribe(client, "a.*")
+    pubsub.punsubscribe(client, "*c")
+    client.frames.clear()
+    assert pubsub.publish("a.b.c", "m") == 2  # noqa: PLR2004
+    assert pubsub.num_patterns == 3  # noqa: PLR2004
+
+
+def test_channel_and_pattern_both_deliver() -> None:
+    pubsub = PubSub()
+    client = _Client()
+    pubsub.subscribe(client, "news")
+    pubsub.psubscribe(client, "n*")
+
+    assert pubsub.publish("news", "m") == 2  # noqa: PLR2004
+    assert client.frames == [message_frame("news", "m"), _pmessage("n*", "news", "m")]
+
+
+def test_subscriptions_are_tracked_per_client() -> None:
+    pubsub = PubSub()
+    first, second = _Client(), _Client()
+    assert pubsub.subscribe(first, "a")
+    assert not pubsub.subscribe(first, "a")
+    pubsub.subscribe(first, "b")
+    pubsub.subscribe(second, "a")
+    pubsub.psubscribe(first, "c*")
+
+    assert pubsub.subscription_count(first) == 3  # noqa: PLR2004
+    assert pubsub.channels(first) == ["a", "b"]
+    assert pubsub.num_subscribers("a") == 2  # noqa: PLR2004
+
+    pubsub.remove(first)
+    assert pubsub.subscription_count(first) == 0
+    assert pubsub.active_channels() == ["a"]
+    assert pubsub.num_patterns == 0
+    assert not pubsub.unsubscribe(first, "a")
+
+
+@pytest.fixture
+def server() -> Iterator[WhodisServer]:
+    server = WhodisServer(host="", port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def _connect(server: WhodisServer) -> socket.socket:
+    s = socket.create_connection(("127.0.0.1", server.bound_port))
+    s.settimeout(5)
+    return s
+
+
+def _recv_exactly(s: socket.socket, num_bytes: int) -> bytes:
+    received = b""
+    while len(received) < num_bytes:
+        chunk = s.recv(num_bytes - len(received))
+        if not chunk:
+            break
+        received += chunk
+
+    return received
+
+
+def _request(s: socket.socket, expected: bytes, *cmd: str) -> None:
+    s.sendall(encode_command(list(cmd)))
+    assert _recv_exactly(s, len(expected)) == expected
+
+
+def test_subscribe_and_publish(server: WhodisServer) -> None:
+    with _connect(server) as subscriber, _connect(server) as publisher:
+        _request(
+            subscriber,
+            b"*3\r\n$9\r\nsubscribe\r\n$1\r\na\r\n:1\r\n*3\r\n$9\r\nsubscribe\r\n$1\r\nb\r\n:2\r\n",
+            "SUBSCRIBE",
+            "a",
+            "b",
+        )
+        _request(subscriber, b"*3\r\n$10\r\npsubscribe\r\n$2\r\nb*\r\n:3\r\n", "PSUBSCRIBE", "b*")
+        _request(publisher, b":2\r\n", "PUBLISH", "b", "hi")
+        _request(publisher, b":0\r\n", "PUBLISH", "c", "hi")
+        expected = message_frame("b", "hi") + _pmessage("b*", "b", "hi")
+        assert _recv_exactly(subscriber, len(expected)) == expected
+
+        _request(publisher, b"*2\r\n$1\r\na\r\n$1\r\nb\r\n", "PUBSUB", "CHANNELS")
+        _request(publisher, b"*4\r\n$1\r\na\r\n:1\r\n$1\r\nz\r\n:0\r\n", "PUBSUB", "NUMSUB", "a", "z")
+        _request(publisher, b":1\r\n", "PUBSUB", "NUMPAT")
+
+
+def test_subscribed_client_can_only_manage_subscriptions(server: WhodisServer) -> None:
+    with _connect(server) as s:
+        _request(s, b"*3\r\n$9\r\nsubscribe\r\n$1\r\na\r\n:1\r\n", "SUBSCRIBE", "a")
+        _request(
+            s,
+            b"-ERR Can't execute 'get': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING are allowed in this context\r\n",
+            "GET",
+            "k",
+        )
+        _request(s, b"*2\r\n$4\r\npong\r\n$0\r\n\r\n", "PING")
+        _request(s, b"*3\r\n$11\r\nunsubscribe\r\n$1\r\na\r\n:0\r\n", "UNSUBSCRIBE")
+        _request(s, b"*3\r\n$11\r\nunsubscribe\r\n$-1\r\n:0\r\n", "UNSUBSCRIBE")
+        _request(s, b"+PONG\r\n", "PING")
+        _request(s, b"$-1\r\n", "GET", "k")
+
+
+def test_disconnected_subscriber_is_unsubscribed(server: WhodisServer) -> None:
+    with _connect(server) as publisher:
+        with _connect(server) as subscriber:
+            _request(subscriber, b"*3\r\n$10\r\npsubscribe\r\n$1\r\n*\r\n:1\r\n", "PSUBSCRIBE", "*")
+            _request(publisher, b":1\r\n", "PUBSUB", "NUMPAT")
+
+        deadline = time.monotonic() + 5
+        while server._pubsub.num_patterns and time.monotonic() < deadline:  # noqa: SLF001
+            time.sleep(0.01)
+        _request(publisher, b":0\r\n", "PUBLISH", "a", "hi")
+
+
+def test_slow_subscriber_is_dropped_without_blocking_publisher() -> None:
+    config = Config(client_output_buffer_limit_pubsub=OutputBufferLimit(hard=256 * 1024))
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    message = "x" * 16 * 1024
+    num_messages = 1000
+
+    # A subscriber with small socket buffers that never reads its messages
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("127.0.0.1", server.bound_port))
+    with slow, _connect(server) as fast, _connect(server) as publisher:
+        slow.sendall(encode_command(["SUBSCRIBE", "news"]))
+        _request(fast, b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n", "SUBSCRIBE", "news")
+        # The slow subscriber's confirmation hasn't necessarily been read
+        time.sleep(0.1)
+
+        receivers = []
+        frame = message_frame("news", message)
+        for _ in range(num_messages):
+            publisher.sendall(encode_command(["PUBLISH", "news", message]))
+            receivers.append(int(_recv_exactly(publisher, 4)[1:2]))
+            assert _recv_exactly(fast, len(frame)) == frame
+
+    disconnections = server._stats.output_buffer_disconnections  # noqa: SLF001
+    server.stop()
+
+    assert receivers[0] == 2  # noqa: PLR2004
+    assert receivers[-1] == 1
+    assert disconnections == 1
@@ -0,0 +1,254 @@
+import dataclasses
+import socket
+import time
+import urllib.request
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+import pytest
+
+from src.whodis.config import Config
+from src.whodis.deserialise import find_reply_end, parse_message
+from src.whodis.eviction import EvictionPolicy
+from src.whodis.replication import ReplicationBacklog
+from src.whodis.serialise import encode_command
+from src.whodis.server import WhodisServer
+from src.whodis.shared import IncompleteMessageError, RESPDataType
+
+ServerFactory = Callable[..., WhodisServer]
+
+
+def test_backlog_wraps_around() -> None:
+    backlog = ReplicationBacklog(8)
+    backlog.feed(b"abcdef")
+    backlog.feed(b"ghij")
+
+    assert backlog.offset == 10  # noqa: PLR2004
+    assert backlog.histlen == 8  # noqa: PLR2004
+    assert backlog.first_offset == 3  # noqa: PLR2004
+    assert backlog.read_from(3) == b"cdefghij"
+    assert backlog.read_from(9) == b"ij"
+    # Everything has been sent up to here
+    assert backlog.read_from(11) == b""
+
+
+def test_backlog_refuses_offsets_it_no_longer_holds() -> None:
+    backlog = ReplicationBacklog(8, offset=100)
+    backlog.feed(b"0123456789abc")
+
+    assert backlog.read_from(106) == b"56789abc"
+    assert backlog.read_from(105) is None
+    assert backlog.read_from(115) is None
+
+
+@pytest.fixture
+def start_server(tmp_path: Path) -> Iterator[ServerFactory]:
+    # Each server has its own snapshot file
+    servers: list[WhodisServer] = []
+
+    def start(config: Config | None = None) -> WhodisServer:
+        path = tmp_path / f"dump-{len(servers)}.wdb"
+        config = dataclasses.replace(config or Config(), dbfilename=str(path))
+        server = WhodisServer(host="", port=0, config=config)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _request(server: WhodisServer, *cmd: str) -> RESPDataType | None:
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(encode_command(list(cmd)))
+        received = b""
+        while True:
+            try:
+                find_reply_end(received)
+            except IncompleteMessageError:
+                received += s.recv(65536)
+                continue
+
+            # Error replies are returned as their message
+            if received.startswith(b"-"):
+                return received[1:-2].decode()
+            if received == b"$-1\r\n":
+                return None
+            return parse_message(received).data
+
+
+def _info(server: WhodisServer, section: str) -> dict[str, str]:
+    reply = _request(server, "INFO", section)
+    assert isinstance(reply, str)
+    return dict(line.split(":", 1) for line in reply.splitlines() if line and not line.startswith("#"))
+
+
+def _wait_for(condition: Callable[[], bool], timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def _replicate(replica: WhodisServer, primary: WhodisServer) -> None:
+    assert _request(replica, "REPLICAOF", "127.0.0.1", str(primary.bound_port)) == "OK"
+    _wait_for(lambda: _info(replica, "replication")["master_link_status"] == "up")
+
+
+def _caught_up(replica: WhodisServer, primary: WhodisServer) -> bool:
+    return _info(replica, "replication")["slave_repl_offset"] == _info(primary, "replication")["master_repl_offset"]
+
+
+def test_full_sync_then_stream(start_server: ServerFactory) -> None:
+    primary = start_server()
+    replica = start_server()
+    _request(primary, "SET", "before", "1")
+    _request(primary, "HSET", "h", "f", "v")
+    _request(primary, "EXPIRE", "h", "1000")
+
+    _replicate(replica, primary)
+    assert _request(replica, "GET", "before") == "1"
+    assert _request(replica, "HGET", "h", "f") == "v"
+    assert 0 < int(str(_request(replica, "TTL", "h"))) <= 1000  # noqa: PLR2004
+
+    _request(primary, "SET", "after", "2")
+    _request(primary, "DEL", "before")
+    _wait_for(lambda: _caught_up(replica, primary))
+    assert _request(replica, "GET", "after") == "2"
+    assert _request(replica, "GET", "before") is None
+
+    info = _info(primary, "replication")
+    assert info["role"] == "master"
+    assert info["connected_slaves"] == "1"
+    assert ",state=online," in info["slave0"]
+    assert info["master_replid"] == _info(replica, "replication")["master_replid"]
+    assert _info(primary, "stats")["sync_full"] == "1"
+
+
+def test_replica_is_read_only(start_server: ServerFactory) -> None:
+    primary = start_server()
+    replica = start_server()
+    _replicate(replica, primary)
+
+    assert _request(replica, "SET", "k", "v") == "READONLY You can't write against a read only replica."
+    assert _request(replica, "GET", "k") is None
+
+    assert _request(replica, "REPLICAOF", "NO", "ONE") == "OK"
+    assert _info(replica, "replication")["role"] == "master"
+    assert _request(replica, "SET", "k", "v") == "OK"
+
+
+def test_evictions_are_replicated(start_server: ServerFactory) -> None:
+    # The replica has the same maxmemory, but leaves eviction to the primary,
+    # whose evictions it is sent as DELs
+    config = Config(maxmemory=200_000, maxmemory_policy=EvictionPolicy.ALLKEYS_LRU)
+    primary = start_server(config)
+    replica = start_server(config)
+    _replicate(replica, primary)
+
+    num_keys = 5_000
+    with socket.create_connection(("127.0.0.1", primary.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(b"".join(encode_command(["SET", f"k{i}", "v" * 50]) for i in range(num_keys)))
+        received = b""
+        while len(received) < len(b"+OK\r\n") * num_keys:
+            received += s.recv(65536)
+    _wait_for(lambda: _caught_up(replica, primary))
+
+    primary_keys = {key for key, _ in primary._keyspace.items()}  # noqa: SLF001
+    assert 0 < len(primary_keys) < num_keys
+    assert {key for key, _ in replica._keyspace.items()} == primary_keys  # noqa: SLF001
+
+
+def test_reconnecting_replica_resumes_with_partial_resync(start_server: ServerFactory) -> None:
+    primary = start_server()
+    replica = start_server()
+    _request(primary, "SET", "a", "1")
+    _replicate(replica, primary)
+
+    link = replica._replication.link  # noqa: SLF001
+    assert link is not None
+    link.close()
+    _request(primary, "SET", "b", "2")
+
+    _wait_for(lambda: _request(replica, "GET", "b") == "2")
+    stats = _info(primary, "stats")
+    assert stats["sync_full"] == "1"
+    assert stats["sync_partial_ok"] == "1"
+
+
+def _unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_replica_behind_the_backlog_gets_full_resync(start_server: ServerFactory) -> None:
+    primary = start_server(Config(repl_backlog_size=1024))
+    replica = start_server()
+    _replicate(replica, primary)
+
+    # Pointed elsewhere, the replica keeps its data and offset but misses more
+    # writes than the backlog holds
+    _request(replica, "REPLICAOF", "127.0.0.1", str(_unused_port()))
+    _request(primary, "SET", "small", "x")
+    _replicate(replica, primary)
+    _request(replica, "REPLICAOF", "127.0.0.1", str(_unused_port()))
+    _request(primary, "SET", "large", "x" * 2048)
+    _replicate(replica, primary)
+
+    assert _request(replica, "GET", "small") == "x"
+    assert _request(replica, "GET", "large") == "x" * 2048
+    stats = _info(primary, "stats")
+    assert stats["sync_partial_ok"] == "1"
+    assert stats["sync_partial_err"] == "1"
+    assert stats["sync_full"] == "2"
+
+
+def test_promoted_replica_resumes_its_sibling(start_server: ServerFactory) -> None:
+    primary = start_server()
+    first = start_server()
+    second = start_server()
+    _request(primary, "SET", "k", "1")
+    _replicate(first, primary)
+    _replicate(second, primary)
+    _wait_for(lambda: _caught_up(first, primary) and _caught_up(second, primary))
+
+    # Failing over to the first replica, the second follows it from where it was
+    primary.stop()
+    _request(first, "REPLICAOF", "NO", "ONE")
+    _replicate(second, first)
+    _request(first, "SET", "k", "2")
+    _wait_for(lambda: _request(second, "GET", "k") == "2")
+
+    stats = _info(first, "stats")
+    assert stats["sync_full"] == "0"
+    assert stats["sync_partial_ok"] == "1"
+    info = _info(first, "replication")
+    assert info["master_replid2"] == _info(second, "replication")["master_replid2"]
+
+
+def test_lag_and_throughput_metrics(start_server: ServerFactory) -> None:
+    primary = start_server(Config(metrics_port=0))
+    replica = start_server()
+    _replicate(replica, primary)
+    for i in range(100):
+        _request(primary, "SET", f"k{i}", "v")
+
+    # Replicas acknowledge their offset once a second
+    def acknowledged() -> bool:
+        info = _info(primary, "replication")
+        return f",offset={info['master_repl_offset']}," in info["slave0"]
+
+    _wait_for(acknowledged)
+    url = f"http://127.0.0.1:{primary.bound_metrics_port}/metrics"
+    with urllib.request.urlopen(url, timeout=5) as response:  # noqa: S310
+        body = response.read().decode()
+
+    assert "whodis_connected_replicas 1\n" in body
+    assert "whodis_replica_lag_bytes 0\n" in body
+    output_bytes = next(line for line in body.splitlines() if line.startswith("whodis_repl_output_bytes_total "))
+    assert int(output_bytes.split()[1]) > 0
+    assert int(_info(replica, "stats")["total_net_repl_input_bytes"]) > 0
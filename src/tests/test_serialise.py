@@ -1,6 +1,16 @@
 import pytest
 
-from src.whodis.serialise import Kind, SerialiseError, SerialiseResult, serialise
+from src.whodis.serialise import (
+    SHARED_INTEGERS,
+    Kind,
+    ReplyWriter,
+    SerialiseError,
+    SerialiseResult,
+    encode_command,
+    encode_reply,
+    serialise,
+)
+from src.whodis.shared import RESPDataType
 
 
 @pytest.mark.parametrize(
@@ -108,3 +118,66 @@ def test_valid_bulk_strings(data: str, expected_serialise_result: str) -> None:
 def test_valid_arrays(data: str, kind: Kind, expected_serialise_result: str) -> None:
     serialise_result = serialise(data, kind)
     assert serialise_result == expected_serialise_result
+
+
+@pytest.mark.parametrize(
+    ("data", "kind"),
+    [
+        pytest.param("OK", Kind.PROTOCOL, id="reply_ok"),
+        pytest.param("PONG", Kind.PROTOCOL, id="reply_pong"),
+        pytest.param("", Kind.NON_PROTOCOL, id="reply_empty_bulk"),
+        pytest.param([], Kind.NON_PROTOCOL, id="reply_empty_array"),
+        pytest.param(0, Kind.NON_PROTOCOL, id="reply_shared_integer_min"),
+        pytest.param(SHARED_INTEGERS - 1, Kind.NON_PROTOCOL, id="reply_shared_integer_max"),
+        pytest.param(SHARED_INTEGERS, Kind.NON_PROTOCOL, id="reply_unshared_integer"),
+        pytest.param(-1, Kind.NON_PROTOCOL, id="reply_negative_integer"),
+        pytest.param("ERR oops", Kind.ERROR, id="reply_error"),
+        pytest.param(["a", 1], Kind.NON_PROTOCOL, id="reply_array"),
+    ],
+)
+def test_encoded_replies_match_serialise(data: RESPDataType, kind: Kind) -> None:
+    assert encode_reply(data, kind) == serialise(data, kind).message.encode()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        pytest.param(["PING"], id="command_one_arg"),
+        pytest.param(["SET", "key", ""], id="command_empty_arg"),
+        pytest.param(["SET", "k", "caf\u00e9"], id="command_multibyte"),
+    ],
+)
+def test_encoded_commands_match_serialise(args: list[str]) -> None:
+    assert encode_command(args) == serialise(list[RESPDataType](args)).message.encode()
+
+
+def test_shared_integer_replies_are_reused() -> None:
+    assert encode_reply(42) is encode_reply(42)
+
+
+def test_writer_batches_replies() -> None:
+    writer = ReplyWriter()
+    writer.write("OK", Kind.PROTOCOL)
+    writer.write_integer(-7)
+    writer.write_null()
+    writer.write(["a", 1])
+
+    assert writer.getvalue() == b"+OK\r\n:-7\r\n$-1\r\n*2\r\n$1\r\na\r\n:1\r\n"
+    assert len(writer) == len(writer.getvalue())
+
+
+def test_writer_passes_large_bulk_strings_through() -> None:
+    value = b"x" * ReplyWriter.LARGE_BULK_BYTES
+    writer = ReplyWriter()
+    writer.write_array_header(2)
+    writer.write_bulk_string(value)
+    writer.write_bulk_string(b"small")
+
+    expected = b"*2\r\n$%d\r\n%s\r\n$5\r\nsmall\r\n" % (len(value), value)
+    assert writer.getvalue() == expected
+    assert len(writer) == len(expected)
+
+    segments = writer.take()
+    assert any(segment is value for segment in segments)
+    assert b"".join(segments) == expected
+    assert len(writer) == 0
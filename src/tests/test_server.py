@@ -1,7 +1,13 @@
+import contextlib
 import socket
+import time
+import tracemalloc
+from pathlib import Path
 
 import pytest
 
+from src.whodis.config import Config, OutputBufferLimit
+from src.whodis.serialise import encode_command
 from src.whodis.server import WhodisServer
 
 
@@ -23,3 +29,380 @@ def test_ping_response(message: bytes) -> None:
     server.stop()
 
     assert response == b"+PONG\r\n"
+
+
+def test_idle_client_does_not_block_others() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    with (
+        socket.create_connection(("127.0.0.1", server.bound_port)),
+        socket.create_connection(("127.0.0.1", server.bound_port)) as active,
+    ):
+        active.settimeout(1)
+        active.sendall(b"+PING\r\n")
+        response = active.recv(1024)
+
+    server.stop()
+
+    assert response == b"+PONG\r\n"
+
+
+def test_many_concurrent_clients() -> None:
+    num_clients = 200
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    clients = [socket.create_connection(("127.0.0.1", server.bound_port)) for _ in range(num_clients)]
+    try:
+        for client in clients:
+            client.settimeout(1)
+            client.sendall(b"+PING\r\n")
+
+        responses = [client.recv(1024) for client in clients]
+    finally:
+        for client in clients:
+            client.close()
+
+    server.stop()
+
+    assert responses == [b"+PONG\r\n"] * num_clients
+
+
+def _recv_exactly(s: socket.socket, num_bytes: int) -> bytes:
+    received = b""
+    while len(received) < num_bytes:
+        chunk = s.recv(num_bytes - len(received))
+        if not chunk:
+            break
+        received += chunk
+
+    return received
+
+
+def test_pipelined_requests() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.sendall(b"+PING\r\n$4\r\nPING\r\n*1\r\n$4\r\nPING\r\n")
+        response = _recv_exactly(s, 21)
+
+    server.stop()
+
+    assert response == b"+PONG\r\n" * 3
+
+
+def test_request_split_across_packets() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.sendall(b"*1\r\n$4\r\nPI")
+        time.sleep(0.05)
+        s.sendall(b"NG\r\n")
+        response = s.recv(1024)
+
+    server.stop()
+
+    assert response == b"+PONG\r\n"
+
+
+def test_invalid_request_closes_connection() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.sendall(b"+PING\r\n&oops\r\n+PING\r\n")
+        response = _recv_exactly(s, 1024)
+
+    server.stop()
+
+    assert response == b"+PONG\r\n-ERR invalid request\r\n"
+
+
+def test_large_value_is_received_with_bounded_memory() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+    size = 8 * 1024 * 1024
+    request = encode_command(["SET", "large", "x" * size])
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        s.sendall(request)
+        response = s.recv(1024)
+        stored, peak = (total - before for total in tracemalloc.get_traced_memory())
+        tracemalloc.stop()
+        s.sendall(encode_command(["STRLEN", "large"]))
+        length = s.recv(1024)
+
+    server.stop()
+
+    assert response == b"+OK\r\n"
+    assert length == b":%d\r\n" % size
+    # The value is received into a buffer of its own and decoded from it, so
+    # at most one copy of it exists alongside the one that is stored
+    assert stored < size * 1.1
+    assert peak < size * 2.2
+
+
+def test_bulk_over_limit_is_refused_before_it_is_sent() -> None:
+    server = WhodisServer(host="", port=0, config=Config(proto_max_bulk_len=1024))
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.sendall(b"*1\r\n$4\r\nPING\r\n*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1025\r\n")
+        response = _recv_exactly(s, 1024)
+
+    server.stop()
+
+    assert response == b"+PONG\r\n-ERR Protocol error: invalid bulk length\r\n"
+
+
+def test_header_line_over_limit_is_refused() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        start = time.monotonic()
+        # A count with no end, which is refused rather than buffered
+        with contextlib.suppress(BrokenPipeError, ConnectionResetError):
+            s.sendall(b"*" + b"1" * (8 * 1024 * 1024))
+        response = _recv_exactly(s, 1024)
+        elapsed = time.monotonic() - start
+
+    server.stop()
+
+    assert response == b"-ERR Protocol error: too big mbulk count string\r\n"
+    assert elapsed < 1
+
+
+def test_commands_share_keyspace_across_connections() -> None:
+    server = WhodisServer(host="", port=0)
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as writer:
+        writer.settimeout(1)
+        writer.sendall(b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$5\r\nvalue\r\n")
+        set_response = writer.recv(1024)
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as reader:
+        reader.settimeout(1)
+        reader.sendall(b"*2\r\n$3\r\nGET\r\n$1\r\nk\r\n*1\r\n$3\r\nGET\r\n")
+        get_response = _recv_exactly(reader, 61)
+
+    server.stop()
+
+    assert set_response == b"+OK\r\n"
+    assert get_response == b"$5\r\nvalue\r\n-ERR wrong number of arguments for 'get' command\r\n"
+
+
+_LARGE_VALUE_SIZE = 64 * 1024
+
+
+def _slow_consumer_server(limit: OutputBufferLimit, value_size: int = _LARGE_VALUE_SIZE) -> WhodisServer:
+    server = WhodisServer(host="", port=0, config=Config(client_output_buffer_limit=limit))
+    server.start()
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.sendall(encode_command(["SET", "large", "x" * value_size]))
+        assert s.recv(1024) == b"+OK\r\n"
+
+    return server
+
+
+def _slow_consumer(port: int) -> socket.socket:
+    # A client with small socket buffers, so that replies it doesn't read
+    # back up in the server rather than the kernel
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    s.connect(("127.0.0.1", port))
+    return s
+
+
+def _read_until_closed(s: socket.socket) -> int:
+    received = 0
+    try:
+        while chunk := s.recv(65536):
+            received += len(chunk)
+    except ConnectionResetError:
+        pass
+
+    return received
+
+
+def _ping(port: int) -> bytes:
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        s.settimeout(1)
+        s.sendall(b"+PING\r\n")
+        return s.recv(1024)
+
+
+def test_client_over_hard_output_limit_is_disconnected() -> None:
+    server = _slow_consumer_server(OutputBufferLimit(hard=1024 * 1024))
+    num_requests = 200
+
+    with _slow_consumer(server.bound_port) as s:
+        s.settimeout(5)
+        s.sendall(encode_command(["GET", "large"]) * num_requests)
+        time.sleep(0.2)
+        received = _read_until_closed(s)
+
+    pong = _ping(server.bound_port)
+    disconnections = server._stats.output_buffer_disconnections  # noqa: SLF001
+    server.stop()
+
+    assert received < num_requests * _LARGE_VALUE_SIZE
+    assert disconnections == 1
+    assert pong == b"+PONG\r\n"
+
+
+def test_client_over_soft_output_limit_is_disconnected_after_timeout() -> None:
+    server = _slow_consumer_server(OutputBufferLimit(soft=256 * 1024, soft_seconds=0))
+    num_requests = 200
+
+    with _slow_consumer(server.bound_port) as s:
+        s.settimeout(5)
+        s.sendall(encode_command(["GET", "large"]) * num_requests)
+        # Leaves the replies unread until the cron has seen them twice
+        time.sleep(0.5)
+        received = _read_until_closed(s)
+
+    disconnections = server._stats.output_buffer_disconnections  # noqa: SLF001
+    server.stop()
+
+    assert received < num_requests * _LARGE_VALUE_SIZE
+    assert disconnections == 1
+
+
+def test_client_that_doesnt_read_stops_being_read() -> None:
+    # Each read of requests asks for much more than the high-water mark
+    server = _slow_consumer_server(OutputBufferLimit(), value_size=1024)
+    request = encode_command(["GET", "large"]) * 100
+
+    with _slow_consumer(server.bound_port) as s:
+        s.settimeout(1)
+        # With no limits the client is never disconnected, but once its
+        # replies back up the server stops reading its requests, so they
+        # back up in turn
+        blocked = False
+        while not blocked:
+            try:
+                s.sendall(request)
+            except TimeoutError:
+                blocked = True
+
+        pong = _ping(server.bound_port)
+
+    server.stop()
+
+    assert pong == b"+PONG\r\n"
+
+
+def test_unix_socket_is_served_alongside_tcp(tmp_path: Path) -> None:
+    path = tmp_path / "whodis.sock"
+    server = WhodisServer(host="", port=0, config=Config(unixsocket=str(path), unixsocketperm=0o700))
+    server.start()
+
+    with socket.socket(socket.AF_UNIX) as s:
+        s.settimeout(1)
+        s.connect(str(path))
+        s.sendall(encode_command(["SET", "k", "v"]))
+        set_response = s.recv(1024)
+    mode = path.stat().st_mode & 0o777
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.sendall(encode_command(["GET", "k"]))
+        get_response = s.recv(1024)
+
+    server.stop()
+
+    assert set_response == b"+OK\r\n"
+    assert get_response == b"$1\r\nv\r\n"
+    assert mode == 0o700  # noqa: PLR2004
+    assert not path.exists()
+
+
+def test_tcp_clients_have_nodelay_and_keepalive() -> None:
+    server = WhodisServer(host="", port=0, config=Config(tcp_keepalive=60))
+    server.start()
+
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(1)
+        s.sendall(b"+PING\r\n")
+        s.recv(1024)
+        (client,) = server._connections  # noqa: SLF001
+        sock = client._transport.get_extra_info("socket")  # type: ignore[union-attr] # noqa: SLF001
+        nodelay = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        keepalive = sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        idle = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE)
+
+    server.stop()
+
+    assert nodelay
+    assert keepalive
+    assert idle == 60  # noqa: PLR2004
+
+
+def test_clients_over_maxclients_are_refused() -> None:
+    server = WhodisServer(host="", port=0, config=Config(maxclients=2))
+    server.start()
+
+    with (
+        socket.create_connection(("127.0.0.1", server.bound_port)),
+        socket.create_connection(("127.0.0.1", server.bound_port)),
+    ):
+        refused = socket.create_connection(("127.0.0.1", server.bound_port))
+        refused.settimeout(1)
+        response = _recv_exactly(refused, 1024)
+        refused.close()
+    # Closing clients makes room for new ones
+    time.sleep(0.1)
+    pong = _ping(server.bound_port)
+    rejected = server._stats.rejected_connections  # noqa: SLF001
+    server.stop()
+
+    assert response == b"-ERR max number of clients reached\r\n"
+    assert rejected == 1
+    assert pong == b"+PONG\r\n"
+
+
+def test_idle_clients_are_closed_after_timeout() -> None:
+    server = WhodisServer(host="", port=0, config=Config(timeout=1))
+    server.start()
+
+    with (
+        socket.create_connection(("127.0.0.1", server.bound_port)) as idle,
+        socket.create_connection(("127.0.0.1", server.bound_port)) as subscriber,
+    ):
+        idle.settimeout(3)
+        subscriber.settimeout(3)
+        idle.sendall(b"+PING\r\n")
+        idle.recv(1024)
+        subscriber.sendall(encode_command(["SUBSCRIBE", "news"]))
+        subscriber.recv(1024)
+
+        start = time.monotonic()
+        closed = idle.recv(1024)
+        elapsed = time.monotonic() - start
+        # Subscribed clients only ever wait for messages, so are left open
+        with socket.create_connection(("127.0.0.1", server.bound_port)) as publisher:
+            publisher.sendall(encode_command(["PUBLISH", "news", "hi"]))
+            message = subscriber.recv(1024)
+
+    disconnections = server._stats.timeout_disconnections  # noqa: SLF001
+    server.stop()
+
+    assert closed == b""
+    assert 0.5 < elapsed < 2  # noqa: PLR2004
+    assert message == b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$2\r\nhi\r\n"
+    assert disconnections == 1
@@ -0,0 +1,159 @@
+import random
+import sys
+import threading
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.commands import command_keys, handle_command
+from src.whodis.keyspace import Keyspace, KeyStore
+from src.whodis.serialise import ReplyWriter
+from src.whodis.sharding import ShardedKeyspace
+
+NUM_SHARDS = 8
+NUM_ACCOUNTS = 50
+NUM_THREADS = 8
+TRANSFERS_PER_THREAD = 2_000
+INITIAL_BALANCE = 100
+
+
+@pytest.fixture
+def keyspace() -> ShardedKeyspace:
+    return ShardedKeyspace(NUM_SHARDS, Keyspace)
+
+
+@pytest.fixture
+def frequent_switches() -> Iterator[None]:
+    # With the GIL, threads otherwise run for 5ms at a time, which leaves few
+    # chances for a missing lock to show
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def _run(keyspace: ShardedKeyspace, *cmd: str) -> bytes:
+    out = ReplyWriter()
+    with keyspace.locked(command_keys(list(cmd))) as locked:
+        handle_command(locked, list(cmd), out)
+    return b"".join(out.take())
+
+
+def test_keys_are_spread_across_shards(keyspace: ShardedKeyspace) -> None:
+    for i in range(1_000):
+        keyspace.shards[keyspace.shard_index(f"key:{i}")].set(f"key:{i}", "v")
+
+    assert len(keyspace) == 1_000  # noqa: PLR2004
+    assert all(len(shard) > 0 for shard in keyspace.shards)
+
+
+def test_multi_key_commands_span_shards(keyspace: ShardedKeyspace) -> None:
+    keys = [f"key:{i}" for i in range(20)]
+    assert len({keyspace.shard_index(key) for key in keys}) > 1
+
+    with keyspace.locked(keys) as locked:
+        handle_command(locked, ["MSET", *(arg for key in keys for arg in (key, key))], ReplyWriter())
+    for key in keys:
+        assert keyspace.shards[keyspace.shard_index(key)].get(key) == key.encode()
+
+    assert _run(keyspace, "EXISTS", *keys, "missing") == b":20\r\n"
+    assert _run(keyspace, "MGET", keys[0], "missing") == b"*2\r\n$5\r\nkey:0\r\n$-1\r\n"
+    assert _run(keyspace, "MSETNX", keys[0], "x", "new", "x") == b":0\r\n"
+    assert _run(keyspace, "DEL", *keys[:10], "missing") == b":10\r\n"
+    assert len(keyspace) == 10  # noqa: PLR2004
+
+
+def test_scan_visits_every_shard(keyspace: ShardedKeyspace) -> None:
+    keys = {f"key:{i}" for i in range(100)}
+    for key in keys:
+        keyspace.shards[keyspace.shard_index(key)].set(key, "v")
+
+    seen: list[str] = []
+    cursor = 0
+    while True:
+        with keyspace.locked(None) as locked:
+            cursor, entries = locked.scan(cursor, 7)
+        seen += [key for key, _ in entries]
+        if cursor == 0:
+            break
+
+    assert sorted(seen) == sorted(keys)
+
+
+def test_locks_only_the_shards_used(keyspace: ShardedKeyspace) -> None:
+    other = next(f"key:{i}" for i in range(100) if keyspace.shard_index(f"key:{i}") != keyspace.shard_index("a"))
+    ready, release = threading.Event(), threading.Event()
+
+    def hold() -> None:
+        with keyspace.locked(["a"]):
+            ready.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    ready.wait()
+    # A key in another shard isn't held up, nor is PING, which takes no lock
+    assert _run(keyspace, "SET", other, "v") == b"+OK\r\n"
+    assert _run(keyspace, "PING") == b"+PONG\r\n"
+    release.set()
+    holder.join()
+
+
+@pytest.mark.usefixtures("frequent_switches")
+def test_concurrent_transfers_keep_total(keyspace: ShardedKeyspace) -> None:
+    # Threads move units between accounts in random pairs, taking the pair's
+    # locks in whatever order the keys come, while another reads every balance
+    # at once. A lock taken out of order would deadlock, and a missing one
+    # would lose a transfer or show a total mid-transfer
+    accounts = [f"account:{i}" for i in range(NUM_ACCOUNTS)]
+    for account in accounts:
+        keyspace.shards[keyspace.shard_index(account)].set(account, INITIAL_BALANCE)
+    total = NUM_ACCOUNTS * INITIAL_BALANCE
+    done = threading.Event()
+    totals_seen: set[int] = set()
+
+    def transfer(seed: int) -> None:
+        rng = random.Random(seed)  # noqa: S311
+        for _ in range(TRANSFERS_PER_THREAD):
+            source, target = rng.sample(accounts, 2)
+            with keyspace.locked([source, target]) as locked:
+                balance = locked.get(source)
+                assert isinstance(balance, int)
+                locked.set(source, balance - 1)
+                received = locked.get(target)
+                assert isinstance(received, int)
+                locked.set(target, received + 1)
+
+    def audit() -> None:
+        while not done.is_set():
+            with keyspace.locked(accounts) as locked:
+                totals_seen.add(sum(int(str(locked.get(account))) for account in accounts))
+
+    threads = [threading.Thread(target=transfer, args=(seed,)) for seed in range(NUM_THREADS)]
+    auditor = threading.Thread(target=audit)
+    auditor.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+        assert not thread.is_alive(), "deadlocked"
+    done.set()
+    auditor.join()
+
+    assert totals_seen == {total}
+    assert sum(int(str(keyspace.shards[keyspace.shard_index(a)].get(a))) for a in accounts) == total
+
+
+def test_group_of_shards_is_a_key_store(keyspace: ShardedKeyspace) -> None:
+    keys = [f"key:{i}" for i in range(20)]
+    with keyspace.locked(keys) as locked:
+        # Commands get what they need of a keyspace, and nothing that would
+        # only see part of it
+        assert isinstance(locked, KeyStore)
+        assert not isinstance(locked, Keyspace)
+        assert not hasattr(locked, "items")
+        assert not hasattr(locked, "used_memory")
+        locked.set(keys[0], "v")
+        assert locked.now_ms() > 0
+
+    assert len(keyspace) == 1
@@ -0,0 +1,201 @@
+import socket
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+import pytest
+
+from src.whodis.commands import handle_command
+from src.whodis.config import Config
+from src.whodis.datatypes import Hash, List, Set, ZSet
+from src.whodis.keyspace import Keyspace
+from src.whodis.serialise import ReplyWriter
+from src.whodis.server import WhodisServer
+from src.whodis.snapshot import SnapshotError, Snapshotter, load_snapshot, save_snapshot
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _keyspace(clock: _FakeClock | None = None) -> Keyspace:
+    keyspace = Keyspace() if clock is None else Keyspace(clock=clock)
+    keyspace.set("plain", "value")
+    keyspace.set("empty", "")
+    keyspace.set("café", "☃" * 100)
+    keyspace.set("large", "x" * 100_000)
+    keyspace.set("expiring", "soon", keyspace.now_ms() + 10_000)
+    return keyspace
+
+
+def test_snapshot_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "dump.wdb"
+    keyspace = _keyspace()
+    save_snapshot(path, keyspace)
+
+    loaded = Keyspace()
+    count = load_snapshot(path, loaded)
+
+    assert count == len(keyspace)
+    for key, entry in keyspace.items():
+        assert loaded.get(key) == entry.value
+        assert loaded.get_expire(key) == entry.expire_at
+
+
+def _elements(value: Hash | List | Set | ZSet) -> Iterable[object]:
+    return value.items() if isinstance(value, Hash | ZSet) else value
+
+
+def test_collections_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "dump.wdb"
+    keyspace = Keyspace()
+    out = ReplyWriter()
+    for cmd in (
+        ["HSET", "hash", "f", "v", "field", "x" * 100],
+        ["RPUSH", "list", *(f"element:{i}" for i in range(300))],
+        ["SADD", "intset", "3", "1", "2"],
+        ["SADD", "set", "a", "b"],
+        ["ZADD", "zset", "1.5", "a", "-inf", "b", "0.1", "c"],
+        ["ZADD", "skiplist", *(arg for i in range(200) for arg in (str(i / 3), f"member:{i}"))],
+        ["PEXPIREAT", "set", str(keyspace.now_ms() + 10_000)],
+    ):
+        handle_command(keyspace, cmd, out)
+    save_snapshot(path, keyspace)
+
+    loaded = Keyspace()
+    load_snapshot(path, loaded)
+
+    for key, entry in keyspace.items():
+        value, loaded_value = entry.value, loaded.get(key)
+        assert isinstance(value, Hash | List | Set | ZSet)
+        assert isinstance(loaded_value, Hash | List | Set | ZSet)
+        assert type(loaded_value) is type(value)
+        assert loaded_value.encoding == value.encoding
+        assert list(_elements(loaded_value)) == list(_elements(value))
+        # Skiplist nodes are given random levels, so their sizes vary
+        if value.encoding != "skiplist":
+            assert loaded.memory_usage(key) == keyspace.memory_usage(key)
+    assert loaded.get_expire("set") == keyspace.get_expire("set")
+
+
+def test_expired_keys_are_skipped(tmp_path: Path) -> None:
+    path = tmp_path / "dump.wdb"
+    clock = _FakeClock()
+    keyspace = _keyspace(clock)
+    keyspace.set("expired", "gone", keyspace.now_ms() + 1_000)
+    clock.now += 1
+    save_snapshot(path, keyspace)
+
+    # Keys that expire between saving and loading are skipped too
+    clock.now += 10
+    loaded = Keyspace(clock=clock)
+    load_snapshot(path, loaded)
+
+    assert "expired" not in loaded
+    assert "expiring" not in loaded
+    assert len(loaded) == len(keyspace) - 2
+
+
+@pytest.mark.parametrize(
+    "damage",
+    [
+        pytest.param(lambda data: data[:-1], id="truncated"),
+        pytest.param(lambda data: data[:20] + bytes([data[20] ^ 1]) + data[21:], id="flipped_bit"),
+        pytest.param(lambda data: b"REDIS" + data[5:], id="wrong_magic"),
+        pytest.param(lambda data: data[:4], id="too_short"),
+    ],
+)
+def test_damaged_snapshot_is_rejected(tmp_path: Path, damage: Callable[[bytes], bytes]) -> None:
+    path = tmp_path / "dump.wdb"
+    save_snapshot(path, _keyspace())
+    path.write_bytes(damage(path.read_bytes()))
+
+    with pytest.raises(SnapshotError):
+        load_snapshot(path, Keyspace())
+
+
+def _wait_for_save(snapshots: Snapshotter) -> None:
+    deadline = time.monotonic() + 10
+    while not snapshots.poll():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_background_save_is_point_in_time(tmp_path: Path) -> None:
+    keyspace = _keyspace()
+    snapshots = Snapshotter(tmp_path / "dump.wdb", keyspace)
+    changes = [("plain", "changed"), ("added", "later")]
+
+    assert snapshots.start_background_save()
+    assert not snapshots.start_background_save()
+    for key, value in changes:
+        keyspace.set(key, value)
+    _wait_for_save(snapshots)
+
+    loaded = Keyspace()
+    load_snapshot(snapshots.path, loaded)
+
+    assert loaded.get("plain") == b"value"
+    assert "added" not in loaded
+    assert snapshots.changes_since_save == len(changes)
+
+
+def test_save_points(tmp_path: Path) -> None:
+    keyspace = Keyspace()
+    snapshots = Snapshotter(tmp_path / "dump.wdb", keyspace, save_points=((0, 3), (3600, 1)))
+    keyspace.set("a", "1")
+    keyspace.set("b", "2")
+
+    assert not snapshots.should_save()
+
+    keyspace.set("c", "3")
+
+    assert snapshots.should_save()
+
+    snapshots.save()
+
+    assert not snapshots.should_save()
+
+
+def _recv_exactly(s: socket.socket, num_bytes: int) -> bytes:
+    received = b""
+    while len(received) < num_bytes:
+        chunk = s.recv(num_bytes - len(received))
+        if not chunk:
+            break
+        received += chunk
+
+    return received
+
+
+def _command(server: WhodisServer, request: bytes, reply_length: int) -> bytes:
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(request)
+        return _recv_exactly(s, reply_length)
+
+
+def test_server_loads_saved_snapshot(tmp_path: Path) -> None:
+    config = Config(dbfilename=str(tmp_path / "dump.wdb"))
+    bgsave_started = b"+Background saving started\r\n"
+
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    set_reply = _command(server, b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n*1\r\n$4\r\nSAVE\r\n", 10)
+    bgsave_reply = _command(server, b"*1\r\n$6\r\nBGSAVE\r\n", len(bgsave_started))
+    lastsave_reply = _command(server, b"*1\r\n$8\r\nLASTSAVE\r\n", 13)
+    server.stop()
+
+    server = WhodisServer(host="", port=0, config=config)
+    server.start()
+    get_reply = _command(server, b"*2\r\n$3\r\nGET\r\n$1\r\nk\r\n", 7)
+    server.stop()
+
+    assert set_reply == b"+OK\r\n+OK\r\n"
+    assert bgsave_reply == bgsave_started
+    assert abs(int(lastsave_reply[1:]) - time.time()) < 5  # noqa: PLR2004
+    assert get_reply == b"$1\r\nv\r\n"
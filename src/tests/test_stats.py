@@ -0,0 +1,179 @@
+import random
+import socket
+import urllib.request
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.config import Config
+from src.whodis.deserialise import find_reply_end, parse_message
+from src.whodis.serialise import encode_command
+from src.whodis.server import WhodisServer
+from src.whodis.shared import IncompleteMessageError, RESPDataType
+from src.whodis.stats import LatencyHistogram, ServerStats, SlowLog, format_info
+
+# Bucket lower bounds are within 1/32 of the values they hold
+HISTOGRAM_PRECISION = 1 / 32
+
+
+@pytest.mark.parametrize("percent", [50.0, 90.0, 99.0, 99.9, 100.0])
+def test_histogram_percentiles(percent: float) -> None:
+    rng = random.Random(42)  # noqa: S311
+    values = [rng.randrange(1, 10_000_000) for _ in range(10_000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    ordered = sorted(values)
+    expected = ordered[max(int(len(values) * percent / 100) - 1, 0)]
+    assert abs(histogram.percentile(percent) - expected) <= expected * HISTOGRAM_PRECISION
+
+
+def test_histogram_is_exact_for_small_values() -> None:
+    histogram = LatencyHistogram()
+    for value in range(10):
+        histogram.record(value)
+
+    assert [histogram.percentile(percent) for percent in (10, 50, 100)] == [0, 4, 9]
+
+
+def test_stats_are_shared_across_name_case() -> None:
+    stats = ServerStats(["GET", "get", "SET", "set"])
+    stats.record_command(["GET", "k"], 1_000)
+    stats.record_command(["get", "k"], 3_000)
+    stats.record_command(["gEt", "k"], 2_000)
+    stats.record_failure(["gEt", "k"])
+
+    [get] = stats.command_stats()
+    assert (get.name, get.calls, get.total_ns, get.failed_calls) == ("get", 3, 6_000, 1)
+
+
+def test_slowlog_keeps_newest_entries_first() -> None:
+    slowlog = SlowLog(slower_than_us=0, max_len=2)
+    stats = ServerStats(["SET"], slowlog=slowlog)
+    for i in range(3):
+        stats.record_command(["SET", f"key:{i}", "x" * 200, *("arg" for _ in range(40))], 5_000)
+
+    [newest, older] = slowlog.get()
+    assert (newest.id, older.id) == (2, 1)
+    assert newest.duration_us == 5  # noqa: PLR2004
+    assert newest.args[:2] == ["SET", "key:2"]
+    assert newest.args[2] == "x" * 128 + "... (72 more bytes)"
+    assert newest.args[-1] == "... (12 more arguments)"
+
+
+def test_slowlog_threshold() -> None:
+    slowlog = SlowLog(slower_than_us=10)
+    stats = ServerStats(["GET"], slowlog=slowlog)
+    stats.record_command(["GET", "fast"], 9_000)
+    stats.record_command(["GET", "slow"], 11_000)
+
+    assert [entry.args for entry in slowlog.get()] == [["GET", "slow"]]
+
+    disabled = SlowLog(slower_than_us=-1)
+    ServerStats(["GET"], slowlog=disabled).record_command(["GET", "slow"], 10**9)
+    assert len(disabled) == 0
+
+
+def test_format_info() -> None:
+    info = format_info({"Server": {"tcp_port": 6379, "hz": 10}, "Keyspace": {}})
+
+    assert info == "# Server\r\ntcp_port:6379\r\nhz:10\r\n\r\n# Keyspace\r\n"
+
+
+@pytest.fixture
+def server() -> Iterator[WhodisServer]:
+    server = WhodisServer(host="", port=0, config=Config(slowlog_log_slower_than=0, metrics_port=0))
+    server.start()
+    yield server
+    server.stop()
+
+
+def _request(s: socket.socket, *cmd: str) -> RESPDataType:
+    s.sendall(encode_command(list(cmd)))
+    received = b""
+    while True:
+        try:
+            find_reply_end(received)
+        except IncompleteMessageError:
+            received += s.recv(65536)
+            continue
+
+        # Error replies are returned as their message
+        if received.startswith(b"-"):
+            return received[1:-2].decode()
+        return parse_message(received).data
+
+
+def _info(s: socket.socket, *sections: str) -> dict[str, str]:
+    reply = _request(s, "INFO", *sections)
+    assert isinstance(reply, str)
+    return dict(line.split(":", 1) for line in reply.splitlines() if line and not line.startswith("#"))
+
+
+def test_info_reports_commands_and_traffic(server: WhodisServer) -> None:
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        _request(s, "SET", "k", "v")
+        _request(s, "GET", "k")
+        _request(s, "get", "k")
+        _request(s, "INCR", "k")
+        _request(s, "NOSUCHCOMMAND")
+        info = _info(s, "all")
+        default = _info(s)
+
+    assert info["connected_clients"] == "1"
+    assert info["db0"] == "keys=1,expires=0,avg_ttl=0"
+    # Bytes so far, not counting the INFO request itself
+    assert int(info["total_net_input_bytes"]) > 0
+    assert int(info["total_net_output_bytes"]) > 0
+    assert info["cmdstat_get"].startswith("calls=2,")
+    assert info["cmdstat_incr"].endswith(",failed_calls=1")
+    assert info["errorstat_ERR"] == "count=2"
+    assert info["total_error_replies"] == "2"
+    percentiles = [part.split("=")[0] for part in info["latency_percentiles_usec_set"].split(",")]
+    assert percentiles == ["p50", "p99", "p99.9"]
+    assert "cmdstat_get" not in default
+    assert "used_memory" in default
+
+
+def test_info_sections(server: WhodisServer) -> None:
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        reply = _request(s, "INFO", "commandstats", "clients")
+
+    assert isinstance(reply, str)
+    assert [line for line in reply.splitlines() if line.startswith("#")] == ["# Commandstats", "# Clients"]
+
+
+def test_slowlog_commands(server: WhodisServer) -> None:
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        _request(s, "SLOWLOG", "RESET")
+        _request(s, "SET", "k", "v")
+        _request(s, "GET", "k")
+        length = _request(s, "SLOWLOG", "LEN")
+        entries = _request(s, "SLOWLOG", "GET", "2")
+        unknown = _request(s, "SLOWLOG", "NOPE")
+
+    # SLOWLOG LEN itself was logged after SET and GET
+    assert length == 3  # noqa: PLR2004
+    assert isinstance(entries, list)
+    assert [entry[3] for entry in entries if isinstance(entry, list)] == [["SLOWLOG", "LEN"], ["GET", "k"]]
+    assert unknown == "ERR unknown subcommand or wrong number of arguments for 'NOPE'"
+
+
+def test_prometheus_endpoint(server: WhodisServer) -> None:
+    with socket.create_connection(("127.0.0.1", server.bound_port)) as s:
+        s.settimeout(5)
+        _request(s, "SET", "k", "v")
+
+    url = f"http://127.0.0.1:{server.bound_metrics_port}/metrics"
+    with urllib.request.urlopen(url, timeout=5) as response:  # noqa: S310
+        content_type = response.headers["Content-Type"]
+        body = response.read().decode()
+
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "whodis_keys 1\n" in body
+    assert 'whodis_command_duration_seconds_count{cmd="set"} 1\n' in body
+    assert 'whodis_command_duration_seconds{cmd="set",quantile="0.99"}' in body
@@ -0,0 +1,114 @@
+import socket
+import sys
+import threading
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+import pytest
+
+from src.whodis.client import Client, ResponseError
+from src.whodis.serialise import encode_command
+from src.whodis.server import ThreadedServer
+
+if TYPE_CHECKING:
+    from src.whodis.deserialise import Reply
+
+NUM_THREADS = 4
+NUM_CLIENTS = 8
+NUM_COUNTERS = 10
+ROUNDS = 200
+
+
+@pytest.fixture
+def server() -> Iterator[ThreadedServer]:
+    server = ThreadedServer(host="", port=0, threads=NUM_THREADS, shards=16)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server: ThreadedServer) -> Iterator[Client]:
+    with Client(port=server.bound_port) as client:
+        yield client
+
+
+def test_commands(client: Client) -> None:
+    assert client.execute("PING") == "PONG"
+    assert client.execute("MSET", "a", 1, "b", 2, "c", 3) == "OK"
+    assert client.execute("MGET", "a", "b", "c", "d") == ["1", "2", "3", None]
+    assert client.execute("INCR", "a") == 2  # noqa: PLR2004
+    assert client.execute("DEL", "b", "c", "d") == 2  # noqa: PLR2004
+    assert client.execute("HSET", "h", "f", "v") == 1
+    with pytest.raises(ResponseError, match="WRONGTYPE"):
+        client.execute("INCR", "h")
+    # Server commands are only available from WhodisServer
+    with pytest.raises(ResponseError, match="unsupported command"):
+        client.execute("INFO")
+
+
+def test_scan_covers_every_shard(client: Client) -> None:
+    keys = {f"key:{i}" for i in range(200)}
+    client.pipeline().command("MSET", *(arg for key in keys for arg in (key, "v"))).execute()
+
+    seen: list[str] = []
+    cursor = "0"
+    while True:
+        reply = client.execute("SCAN", cursor, "COUNT", 20)
+        assert isinstance(reply, list)
+        next_cursor, found = reply
+        assert isinstance(next_cursor, str)
+        assert isinstance(found, list)
+        cursor = next_cursor
+        seen += [str(key) for key in found]
+        if cursor == "0":
+            break
+
+    assert sorted(seen) == sorted(keys)
+
+
+def test_connections_are_spread_across_threads(server: ThreadedServer) -> None:
+    clients = [socket.create_connection(("127.0.0.1", server.bound_port)) for _ in range(NUM_THREADS * 2)]
+    for s in clients:
+        s.sendall(encode_command(["PING"]))
+        assert s.recv(16) == b"+PONG\r\n"
+        s.close()
+
+    assert [thread.stats.total_connections_received for thread in server._threads] == [2] * NUM_THREADS  # noqa: SLF001
+
+
+def test_stress(server: ThreadedServer) -> None:
+    # Clients on several threads increment shared counters and write pairs of
+    # keys, which land in different shards, to the same value at once. Every
+    # increment must count, and no read may see a pair half written
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    counters = [f"counter:{i}" for i in range(NUM_COUNTERS)]
+    torn: list[list[Reply]] = []
+
+    def work(client_id: int) -> None:
+        with Client(port=server.bound_port) as client:
+            for i in range(ROUNDS):
+                pipe = client.pipeline()
+                for counter in counters:
+                    pipe.command("INCR", counter)
+                pipe.command("MSET", "pair:a", f"{client_id}:{i}", "pair:b", f"{client_id}:{i}")
+                pipe.execute()
+                pair = client.execute("MGET", "pair:a", "pair:b")
+                assert isinstance(pair, list)
+                if pair[0] != pair[1]:
+                    torn.append(pair)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(NUM_CLIENTS)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=120)
+            assert not thread.is_alive()
+    finally:
+        sys.setswitchinterval(interval)
+
+    with Client(port=server.bound_port) as client:
+        assert client.execute("MGET", *counters) == [str(NUM_CLIENTS * ROUNDS)] * NUM_COUNTERS
+    assert torn == []
@@ -0,0 +1,181 @@
+import os
+import signal
+import socket
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from src.whodis.config import Config
+from src.whodis.workers import HASH_SLOTS, Supervisor, WorkerTopology, crc16, key_slot
+
+NUM_WORKERS = 2
+# The check value for CRC-16/XMODEM, also used in the Redis Cluster spec
+CRC16_CHECK = 0x31C3
+
+
+def test_crc16_matches_xmodem() -> None:
+    assert crc16(b"123456789") == CRC16_CHECK
+
+
+@pytest.mark.parametrize(
+    ("key", "hashed"),
+    [
+        pytest.param("user:1", b"user:1", id="no_tag"),
+        pytest.param("{user:1}:name", b"user:1", id="tag"),
+        pytest.param("name:{user:1}", b"user:1", id="tag_not_at_start"),
+        pytest.param("{}user:1", b"{}user:1", id="empty_tag"),
+        pytest.param("{user:1", b"{user:1", id="unclosed_tag"),
+        pytest.param("{a}{b}", b"a", id="first_tag_only"),
+    ],
+)
+def test_key_slot_hash_tags(key: str, hashed: bytes) -> None:
+    assert key_slot(key) == crc16(hashed) % HASH_SLOTS
+
+
+def test_topology_splits_slots_evenly() -> None:
+    num_keys, num_workers = 10_000, 4
+    topology = WorkerTopology(worker_id=0, num_workers=num_workers, socket_dir="")
+    owners = [topology.owner(f"key:{i}") for i in range(num_keys)]
+
+    share = num_keys // num_workers
+    for worker_id in range(num_workers):
+        assert abs(owners.count(worker_id) - share) < share * 0.1
+
+
+def _keys_by_owner() -> tuple[str, str]:
+    # One key owned by each of the two workers
+    topology = WorkerTopology(worker_id=0, num_workers=NUM_WORKERS, socket_dir="")
+    keys: dict[int, str] = {}
+    i = 0
+    while len(keys) < NUM_WORKERS:
+        keys.setdefault(topology.owner(f"key:{i}"), f"key:{i}")
+        i += 1
+
+    return keys[0], keys[1]
+
+
+def _recv_exactly(s: socket.socket, num_bytes: int) -> bytes:
+    received = b""
+    while len(received) < num_bytes:
+        chunk = s.recv(num_bytes - len(received))
+        if not chunk:
+            break
+        received += chunk
+
+    return received
+
+
+@pytest.fixture
+def supervisor() -> Iterator[Supervisor]:
+    supervisor = Supervisor(host="127.0.0.1", port=0, num_workers=NUM_WORKERS)
+    supervisor.start()
+    yield supervisor
+    supervisor.stop()
+
+
+def test_keys_are_shared_across_workers(supervisor: Supervisor) -> None:
+    # The kernel picks the worker for each connection, so every connection
+    # must see keys whichever worker owns them
+    commands = b"".join(b"*3\r\n$3\r\nSET\r\n$6\r\nkey:%02d\r\n$1\r\n%d\r\n" % (i, i % 10) for i in range(20))
+    with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(commands)
+        assert _recv_exactly(s, 5 * 20) == b"+OK\r\n" * 20
+
+    expected = b"".join(b"$1\r\n%d\r\n" % (i % 10) for i in range(20))
+    for _ in range(4):
+        with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as s:
+            s.settimeout(5)
+            s.sendall(b"".join(b"*2\r\n$3\r\nGET\r\n$6\r\nkey:%02d\r\n" % i for i in range(20)))
+            assert _recv_exactly(s, len(expected)) == expected
+
+
+def test_replies_keep_request_order(supervisor: Supervisor) -> None:
+    local, remote = _keys_by_owner()
+    commands = [
+        f"*3\r\n$3\r\nSET\r\n${len(local)}\r\n{local}\r\n$5\r\nlocal\r\n",
+        f"*3\r\n$3\r\nSET\r\n${len(remote)}\r\n{remote}\r\n$6\r\nremote\r\n",
+        f"*2\r\n$3\r\nGET\r\n${len(remote)}\r\n{remote}\r\n",
+        "*1\r\n$4\r\nPING\r\n",
+        f"*2\r\n$3\r\nGET\r\n${len(local)}\r\n{local}\r\n",
+    ]
+    expected = b"+OK\r\n+OK\r\n$6\r\nremote\r\n+PONG\r\n$5\r\nlocal\r\n"
+
+    with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall("".join(commands).encode())
+        assert _recv_exactly(s, len(expected)) == expected
+
+
+def test_links_between_workers_leave_maxclients_to_clients() -> None:
+    # Each client forwards a command to the other worker, opening a link to
+    # it, and must still find room on whichever worker it lands on
+    supervisor = Supervisor(host="127.0.0.1", port=0, num_workers=NUM_WORKERS, config=Config(maxclients=1))
+    supervisor.start()
+    local, remote = _keys_by_owner()
+    request = f"*2\r\n$3\r\nGET\r\n${len(local)}\r\n{local}\r\n*2\r\n$3\r\nGET\r\n${len(remote)}\r\n{remote}\r\n"
+    replies = []
+    try:
+        for _ in range(10):
+            with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as s:
+                s.settimeout(5)
+                s.sendall(request.encode())
+                replies.append(_recv_exactly(s, 10))
+            # Gives the worker time to see the client go
+            time.sleep(0.05)
+    finally:
+        supervisor.stop()
+
+    assert replies == [b"$-1\r\n$-1\r\n"] * 10
+
+
+def test_multi_key_command_across_workers_is_refused(supervisor: Supervisor) -> None:
+    first, second = _keys_by_owner()
+    command = f"*3\r\n$4\r\nMGET\r\n${len(first)}\r\n{first}\r\n${len(second)}\r\n{second}\r\n"
+    expected = b"-CROSSSLOT Keys in request don't hash to the same worker\r\n"
+
+    with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(command.encode())
+        assert _recv_exactly(s, len(expected)) == expected
+
+
+def test_messages_are_published_to_every_worker(supervisor: Supervisor) -> None:
+    # With several subscribers, some are almost certainly on each worker
+    num_subscribers = 8
+    confirmation = b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n"
+    message = b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$2\r\nhi\r\n"
+    subscribers = [socket.create_connection(("127.0.0.1", supervisor.bound_port)) for _ in range(num_subscribers)]
+    try:
+        for s in subscribers:
+            s.settimeout(5)
+            s.sendall(b"*2\r\n$9\r\nSUBSCRIBE\r\n$4\r\nnews\r\n")
+            assert _recv_exactly(s, len(confirmation)) == confirmation
+
+        with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as publisher:
+            publisher.settimeout(5)
+            publisher.sendall(b"*3\r\n$7\r\nPUBLISH\r\n$4\r\nnews\r\n$2\r\nhi\r\n")
+            # Only the subscribers of the publisher's own worker are counted
+            assert _recv_exactly(publisher, 1) == b":"
+
+        assert [_recv_exactly(s, len(message)) for s in subscribers] == [message] * num_subscribers
+    finally:
+        for s in subscribers:
+            s.close()
+
+
+def test_supervisor_restarts_failed_worker(supervisor: Supervisor) -> None:
+    pid = supervisor.worker_pids[0]
+    assert pid is not None
+    os.kill(pid, signal.SIGKILL)
+
+    deadline = time.monotonic() + 10
+    while supervisor.worker_pids[0] == pid and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert supervisor.worker_pids[0] != pid
+    with socket.create_connection(("127.0.0.1", supervisor.bound_port)) as s:
+        s.settimeout(5)
+        s.sendall(b"*1\r\n$4\r\nPING\r\n")
+        assert _recv_exactly(s, 7) == b"+PONG\r\n"
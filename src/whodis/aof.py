@@ -0,0 +1,299 @@
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+import os
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from enum import StrEnum
+from pathlib import Path
+from typing import cast
+
+from src.whodis.commands import CommandError, CommandTable, handle_command
+from src.whodis.datatypes import Collection, Hash, List, ZSet, format_score
+from src.whodis.deserialise import parse_message
+from src.whodis.forking import child_exit_code, fork_child, kill_child
+from src.whodis.keyspace import Keyspace, value_bytes
+from src.whodis.serialise import ReplyWriter, encode_command
+from src.whodis.shared import IncompleteMessageError
+
+# Seconds between fsyncs with the everysec policy
+AOF_FSYNC_INTERVAL = 1.0
+
+# The rewrite child writes the new file in chunks of about this size
+_REWRITE_CHUNK_BYTES = 64 * 1024
+# Collections are rewritten in commands of at most this many elements (or
+# field/value pairs), as Redis's AOF_REWRITE_ITEMS_PER_CMD
+_REWRITE_ITEMS_PER_COMMAND = 64
+
+
+class AppendFsync(StrEnum):
+    # When data written to the AOF is flushed to disk: before replying to the
+    # writes (always), on a background thread once a second (everysec), or
+    # whenever the OS decides to (no)
+    ALWAYS = "always"
+    EVERYSEC = "everysec"
+    NO = "no"
+
+
+class AofError(Exception):
+    pass
+
+
+@dataclass
+class _Rewrite:
+    pid: int
+    path: Path
+    # Writes made since the child took its snapshot, appended to the new file
+    # once the child has finished
+    buffer: bytearray = field(default_factory=bytearray)
+
+
+def with_absolute_expiry(cmd: list[str], keyspace: Keyspace) -> list[str]:
+    # Commands that set relative expiry times are logged with the absolute
+    # time they set, so replaying the log later doesn't extend them
+    name = cmd[0].upper()
+    if name in {"EXPIRE", "PEXPIRE"}:
+        expire_at = keyspace.get_expire(cmd[1])
+        # A deadline in the past deletes the key
+        return ["DEL", cmd[1]] if expire_at is None else ["PEXPIREAT", cmd[1], str(expire_at)]
+
+    if name == "SET" and any(option.upper() in {"EX", "PX"} for option in cmd[3:]):
+        expire_at = keyspace.get_expire(cmd[1])
+        options = iter(cmd[3:])
+        rewritten = cmd[:3]
+        for option in options:
+            if option.upper() in {"EX", "PX"}:
+                next(options)
+                if expire_at is not None:
+                    rewritten += ["PXAT", str(expire_at)]
+            else:
+                rewritten.append(option)
+        return rewritten
+
+    return cmd
+
+
+def rewrite_commands(keyspace: Keyspace) -> Iterator[list[str]]:
+    # The shortest sequence of commands that recreates the keyspace
+    now = keyspace.now_ms()
+    for key, entry in keyspace.items():
+        expire_at, value = entry.expire_at, entry.value
+        if expire_at is not None and expire_at <= now:
+            continue
+
+        if isinstance(value, int | bytes):
+            cmd = ["SET", key, value_bytes(value).decode()]
+            yield cmd if expire_at is None else [*cmd, "PXAT", str(expire_at)]
+            continue
+
+        yield from _collection_commands(key, value)
+        if expire_at is not None:
+            yield ["PEXPIREAT", key, str(expire_at)]
+
+
+def _collection_commands(key: str, value: Collection) -> Iterator[list[str]]:
+    if isinstance(value, Hash):
+        name, per_command = "HSET", 2 * _REWRITE_ITEMS_PER_COMMAND
+        elements: Iterable[bytes] = (item for pair in value.items() for item in pair)
+    elif isinstance(value, ZSet):
+        name, per_command = "ZADD", 2 * _REWRITE_ITEMS_PER_COMMAND
+        elements = (item for member, score in value.items() for item in (format_score(score), member))
+    else:
+        name, per_command = "RPUSH" if isinstance(value, List) else "SADD", _REWRITE_ITEMS_PER_COMMAND
+        elements = value
+
+    for batch in itertools.batched(elements, per_command, strict=False):
+        yield [name, key, *(element.decode() for element in batch)]
+
+
+class AppendOnlyFile:
+    # Logs write commands in RESP form. Commands are buffered as they run and
+    # written by flush(), which the server calls once per event loop iteration,
+    # so all the writes made in one iteration share a single write and fsync
+    def __init__(
+        self,
+        path: str | Path,
+        fsync: AppendFsync = AppendFsync.EVERYSEC,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.path = Path(path)
+        self.fsync = fsync
+        self._clock = clock
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._buffer = bytearray()
+        self._unsynced = False
+        self._last_fsync = clock()
+        self._fsync_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="whodis-aof-fsync")
+        self._background_fsync: concurrent.futures.Future[None] | None = None
+        self._rewrite: _Rewrite | None = None
+        self.size = os.fstat(self._fd).st_size
+        # Size after the last rewrite, against which growth is measured
+        self.base_size = self.size
+        self.fsyncs = 0
+        self.rewrites = 0
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._buffer)
+
+    @property
+    def rewrite_in_progress(self) -> bool:
+        return self._rewrite is not None
+
+    def load(self, keyspace: Keyspace, table: CommandTable | None = None) -> int:
+        # Replays the log into the keyspace, returning the number of commands.
+        # A command cut short by a crash is dropped, as with Redis's
+        # aof-load-truncated
+        data = self.path.read_bytes()
+        out = ReplyWriter()
+        pos = loaded = 0
+        while pos < len(data):
+            try:
+                result = parse_message(data, pos)
+            except IncompleteMessageError:
+                print(f"Truncating incomplete command at the end of {self.path}")  # noqa: T201
+                os.truncate(self._fd, pos)
+                self.size = self.base_size = pos
+                break
+
+            if not isinstance(result.data, list):
+                msg = f"Invalid command at offset {pos} of {self.path}"
+                raise AofError(msg)
+
+            # Commands that failed when they first ran were never logged. As in
+            # Redis, nothing is evicted while loading: the log already holds
+            # the evictions made when it was written, as DELs
+            with contextlib.suppress(CommandError):
+                handle_command(keyspace, cast("list[str]", result.data), out, table, evict=False)
+            out.take()
+            pos += result.bytes_consumed
+            loaded += 1
+
+        return loaded
+
+    def feed(self, cmd: list[str]) -> None:
+        self.feed_encoded(encode_command(cmd))
+
+    def feed_encoded(self, entry: bytes) -> None:
+        self._buffer += entry
+        if self._rewrite is not None:
+            self._rewrite.buffer += entry
+
+    def flush(self) -> None:
+        if self._buffer:
+            _write_all(self._fd, self._buffer)
+            self.size += len(self._buffer)
+            self._buffer = bytearray()
+            self._unsynced = True
+
+        if not self._unsynced:
+            return
+
+        if self.fsync == AppendFsync.ALWAYS:
+            os.fsync(self._fd)
+            self._synced()
+        elif self.fsync == AppendFsync.EVERYSEC and self._clock() - self._last_fsync >= AOF_FSYNC_INTERVAL:
+            # A slow disk can't hold up the event loop, though writes carry on
+            # past a second without an fsync if the previous one is still going
+            if self._background_fsync is None or self._background_fsync.done():
+                self._background_fsync = self._fsync_executor.submit(os.fsync, self._fd)
+                self._synced()
+
+    def should_rewrite(self, min_size: int, percentage: int) -> bool:
+        # As Redis's auto-aof-rewrite-*: once the file is big enough and has
+        # grown by percentage since the last rewrite
+        if not percentage or self._rewrite is not None or self.size < min_size:
+            return False
+
+        base = max(self.base_size, 1)
+        return (self.size - base) * 100 // base >= percentage
+
+    def start_rewrite(self, keyspace: Keyspace) -> bool:
+        # Writes a compacted log from a forked child, which sees the keyspace
+        # as it was at the fork while this process carries on serving
+        if self._rewrite is not None:
+            return False
+
+        path = self.path.with_name(f"temp-rewriteaof-{os.getpid()}.aof")
+        pid = fork_child(functools.partial(_write_rewrite, path, keyspace))
+        self._rewrite = _Rewrite(pid, path)
+        return True
+
+    def poll_rewrite(self) -> bool:
+        # Completes a rewrite if its child has exited; returns True if the new
+        # file has replaced the old one
+        rewrite = self._rewrite
+        if rewrite is None:
+            return False
+
+        code = child_exit_code(rewrite.pid)
+        if code is None:
+            return False
+
+        self._rewrite = None
+        if code != 0:
+            print(f"Background AOF rewrite failed with exit code {code}")  # noqa: T201
+            rewrite.path.unlink(missing_ok=True)
+            return False
+
+        self._finish_rewrite(rewrite)
+        return True
+
+    def cancel_rewrite(self) -> None:
+        if self._rewrite is not None:
+            kill_child(self._rewrite.pid)
+            self._rewrite.path.unlink(missing_ok=True)
+            self._rewrite = None
+
+    def close(self) -> None:
+        self.cancel_rewrite()
+        self.flush()
+        self._fsync_executor.shutdown()
+        if self._unsynced:
+            os.fsync(self._fd)
+            self._synced()
+        os.close(self._fd)
+
+    def _finish_rewrite(self, rewrite: _Rewrite) -> None:
+        # Everything written since the fork is already in the old file, so it
+        # stays complete until the new one is renamed over it
+        self.flush()
+        fd = os.open(rewrite.path, os.O_WRONLY | os.O_APPEND)
+        _write_all(fd, rewrite.buffer)
+        os.fsync(fd)
+        rewrite.path.replace(self.path)
+
+        if self._background_fsync is not None:
+            self._background_fsync.result()
+        os.close(self._fd)
+        self._fd = fd
+        self._unsynced = False
+        self.size = self.base_size = os.fstat(fd).st_size
+        self.rewrites += 1
+
+    def _synced(self) -> None:
+        self._unsynced = False
+        self._last_fsync = self._clock()
+        self.fsyncs += 1
+
+
+def _write_rewrite(path: Path, keyspace: Keyspace) -> None:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    chunk = bytearray()
+    for cmd in rewrite_commands(keyspace):
+        chunk += encode_command(cmd)
+        if len(chunk) >= _REWRITE_CHUNK_BYTES:
+            _write_all(fd, chunk)
+            chunk = bytearray()
+
+    _write_all(fd, chunk)
+    os.fsync(fd)
+    os.close(fd)
+
+
+def _write_all(fd: int, data: bytes | bytearray) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
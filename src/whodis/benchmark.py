@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import random
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from src.whodis.client import AsyncClient
+from src.whodis.deserialise import ErrorReply
+from src.whodis.serialise import encode_command
+
+# Keys are numbered like redis-benchmark's __rand_int__, so the two tools
+# produce the same keyspace
+_KEY_DIGITS = 12
+# Keys set or read by each MSET and MGET
+_MULTI_KEY_COUNT = 10
+
+PERCENTILES = (50.0, 99.0, 99.9)
+
+Builder = Callable[[Callable[[], str], str], list[str]]
+
+# Each command is built from a function returning random keys and the value
+COMMANDS: dict[str, Builder] = {
+    "ping": lambda _key, _value: ["PING"],
+    "set": lambda key, value: ["SET", key(), value],
+    "get": lambda key, _value: ["GET", key()],
+    "incr": lambda key, _value: ["INCR", f"counter:{key()}"],
+    "mset": lambda key, value: ["MSET", *(arg for _ in range(_MULTI_KEY_COUNT) for arg in (key(), value))],
+    "mget": lambda key, _value: ["MGET", *(key() for _ in range(_MULTI_KEY_COUNT))],
+}
+
+Mix = tuple[tuple[str, int], ...]
+
+
+@dataclass(frozen=True)
+class Workload:
+    name: str
+    # Commands with their relative weights, chosen at random for each request
+    mix: Mix
+    value_size: int = 3
+    keyspace: int = 1
+
+    def batch_builder(self) -> Callable[[int], bytes]:
+        builders = [COMMANDS[name] for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        value = "x" * self.value_size
+        keyspace = self.keyspace
+
+        def key() -> str:
+            return f"key:{random.randrange(keyspace):0{_KEY_DIGITS}d}"  # noqa: S311
+
+        def build(size: int) -> bytes:
+            chosen = builders * size if len(builders) == 1 else random.choices(builders, weights, k=size)  # noqa: S311
+            return b"".join(encode_command(builder(key, value)) for builder in chosen)
+
+        return build
+
+
+@dataclass
+class BenchmarkResult:
+    requests: int = 0
+    errors: int = 0
+    elapsed: float = 0.0
+    # Microseconds from sending a pipeline to reading its last reply, counted
+    # once for each request in the pipeline
+    latencies: Counter[int] = field(default_factory=Counter)
+
+    @property
+    def ops_per_second(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, percent: float) -> int:
+        # The smallest latency that at least percent of requests were within
+        target = self.requests * percent / 100
+        seen = 0
+        for latency in sorted(self.latencies):
+            seen += self.latencies[latency]
+            if seen >= target:
+                return latency
+
+        return 0
+
+
+def parse_mix(value: str) -> Mix:
+    # e.g. "get:9,set:1" for nine GETs to each SET; weights default to one
+    mix = []
+    for part in value.split(","):
+        name, _, weight = part.strip().lower().partition(":")
+        if name not in COMMANDS or (weight and (not weight.isdigit() or int(weight) == 0)):
+            msg = f"Invalid command mix: {value!r}"
+            raise ValueError(msg)
+        mix.append((name, int(weight or 1)))
+
+    return tuple(mix)
+
+
+def run_workload(  # noqa: PLR0913
+    host: str,
+    port: int,
+    workload: Workload,
+    *,
+    clients: int = 50,
+    requests: int = 100_000,
+    pipeline: int = 1,
+    processes: int = 1,
+) -> BenchmarkResult:
+    # Clients are spread across processes so that a single client process
+    # isn't the bottleneck, each running its share on an event loop
+    if processes == 1:
+        return asyncio.run(_run_clients(host, port, workload, clients, requests, pipeline))
+
+    shares = [(clients * i // processes, requests * i // processes) for i in range(processes + 1)]
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(
+                _run_process,
+                host,
+                port,
+                workload,
+                next_clients - first_clients,
+                next_requests - first_requests,
+                pipeline,
+            )
+            for (first_clients, first_requests), (next_clients, next_requests) in itertools.pairwise(shares)
+        ]
+        parts = [future.result() for future in futures]
+
+    result = BenchmarkResult()
+    first_start = min(start for _, start, _ in parts)
+    last_end = max(end for _, _, end in parts)
+    for part, _, _ in parts:
+        result.requests += part.requests
+        result.errors += part.errors
+        result.latencies += part.latencies
+    result.elapsed = last_end - first_start
+    return result
+
+
+def _run_process(  # noqa: PLR0913
+    host: str,
+    port: int,
+    workload: Workload,
+    clients: int,
+    requests: int,
+    pipeline: int,
+) -> tuple[BenchmarkResult, float, float]:
+    # Returns the result with its start and end times, which are comparable
+    # across processes as the monotonic clock is system-wide
+    result = asyncio.run(_run_clients(host, port, workload, clients, requests, pipeline))
+    end = time.monotonic()
+    return result, end - result.elapsed, end
+
+
+async def _run_clients(  # noqa: PLR0913
+    host: str,
+    port: int,
+    workload: Workload,
+    clients: int,
+    requests: int,
+    pipeline: int,
+) -> BenchmarkResult:
+    # Each benchmark client has a connection of its own, so waits on the
+    # server's replies rather than on other clients' requests
+    connections = [AsyncClient(host, port) for _ in range(max(clients, 1))]
+    for client in connections:
+        await client.connect()
+    result = BenchmarkResult()
+    remaining = [requests]
+    build = workload.batch_builder()
+
+    def claim() -> int:
+        # Clients take requests from a shared count, as with redis-benchmark,
+        # so they all finish at about the same time
+        size = min(pipeline, remaining[0])
+        remaining[0] -= size
+        return size
+
+    start = time.monotonic()
+    try:
+        await asyncio.gather(*(_client(client, claim, build, result) for client in connections))
+    finally:
+        result.elapsed = time.monotonic() - start
+        for client in connections:
+            client.close()
+
+    return result
+
+
+async def _client(
+    client: AsyncClient,
+    claim: Callable[[], int],
+    build: Callable[[int], bytes],
+    result: BenchmarkResult,
+) -> None:
+    while size := claim():
+        request = build(size)
+        sent = time.perf_counter_ns()
+        replies = await client.request(request, size)
+        result.latencies[(time.perf_counter_ns() - sent) // 1000] += size
+        result.requests += size
+        result.errors += sum(isinstance(reply, ErrorReply) for reply in replies)
+
+
+def _report(workload: Workload, result: BenchmarkResult) -> str:
+    latencies = ", ".join(f"p{percent:g}={result.percentile(percent) / 1000:.3f} ms" for percent in PERCENTILES)
+    errors = f", {result.errors:,} errors" if result.errors else ""
+    return f"{workload.name.upper()}: {result.ops_per_second:,.2f} requests per second, {latencies}{errors}"
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Measures whodis throughput and latency, like redis-benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=6379)
+    parser.add_argument("-c", "--clients", type=int, default=50)
+    parser.add_argument("-n", "--requests", type=int, default=100_000)
+    parser.add_argument("-P", "--pipeline", type=int, default=1)
+    parser.add_argument("-d", "--data-size", type=int, default=3, help="bytes in each value")
+    parser.add_argument("-r", "--keyspace", type=int, default=1, help="number of distinct keys to use at random")
+    parser.add_argument(
+        "-t",
+        "--tests",
+        type=parse_mix,
+        default=parse_mix(",".join(COMMANDS)),
+        help=f"commands to benchmark one after another, from {', '.join(COMMANDS)}",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        help='run one test with a weighted mix of commands, e.g. "get:9,set:1"',
+    )
+    parser.add_argument("--processes", type=int, default=1, help="client processes to spread the clients across")
+    args = parser.parse_args(argv)
+
+    mixes = [args.mix] if args.mix else [((name, 1),) for name, _ in args.tests]
+    for mix in mixes:
+        workload = Workload(
+            name=",".join(name if len(mix) == 1 else f"{name}:{weight}" for name, weight in mix),
+            mix=mix,
+            value_size=args.data_size,
+            keyspace=args.keyspace,
+        )
+        result = run_workload(
+            args.host,
+            args.port,
+            workload,
+            clients=args.clients,
+            requests=args.requests,
+            pipeline=args.pipeline,
+            processes=args.processes,
+        )
+        print(_report(workload, result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+import asyncio
+import contextlib
+import itertools
+import queue
+import socket
+from collections import deque
+from collections.abc import Iterator
+from types import TracebackType
+from typing import Self, cast
+
+from src.whodis.deserialise import ErrorReply, Reply, parse_reply
+from src.whodis.serialise import encode_command
+from src.whodis.shared import IncompleteMessageError, InvalidMessageError
+
+Arg = str | int | float
+
+_READ_BYTES = 64 * 1024
+
+
+class ResponseError(Exception):
+    # An error reply from the server
+    pass
+
+
+def _encode(args: tuple[Arg, ...]) -> bytes:
+    return encode_command([arg if isinstance(arg, str) else str(arg) for arg in args])
+
+
+def _check(replies: list[Reply]) -> list[Reply]:
+    # Raises the first error among the replies, once all of them have been
+    # read so the connection is left ready for the next request
+    for reply in replies:
+        if isinstance(reply, ErrorReply):
+            raise ResponseError(reply.message)
+
+    return replies
+
+
+class Connection:
+    # A blocking connection. Replies are read into a buffer and parsed from
+    # there, so the replies to a pipeline arriving together take one read
+    def __init__(self, host: str, port: int, timeout: float | None = None) -> None:
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = bytearray()
+        # Set once the connection can't be relied on to be in step with the
+        # server, after which it is closed rather than reused
+        self.broken = False
+
+    def send(self, data: bytes) -> None:
+        try:
+            self._sock.sendall(data)
+        except OSError:
+            self.broken = True
+            raise
+
+    def read_replies(self, count: int) -> list[Reply]:
+        replies: list[Reply] = []
+        buffer = self._buffer
+        pos = 0
+        while len(replies) < count:
+            try:
+                reply, pos = parse_reply(buffer, pos)
+            except IncompleteMessageError:
+                self._receive()
+                continue
+            replies.append(reply)
+
+        del buffer[:pos]
+        return replies
+
+    def close(self) -> None:
+        self._sock.close()
+
+    def _receive(self) -> None:
+        try:
+            data = self._sock.recv(_READ_BYTES)
+        except OSError:
+            self.broken = True
+            raise
+
+        if not data:
+            self.broken = True
+            msg = "Server closed the connection"
+            raise ConnectionError(msg)
+        self._buffer += data
+
+
+class ConnectionPool:
+    # Connections shared by any number of threads, each used by one thread at
+    # a time. They are opened as needed up to max_connections; a thread that
+    # finds them all in use waits for one to be released
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 6379,
+        *,
+        max_connections: int = 50,
+        socket_timeout: float | None = None,
+        wait_timeout: float | None = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.socket_timeout = socket_timeout
+        self.wait_timeout = wait_timeout
+        # One slot per connection, None until it is first needed. Taken most
+        # recently released first, so a quiet pool keeps few connections open
+        self._free: queue.LifoQueue[Connection | None] = queue.LifoQueue()
+        for _ in range(max_connections):
+            self._free.put(None)
+
+    def acquire(self) -> Connection:
+        try:
+            conn = self._free.get(timeout=self.wait_timeout)
+        except queue.Empty as e:
+            msg = "No connection available in the pool"
+            raise ConnectionError(msg) from e
+
+        if conn is not None:
+            return conn
+
+        try:
+            return Connection(self.host, self.port, self.socket_timeout)
+        except BaseException:
+            self._free.put(None)
+            raise
+
+    def release(self, conn: Connection) -> None:
+        if conn.broken:
+            conn.close()
+            self._free.put(None)
+        else:
+            self._free.put(conn)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        except ResponseError:
+            raise
+        except BaseException:
+            # Interrupted part way through a request, the connection may still
+            # have replies on their way
+            conn.broken = True
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        # Closes the connections not in use
+        while True:
+            try:
+                conn = self._free.get_nowait()
+            except queue.Empty:
+                return
+            if conn is not None:
+                conn.close()
+
+
+class Pipeline:
+    # Commands queued and then sent in one write, with their replies read back
+    # together, so a batch costs one round trip rather than one per command
+    def __init__(self, pool: ConnectionPool) -> None:
+        self._pool = pool
+        self._commands: list[bytes] = []
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self._commands.clear()
+
+    def command(self, *args: Arg) -> Self:
+        self._commands.append(_encode(args))
+        return self
+
+    def execute(self, *, raise_on_error: bool = True) -> list[Reply]:
+        # Error replies are raised, or returned among the replies as ErrorReply
+        if not self._commands:
+            return []
+
+        data = b"".join(self._commands)
+        count = len(self._commands)
+        self._commands.clear()
+        with self._pool.connection() as conn:
+            conn.send(data)
+            replies = conn.read_replies(count)
+
+        return _check(replies) if raise_on_error else replies
+
+
+class Client:
+    # A thread-safe client, taking a connection from its pool for each request
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 6379,
+        *,
+        pool: ConnectionPool | None = None,
+        max_connections: int = 50,
+        socket_timeout: float | None = None,
+    ) -> None:
+        self.pool = pool or ConnectionPool(
+            host,
+            port,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+        )
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def execute(self, *args: Arg) -> Reply:
+        with self.pool.connection() as conn:
+            conn.send(_encode(args))
+            [reply] = conn.read_replies(1)
+
+        return _check([reply])[0]
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self.pool)
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+class _Multiplexer(asyncio.Protocol):
+    # One connection shared by any number of concurrent requests. Those made
+    # in the same event loop iteration are sent in one write, and the replies,
+    # which come back in the order the requests were sent, are handed out in
+    # that order
+    def __init__(self) -> None:
+        self._transport: asyncio.Transport | None = None
+        self._outgoing: list[bytes] = []
+        self._coalescing = False
+        # Each request's future, with the number of replies it is waiting for
+        self._waiting: deque[tuple[asyncio.Future[list[Reply]], int]] = deque()
+        self._replies: list[Reply] = []
+        self._buffer = bytearray()
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = cast("asyncio.Transport", transport)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._closed = True
+        self._transport = None
+        error = ConnectionError("Connection to the server was lost")
+        error.__cause__ = exc
+        while self._waiting:
+            future, _ = self._waiting.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def request(self, data: bytes, count: int) -> asyncio.Future[list[Reply]]:
+        if self._transport is None:
+            msg = "Not connected to the server"
+            raise ConnectionError(msg)
+
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[list[Reply]] = loop.create_future()
+        self._waiting.append((future, count))
+        if self._coalescing:
+            self._outgoing.append(data)
+        else:
+            # The first request of an iteration goes straight out, with any
+            # that follow it gathered into one write at the end
+            self._transport.write(data)
+            self._coalescing = True
+            loop.call_soon(self._flush)
+        return future
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def data_received(self, data: bytes) -> None:
+        buffer = self._buffer
+        buffer += data
+        pos = 0
+        try:
+            while self._waiting:
+                reply, pos = parse_reply(buffer, pos)
+                self._replies.append(reply)
+                future, count = self._waiting[0]
+                if len(self._replies) == count:
+                    self._waiting.popleft()
+                    # A cancelled request's replies are still read, and dropped
+                    if not future.done():
+                        future.set_result(self._replies)
+                    self._replies = []
+        except IncompleteMessageError:
+            pass
+        except InvalidMessageError:
+            self.close()
+        finally:
+            del buffer[:pos]
+
+    def _flush(self) -> None:
+        self._coalescing = False
+        if self._transport is not None and self._outgoing:
+            self._transport.write(b"".join(self._outgoing))
+        self._outgoing.clear()
+
+
+class AsyncPipeline:
+    # As Pipeline, for AsyncClient
+    def __init__(self, client: "AsyncClient") -> None:
+        self._client = client
+        self._commands: list[bytes] = []
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def command(self, *args: Arg) -> Self:
+        self._commands.append(_encode(args))
+        return self
+
+    async def execute(self, *, raise_on_error: bool = True) -> list[Reply]:
+        if not self._commands:
+            return []
+
+        data = b"".join(self._commands)
+        count = len(self._commands)
+        self._commands.clear()
+        replies = await self._client.request(data, count)
+        return _check(replies) if raise_on_error else replies
+
+
+class AsyncClient:
+    # Requests from any number of coroutines are multiplexed over a few
+    # connections, taken in turn, rather than each waiting for a connection of
+    # its own. Closed connections are reopened when next needed
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, *, connections: int = 1) -> None:
+        self.host = host
+        self.port = port
+        self._connections: list[_Multiplexer | None] = [None] * connections
+        self._turn = itertools.count()
+        self._connect_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    async def execute(self, *args: Arg) -> Reply:
+        replies = await self.request(_encode(args), 1)
+        return _check(replies)[0]
+
+    def pipeline(self) -> AsyncPipeline:
+        return AsyncPipeline(self)
+
+    async def connect(self) -> None:
+        # Opens the connections now rather than on first use
+        for index in range(len(self._connections)):
+            await self._connect(index)
+
+    async def request(self, data: bytes, count: int) -> list[Reply]:
+        # Sends encoded commands and waits for their count replies
+        conn = await self._connection()
+        return await conn.request(data, count)
+
+    def close(self) -> None:
+        for conn in self._connections:
+            if conn is not None:
+                conn.close()
+        self._connections = [None] * len(self._connections)
+
+    async def _connection(self) -> _Multiplexer:
+        index = next(self._turn) % len(self._connections)
+        conn = self._connections[index]
+        if conn is not None and not conn.closed:
+            return conn
+        return await self._connect(index)
+
+    async def _connect(self, index: int) -> _Multiplexer:
+        # Requests arriving while a connection is being opened wait for it
+        # rather than opening more
+        async with self._connect_lock:
+            conn = self._connections[index]
+            if conn is None or conn.closed:
+                loop = asyncio.get_running_loop()
+                _, conn = await loop.create_connection(_Multiplexer, self.host, self.port)
+                self._connections[index] = conn
+
+        return conn
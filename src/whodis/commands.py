@@ -1,28 +1,1001 @@
-from enum import Enum
+import itertools
+import math
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from dataclasses import dataclass
 
+from src.whodis.datatypes import INT_MAX, INT_MIN, EncodingLimits, Hash, List, Set, ZSet, format_score
+from src.whodis.eviction import OutOfMemoryError
+from src.whodis.glob import compile_glob, compile_glob_bytes
+from src.whodis.keyspace import KeyStore, String, value_bytes, value_encoding, value_type
+from src.whodis.serialise import EMPTY_ARRAY_REPLY, NULL_ARRAY_REPLY, OK_REPLY, PONG_REPLY, ReplyWriter
 
-class Command(Enum):
-    PING = "PING"
+Handler = Callable[[KeyStore, list[str], ReplyWriter], None]
+
+_WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
 
 
 class UnsupportedCommandError(Exception):
     pass
 
 
-def handle_command(cmd: list[str]) -> str:
-    if len(cmd) == 1:
+class CommandError(Exception):
+    # Raised by handlers before writing anything; the message is sent to the
+    # client as an error reply
+    pass
+
+
+@dataclass(frozen=True)
+class CommandSpec:
+    name: str
+    handler: Handler
+    # As in Redis, a positive arity is the exact number of arguments including
+    # the command name, and a negative arity is the minimum
+    arity: int
+    # Commands that may use more memory are refused when over maxmemory
+    denyoom: bool = False
+    # Commands that may change the keyspace, which read-only replicas refuse
+    write: bool = False
+    # Positions of the key arguments as (first, last, step), where a negative
+    # last counts back from the end, as in Redis's command table
+    keys: tuple[int, int, int] | None = None
+
+    def accepts(self, num_args: int) -> bool:
+        if self.arity >= 0:
+            return num_args == self.arity
+
+        return num_args >= -self.arity
+
+
+def handle_command(
+    keyspace: KeyStore,
+    cmd: list[str],
+    out: ReplyWriter,
+    table: "CommandTable | None" = None,
+    *,
+    evict: bool = True,
+) -> None:
+    spec = _lookup_command(cmd, table)
+
+    if not spec.accepts(len(cmd)):
+        msg = f"ERR wrong number of arguments for '{spec.name.lower()}' command"
+        raise CommandError(msg)
+
+    if spec.denyoom and evict:
         try:
-            command = Command(cmd[0])
-        except ValueError as e:
+            keyspace.perform_evictions()
+        except OutOfMemoryError as e:
+            msg = "OOM command not allowed when used memory > 'maxmemory'."
+            raise CommandError(msg) from e
+
+    spec.handler(keyspace, cmd, out)
+
+
+def command_keys(cmd: list[str], table: "CommandTable | None" = None) -> list[str]:
+    spec = _lookup_command(cmd, table)
+    if spec.keys is None or not spec.accepts(len(cmd)):
+        return []
+
+    first, last, step = spec.keys
+    if last < 0:
+        last += len(cmd)
+
+    return cmd[first : last + 1 : step]
+
+
+def build_command_table(specs: Iterable[CommandSpec]) -> dict[str, CommandSpec]:
+    # Keyed by both upper and lower case names so the common cases are one lookup
+    return {name: spec for spec in specs for name in (spec.name, spec.name.lower())}
+
+
+def _lookup_command(cmd: list[str], table: "CommandTable | None") -> CommandSpec:
+    if not cmd:
+        msg = "Command is empty"
+        raise UnsupportedCommandError(msg)
+
+    if table is None:
+        table = COMMAND_TABLE
+
+    name = cmd[0]
+    spec = table.get(name)
+    if spec is None:
+        # Most clients send upper or lower case names, which are in the table
+        # already; anything else pays for one normalisation
+        spec = table.get(name.upper())
+        if spec is None:
             msg = f"Command {cmd} is not supported"
-            raise UnsupportedCommandError(msg) from e
+            raise UnsupportedCommandError(msg)
+
+    return spec
+
+
+def _parse_int(value: str) -> int:
+    msg = "ERR value is not an integer or out of range"
+    try:
+        number = int(value)
+    except ValueError as e:
+        raise CommandError(msg) from e
+
+    # int() is more lenient than Redis (whitespace, underscores, leading zeros)
+    if not INT_MIN <= number <= INT_MAX or str(number) != value:
+        raise CommandError(msg)
+
+    return number
+
+
+def _parse_score(value: str, msg: str = "ERR value is not a valid float") -> float:
+    # float() is more lenient than Redis (whitespace, underscores), and
+    # accepts NaN, which can't be ordered
+    try:
+        score = float(value)
+    except ValueError as e:
+        raise CommandError(msg) from e
+
+    if math.isnan(score) or "_" in value or value[0].isspace() or value[-1].isspace():
+        raise CommandError(msg)
+
+    return score
+
+
+def _parse_score_bound(value: str) -> tuple[float, bool]:
+    # A score range bound, and whether it is exclusive ("(" prefixed)
+    msg = "ERR min or max is not a float"
+    if value.startswith("("):
+        return _parse_score(value[1:], msg) if len(value) > 1 else _parse_score(value, msg), True
+
+    return _parse_score(value, msg), False
+
+
+def _get_string(keyspace: KeyStore, key: str) -> String | None:
+    value = keyspace.get(key)
+    if value is None or isinstance(value, int | bytes):
+        return value
+
+    raise CommandError(_WRONGTYPE)
+
+
+def _get_collection[C: (Hash, List, Set, ZSet)](keyspace: KeyStore, key: str, kind: type[C]) -> C | None:
+    value = keyspace.get(key)
+    if value is None or isinstance(value, kind):
+        return value
+
+    raise CommandError(_WRONGTYPE)
+
+
+def _get_or_create[C: (Hash, List, Set, ZSet)](keyspace: KeyStore, key: str, kind: type[C]) -> C:
+    # The caller must pass the collection to keyspace.collection_changed once
+    # it has added to it
+    value = _get_collection(keyspace, key, kind)
+    if value is None:
+        created = kind()
+        keyspace.set(key, created)
+        return created
+
+    return value
+
+
+def _handle_ping(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG001
+    if len(args) > 2:  # noqa: PLR2004
+        msg = "ERR wrong number of arguments for 'ping' command"
+        raise CommandError(msg)
+
+    if len(args) == 1:
+        out.write_raw(PONG_REPLY)
+    else:
+        out.write_bulk_string(args[1])
+
+
+def _handle_get(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    # The type check is inlined, as GET is the hottest command
+    value = keyspace.get(args[1])
+    if value is None:
+        out.write_null()
+    elif isinstance(value, bytes):
+        out.write_bulk_string(value)
+    elif isinstance(value, int):
+        out.write_bulk_string(b"%d" % value)
+    else:
+        raise CommandError(_WRONGTYPE)
+
+
+def _handle_set(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    expire_at: int | None = None
+    keep_ttl = only_if_missing = only_if_present = False
+
+    options = iter(args[3:])
+    for option in options:
+        match option.upper():
+            case "EX" | "PX" | "EXAT" | "PXAT" as unit if expire_at is None and not keep_ttl:
+                amount = next(options, None)
+                if amount is None:
+                    msg = "ERR syntax error"
+                    raise CommandError(msg)
+
+                ttl = _parse_int(amount) * (1000 if unit in {"EX", "EXAT"} else 1)
+                if ttl <= 0:
+                    msg = "ERR invalid expire time in 'set' command"
+                    raise CommandError(msg)
+
+                # The absolute forms are what the AOF records, so replaying it
+                # later doesn't extend expiry times
+                expire_at = ttl if unit.endswith("AT") else keyspace.now_ms() + ttl
+            case "KEEPTTL" if expire_at is None:
+                keep_ttl = True
+            case "NX" if not only_if_present:
+                only_if_missing = True
+            case "XX" if not only_if_missing:
+                only_if_present = True
+            case _:
+                msg = "ERR syntax error"
+                raise CommandError(msg)
+
+    if (only_if_missing and key in keyspace) or (only_if_present and key not in keyspace):
+        out.write_null()
+        return
+
+    keyspace.set(key, args[2], expire_at, keep_ttl=keep_ttl)
+    out.write_raw(OK_REPLY)
+
+
+def _handle_mget(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    out.write_array_header(len(args) - 1)
+    for key in args[1:]:
+        # Keys holding other types read as missing, rather than failing MGET
+        value = keyspace.get(key)
+        if isinstance(value, int | bytes):
+            out.write_bulk_string(value_bytes(value))
+        else:
+            out.write_null()
+
+
+def _check_pairs(args: list[str]) -> None:
+    if len(args) % 2 == 0:
+        msg = f"ERR wrong number of arguments for '{args[0].lower()}' command"
+        raise CommandError(msg)
+
+
+def _handle_mset(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _check_pairs(args)
+    for i in range(1, len(args), 2):
+        keyspace.set(args[i], args[i + 1])
+
+    out.write_raw(OK_REPLY)
+
+
+def _handle_msetnx(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _check_pairs(args)
+    if any(args[i] in keyspace for i in range(1, len(args), 2)):
+        out.write_integer(0)
+        return
+
+    for i in range(1, len(args), 2):
+        keyspace.set(args[i], args[i + 1])
+
+    out.write_integer(1)
+
+
+def _handle_del(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    out.write_integer(keyspace.delete_many(args[1:]))
+
+
+def _handle_unlink(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    out.write_integer(keyspace.delete_many(args[1:], lazy=True))
+
+
+def _handle_exists(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    out.write_integer(sum(key in keyspace for key in args[1:]))
+
+
+def _handle_incr(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    current = _get_string(keyspace, key)
+    # Any value that is an integer in range is already stored as an int
+    if isinstance(current, bytes):
+        msg = "ERR value is not an integer or out of range"
+        raise CommandError(msg)
+
+    number = current or 0
+    if number == INT_MAX:
+        msg = "ERR increment or decrement would overflow"
+        raise CommandError(msg)
+
+    number += 1
+    keyspace.set(key, number)
+    out.write_integer(number)
+
+
+def _handle_append(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    current = _get_string(keyspace, key)
+    value = args[2].encode()
+    if current is not None:
+        value = value_bytes(current) + value
+    keyspace.set(key, value)
+    out.write_integer(len(value))
+
+
+def _expire(keyspace: KeyStore, args: list[str], out: ReplyWriter, unit_ms: int, *, absolute: bool = False) -> None:
+    expire_at = _parse_int(args[2]) * unit_ms
+    if not absolute:
+        expire_at += keyspace.now_ms()
+    out.write_integer(int(keyspace.expire(args[1], expire_at)))
+
+
+def _handle_expire(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _expire(keyspace, args, out, 1000)
+
+
+def _handle_pexpire(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _expire(keyspace, args, out, 1)
+
+
+def _handle_expireat(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _expire(keyspace, args, out, 1000, absolute=True)
+
+
+def _handle_pexpireat(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _expire(keyspace, args, out, 1, absolute=True)
+
+
+def _remaining_ttl(keyspace: KeyStore, key: str) -> int:
+    # Returns -2 for a missing key and -1 for a key without an expiry, as
+    # TTL and PTTL reply
+    if key not in keyspace:
+        return -2
+
+    expire_at = keyspace.get_expire(key)
+    if expire_at is None:
+        return -1
+
+    return max(expire_at - keyspace.now_ms(), 0)
+
+
+def _handle_ttl(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    remaining = _remaining_ttl(keyspace, args[1])
+    # Rounds to the nearest second, as Redis does
+    out.write_integer(remaining if remaining < 0 else (remaining + 500) // 1000)
+
+
+def _handle_pttl(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    out.write_integer(_remaining_ttl(keyspace, args[1]))
+
+
+def _handle_persist(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    out.write_integer(int(keyspace.persist(args[1])))
+
+
+def _handle_strlen(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    value = _get_string(keyspace, args[1])
+    out.write_integer(0 if value is None else len(value_bytes(value)))
+
+
+def _handle_type(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    value = keyspace.get(args[1])
+    out.write_simple_string("none" if value is None else value_type(value))
+
+
+def _handle_hset(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    if len(args) % 2:
+        msg = "ERR wrong number of arguments for 'hset' command"
+        raise CommandError(msg)
+
+    key = args[1]
+    hash_ = _get_or_create(keyspace, key, Hash)
+    size = hash_.memory_usage()
+    limits = keyspace.encoding_limits
+    added = 0
+    for i in range(2, len(args), 2):
+        added += hash_.set(args[i].encode(), args[i + 1].encode(), limits)
+
+    keyspace.collection_changed(key, hash_, size)
+    out.write_integer(added)
+
+
+def _handle_hget(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    hash_ = _get_collection(keyspace, args[1], Hash)
+    value = None if hash_ is None else hash_.get(args[2].encode())
+    if value is None:
+        out.write_null()
+    else:
+        out.write_bulk_string(value)
+
+
+def _handle_hgetall(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    hash_ = _get_collection(keyspace, args[1], Hash)
+    if hash_ is None:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    out.write_array_header(len(hash_) * 2)
+    for field, value in hash_.items():
+        out.write_bulk_string(field)
+        out.write_bulk_string(value)
+
+
+def _handle_hdel(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    hash_ = _get_collection(keyspace, key, Hash)
+    if hash_ is None:
+        out.write_integer(0)
+        return
+
+    size = hash_.memory_usage()
+    deleted = sum(hash_.delete(field.encode()) for field in args[2:])
+    if deleted:
+        keyspace.collection_changed(key, hash_, size)
+    out.write_integer(deleted)
+
+
+def _handle_hlen(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    hash_ = _get_collection(keyspace, args[1], Hash)
+    out.write_integer(0 if hash_ is None else len(hash_))
+
+
+def _push(keyspace: KeyStore, args: list[str], out: ReplyWriter, *, left: bool) -> None:
+    key = args[1]
+    list_ = _get_or_create(keyspace, key, List)
+    size = list_.memory_usage()
+    elements = [arg.encode() for arg in args[2:]]
+    if left:
+        list_.push_left(elements, keyspace.encoding_limits)
+    else:
+        list_.push_right(elements, keyspace.encoding_limits)
+
+    keyspace.collection_changed(key, list_, size)
+    out.write_integer(len(list_))
+
+
+def _handle_lpush(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _push(keyspace, args, out, left=True)
+
+
+def _handle_rpush(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _push(keyspace, args, out, left=False)
+
+
+def _pop(keyspace: KeyStore, args: list[str], out: ReplyWriter, *, left: bool) -> None:
+    # Pops one element, or with a count an array of up to that many
+    if len(args) > 3:  # noqa: PLR2004
+        msg = f"ERR wrong number of arguments for '{args[0].lower()}' command"
+        raise CommandError(msg)
+
+    count = None if len(args) == 2 else _parse_int(args[2])  # noqa: PLR2004
+    if count is not None and count < 0:
+        msg = "ERR value is out of range, must be positive"
+        raise CommandError(msg)
+
+    key = args[1]
+    list_ = _get_collection(keyspace, key, List)
+    if list_ is None:
+        if count is None:
+            out.write_null()
+        else:
+            out.write_raw(NULL_ARRAY_REPLY)
+        return
+
+    size = list_.memory_usage()
+    n = 1 if count is None else count
+    popped = list_.pop_left(n) if left else list_.pop_right(n)
+    if popped:
+        keyspace.collection_changed(key, list_, size)
+
+    if count is None:
+        out.write_bulk_string(popped[0])
+        return
+
+    out.write_array_header(len(popped))
+    for element in popped:
+        out.write_bulk_string(element)
+
+
+def _handle_lpop(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _pop(keyspace, args, out, left=True)
+
+
+def _handle_rpop(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _pop(keyspace, args, out, left=False)
+
+
+def _handle_lrange(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    start, stop = _parse_int(args[2]), _parse_int(args[3])
+    list_ = _get_collection(keyspace, args[1], List)
+    if list_ is None:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    # Negative indexes count back from the end, and out of range ones are
+    # clamped to the list, as in Redis
+    length = len(list_)
+    start = max(start + length if start < 0 else start, 0)
+    stop = min(stop + length if stop < 0 else stop, length - 1)
+    if start > stop:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    out.write_array_header(stop - start + 1)
+    for element in list_.range(start, stop):
+        out.write_bulk_string(element)
+
+
+def _handle_lindex(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    index = _parse_int(args[2])
+    list_ = _get_collection(keyspace, args[1], List)
+    element = None if list_ is None else list_.index(index)
+    if element is None:
+        out.write_null()
+    else:
+        out.write_bulk_string(element)
+
+
+def _handle_llen(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    list_ = _get_collection(keyspace, args[1], List)
+    out.write_integer(0 if list_ is None else len(list_))
+
+
+def _handle_sadd(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    set_ = _get_or_create(keyspace, key, Set)
+    size = set_.memory_usage()
+    limits = keyspace.encoding_limits
+    added = sum(set_.add(member.encode(), limits) for member in args[2:])
+    keyspace.collection_changed(key, set_, size)
+    out.write_integer(added)
+
+
+def _handle_srem(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    set_ = _get_collection(keyspace, key, Set)
+    if set_ is None:
+        out.write_integer(0)
+        return
+
+    size = set_.memory_usage()
+    removed = sum(set_.remove(member.encode()) for member in args[2:])
+    if removed:
+        keyspace.collection_changed(key, set_, size)
+    out.write_integer(removed)
+
+
+def _handle_sismember(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    set_ = _get_collection(keyspace, args[1], Set)
+    out.write_integer(int(set_ is not None and args[2].encode() in set_))
+
+
+def _handle_smembers(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    set_ = _get_collection(keyspace, args[1], Set)
+    if set_ is None:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    out.write_array_header(len(set_))
+    for member in set_:
+        out.write_bulk_string(member)
+
+
+def _handle_scard(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    set_ = _get_collection(keyspace, args[1], Set)
+    out.write_integer(0 if set_ is None else len(set_))
+
+
+_ZADD_FLAGS = frozenset({"NX", "XX", "GT", "LT", "CH", "INCR"})
+
+
+def _parse_zadd_flags(args: list[str]) -> tuple[set[str], list[str]]:
+    # The flags given to ZADD, and the score/member pairs after them
+    i = 2
+    flags = set()
+    while i < len(args) and (flag := args[i].upper()) in _ZADD_FLAGS:
+        flags.add(flag)
+        i += 1
+
+    pairs = args[i:]
+    if not pairs or len(pairs) % 2:
+        msg = "ERR syntax error"
+        raise CommandError(msg)
+    if {"NX", "XX"} <= flags:
+        msg = "ERR XX and NX options at the same time are not compatible"
+        raise CommandError(msg)
+    if {"GT", "LT"} <= flags or ("NX" in flags and flags & {"GT", "LT"}):
+        msg = "ERR GT, LT, and/or NX options at the same time are not compatible"
+        raise CommandError(msg)
+    if "INCR" in flags and len(pairs) > 2:  # noqa: PLR2004
+        msg = "ERR INCR option supports a single increment-element pair"
+        raise CommandError(msg)
+
+    return flags, pairs
+
+
+def _zadd(
+    zset: ZSet,
+    pairs: list[tuple[float, bytes]],
+    flags: set[str],
+    limits: EncodingLimits,
+) -> tuple[int, int, int]:
+    # Returns how many members were added, how many had their score changed,
+    # and how many the flags let through, changed or not
+    added = changed = processed = 0
+    for score, member in pairs:
+        current = zset.score(member)
+        if current is None:
+            if "XX" not in flags:
+                zset.add(member, score, limits)
+                added += 1
+                processed += 1
+            continue
+
+        new = current + score if "INCR" in flags else score
+        if "NX" in flags or ("GT" in flags and new <= current) or ("LT" in flags and new >= current):
+            continue
+
+        zset.add(member, new, limits)
+        changed += new != current
+        processed += 1
+
+    return added, changed, processed
+
+
+def _handle_zadd(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    # ZADD key [NX|XX] [GT|LT] [CH] [INCR] score member [score member ...]
+    flags, args_pairs = _parse_zadd_flags(args)
+    # Every score is checked before any is applied
+    pairs = [(_parse_score(score), member.encode()) for score, member in itertools.batched(args_pairs, 2, strict=True)]
+    key = args[1]
+    zset = _get_collection(keyspace, key, ZSet)
+    incr = "INCR" in flags
+    if incr:
+        [(increment, member)] = pairs
+        current = None if zset is None else zset.score(member)
+        if current is not None and math.isnan(current + increment):
+            msg = "ERR resulting score is not a number (NaN)"
+            raise CommandError(msg)
+
+    added = changed = processed = 0
+    if zset is not None or "XX" not in flags:
+        zset = _get_or_create(keyspace, key, ZSet)
+        size = zset.memory_usage()
+        added, changed, processed = _zadd(zset, pairs, flags, keyspace.encoding_limits)
+        if added or changed:
+            keyspace.collection_changed(key, zset, size)
+
+    if not incr:
+        out.write_integer(added + changed if "CH" in flags else added)
+        return
+
+    # INCR replies with the new score, unless the flags kept it from changing
+    score = None if zset is None or not processed else zset.score(member)
+    if score is None:
+        out.write_null()
+    else:
+        out.write_bulk_string(format_score(score))
+
+
+def _handle_zincrby(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key, increment, member = args[1], _parse_score(args[2]), args[3].encode()
+    zset = _get_collection(keyspace, key, ZSet)
+    current = None if zset is None else zset.score(member)
+    score = increment if current is None else current + increment
+    if math.isnan(score):
+        msg = "ERR resulting score is not a number (NaN)"
+        raise CommandError(msg)
+
+    zset = _get_or_create(keyspace, key, ZSet)
+    size = zset.memory_usage()
+    zset.add(member, score, keyspace.encoding_limits)
+    keyspace.collection_changed(key, zset, size)
+    out.write_bulk_string(format_score(score))
+
+
+def _handle_zscore(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    zset = _get_collection(keyspace, args[1], ZSet)
+    score = None if zset is None else zset.score(args[2].encode())
+    if score is None:
+        out.write_null()
+    else:
+        out.write_bulk_string(format_score(score))
+
+
+def _rank(keyspace: KeyStore, args: list[str], out: ReplyWriter, *, reverse: bool) -> None:
+    zset = _get_collection(keyspace, args[1], ZSet)
+    rank = None if zset is None else zset.rank(args[2].encode())
+    if zset is None or rank is None:
+        out.write_null()
+    else:
+        out.write_integer(len(zset) - 1 - rank if reverse else rank)
+
+
+def _handle_zrank(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _rank(keyspace, args, out, reverse=False)
+
+
+def _handle_zrevrank(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    _rank(keyspace, args, out, reverse=True)
+
+
+def _write_zset_range(
+    out: ReplyWriter,
+    entries: Iterator[tuple[bytes, float]],
+    count: int,
+    *,
+    withscores: bool,
+) -> None:
+    # Written as the skiplist is walked, without collecting the range first
+    out.write_array_header(count * 2 if withscores else count)
+    if withscores:
+        for member, score in entries:
+            out.write_bulk_string(member)
+            out.write_bulk_string(format_score(score))
+    else:
+        for member, _ in entries:
+            out.write_bulk_string(member)
+
+
+def _handle_zrange(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    # ZRANGE key start stop [WITHSCORES]
+    if len(args) > 5 or (len(args) == 5 and args[4].upper() != "WITHSCORES"):  # noqa: PLR2004
+        msg = "ERR syntax error"
+        raise CommandError(msg)
+
+    start, stop = _parse_int(args[2]), _parse_int(args[3])
+    zset = _get_collection(keyspace, args[1], ZSet)
+    if zset is None:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    # Clamped as LRANGE is
+    length = len(zset)
+    start = max(start + length if start < 0 else start, 0)
+    stop = min(stop + length if stop < 0 else stop, length - 1)
+    if start > stop:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    count = stop - start + 1
+    _write_zset_range(out, zset.range(start, count), count, withscores=len(args) == 5)  # noqa: PLR2004
+
+
+def _handle_zrangebyscore(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    # ZRANGEBYSCORE key min max [WITHSCORES] [LIMIT offset count]
+    (low, low_exclusive), (high, high_exclusive) = _parse_score_bound(args[2]), _parse_score_bound(args[3])
+    withscores = False
+    offset, limit = 0, -1
+    i = 4
+    while i < len(args):
+        option = args[i].upper()
+        if option == "WITHSCORES":
+            withscores = True
+            i += 1
+        elif option == "LIMIT" and i + 2 < len(args):
+            offset, limit = _parse_int(args[i + 1]), _parse_int(args[i + 2])
+            i += 3
+        else:
+            msg = "ERR syntax error"
+            raise CommandError(msg)
+
+    zset = _get_collection(keyspace, args[1], ZSet)
+    if zset is None or offset < 0:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    # Both ends are found by rank, so the reply's length is known up front
+    start = zset.count_below(low, inclusive=low_exclusive) + offset
+    count = zset.count_below(high, inclusive=not high_exclusive) - start
+    if limit >= 0:
+        count = min(count, limit)
+    if count <= 0:
+        out.write_raw(EMPTY_ARRAY_REPLY)
+        return
+
+    _write_zset_range(out, zset.range(start, count), count, withscores=withscores)
+
+
+def _handle_zrem(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    key = args[1]
+    zset = _get_collection(keyspace, key, ZSet)
+    if zset is None:
+        out.write_integer(0)
+        return
+
+    size = zset.memory_usage()
+    removed = sum(zset.remove(member.encode()) for member in args[2:])
+    if removed:
+        keyspace.collection_changed(key, zset, size)
+    out.write_integer(removed)
+
+
+def _handle_zcard(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    zset = _get_collection(keyspace, args[1], ZSet)
+    out.write_integer(0 if zset is None else len(zset))
+
+
+@dataclass(frozen=True)
+class _ScanOptions:
+    # MATCH "*" matches everything, so is treated as no pattern
+    match: str | None = None
+    count: int = 10
+    type: str | None = None
+
+
+def _parse_cursor(value: str) -> int:
+    if not (value.isascii() and value.isdigit()) or int(value) >= 2**64:
+        msg = "ERR invalid cursor"
+        raise CommandError(msg)
+
+    return int(value)
+
+
+def _parse_scan_options(args: list[str], start: int, *, allow_type: bool = False) -> _ScanOptions:
+    match, count, type_ = None, 10, None
+    i = start
+    while i < len(args):
+        option = args[i].upper()
+        if i + 1 == len(args):
+            msg = "ERR syntax error"
+            raise CommandError(msg)
+
+        if option == "MATCH":
+            match = None if args[i + 1] == "*" else args[i + 1]
+        elif option == "COUNT":
+            count = _parse_int(args[i + 1])
+            if count < 1:
+                msg = "ERR syntax error"
+                raise CommandError(msg)
+        elif option == "TYPE" and allow_type:
+            type_ = args[i + 1].lower()
+        else:
+            msg = "ERR syntax error"
+            raise CommandError(msg)
+        i += 2
+
+    return _ScanOptions(match, count, type_)
+
+
+def _write_scan_reply(out: ReplyWriter, cursor: int, elements: Iterable[str | bytes], length: int) -> None:
+    out.write_array_header(2)
+    out.write_bulk_string(b"%d" % cursor)
+    out.write_array_header(length)
+    for element in elements:
+        out.write_bulk_string(element)
+
+
+def _handle_scan(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    # SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]. Each call visits
+    # COUNT keys at most, however many match, so it never holds up the server
+    cursor = _parse_cursor(args[1])
+    options = _parse_scan_options(args, 2, allow_type=True)
+    cursor, entries = keyspace.scan(cursor, options.count)
+    keys = [key for key, entry in entries if options.type is None or value_type(entry.value) == options.type]
+    if options.match is not None:
+        pattern = compile_glob(options.match)
+        keys = [key for key in keys if pattern.fullmatch(key)]
+
+    _write_scan_reply(out, cursor, keys, len(keys))
+
+
+def _handle_hscan(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    cursor, options = _parse_cursor(args[2]), _parse_scan_options(args, 3)
+    hash_ = _get_collection(keyspace, args[1], Hash)
+    cursor, items = (0, []) if hash_ is None else hash_.scan(cursor, options.count)
+    if options.match is not None:
+        pattern = compile_glob_bytes(options.match)
+        items = [(field, value) for field, value in items if pattern.fullmatch(field)]
+
+    _write_scan_reply(out, cursor, (element for item in items for element in item), len(items) * 2)
+
+
+def _handle_sscan(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    cursor, options = _parse_cursor(args[2]), _parse_scan_options(args, 3)
+    set_ = _get_collection(keyspace, args[1], Set)
+    cursor, members = (0, []) if set_ is None else set_.scan(cursor, options.count)
+    if options.match is not None:
+        pattern = compile_glob_bytes(options.match)
+        members = [member for member in members if pattern.fullmatch(member)]
+
+    _write_scan_reply(out, cursor, members, len(members))
+
+
+def _handle_zscan(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    cursor, options = _parse_cursor(args[2]), _parse_scan_options(args, 3)
+    zset = _get_collection(keyspace, args[1], ZSet)
+    cursor, items = (0, []) if zset is None else zset.scan(cursor, options.count)
+    if options.match is not None:
+        pattern = compile_glob_bytes(options.match)
+        items = [(member, score) for member, score in items if pattern.fullmatch(member)]
+
+    elements = (element for member, score in items for element in (member, format_score(score)))
+    _write_scan_reply(out, cursor, elements, len(items) * 2)
+
+
+def _handle_memory(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    # MEMORY USAGE key [SAMPLES count]. Values are single objects, so there is
+    # nothing to sample and the count is only validated
+    if args[1].upper() != "USAGE" or len(args) not in {3, 5}:
+        msg = f"ERR unknown subcommand or wrong number of arguments for '{args[1]}'"
+        raise CommandError(msg)
+
+    if len(args) == 5:  # noqa: PLR2004
+        if args[3].upper() != "SAMPLES":
+            msg = "ERR syntax error"
+            raise CommandError(msg)
+        _parse_int(args[4])
+
+    usage = keyspace.memory_usage(args[2])
+    if usage is None:
+        out.write_null()
+    else:
+        out.write_integer(usage)
+
+
+def _handle_object(keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+    if args[1].upper() != "ENCODING" or len(args) != 3:  # noqa: PLR2004
+        msg = f"ERR unknown subcommand or wrong number of arguments for '{args[1]}'"
+        raise CommandError(msg)
+
+    value = keyspace.get(args[2])
+    if value is None:
+        out.write_null()
+    else:
+        out.write_bulk_string(value_encoding(value))
 
-        if command is Command.PING:
-            return _handle_ping()
 
-    msg = f"Command {cmd} is not supported"
-    raise UnsupportedCommandError(msg)
+_ONE_KEY = (1, 1, 1)
+_ALL_KEYS = (1, -1, 1)
+_KEY_VALUE_PAIRS = (1, -1, 2)
+_SUBCOMMAND_KEY = (2, 2, 1)
 
+COMMANDS = (
+    CommandSpec("PING", _handle_ping, -1),
+    CommandSpec("GET", _handle_get, 2, keys=_ONE_KEY),
+    CommandSpec("SET", _handle_set, -3, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("MGET", _handle_mget, -2, keys=_ALL_KEYS),
+    CommandSpec("MSET", _handle_mset, -3, denyoom=True, write=True, keys=_KEY_VALUE_PAIRS),
+    CommandSpec("MSETNX", _handle_msetnx, -3, denyoom=True, write=True, keys=_KEY_VALUE_PAIRS),
+    CommandSpec("DEL", _handle_del, -2, write=True, keys=_ALL_KEYS),
+    CommandSpec("UNLINK", _handle_unlink, -2, write=True, keys=_ALL_KEYS),
+    CommandSpec("EXISTS", _handle_exists, -2, keys=_ALL_KEYS),
+    CommandSpec("INCR", _handle_incr, 2, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("APPEND", _handle_append, 3, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("STRLEN", _handle_strlen, 2, keys=_ONE_KEY),
+    CommandSpec("EXPIRE", _handle_expire, 3, write=True, keys=_ONE_KEY),
+    CommandSpec("PEXPIRE", _handle_pexpire, 3, write=True, keys=_ONE_KEY),
+    CommandSpec("EXPIREAT", _handle_expireat, 3, write=True, keys=_ONE_KEY),
+    CommandSpec("PEXPIREAT", _handle_pexpireat, 3, write=True, keys=_ONE_KEY),
+    CommandSpec("TTL", _handle_ttl, 2, keys=_ONE_KEY),
+    CommandSpec("PTTL", _handle_pttl, 2, keys=_ONE_KEY),
+    CommandSpec("PERSIST", _handle_persist, 2, write=True, keys=_ONE_KEY),
+    CommandSpec("TYPE", _handle_type, 2, keys=_ONE_KEY),
+    CommandSpec("HSET", _handle_hset, -4, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("HGET", _handle_hget, 3, keys=_ONE_KEY),
+    CommandSpec("HGETALL", _handle_hgetall, 2, keys=_ONE_KEY),
+    CommandSpec("HDEL", _handle_hdel, -3, write=True, keys=_ONE_KEY),
+    CommandSpec("HLEN", _handle_hlen, 2, keys=_ONE_KEY),
+    CommandSpec("LPUSH", _handle_lpush, -3, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("RPUSH", _handle_rpush, -3, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("LPOP", _handle_lpop, -2, write=True, keys=_ONE_KEY),
+    CommandSpec("RPOP", _handle_rpop, -2, write=True, keys=_ONE_KEY),
+    CommandSpec("LRANGE", _handle_lrange, 4, keys=_ONE_KEY),
+    CommandSpec("LINDEX", _handle_lindex, 3, keys=_ONE_KEY),
+    CommandSpec("LLEN", _handle_llen, 2, keys=_ONE_KEY),
+    CommandSpec("SADD", _handle_sadd, -3, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("SREM", _handle_srem, -3, write=True, keys=_ONE_KEY),
+    CommandSpec("SISMEMBER", _handle_sismember, 3, keys=_ONE_KEY),
+    CommandSpec("SMEMBERS", _handle_smembers, 2, keys=_ONE_KEY),
+    CommandSpec("SCARD", _handle_scard, 2, keys=_ONE_KEY),
+    CommandSpec("ZADD", _handle_zadd, -4, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("ZINCRBY", _handle_zincrby, 4, denyoom=True, write=True, keys=_ONE_KEY),
+    CommandSpec("ZSCORE", _handle_zscore, 3, keys=_ONE_KEY),
+    CommandSpec("ZRANK", _handle_zrank, 3, keys=_ONE_KEY),
+    CommandSpec("ZREVRANK", _handle_zrevrank, 3, keys=_ONE_KEY),
+    CommandSpec("ZRANGE", _handle_zrange, -4, keys=_ONE_KEY),
+    CommandSpec("ZRANGEBYSCORE", _handle_zrangebyscore, -4, keys=_ONE_KEY),
+    CommandSpec("ZREM", _handle_zrem, -3, write=True, keys=_ONE_KEY),
+    CommandSpec("ZCARD", _handle_zcard, 2, keys=_ONE_KEY),
+    CommandSpec("SCAN", _handle_scan, -2),
+    CommandSpec("HSCAN", _handle_hscan, -3, keys=_ONE_KEY),
+    CommandSpec("SSCAN", _handle_sscan, -3, keys=_ONE_KEY),
+    CommandSpec("ZSCAN", _handle_zscan, -3, keys=_ONE_KEY),
+    CommandSpec("MEMORY", _handle_memory, -2, keys=_SUBCOMMAND_KEY),
+    CommandSpec("OBJECT", _handle_object, -2, keys=_SUBCOMMAND_KEY),
+)
 
-def _handle_ping() -> str:
-    return "PONG"
+CommandTable = Mapping[str, CommandSpec]
+COMMAND_TABLE: CommandTable = build_command_table(COMMANDS)
@@ -0,0 +1,141 @@
+import re
+from dataclasses import dataclass
+
+from src.whodis.aof import AppendFsync
+from src.whodis.datatypes import EncodingLimits
+from src.whodis.eviction import EvictionPolicy
+
+
+@dataclass(frozen=True)
+class OutputBufferLimit:
+    # As Redis's client-output-buffer-limit: a client whose unsent replies
+    # exceed the hard limit, or stay over the soft limit for soft_seconds, is
+    # disconnected. Zero disables a limit
+    hard: int = 0
+    soft: int = 0
+    soft_seconds: int = 0
+
+
+@dataclass
+class Config:
+    # Bytes of memory for keys and values; 0 means no limit
+    maxmemory: int = 0
+    maxmemory_policy: EvictionPolicy = EvictionPolicy.NOEVICTION
+    maxmemory_samples: int = 5
+    appendonly: bool = False
+    appendfilename: str = "appendonly.aof"
+    appendfsync: AppendFsync = AppendFsync.EVERYSEC
+    # The AOF is rewritten once it has grown by this percentage since the last
+    # rewrite, if it is at least the minimum size; a percentage of 0 disables it
+    auto_aof_rewrite_percentage: int = 100
+    auto_aof_rewrite_min_size: int = 64 * 1024 * 1024
+    dbfilename: str = "dump.wdb"
+    # A snapshot is saved in the background once both the seconds and the
+    # number of changes in any (seconds, changes) pair have passed
+    save: tuple[tuple[int, int], ...] = ()
+    # Per-command latency histograms, reported by INFO latencystats
+    latency_tracking: bool = True
+    # Commands taking longer than this many microseconds are added to the slow
+    # log, which keeps the most recent slowlog_max_len; negative disables it
+    slowlog_log_slower_than: int = 10_000
+    slowlog_max_len: int = 128
+    # Serves metrics in the Prometheus text format over HTTP when set
+    metrics_port: int | None = None
+    client_output_buffer_limit: OutputBufferLimit = OutputBufferLimit(
+        hard=256 * 1024 * 1024,
+        soft=64 * 1024 * 1024,
+        soft_seconds=60,
+    )
+    # Applies instead while a client is subscribed to channels or patterns, as
+    # Redis's pubsub class, so a subscriber that can't keep up is dropped
+    # rather than buffering messages without bound
+    client_output_buffer_limit_pubsub: OutputBufferLimit = OutputBufferLimit(
+        hard=32 * 1024 * 1024,
+        soft=8 * 1024 * 1024,
+        soft_seconds=60,
+    )
+    # Applies instead to replicas once they have been sent a snapshot, as
+    # Redis's replica class
+    client_output_buffer_limit_replica: OutputBufferLimit = OutputBufferLimit(
+        hard=256 * 1024 * 1024,
+        soft=64 * 1024 * 1024,
+        soft_seconds=60,
+    )
+    # Starts as a replica of this (host, port), as Redis's replicaof
+    replicaof: tuple[str, int] | None = None
+    # Bytes of the replication stream kept so a replica that reconnects can
+    # carry on from where it was rather than being sent a full snapshot
+    repl_backlog_size: int = 1024 * 1024
+    # Seconds without hearing from the other end after which a replication
+    # link is dropped
+    repl_timeout: int = 60
+    # Also serves clients on this Unix socket when set, as Redis's unixsocket,
+    # with its permissions set to unixsocketperm if given
+    unixsocket: str | None = None
+    unixsocketperm: int | None = None
+    # Connections the kernel queues until they are accepted, as Redis's
+    # tcp-backlog; it may be capped by net.core.somaxconn
+    tcp_backlog: int = 511
+    # Seconds a TCP connection is idle before keepalive probes are sent, so
+    # peers that have gone away without closing are noticed; 0 disables them
+    tcp_keepalive: int = 300
+    # Connections beyond this many clients are refused
+    maxclients: int = 10_000
+    # Seconds after which a client that has sent nothing is closed; 0 never.
+    # Subscribed clients and replicas are exempt, as in Redis
+    timeout: int = 0
+    # Longest bulk string accepted in a request, as Redis's proto-max-bulk-len;
+    # a client sending a longer one is disconnected before it is read
+    proto_max_bulk_len: int = 512 * 1024 * 1024
+    encoding_limits: EncodingLimits = EncodingLimits()  # noqa: RUF009
+
+
+_MEMORY_UNITS = {
+    "": 1,
+    "b": 1,
+    "k": 1000,
+    "kb": 1024,
+    "m": 1000**2,
+    "mb": 1024**2,
+    "g": 1000**3,
+    "gb": 1024**3,
+}
+_MEMORY_PATTERN = re.compile(r"(\d+)([a-z]*)")
+
+
+def parse_memory(value: str) -> int:
+    # Accepts sizes as redis.conf does, e.g. 100mb, 1gb or a number of bytes
+    match = _MEMORY_PATTERN.fullmatch(value.strip().lower())
+    if match is None or match.group(2) not in _MEMORY_UNITS:
+        msg = f"Invalid memory size: {value!r}"
+        raise ValueError(msg)
+
+    return int(match.group(1)) * _MEMORY_UNITS[match.group(2)]
+
+
+def parse_save_points(value: str) -> tuple[tuple[int, int], ...]:
+    # Parses save points as redis.conf does, e.g. "3600 1 300 100"
+    numbers = value.split()
+    if len(numbers) % 2 or not all(number.isdigit() for number in numbers):
+        msg = f"Invalid save points: {value!r}"
+        raise ValueError(msg)
+
+    return tuple((int(seconds), int(changes)) for seconds, changes in zip(numbers[::2], numbers[1::2], strict=True))
+
+
+def parse_output_buffer_limit(value: str) -> OutputBufferLimit:
+    # Parses a limit as redis.conf does, without the client class, e.g.
+    # "256mb 64mb 60"
+    parts = value.split()
+    try:
+        hard, soft, soft_seconds = parts
+        limit = OutputBufferLimit(parse_memory(hard), parse_memory(soft), int(soft_seconds))
+    except ValueError as e:
+        msg = f"Invalid output buffer limit: {value!r}"
+        raise ValueError(msg) from e
+
+    if limit.soft_seconds < 0:
+        msg = f"Invalid output buffer limit: {value!r}"
+        raise ValueError(msg)
+
+    return limit
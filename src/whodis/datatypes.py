@@ -0,0 +1,796 @@
+import bisect
+import itertools
+import random
+import sys
+from array import array
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping
+from dataclasses import dataclass
+from typing import cast
+
+# Redis keeps integer values within a signed 64-bit range
+INT_MIN = -(2**63)
+INT_MAX = 2**63 - 1
+_MAX_INT_LENGTH = len(str(INT_MIN))
+_INT_PREFIXES = frozenset(b"-0123456789"[i : i + 1] for i in range(11))
+
+# The size of an empty list, charged for each chunk of a quicklist
+_CHUNK_OVERHEAD = sys.getsizeof([])
+_FLOAT_SIZE = sys.getsizeof(0.0)
+
+# As Redis's ZSKIPLIST_MAXLEVEL; each level holds a quarter of the nodes of the
+# one below, as ZSKIPLIST_P
+_SKIPLIST_MAX_LEVEL = 32
+
+
+@dataclass(frozen=True)
+class EncodingLimits:
+    # As Redis's *-max-listpack-* and set-max-intset-entries settings: small
+    # collections are kept in compact encodings, and converted to hash tables
+    # once they pass either limit. Lists are kept in chunks of at most
+    # list_max_listpack_size elements
+    hash_max_listpack_entries: int = 128
+    hash_max_listpack_value: int = 64
+    set_max_intset_entries: int = 512
+    set_max_listpack_entries: int = 128
+    set_max_listpack_value: int = 64
+    list_max_listpack_size: int = 128
+    zset_max_listpack_entries: int = 128
+    zset_max_listpack_value: int = 64
+
+
+def parse_int64(data: bytes) -> int | None:
+    # The integer data holds in canonical form, if it fits in 64 bits
+    if len(data) > _MAX_INT_LENGTH or data[:1] not in _INT_PREFIXES:
+        return None
+
+    try:
+        number = int(data)
+    except ValueError:
+        return None
+
+    # int() is more lenient than Redis (whitespace, underscores, leading zeros)
+    if INT_MIN <= number <= INT_MAX and b"%d" % number == data:
+        return number
+
+    return None
+
+
+def format_score(score: float) -> bytes:
+    # As Redis replies with scores: integral ones without a fractional part,
+    # others in the shortest form that reads back as the same float
+    if score.is_integer() and abs(score) < 2**53:
+        return b"%d" % score
+
+    return repr(score).encode()
+
+
+def scan_positions[K](items: list[K], cursor: int, count: int) -> tuple[int, list[K]]:
+    # One step of a SCAN over count positions of a list whose elements only
+    # ever move to lower positions, such as one kept dense by swapping the last
+    # element into removed slots. The cursor is the number of positions still
+    # to visit, which are visited from the end down, so removals and additions
+    # only move visited elements below the cursor (to be returned again) and
+    # never unvisited ones above it: elements present for the whole scan are
+    # returned at least once. A cursor of 0 starts a scan, and is returned
+    # once it is complete
+    size = len(items)
+    start = size if cursor == 0 else min(cursor, size)
+    stop = max(start - count, 0)
+    return stop, items[stop:start][::-1]
+
+
+class _ScanOrder:
+    # The members of a hash table, in the order they were added, as a list
+    # that SCAN can index, so each step costs O(COUNT) however far its cursor
+    # has got. Removed members are left in place, and skipped, until they
+    # outnumber the rest, when the list is rebuilt from the table. As the
+    # table keeps the same order, that only moves members to lower positions
+    __slots__ = ("_removed", "members")
+
+    def __init__(self, members: Iterable[bytes]) -> None:
+        self.members = list(members)
+        self._removed = 0
+
+    def add(self, member: bytes) -> None:
+        # Called for members new to the table
+        self.members.append(member)
+
+    def remove(self, table: Mapping[bytes, object]) -> None:
+        self._removed += 1
+        if self._removed > len(table):
+            self.members = list(table)
+            self._removed = 0
+
+    def scan(self, table: Mapping[bytes, object], cursor: int, count: int) -> tuple[int, list[bytes]]:
+        cursor, members = scan_positions(self.members, cursor, count)
+        return cursor, [member for member in members if member in table]
+
+    def memory_usage(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self.members)
+
+
+def _find_field(items: list[bytes], field: bytes) -> int:
+    # The index of field among the even positions of a flat field/value list,
+    # or -1. list.index does the comparisons in C, which beats a Python loop
+    start = 0
+    while True:
+        try:
+            i = items.index(field, start)
+        except ValueError:
+            return -1
+
+        if i % 2 == 0:
+            return i
+        start = i + 1
+
+
+class Hash:
+    # A listpack while small, as in Redis: here a flat list of alternating
+    # fields and values, searched linearly, which costs a fraction of a dict.
+    # Converted to a dict once it passes either limit, and never back
+    __slots__ = ("_items", "_order", "_payload")
+
+    def __init__(self) -> None:
+        self._items: list[bytes] | dict[bytes, bytes] = []
+        # Positions of the dict's fields for HSCAN, once it is one
+        self._order: _ScanOrder | None = None
+        # Bytes used by the fields and values themselves
+        self._payload = 0
+
+    def __len__(self) -> int:
+        items = self._items
+        return len(items) // 2 if isinstance(items, list) else len(items)
+
+    @property
+    def encoding(self) -> str:
+        return "listpack" if isinstance(self._items, list) else "hashtable"
+
+    def get(self, field: bytes) -> bytes | None:
+        items = self._items
+        if isinstance(items, dict):
+            return items.get(field)
+
+        i = _find_field(items, field)
+        return None if i < 0 else items[i + 1]
+
+    def set(self, field: bytes, value: bytes, limits: EncodingLimits) -> bool:
+        # Returns whether the field is new
+        items = self._items
+        if isinstance(items, list):
+            if len(value) > limits.hash_max_listpack_value or len(field) > limits.hash_max_listpack_value:
+                items = self._convert(items)
+            else:
+                i = _find_field(items, field)
+                if i >= 0:
+                    self._payload += sys.getsizeof(value) - sys.getsizeof(items[i + 1])
+                    items[i + 1] = value
+                    return False
+
+                if len(items) // 2 < limits.hash_max_listpack_entries:
+                    items += (field, value)
+                    self._payload += sys.getsizeof(field) + sys.getsizeof(value)
+                    return True
+
+                items = self._convert(items)
+
+        old = items.get(field)
+        items[field] = value
+        if old is None:
+            cast("_ScanOrder", self._order).add(field)
+            self._payload += sys.getsizeof(field) + sys.getsizeof(value)
+            return True
+
+        self._payload += sys.getsizeof(value) - sys.getsizeof(old)
+        return False
+
+    def delete(self, field: bytes) -> bool:
+        items = self._items
+        if isinstance(items, dict):
+            value = items.pop(field, None)
+            if value is None:
+                return False
+            cast("_ScanOrder", self._order).remove(items)
+        else:
+            i = _find_field(items, field)
+            if i < 0:
+                return False
+            value = items[i + 1]
+            del items[i : i + 2]
+
+        self._payload -= sys.getsizeof(field) + sys.getsizeof(value)
+        return True
+
+    def items(self) -> Iterator[tuple[bytes, bytes]]:
+        items = self._items
+        if isinstance(items, dict):
+            return iter(items.items())
+
+        return zip(items[::2], items[1::2], strict=True)
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[tuple[bytes, bytes]]]:
+        items = self._items
+        if isinstance(items, dict):
+            cursor, fields = cast("_ScanOrder", self._order).scan(items, cursor, count)
+            return cursor, [(field, items[field]) for field in fields]
+
+        return 0, list(self.items())
+
+    def memory_usage(self) -> int:
+        order = 0 if self._order is None else self._order.memory_usage()
+        return sys.getsizeof(self) + sys.getsizeof(self._items) + order + self._payload
+
+    def _convert(self, items: list[bytes]) -> dict[bytes, bytes]:
+        converted = self._items = dict(zip(items[::2], items[1::2], strict=True))
+        self._order = _ScanOrder(converted)
+        return converted
+
+
+class Set:
+    # An intset while every member is an integer (a sorted array of 64-bit
+    # integers, binary searched, with no object per member), or else a
+    # listpack while small, as in Redis; converted to a hash table once it
+    # passes the limits for either, and never back. The hash table is a dict
+    # with None values, as Redis's is, whose insertion order (unlike a set's)
+    # its positions for SSCAN are kept in
+    __slots__ = ("_members", "_order", "_payload")
+
+    def __init__(self) -> None:
+        self._members: array[int] | list[bytes] | dict[bytes, None] = array("q")
+        # Positions of the hash table's members for SSCAN, once it is one
+        self._order: _ScanOrder | None = None
+        # Bytes used by the members themselves, when they are objects
+        self._payload = 0
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __iter__(self) -> Iterator[bytes]:
+        members = self._members
+        if isinstance(members, array):
+            return (b"%d" % member for member in members)
+
+        return iter(members)
+
+    @property
+    def encoding(self) -> str:
+        members = self._members
+        if isinstance(members, array):
+            return "intset"
+
+        return "listpack" if isinstance(members, list) else "hashtable"
+
+    def __contains__(self, member: bytes) -> bool:
+        members = self._members
+        if isinstance(members, array):
+            number = parse_int64(member)
+            if number is None:
+                return False
+
+            i = bisect.bisect_left(members, number)
+            return i < len(members) and members[i] == number
+
+        return member in members
+
+    def add(self, member: bytes, limits: EncodingLimits) -> bool:
+        # Returns whether the member is new
+        members = self._members
+        if isinstance(members, array):
+            number = parse_int64(member)
+            if number is not None:
+                i = bisect.bisect_left(members, number)
+                if i < len(members) and members[i] == number:
+                    return False
+
+                if len(members) < limits.set_max_intset_entries:
+                    members.insert(i, number)
+                    return True
+
+            members = self._convert(len(members) + 1, len(member), limits)
+
+        if isinstance(members, list):
+            if member in members:
+                return False
+
+            if len(members) < limits.set_max_listpack_entries and len(member) <= limits.set_max_listpack_value:
+                members.append(member)
+                self._payload += sys.getsizeof(member)
+                return True
+
+            members = self._to_hashtable(members)
+
+        if member in members:
+            return False
+
+        members[member] = None
+        cast("_ScanOrder", self._order).add(member)
+        self._payload += sys.getsizeof(member)
+        return True
+
+    def remove(self, member: bytes) -> bool:
+        members = self._members
+        if isinstance(members, array):
+            number = parse_int64(member)
+            if number is None:
+                return False
+
+            i = bisect.bisect_left(members, number)
+            if i == len(members) or members[i] != number:
+                return False
+
+            del members[i]
+            return True
+
+        if member not in members:
+            return False
+
+        if isinstance(members, list):
+            members.remove(member)
+        else:
+            del members[member]
+            cast("_ScanOrder", self._order).remove(members)
+        self._payload -= sys.getsizeof(member)
+        return True
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[bytes]]:
+        members = self._members
+        if isinstance(members, dict):
+            return cast("_ScanOrder", self._order).scan(members, cursor, count)
+
+        return 0, list(self)
+
+    def memory_usage(self) -> int:
+        order = 0 if self._order is None else self._order.memory_usage()
+        return sys.getsizeof(self) + sys.getsizeof(self._members) + order + self._payload
+
+    def _convert(self, size: int, member_length: int, limits: EncodingLimits) -> list[bytes] | dict[bytes, None]:
+        # Converts an intset that is about to take a member it can't hold
+        members = list(self)
+        self._payload = sum(map(sys.getsizeof, members))
+        if size > limits.set_max_listpack_entries or member_length > limits.set_max_listpack_value:
+            return self._to_hashtable(members)
+
+        self._members = members
+        return members
+
+    def _to_hashtable(self, members: list[bytes]) -> dict[bytes, None]:
+        converted = self._members = dict.fromkeys(members)
+        self._order = _ScanOrder(converted)
+        return converted
+
+
+class List:
+    # A quicklist, as in Redis: a deque of listpacks (here, Python lists) of at
+    # most list_max_listpack_size elements. Pushes and pops at either end only
+    # touch the chunk there, and LINDEX and LRANGE skip whole chunks to reach
+    # their elements rather than copying the list
+    __slots__ = ("_chunks", "_len", "_payload")
+
+    def __init__(self) -> None:
+        self._chunks: deque[list[bytes]] = deque()
+        self._len = 0
+        # Bytes used by the elements themselves
+        self._payload = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[bytes]:
+        return itertools.chain.from_iterable(self._chunks)
+
+    @property
+    def encoding(self) -> str:
+        # Small enough to be a single chunk
+        return "listpack" if len(self._chunks) <= 1 else "quicklist"
+
+    def push_left(self, elements: list[bytes], limits: EncodingLimits) -> None:
+        chunks = self._chunks
+        for element in elements:
+            if not chunks or len(chunks[0]) >= limits.list_max_listpack_size:
+                chunks.appendleft([])
+            chunks[0].insert(0, element)
+            self._payload += sys.getsizeof(element)
+
+        self._len += len(elements)
+
+    def push_right(self, elements: list[bytes], limits: EncodingLimits) -> None:
+        chunks = self._chunks
+        for element in elements:
+            if not chunks or len(chunks[-1]) >= limits.list_max_listpack_size:
+                chunks.append([])
+            chunks[-1].append(element)
+            self._payload += sys.getsizeof(element)
+
+        self._len += len(elements)
+
+    def pop_left(self, count: int) -> list[bytes]:
+        chunks = self._chunks
+        popped: list[bytes] = []
+        while chunks and len(popped) < count:
+            chunk = chunks[0]
+            taken = count - len(popped)
+            popped += chunk[:taken]
+            del chunk[:taken]
+            if not chunk:
+                chunks.popleft()
+
+        self._removed(popped)
+        return popped
+
+    def pop_right(self, count: int) -> list[bytes]:
+        chunks = self._chunks
+        popped: list[bytes] = []
+        while chunks and len(popped) < count:
+            chunk = chunks[-1]
+            taken = min(count - len(popped), len(chunk))
+            popped += reversed(chunk[-taken:])
+            del chunk[-taken:]
+            if not chunk:
+                chunks.pop()
+
+        self._removed(popped)
+        return popped
+
+    def index(self, index: int) -> bytes | None:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            return None
+
+        # Walks from whichever end is nearer, a chunk at a time
+        if index < self._len // 2:
+            for chunk in self._chunks:
+                if index < len(chunk):
+                    return chunk[index]
+                index -= len(chunk)
+        else:
+            index = self._len - 1 - index
+            for chunk in reversed(self._chunks):
+                if index < len(chunk):
+                    return chunk[-1 - index]
+                index -= len(chunk)
+
+        return None
+
+    def range(self, start: int, stop: int) -> list[bytes]:
+        # Elements start to stop inclusive, which must be within the list
+        elements: list[bytes] = []
+        offset = 0
+        for chunk in self._chunks:
+            end = offset + len(chunk)
+            if end > start:
+                elements += chunk[max(start - offset, 0) : stop + 1 - offset]
+                if end > stop:
+                    break
+            offset = end
+
+        return elements
+
+    def memory_usage(self) -> int:
+        # Each chunk is charged as an empty list plus a pointer per element
+        chunks = len(self._chunks) * _CHUNK_OVERHEAD + self._len * 8
+        return sys.getsizeof(self) + sys.getsizeof(self._chunks) + chunks + self._payload
+
+    def _removed(self, elements: list[bytes]) -> None:
+        self._len -= len(elements)
+        self._payload -= sum(map(sys.getsizeof, elements))
+
+
+class _SkiplistNode:
+    __slots__ = ("backward", "forward", "member", "score", "span")
+
+    def __init__(self, level: int, score: float, member: bytes) -> None:
+        self.score = score
+        self.member = member
+        self.backward: _SkiplistNode | None = None
+        self.forward: list[_SkiplistNode | None] = [None] * level
+        # The number of nodes each forward link moves along the bottom level
+        self.span = [0] * level
+
+
+def _random_level() -> int:
+    # Each pair of trailing zero bits adds a level, so a node reaches level n
+    # with probability 1/4**(n-1)
+    bits = random.getrandbits(2 * _SKIPLIST_MAX_LEVEL - 2) | 1 << (2 * _SKIPLIST_MAX_LEVEL - 2)
+    return 1 + ((bits & -bits).bit_length() - 1) // 2
+
+
+class _Skiplist:
+    # Redis's zskiplist: nodes ordered by score and then member, linked forward
+    # on a random number of levels and back on the bottom one. The spans of the
+    # links give a node's rank, and the node at a rank, in O(log n)
+    __slots__ = ("header", "length", "level", "tail")
+
+    def __init__(self) -> None:
+        self.header = _SkiplistNode(_SKIPLIST_MAX_LEVEL, 0.0, b"")
+        self.tail: _SkiplistNode | None = None
+        self.length = 0
+        self.level = 1
+
+    def insert(self, score: float, member: bytes) -> _SkiplistNode:
+        # The member must not already be in the list
+        header = self.header
+        update = [header] * _SKIPLIST_MAX_LEVEL
+        rank = [0] * _SKIPLIST_MAX_LEVEL
+        x = header
+        for i in range(self.level - 1, -1, -1):
+            rank[i] = 0 if i == self.level - 1 else rank[i + 1]
+            while (y := x.forward[i]) is not None and (y.score < score or (y.score == score and y.member < member)):
+                rank[i] += x.span[i]
+                x = y
+            update[i] = x
+
+        level = _random_level()
+        if level > self.level:
+            for i in range(self.level, level):
+                header.span[i] = self.length
+            self.level = level
+
+        node = _SkiplistNode(level, score, member)
+        for i in range(level):
+            previous = update[i]
+            node.forward[i] = previous.forward[i]
+            previous.forward[i] = node
+            node.span[i] = previous.span[i] - (rank[0] - rank[i])
+            previous.span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self.level):
+            update[i].span[i] += 1
+
+        node.backward = None if update[0] is header else update[0]
+        following = node.forward[0]
+        if following is None:
+            self.tail = node
+        else:
+            following.backward = node
+        self.length += 1
+        return node
+
+    def delete(self, node: _SkiplistNode) -> None:
+        score, member = node.score, node.member
+        update = [self.header] * _SKIPLIST_MAX_LEVEL
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (y := x.forward[i]) is not None and (y.score < score or (y.score == score and y.member < member)):
+                x = y
+            update[i] = x
+
+        for i in range(self.level):
+            previous = update[i]
+            if previous.forward[i] is node:
+                previous.span[i] += node.span[i] - 1
+                previous.forward[i] = node.forward[i]
+            else:
+                previous.span[i] -= 1
+
+        following = node.forward[0]
+        if following is None:
+            self.tail = node.backward
+        else:
+            following.backward = node.backward
+        while self.level > 1 and self.header.forward[self.level - 1] is None:
+            self.level -= 1
+        self.length -= 1
+
+    def rank(self, node: _SkiplistNode) -> int:
+        score, member = node.score, node.member
+        rank = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (y := x.forward[i]) is not None and (y.score < score or (y.score == score and y.member <= member)):
+                rank += x.span[i]
+                x = y
+            if x is node:
+                break
+
+        return rank - 1
+
+    def count_below(self, score: float, *, inclusive: bool) -> int:
+        # The number of nodes scoring less than score, or no more if inclusive
+        rank = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (y := x.forward[i]) is not None and (y.score <= score if inclusive else y.score < score):
+                rank += x.span[i]
+                x = y
+
+        return rank
+
+    def node_at(self, rank: int) -> _SkiplistNode | None:
+        traversed = 0
+        x = self.header
+        for i in range(self.level - 1, -1, -1):
+            while (y := x.forward[i]) is not None and traversed + x.span[i] <= rank + 1:
+                traversed += x.span[i]
+                x = y
+            if traversed == rank + 1:
+                return x
+
+        return None
+
+
+def _node_size(node: _SkiplistNode) -> int:
+    return (
+        sys.getsizeof(node)
+        + sys.getsizeof(node.forward)
+        + sys.getsizeof(node.span)
+        + sys.getsizeof(node.member)
+        + _FLOAT_SIZE
+    )
+
+
+class ZSet:
+    # A listpack while small, as in Redis: here parallel lists of scores and
+    # members, kept in order, so lookups by member are a list.index and by
+    # score a bisect. Converted once it passes either limit, and never back,
+    # to a skiplist for order and rank plus a dict from member to node
+    __slots__ = ("_nodes", "_order", "_payload", "_scores", "_skiplist")
+
+    def __init__(self) -> None:
+        self._scores: list[float] = []
+        self._nodes: list[bytes] | dict[bytes, _SkiplistNode] = []
+        self._skiplist: _Skiplist | None = None
+        # Positions of the dict's members for ZSCAN, once it is one
+        self._order: _ScanOrder | None = None
+        # Bytes used by the members and scores themselves, and the nodes
+        self._payload = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def encoding(self) -> str:
+        return "listpack" if self._skiplist is None else "skiplist"
+
+    def score(self, member: bytes) -> float | None:
+        nodes = self._nodes
+        if isinstance(nodes, dict):
+            node = nodes.get(member)
+            return None if node is None else node.score
+
+        try:
+            return self._scores[nodes.index(member)]
+        except ValueError:
+            return None
+
+    def add(self, member: bytes, score: float, limits: EncodingLimits) -> bool:
+        # Adds the member or updates its score. Returns whether it is new
+        nodes = self._nodes
+        if isinstance(nodes, list):
+            if len(member) > limits.zset_max_listpack_value or (
+                len(nodes) >= limits.zset_max_listpack_entries and member not in nodes
+            ):
+                nodes = self._convert(nodes)
+            else:
+                return self._listpack_add(nodes, member, score)
+
+        skiplist = cast("_Skiplist", self._skiplist)
+        node = nodes.get(member)
+        if node is None:
+            node = nodes[member] = skiplist.insert(score, member)
+            cast("_ScanOrder", self._order).add(member)
+            self._payload += _node_size(node)
+            return True
+
+        if node.score == score:
+            return False
+
+        # Updated in place if the node stays in the same position
+        backward, following = node.backward, node.forward[0]
+        if (backward is None or backward.score < score) and (following is None or following.score > score):
+            node.score = score
+            return False
+
+        skiplist.delete(node)
+        self._payload -= _node_size(node)
+        node = nodes[member] = skiplist.insert(score, member)
+        self._payload += _node_size(node)
+        return False
+
+    def remove(self, member: bytes) -> bool:
+        nodes = self._nodes
+        if isinstance(nodes, dict):
+            node = nodes.pop(member, None)
+            if node is None:
+                return False
+
+            cast("_Skiplist", self._skiplist).delete(node)
+            cast("_ScanOrder", self._order).remove(nodes)
+            self._payload -= _node_size(node)
+            return True
+
+        try:
+            i = nodes.index(member)
+        except ValueError:
+            return False
+
+        del nodes[i], self._scores[i]
+        self._payload -= sys.getsizeof(member) + _FLOAT_SIZE
+        return True
+
+    def rank(self, member: bytes) -> int | None:
+        nodes = self._nodes
+        if isinstance(nodes, dict):
+            node = nodes.get(member)
+            return None if node is None else cast("_Skiplist", self._skiplist).rank(node)
+
+        try:
+            return nodes.index(member)
+        except ValueError:
+            return None
+
+    def count_below(self, score: float, *, inclusive: bool) -> int:
+        # The number of members scoring less than score, or no more if inclusive
+        if self._skiplist is not None:
+            return self._skiplist.count_below(score, inclusive=inclusive)
+
+        return (bisect.bisect_right if inclusive else bisect.bisect_left)(self._scores, score)
+
+    def range(self, start: int, count: int) -> Iterator[tuple[bytes, float]]:
+        # Members and scores from rank start on, which must be within the set,
+        # walking the skiplist as they are consumed
+        nodes = self._nodes
+        if isinstance(nodes, list):
+            yield from zip(nodes[start : start + count], self._scores[start : start + count], strict=True)
+            return
+
+        node = cast("_Skiplist", self._skiplist).node_at(start)
+        for _ in range(count):
+            if node is None:
+                return
+            yield node.member, node.score
+            node = node.forward[0]
+
+    def items(self) -> Iterator[tuple[bytes, float]]:
+        return self.range(0, len(self))
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[tuple[bytes, float]]]:
+        nodes = self._nodes
+        if isinstance(nodes, dict):
+            cursor, members = cast("_ScanOrder", self._order).scan(nodes, cursor, count)
+            return cursor, [(member, nodes[member].score) for member in members]
+
+        return 0, list(self.items())
+
+    def memory_usage(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self._nodes) + self._payload
+        if self._skiplist is None:
+            return size + sys.getsizeof(self._scores)
+
+        return size + _node_size(self._skiplist.header) + cast("_ScanOrder", self._order).memory_usage()
+
+    def _listpack_add(self, members: list[bytes], member: bytes, score: float) -> bool:
+        scores = self._scores
+        try:
+            i = members.index(member)
+        except ValueError:
+            new = True
+            self._payload += sys.getsizeof(member) + _FLOAT_SIZE
+        else:
+            if scores[i] == score:
+                return False
+            new = False
+            del members[i], scores[i]
+
+        # Among equal scores, members are in byte order
+        low = bisect.bisect_left(scores, score)
+        high = bisect.bisect_right(scores, score, low)
+        i = bisect.bisect_left(members, member, low, high)
+        members.insert(i, member)
+        scores.insert(i, score)
+        return new
+
+    def _convert(self, members: list[bytes]) -> dict[bytes, _SkiplistNode]:
+        skiplist = self._skiplist = _Skiplist()
+        nodes: dict[bytes, _SkiplistNode] = {}
+        self._payload = 0
+        for member, score in zip(members, self._scores, strict=True):
+            node = nodes[member] = skiplist.insert(score, member)
+            self._payload += _node_size(node)
+
+        self._nodes = nodes
+        self._order = _ScanOrder(nodes)
+        self._scores = []
+        return nodes
+
+
+Collection = Hash | List | Set | ZSet
@@ -1,6 +1,36 @@
+from collections.abc import Callable
 from dataclasses import dataclass
+from typing import cast
 
-from src.whodis.shared import CRLF, InvalidMessageError, RESPDataType
+from src.whodis.shared import (
+    CRLF,
+    BulkLengthError,
+    IncompleteMessageError,
+    InvalidMessageError,
+    LineLengthError,
+    RESPDataType,
+)
+
+Buffer = bytes | bytearray | memoryview
+
+_CRLF = CRLF.encode()
+_CR = b"\r"
+_LF = b"\n"
+
+_ARRAY_PREFIX = ord("*")
+_BULK_PREFIX = ord("$")
+_ERROR_PREFIX = ord("-")
+_NULL_LENGTH = b"-1\r\n"
+_LINE_PREFIXES = frozenset(b"+-:")
+_REPLY_PREFIXES = frozenset(b"+-:$*")
+
+
+# As Redis's PROTO_MBULK_BIG_ARG: bulk strings in requests at least this long
+# are received straight into a buffer of their own
+BIG_BULK_BYTES = 32 * 1024
+# As Redis's PROTO_INLINE_MAX_SIZE: the longest line, such as an array or bulk
+# string header, buffered from a request while waiting for its CRLF
+MAX_LINE_BYTES = 64 * 1024
 
 
 @dataclass(frozen=True)
@@ -9,147 +39,419 @@ class ParseResult:
     bytes_consumed: int
 
 
-def deserialise(msg: str) -> ParseResult:
-    if not msg.endswith(CRLF):
+@dataclass(frozen=True)
+class ErrorReply:
+    message: str
+
+
+# What a client can be sent, which unlike requests includes errors and nulls
+Reply = int | str | ErrorReply | None | list["Reply"]
+
+
+def deserialise(msg: str | Buffer) -> ParseResult:
+    buf = _as_searchable(msg)
+    if buf[-len(_CRLF) :] != _CRLF:
         error = "Message could not be parsed: missing CRLF terminator"
         raise InvalidMessageError(error)
 
-    result = _parse(msg)
+    data, end = _parse(buf, 0)
     # As each _parse_* function must be stream-friendly, they cannot detect if
     # there are trailing bytes (as arrays and bulk strings will contain CRLFs)
-    if result.bytes_consumed != len(msg):
+    if end != len(buf):
         error = "Message could not be parsed: trailing data after message"
         raise InvalidMessageError(error)
 
-    return result
-
-
-def _parse(msg: str) -> ParseResult:
-    match msg[0]:
-        case "*":
-            return _parse_array(msg)
-        case "$":
-            return _parse_bulk_string(msg)
-        case "+":
-            return _parse_simple_string(msg)
-        case ":":
-            return _parse_integer(msg)
-        case _:
-            error = "Message could not be parsed: unsupported data type"
-            raise InvalidMessageError(error)
+    return ParseResult(data=data, bytes_consumed=end)
+
+
+def parse_message(msg: str | Buffer, start: int = 0) -> ParseResult:
+    # Parses the first message at start, leaving any trailing data for the
+    # caller; raises IncompleteMessageError if more data is needed
+    buf = _as_searchable(msg)
+    data, end = _parse(buf, start)
+    return ParseResult(data=data, bytes_consumed=end - start)
 
 
-def _parse_array(msg: str) -> ParseResult:
-    if not msg.startswith("*") or not msg.endswith(CRLF):
-        error = "Message could not be parsed as an array"
+def find_reply_end(buf: bytes | bytearray, start: int = 0) -> int:
+    # Finds where the reply starting at start ends, without decoding it. Unlike
+    # requests, replies may be errors or nulls, so this is used to relay them
+    if start >= len(buf):
+        error = "Message is incomplete: no data"
+        raise IncompleteMessageError(error)
+
+    prefix = buf[start]
+    if prefix not in _REPLY_PREFIXES:
+        error = "Message could not be parsed: unsupported data type"
         raise InvalidMessageError(error)
 
+    prefix_end = _find_prefix_end(buf, start)
+    pos = prefix_end + len(_CRLF)
+    if prefix in _LINE_PREFIXES:
+        return pos
+
     try:
-        prefix_end = msg.index(CRLF)
-        num_elements = int(msg[1:prefix_end])
-    except (ValueError, IndexError) as e:
+        length = int(buf[start + 1 : prefix_end])
+    except ValueError as e:
+        error = "Length could not be determined for reply"
+        raise InvalidMessageError(error) from e
+
+    if prefix == _BULK_PREFIX:
+        end = pos if length < 0 else pos + length + len(_CRLF)
+        if len(buf) < end:
+            error = "Content is incomplete for bulk string"
+            raise IncompleteMessageError(error)
+        return end
+
+    for _ in range(max(length, 0)):
+        pos = find_reply_end(buf, pos)
+
+    return pos
+
+
+def parse_reply(buf: bytes | bytearray, start: int = 0) -> tuple[Reply, int]:
+    # Parses the reply starting at start, returning it with the offset just
+    # past it; raises IncompleteMessageError if more data is needed
+    if start >= len(buf):
+        error = "Message is incomplete: no data"
+        raise IncompleteMessageError(error)
+
+    prefix = buf[start]
+    if prefix == _ERROR_PREFIX:
+        end = _find_prefix_end(buf, start)
+        return ErrorReply(buf[start + 1 : end].decode()), end + len(_CRLF)
+
+    if prefix in {_BULK_PREFIX, _ARRAY_PREFIX} and buf.startswith(_NULL_LENGTH, start + 1):
+        return None, start + 1 + len(_NULL_LENGTH)
+
+    if prefix != _ARRAY_PREFIX:
+        # Anything else is a single value, never a list
+        data, end = _parse(buf, start)
+        return cast("int | str", data), end
+
+    # Elements of arrays may themselves be nulls, as from MGET
+    prefix_end = _find_prefix_end(buf, start)
+    try:
+        num_elements = int(buf[start + 1 : prefix_end])
+    except ValueError as e:
         error = "Number of elements could not be determined for array"
         raise InvalidMessageError(error) from e
 
-    bytes_consumed = prefix_end + len(CRLF)
+    pos = prefix_end + len(_CRLF)
+    elements: list[Reply] = []
+    for _ in range(num_elements):
+        element, pos = parse_reply(buf, pos)
+        elements.append(element)
+
+    return elements, pos
+
+
+def _as_searchable(msg: str | Buffer) -> bytes | bytearray:
+    # The parsers walk a single buffer with an advancing offset and rely on
+    # find(), which memoryview lacks, so it is materialised once up front
+    if isinstance(msg, str):
+        return msg.encode()
+
+    if isinstance(msg, memoryview):
+        return msg.tobytes()
+
+    return msg
+
+
+# Each _parse_* function takes the buffer and the offset of a message's type
+# prefix, and returns the parsed data with the offset just past the message
+def _parse(buf: bytes | bytearray, pos: int) -> tuple[RESPDataType, int]:
+    if pos >= len(buf):
+        error = "Message is incomplete: no data"
+        raise IncompleteMessageError(error)
+
+    parser = _PARSERS.get(buf[pos])
+    if parser is None:
+        error = "Message could not be parsed: unsupported data type"
+        raise InvalidMessageError(error)
+
+    return parser(buf, pos)
+
+
+def _find_prefix_end(buf: bytes | bytearray, pos: int) -> int:
+    prefix_end = buf.find(_CRLF, pos)
+    if prefix_end == -1:
+        error = "Message is incomplete: missing CRLF terminator"
+        raise IncompleteMessageError(error)
+
+    return prefix_end
+
+
+def _parse_array(buf: bytes | bytearray, pos: int) -> tuple[RESPDataType, int]:
+    prefix_end = _find_prefix_end(buf, pos)
+    try:
+        num_elements = int(buf[pos + 1 : prefix_end])
+    except ValueError as e:
+        error = "Number of elements could not be determined for array"
+        raise InvalidMessageError(error) from e
+
+    pos = prefix_end + len(_CRLF)
     array_elements: list[RESPDataType] = []
 
     for _ in range(num_elements):
         # Preferred to catching an IndexError if loop overruns
-        if bytes_consumed >= len(msg):
+        if pos >= len(buf):
             error = "Array has fewer elements than declared"
-            raise InvalidMessageError(error)
+            raise IncompleteMessageError(error)
 
-        parse_result = _parse(msg[bytes_consumed:])
-        array_elements.append(parse_result.data)
-        bytes_consumed += parse_result.bytes_consumed
+        element, pos = _parse(buf, pos)
+        array_elements.append(element)
 
-    if bytes_consumed != len(msg):
-        error = "Message length does not match content for array"
-        raise InvalidMessageError(error)
+    return array_elements, pos
 
-    return ParseResult(
-        data=array_elements,
-        bytes_consumed=bytes_consumed,
-    )
-
-
-def _parse_bulk_string(msg: str) -> ParseResult:
-    if not msg.startswith("$") or not msg.endswith(CRLF):
-        error = "Message could not be parsed as a bulk string"
-        raise InvalidMessageError(error)
 
+def _parse_bulk_string(buf: bytes | bytearray, pos: int) -> tuple[RESPDataType, int]:
+    prefix_end = _find_prefix_end(buf, pos)
     try:
-        prefix_end = msg.index(CRLF)
-        num_chars = int(msg[1:prefix_end])
-    except (ValueError, IndexError) as e:
+        num_bytes = int(buf[pos + 1 : prefix_end])
+    except ValueError as e:
         error = "Content length could not be determined for bulk string"
         raise InvalidMessageError(error) from e
 
     # Don't allow null bulk strings; this isn't RESP3, we're better than that
-    if num_chars < 0:
+    if num_bytes < 0:
         error = "Content length is negative"
         raise InvalidMessageError(error)
 
-    start = prefix_end + len(CRLF)
-    end = start + num_chars
+    start = prefix_end + len(_CRLF)
+    end = start + num_bytes
 
-    bytes_consumed = end + len(CRLF)
-    if len(msg) < bytes_consumed or msg[end:bytes_consumed] != CRLF:
+    next_pos = end + len(_CRLF)
+    if len(buf) < next_pos:
+        error = "Content is incomplete for bulk string"
+        raise IncompleteMessageError(error)
+
+    if buf[end:next_pos] != _CRLF:
         error = "Content length does not match number of bytes"
         raise InvalidMessageError(error)
 
-    value = msg[start:end]
-    return ParseResult(
-        data=value,
-        bytes_consumed=bytes_consumed,
-    )
-
+    return buf[start:end].decode(), next_pos
 
-def _parse_simple_string(msg: str) -> ParseResult:
-    if not msg.startswith("+") or not msg.endswith(CRLF):
-        error = "Message could not be parsed as a simple string"
-        raise InvalidMessageError(error)
 
-    end = msg.index(CRLF)
-    if end == 1:
+def _parse_simple_string(buf: bytes | bytearray, pos: int) -> tuple[RESPDataType, int]:
+    end = _find_prefix_end(buf, pos)
+    start = pos + 1
+    if end == start:
         error = "Content length is zero"
         raise InvalidMessageError(error)
 
-    value = msg[1:end]
-    if "\r" in value or "\n" in value:
+    if buf.find(_CR, start, end) != -1 or buf.find(_LF, start, end) != -1:
         error = "Content contains newline characters"
         raise InvalidMessageError(error)
 
-    bytes_consumed = end + len(CRLF)
+    return buf[start:end].decode(), end + len(_CRLF)
 
-    return ParseResult(
-        data=value,
-        bytes_consumed=bytes_consumed,
-    )
 
-
-def _parse_integer(msg: str) -> ParseResult:
-    if not msg.startswith(":") or not msg.endswith(CRLF):
-        error = "Message could not be parsed as an integer"
-        raise InvalidMessageError(error)
-
-    end = msg.index(CRLF)
-    if end == 1:
+def _parse_integer(buf: bytes | bytearray, pos: int) -> tuple[RESPDataType, int]:
+    end = _find_prefix_end(buf, pos)
+    start = pos + 1
+    if end == start:
         error = "Content length is zero"
         raise InvalidMessageError(error)
 
-    bytes_consumed = end + len(CRLF)
-
     try:
-        value = int(msg[1:end])
+        value = int(buf[start:end])
     except ValueError as e:
         error = "Could not parse: not an integer"
         raise InvalidMessageError(error) from e
 
-    bytes_consumed = end + len(CRLF)
+    return value, end + len(_CRLF)
+
+
+_PARSERS: dict[int, Callable[[bytes | bytearray, int], tuple[RESPDataType, int]]] = {
+    ord("*"): _parse_array,
+    ord("$"): _parse_bulk_string,
+    ord("+"): _parse_simple_string,
+    ord(":"): _parse_integer,
+}
+
+
+class RequestReader:
+    # Parses a client's requests as they arrive, with the transport receiving
+    # into the buffer returned by get_buffer(). As in Redis, a request is an
+    # array of bulk strings, or a single value. A bulk string of at least
+    # BIG_BULK_BYTES is received straight into a buffer of its exact size,
+    # rather than growing the request buffer, and its length is checked
+    # against max_bulk_len before any of it is buffered
+    def __init__(self, read_buffer: bytearray, max_bulk_len: int) -> None:
+        # Shared by the connections on an event loop, each read being copied
+        # out of it before the next
+        self._read_buffer = memoryview(read_buffer)
+        self._max_bulk_len = max_bulk_len
+        self._buffer = bytearray()
+        self._pos = 0
+        # How far past _pos the line there has already been searched for its
+        # CRLF, so each read only searches what it added
+        self._scanned = 0
+        # The array being received, and how many elements it still needs
+        self._args: list[RESPDataType] | None = None
+        self._remaining = 0
+        # A large bulk string being received, and the view of it last handed
+        # to the transport
+        self._bulk: bytearray | None = None
+        self._bulk_filled = 0
+        self._bulk_view: memoryview | None = None
+
+    def get_buffer(self) -> memoryview:
+        if self._bulk is None:
+            return self._read_buffer
+
+        self._bulk_view = memoryview(self._bulk)[self._bulk_filled :]
+        return self._bulk_view
+
+    def buffer_updated(self, nbytes: int) -> None:
+        if self._bulk is None:
+            self._buffer += self._read_buffer[:nbytes]
+        else:
+            self._bulk_filled += nbytes
+
+    def next_request(self) -> RESPDataType | None:
+        # Returns the next complete request, or None once more data is needed
+        if self._args is None and self._pos >= len(self._buffer):
+            self._compact()
+            return None
+
+        try:
+            if self._args is None:
+                if self._buffer[self._pos] != _ARRAY_PREFIX:
+                    return self._read_value()
+                self._read_array_header()
+            args = self._read_elements()
+        except IncompleteMessageError:
+            self._compact()
+            return None
+
+        self._args = None
+        return args
+
+    def _compact(self) -> None:
+        # Drops the requests, and elements of the current one, already read
+        if self._pos:
+            del self._buffer[: self._pos]
+            self._pos = 0
+
+    def _read_value(self) -> RESPDataType:
+        if self._buffer[self._pos] == _BULK_PREFIX:
+            self._bulk_header()
+        else:
+            self._line_end("too big inline request")
+        data, self._pos = _parse(self._buffer, self._pos)
+        return data
+
+    def _line_end(self, too_long: str) -> int:
+        # Returns where the line at the current position ends, refusing it once
+        # it is over MAX_LINE_BYTES without one rather than buffering any more
+        buf, pos = self._buffer, self._pos
+        end = buf.find(_CRLF, pos + self._scanned, pos + MAX_LINE_BYTES)
+        if end != -1:
+            self._scanned = 0
+            return end
+
+        if len(buf) - pos >= MAX_LINE_BYTES:
+            raise LineLengthError(too_long)
+
+        # The last byte may be the CR of a CRLF split across reads
+        self._scanned = max(len(buf) - pos - 1, 0)
+        error = "Message is incomplete: missing CRLF terminator"
+        raise IncompleteMessageError(error)
+
+    def _read_array_header(self) -> None:
+        buf = self._buffer
+        prefix_end = self._line_end("too big mbulk count string")
+        try:
+            num_elements = int(buf[self._pos + 1 : prefix_end])
+        except ValueError as e:
+            error = "Number of elements could not be determined for array"
+            raise InvalidMessageError(error) from e
+
+        self._pos = prefix_end + len(_CRLF)
+        self._args = []
+        self._remaining = max(num_elements, 0)
+
+    def _read_elements(self) -> list[RESPDataType]:
+        args = cast("list[RESPDataType]", self._args)
+        while self._remaining:
+            args.append(self._finish_bulk() if self._bulk is not None else self._read_bulk())
+            self._remaining -= 1
+
+        return args
+
+    def _bulk_header(self) -> tuple[int, int]:
+        # Returns the length of the bulk string at the current position, which
+        # must be within the limit, and where its content starts
+        buf, pos = self._buffer, self._pos
+        prefix_end = self._line_end("too big bulk count string")
+        try:
+            num_bytes = int(buf[pos + 1 : prefix_end])
+        except ValueError as e:
+            error = "Content length could not be determined for bulk string"
+            raise InvalidMessageError(error) from e
+
+        if num_bytes < 0:
+            error = "Content length is negative"
+            raise InvalidMessageError(error)
+
+        if num_bytes > self._max_bulk_len:
+            error = f"Bulk string of {num_bytes} bytes is over the limit of {self._max_bulk_len}"
+            raise BulkLengthError(error)
+
+        return num_bytes, prefix_end + len(_CRLF)
+
+    def _read_bulk(self) -> str:
+        buf, pos = self._buffer, self._pos
+        if pos >= len(buf):
+            error = "Array has fewer elements than declared"
+            raise IncompleteMessageError(error)
+
+        if buf[pos] != _BULK_PREFIX:
+            error = "Request array elements must be bulk strings"
+            raise InvalidMessageError(error)
+
+        num_bytes, start = self._bulk_header()
+        end = start + num_bytes
+        next_pos = end + len(_CRLF)
+        if len(buf) < next_pos:
+            if num_bytes >= BIG_BULK_BYTES:
+                self._start_bulk(start, num_bytes)
+            error = "Content is incomplete for bulk string"
+            raise IncompleteMessageError(error)
+
+        if buf[end:next_pos] != _CRLF:
+            error = "Content length does not match number of bytes"
+            raise InvalidMessageError(error)
+
+        self._pos = next_pos
+        return buf[start:end].decode()
+
+    def _start_bulk(self, start: int, num_bytes: int) -> None:
+        # Moves what has arrived of the bulk string, with its CRLF, into a
+        # buffer that the rest is then received into
+        received = len(self._buffer) - start
+        self._bulk = bytearray(num_bytes + len(_CRLF))
+        self._bulk[:received] = memoryview(self._buffer)[start:]
+        self._bulk_filled = received
+        del self._buffer[start:]
+        self._pos = start
+
+    def _finish_bulk(self) -> str:
+        body = cast("bytearray", self._bulk)
+        if self._bulk_filled < len(body):
+            error = "Content is incomplete for bulk string"
+            raise IncompleteMessageError(error)
+
+        self._bulk = None
+        # The transport still holds the last view, which would otherwise keep
+        # the buffer alive alongside the string decoded from it
+        if self._bulk_view is not None:
+            self._bulk_view.release()
+            self._bulk_view = None
+        if body[-len(_CRLF) :] != _CRLF:
+            error = "Content length does not match number of bytes"
+            raise InvalidMessageError(error)
 
-    return ParseResult(
-        data=value,
-        bytes_consumed=bytes_consumed,
-    )
+        with memoryview(body) as view:
+            return str(view[: -len(_CRLF)], "utf-8")
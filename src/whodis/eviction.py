@@ -0,0 +1,145 @@
+import bisect
+import time
+from collections.abc import Callable
+from enum import StrEnum
+
+from src.whodis.datatypes import EncodingLimits
+from src.whodis.keyspace import Entry, Keyspace
+
+# Candidates carried between evictions, which makes sampled eviction a much
+# closer approximation of true LRU/LFU (as in Redis)
+EVICTION_POOL_SIZE = 16
+
+# Redis's LFU counter: 8 bits, incremented with decreasing probability as it
+# grows, and decremented by one for every minute a key goes unused
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_DECAY_SECONDS = 60
+LFU_COUNTER_MAX = 255
+
+
+class EvictionPolicy(StrEnum):
+    NOEVICTION = "noeviction"
+    ALLKEYS_LRU = "allkeys-lru"
+    ALLKEYS_LFU = "allkeys-lfu"
+    VOLATILE_TTL = "volatile-ttl"
+
+
+class OutOfMemoryError(Exception):
+    pass
+
+
+class EvictingKeyspace(Keyspace):
+    # Enforces maxmemory by evicting keys before commands that may use more
+    # memory. Keys are ranked by sampling rather than by keeping them ordered,
+    # so the only per-key cost is the access field on each entry
+    def __init__(  # noqa: PLR0913
+        self,
+        maxmemory: int,
+        policy: EvictionPolicy,
+        samples: int = 5,
+        clock: Callable[[], float] = time.time,
+        *,
+        encoding_limits: EncodingLimits = EncodingLimits(),  # noqa: B008
+        on_evict: Callable[[str], None] | None = None,
+    ) -> None:
+        super().__init__(clock, encoding_limits)
+        self.maxmemory = maxmemory
+        self.policy = policy
+        self.samples = samples
+        self.evicted_keys = 0
+        # Told of each key evicted, so the deletion can be logged and replicated
+        self._on_evict = on_evict
+        # A logical clock, advanced on every access, orders keys for LRU
+        self._lru_clock = 0
+        # (score, key) pairs, ascending, where a higher score is a better victim
+        self._pool: list[tuple[float, str]] = []
+
+    def perform_evictions(self) -> None:
+        if self.used_memory <= self.maxmemory:
+            return
+
+        if self.policy == EvictionPolicy.NOEVICTION:
+            msg = "Used memory is over maxmemory and the policy is noeviction"
+            raise OutOfMemoryError(msg)
+
+        while self.used_memory > self.maxmemory:
+            key = self._next_victim()
+            if key is None:
+                msg = "Used memory is over maxmemory and there are no keys to evict"
+                raise OutOfMemoryError(msg)
+
+            self._delete(key)
+            self.evicted_keys += 1
+            if self._on_evict is not None:
+                self._on_evict(key)
+
+    def _touch(self, entry: Entry) -> None:
+        if self.policy == EvictionPolicy.ALLKEYS_LRU:
+            self._lru_clock += 1
+            entry.access = self._lru_clock
+        elif self.policy == EvictionPolicy.ALLKEYS_LFU:
+            entry.access = self._lfu_increment(entry.access)
+
+    def _next_victim(self) -> str | None:
+        self._populate_pool()
+        while self._pool:
+            _, key = self._pool.pop()
+            entry = self._data.get(key)
+            # Pooled keys may have been deleted (or persisted) since sampling
+            if entry is not None and (self.policy != EvictionPolicy.VOLATILE_TTL or entry.expire_at is not None):
+                return key
+
+        return None
+
+    def _populate_pool(self) -> None:
+        volatile = self.policy == EvictionPolicy.VOLATILE_TTL
+        pool = self._pool
+        now = self.now_ms()
+        for key, entry in self.sample(self.samples, volatile=volatile):
+            if any(pooled == key for _, pooled in pool):
+                continue
+
+            score = self._score(entry, now)
+            if len(pool) >= EVICTION_POOL_SIZE:
+                if score <= pool[0][0]:
+                    continue
+                pool.pop(0)
+
+            bisect.insort(pool, (score, key))
+
+    def _score(self, entry: Entry, now: int) -> float:
+        # Already expired keys are the best possible victims
+        if entry.expire_at is not None and entry.expire_at <= now:
+            return float("inf")
+
+        if self.policy == EvictionPolicy.ALLKEYS_LRU:
+            return self._lru_clock - entry.access
+
+        if self.policy == EvictionPolicy.ALLKEYS_LFU:
+            return LFU_COUNTER_MAX - self._lfu_decayed(entry.access, self._lfu_minutes())
+
+        # volatile-ttl: the sooner a key would expire, the better a victim
+        return -(entry.expire_at or 0)
+
+    def _lfu_minutes(self) -> int:
+        return int(self._clock() // LFU_DECAY_SECONDS)
+
+    def _lfu_decayed(self, access: int, minutes: int) -> int:
+        # access packs the time of the last decrement (in decay periods) above
+        # an 8-bit counter; zero means the key has never been accessed
+        if access == 0:
+            return LFU_INIT_VAL
+
+        counter = access & LFU_COUNTER_MAX
+        return max(counter - (minutes - (access >> 8)), 0)
+
+    def _lfu_increment(self, access: int) -> int:
+        minutes = self._lfu_minutes()
+        counter = self._lfu_decayed(access, minutes)
+        if counter < LFU_COUNTER_MAX:
+            probability = 1.0 / ((max(counter - LFU_INIT_VAL, 0)) * LFU_LOG_FACTOR + 1)
+            if self._random.random() < probability:
+                counter += 1
+
+        return (minutes << 8) | counter
@@ -0,0 +1,40 @@
+import os
+import signal
+import warnings
+from collections.abc import Callable
+
+
+def fork_child(target: Callable[[], None]) -> int:
+    # Runs target in a forked child, which sees memory as it was at the fork
+    # (copy-on-write) while the parent carries on. The child exits with 0 if
+    # target returns and 1 if it raises, without running any of the parent's
+    # cleanup
+    with warnings.catch_warnings():
+        # Children only read the keyspace and write files, so they don't
+        # depend on locks held by the parent's other threads
+        warnings.simplefilter("ignore", DeprecationWarning)
+        pid = os.fork()
+
+    if pid != 0:
+        return pid
+
+    code = 1
+    try:
+        target()
+        code = 0
+    finally:
+        os._exit(code)
+
+
+def child_exit_code(pid: int) -> int | None:
+    # Returns the child's exit code, or None if it is still running
+    waited, status = os.waitpid(pid, os.WNOHANG)
+    if waited == 0:
+        return None
+
+    return os.waitstatus_to_exitcode(status)
+
+
+def kill_child(pid: int) -> None:
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
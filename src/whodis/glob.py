@@ -0,0 +1,57 @@
+import functools
+import re
+
+
+def _translate(pattern: str) -> str:
+    # Redis's glob-style patterns: * and ? wildcards, [abc], [^abc] and [a-z]
+    # classes, and \ to match the next character literally
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            regex.append(".*")
+        elif c == "?":
+            regex.append(".")
+        elif c == "\\" and i < n:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+        elif c == "[":
+            negate = pattern.startswith("^", i)
+            i += negate
+            members = []
+            # An unterminated class runs to the end of the pattern, as in Redis
+            while i < n and pattern[i] != "]":
+                if pattern[i] == "\\" and i + 1 < n:
+                    i += 1
+                if i + 2 < n and pattern[i + 1] == "-" and pattern[i + 2] != "]":
+                    # Reversed ranges match as if they were the right way round
+                    low, high = sorted((pattern[i], pattern[i + 2]))
+                    members.append(f"{re.escape(low)}-{re.escape(high)}")
+                    i += 3
+                else:
+                    members.append(re.escape(pattern[i]))
+                    i += 1
+            i += 1
+            if members:
+                regex.append(f"[{'^' if negate else ''}{''.join(members)}]")
+            else:
+                # [] matches nothing, and [^] any character
+                regex.append("." if negate else "(?!)")
+        else:
+            regex.append(re.escape(c))
+
+    return "".join(regex)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_glob(pattern: str) -> re.Pattern[str]:
+    # Use fullmatch() to test a string against the pattern
+    return re.compile(_translate(pattern), re.DOTALL)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_glob_bytes(pattern: str) -> re.Pattern[bytes]:
+    # For collection members, which are bytes; ? matches a single byte, as in Redis
+    return re.compile(_translate(pattern).encode(), re.DOTALL)
@@ -0,0 +1,380 @@
+import random
+import sys
+import time
+from collections.abc import Callable, ItemsView
+from dataclasses import dataclass
+from typing import Protocol, runtime_checkable
+
+from src.whodis.datatypes import Collection, EncodingLimits, parse_int64, scan_positions
+from src.whodis.lazyfree import lazyfree, should_free_lazily
+from src.whodis.serialise import SHARED_INTEGERS
+
+# Mirrors Redis's active expiry: keys are sampled in small batches, and a cycle
+# carries on while enough of a batch turns out to be expired
+ACTIVE_EXPIRE_SAMPLE_SIZE = 20
+ACTIVE_EXPIRE_ACCEPTABLE_STALE = 0.1
+ACTIVE_EXPIRE_MAX_SAMPLES = 2_000
+ACTIVE_EXPIRE_TIME_BUDGET = 0.025
+
+# Approximate bytes used by a key's dict slot, entry record and index slots,
+# on top of the key and value objects themselves
+ENTRY_OVERHEAD = 160
+
+# Strings are stored as bytes, or as ints if they are integers in canonical
+# form that fit in 64 bits, as Redis's int encoding. Either is smaller than a str
+String = int | bytes
+Value = String | Collection
+
+# Small integers are shared, as Redis's shared integers, so counters and flags
+# cost no more than their entry
+_SHARED_INTEGERS = tuple(range(SHARED_INTEGERS))
+# The longest string Redis embeds in its object header (the embstr encoding)
+_EMBSTR_MAX_LENGTH = 44
+
+
+def encode_value(value: str | Value) -> Value:
+    if isinstance(value, str):
+        value = value.encode()
+    elif isinstance(value, int):
+        return _SHARED_INTEGERS[value] if 0 <= value < SHARED_INTEGERS else value
+    elif not isinstance(value, bytes):
+        return value
+
+    number = parse_int64(value)
+    if number is None:
+        return value
+
+    return _SHARED_INTEGERS[number] if 0 <= number < SHARED_INTEGERS else number
+
+
+def value_bytes(value: String) -> bytes:
+    return value if isinstance(value, bytes) else b"%d" % value
+
+
+def value_encoding(value: Value) -> str:
+    # As OBJECT ENCODING names Redis's encodings
+    if isinstance(value, int):
+        return "int"
+
+    if isinstance(value, bytes):
+        return "embstr" if len(value) <= _EMBSTR_MAX_LENGTH else "raw"
+
+    return value.encoding
+
+
+def value_type(value: Value) -> str:
+    # As TYPE names Redis's types
+    if isinstance(value, int | bytes):
+        return "string"
+
+    return type(value).__name__.lower()
+
+
+def value_size(value: Value) -> int:
+    if isinstance(value, int):
+        # Shared integers belong to no key in particular
+        return 0 if 0 <= value < SHARED_INTEGERS else sys.getsizeof(value)
+
+    if isinstance(value, bytes):
+        return sys.getsizeof(value)
+
+    return value.memory_usage()
+
+
+def entry_size(key: str, value: Value) -> int:
+    return sys.getsizeof(key) + value_size(value) + ENTRY_OVERHEAD
+
+
+@dataclass(frozen=True)
+class ExpireCycleResult:
+    sampled: int
+    expired: int
+
+
+class Entry:
+    __slots__ = ("access", "expire_at", "pos", "value", "volatile_pos")
+
+    def __init__(self, value: Value, pos: int) -> None:
+        self.value = value
+        # Positions in the dense key lists, which allow O(1) random sampling
+        self.pos = pos
+        self.volatile_pos = -1
+        # Absolute expiry time in milliseconds since the epoch
+        self.expire_at: int | None = None
+        # Recency or frequency information, maintained by eviction policies
+        self.access = 0
+
+
+@runtime_checkable
+class KeyStore(Protocol):
+    # What commands need of a keyspace: operations on the keys they name, and
+    # SCAN. A Keyspace is one, as is a group of shards locked for a command;
+    # whole-keyspace operations such as items and clear aren't part of it
+    encoding_limits: EncodingLimits
+
+    def __contains__(self, key: str) -> bool: ...
+
+    def now_ms(self) -> int: ...
+
+    def get(self, key: str) -> Value | None: ...
+
+    def set(self, key: str, value: str | Value, expire_at: int | None = None, *, keep_ttl: bool = False) -> None: ...
+
+    def collection_changed(self, key: str, value: Collection, old_size: int) -> None: ...
+
+    def delete_many(self, keys: list[str], *, lazy: bool = False) -> int: ...
+
+    def memory_usage(self, key: str) -> int | None: ...
+
+    def get_expire(self, key: str) -> int | None: ...
+
+    def expire(self, key: str, expire_at: int) -> bool: ...
+
+    def persist(self, key: str) -> bool: ...
+
+    def perform_evictions(self) -> None: ...
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[tuple[str, "Entry"]]]: ...
+
+
+class Keyspace:
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.time,
+        encoding_limits: EncodingLimits = EncodingLimits(),  # noqa: B008
+    ) -> None:
+        self._data: dict[str, Entry] = {}
+        self._clock = clock
+        self.encoding_limits = encoding_limits
+        # Every key, and every key with an expiry, is also kept in a dense
+        # list so that keys can be sampled at random
+        self._keys: list[str] = []
+        self._volatile: list[str] = []
+        self._random = random.Random()  # noqa: S311 - sampling, not security
+        self.used_memory = 0
+        # Changes made by commands, used to decide what to persist
+        self.dirty = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: str) -> bool:
+        return self._lookup(key) is not None
+
+    @property
+    def volatile_count(self) -> int:
+        return len(self._volatile)
+
+    def now_ms(self) -> int:
+        return int(self._clock() * 1000)
+
+    def get(self, key: str) -> Value | None:
+        entry = self._lookup(key)
+        return None if entry is None else entry.value
+
+    def set(self, key: str, value: str | Value, expire_at: int | None = None, *, keep_ttl: bool = False) -> None:
+        value = encode_value(value)
+        entry = self._data.get(key)
+        if entry is None:
+            entry = Entry(value, len(self._keys))
+            self._data[key] = entry
+            self._keys.append(key)
+            self.used_memory += sys.getsizeof(key) + ENTRY_OVERHEAD
+        else:
+            self.used_memory -= value_size(entry.value)
+            entry.value = value
+
+        self.used_memory += value_size(value)
+        self.dirty += 1
+        self._touch(entry)
+        if expire_at is not None:
+            self._set_expire(key, entry, expire_at)
+        elif not keep_ttl and entry.expire_at is not None:
+            self._remove_expire(entry)
+
+    def collection_changed(self, key: str, value: Collection, old_size: int) -> None:
+        # Accounts for a change made to a collection in place, given its size
+        # before the change. Collections left empty are deleted, as in Redis
+        self.used_memory += value.memory_usage() - old_size
+        self.dirty += 1
+        if not value:
+            self._delete(key)
+
+    def delete(self, key: str) -> bool:
+        if self._lookup(key) is None:
+            return False
+
+        self._delete(key)
+        self.dirty += 1
+        return True
+
+    def delete_many(self, keys: list[str], *, lazy: bool = False) -> int:
+        # With lazy set, large values are handed to a background thread to be
+        # released, so the caller isn't held up freeing them (UNLINK)
+        deleted = 0
+        for key in keys:
+            if self._lookup(key) is None:
+                continue
+
+            entry = self._delete(key)
+            if lazy and should_free_lazily(entry.value):
+                lazyfree.free(entry.value)
+            deleted += 1
+
+        self.dirty += deleted
+        return deleted
+
+    def clear(self) -> int:
+        # Removes every key, as FLUSHALL ASYNC: the old keys are released on
+        # the background thread
+        removed = len(self._data)
+        if removed:
+            lazyfree.free(self._data)
+        self._data = {}
+        self._keys = []
+        self._volatile = []
+        self.used_memory = 0
+        self.dirty += removed
+        return removed
+
+    def memory_usage(self, key: str) -> int | None:
+        # The bytes a key accounts for in used_memory
+        entry = self._lookup(key)
+        return None if entry is None else entry_size(key, entry.value)
+
+    def get_expire(self, key: str) -> int | None:
+        entry = self._lookup(key)
+        return None if entry is None else entry.expire_at
+
+    def expire(self, key: str, expire_at: int) -> bool:
+        entry = self._lookup(key)
+        if entry is None:
+            return False
+
+        # A deadline that has already passed deletes the key straight away
+        if expire_at <= self.now_ms():
+            self._delete(key)
+        else:
+            self._set_expire(key, entry, expire_at)
+
+        self.dirty += 1
+        return True
+
+    def persist(self, key: str) -> bool:
+        entry = self._lookup(key)
+        if entry is None or entry.expire_at is None:
+            return False
+
+        self._remove_expire(entry)
+        self.dirty += 1
+        return True
+
+    def perform_evictions(self) -> None:
+        # Called before commands that may use more memory; a keyspace without
+        # a memory limit never needs to evict
+        return
+
+    def active_expire_cycle(
+        self,
+        max_samples: int = ACTIVE_EXPIRE_MAX_SAMPLES,
+        time_budget: float = ACTIVE_EXPIRE_TIME_BUDGET,
+    ) -> ExpireCycleResult:
+        # Reclaims expired keys that are never read again. Work is bounded by
+        # both the number of keys sampled and the time spent, so a keyspace
+        # with millions of volatile keys cannot stall the event loop
+        deadline = time.perf_counter() + time_budget
+        now = self.now_ms()
+        sampled = expired = 0
+
+        while self._volatile and sampled < max_samples:
+            batch = min(ACTIVE_EXPIRE_SAMPLE_SIZE, len(self._volatile), max_samples - sampled)
+            batch_expired = 0
+            for _ in range(batch):
+                if not self._volatile:
+                    break
+
+                key = self._volatile[self._random.randrange(len(self._volatile))]
+                expire_at = self._data[key].expire_at
+                if expire_at is not None and expire_at <= now:
+                    self._delete(key)
+                    batch_expired += 1
+
+            sampled += batch
+            expired += batch_expired
+            if batch_expired <= batch * ACTIVE_EXPIRE_ACCEPTABLE_STALE or time.perf_counter() >= deadline:
+                break
+
+        return ExpireCycleResult(sampled=sampled, expired=expired)
+
+    def items(self) -> ItemsView[str, Entry]:
+        # Every key with its entry, including any that have expired but not
+        # yet been removed
+        return self._data.items()
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[tuple[str, Entry]]]:
+        # One step of SCAN, visiting count slots of the dense key list, which
+        # a table resize never reorders. Expired keys are skipped, but left
+        # for the expiry cycle to remove
+        cursor, keys = scan_positions(self._keys, cursor, count)
+        now, data = self.now_ms(), self._data
+        entries = [(key, data[key]) for key in keys]
+        return cursor, [(key, entry) for key, entry in entries if entry.expire_at is None or entry.expire_at > now]
+
+    def sample(self, count: int, *, volatile: bool = False) -> list[tuple[str, Entry]]:
+        # Returns up to count random keys (possibly repeated) with their
+        # entries, without checking whether they have expired
+        keys = self._volatile if volatile else self._keys
+        if not keys:
+            return []
+
+        data, randrange, size = self._data, self._random.randrange, len(keys)
+        return [(key, data[key]) for key in (keys[randrange(size)] for _ in range(count))]
+
+    def _lookup(self, key: str) -> Entry | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        if entry.expire_at is not None and entry.expire_at <= self.now_ms():
+            self._delete(key)
+            return None
+
+        self._touch(entry)
+        return entry
+
+    def _touch(self, entry: Entry) -> None:
+        # Records an access to a key; eviction policies override this
+        pass
+
+    def _delete(self, key: str) -> Entry:
+        entry = self._data.pop(key)
+        if entry.expire_at is not None:
+            self._remove_expire(entry)
+
+        self.used_memory -= entry_size(key, entry.value)
+        # Swap the last key into the removed key's slot
+        last = self._keys.pop()
+        if last != key:
+            self._keys[entry.pos] = last
+            self._data[last].pos = entry.pos
+
+        return entry
+
+    def _set_expire(self, key: str, entry: Entry, expire_at: int) -> None:
+        if entry.expire_at is None:
+            entry.volatile_pos = len(self._volatile)
+            self._volatile.append(key)
+
+        entry.expire_at = expire_at
+
+    def _remove_expire(self, entry: Entry) -> None:
+        entry.expire_at = None
+        # Swap the last volatile key into the removed key's slot. The entry may
+        # already be gone from _data, so it stands in if the last key is its own
+        last = self._volatile.pop()
+        last_entry = self._data.get(last, entry)
+        if last_entry is not entry:
+            self._volatile[entry.volatile_pos] = last
+            last_entry.volatile_pos = entry.volatile_pos
+
+        entry.volatile_pos = -1
@@ -0,0 +1,57 @@
+import queue
+import threading
+
+from src.whodis.datatypes import Hash, List, Set, ZSet
+
+# Values at least this large are released on a background thread by UNLINK;
+# smaller ones are cheaper to free inline than to hand over
+LAZYFREE_THRESHOLD_BYTES = 1024 * 1024
+# As Redis's LAZYFREE_THRESHOLD, for collections
+LAZYFREE_THRESHOLD_ELEMENTS = 64
+
+
+class LazyFreer:
+    def __init__(self) -> None:
+        self._queue: queue.SimpleQueue[object] = queue.SimpleQueue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._thread: threading.Thread | None = None
+        self.freed = 0
+
+    def free(self, value: object) -> None:
+        # The caller must drop its own references for the value to actually be
+        # released on the background thread
+        with self._lock:
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="whodis-lazyfree", daemon=True)
+                self._thread.start()
+
+        self._queue.put(value)
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self) -> None:
+        while True:
+            value = self._queue.get()
+            del value
+            with self._idle:
+                self._pending -= 1
+                self.freed += 1
+                self._idle.notify_all()
+
+
+def should_free_lazily(value: object) -> bool:
+    if isinstance(value, bytes):
+        return len(value) >= LAZYFREE_THRESHOLD_BYTES
+
+    if isinstance(value, Hash | List | Set | ZSet):
+        return len(value) > LAZYFREE_THRESHOLD_ELEMENTS
+
+    return False
+
+
+lazyfree = LazyFreer()
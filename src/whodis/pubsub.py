@@ -0,0 +1,197 @@
+import bisect
+import re
+from collections.abc import Iterator
+from typing import Protocol
+
+from src.whodis.glob import compile_glob
+
+# Characters that end a pattern's literal prefix
+_WILDCARDS = re.compile(r"[*?\[\\]")
+
+
+class Subscriber(Protocol):
+    def deliver(self, frame: bytes) -> None: ...
+
+
+def _bulk(data: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def message_frame(channel: str, message: str) -> bytes:
+    return b"*3\r\n$7\r\nmessage\r\n" + _bulk(channel.encode()) + _bulk(message.encode())
+
+
+def subscription_frame(kind: bytes, name: str | None, count: int) -> bytes:
+    # The reply to each channel or pattern of (P)SUBSCRIBE and (P)UNSUBSCRIBE
+    target = b"$-1\r\n" if name is None else _bulk(name.encode())
+    return b"*3\r\n" + _bulk(kind) + target + b":%d\r\n" % count
+
+
+class _PatternIndex:
+    # Patterns grouped by their literal prefix, the part before the first
+    # wildcard, so a channel is only matched against the patterns whose prefix
+    # it starts with. Lookups probe one slice of the channel per distinct
+    # prefix length in use rather than testing every pattern
+    def __init__(self) -> None:
+        self._by_prefix: dict[str, dict[str, re.Pattern[str]]] = {}
+        # Sorted, with how many prefixes have each length
+        self._lengths: list[int] = []
+        self._length_counts: dict[int, int] = {}
+
+    def add(self, pattern: str) -> None:
+        prefix = _literal_prefix(pattern)
+        group = self._by_prefix.get(prefix)
+        if group is None:
+            group = self._by_prefix[prefix] = {}
+            n = len(prefix)
+            if n not in self._length_counts:
+                self._length_counts[n] = 0
+                bisect.insort(self._lengths, n)
+            self._length_counts[n] += 1
+        group[pattern] = compile_glob(pattern)
+
+    def remove(self, pattern: str) -> None:
+        prefix = _literal_prefix(pattern)
+        group = self._by_prefix[prefix]
+        del group[pattern]
+        if group:
+            return
+
+        del self._by_prefix[prefix]
+        n = len(prefix)
+        self._length_counts[n] -= 1
+        if not self._length_counts[n]:
+            del self._length_counts[n]
+            self._lengths.remove(n)
+
+    def matches(self, channel: str) -> Iterator[str]:
+        by_prefix = self._by_prefix
+        for n in self._lengths:
+            if n > len(channel):
+                break
+            group = by_prefix.get(channel[:n])
+            if group is not None:
+                yield from (pattern for pattern, regex in group.items() if regex.fullmatch(channel))
+
+
+def _literal_prefix(pattern: str) -> str:
+    match = _WILDCARDS.search(pattern)
+    return pattern if match is None else pattern[: match.start()]
+
+
+class PubSub:
+    # Channel and pattern subscriptions, and each subscriber's own, in the
+    # order they were made as UNSUBSCRIBE with no arguments replies in order
+    def __init__(self) -> None:
+        self._channels: dict[str, dict[Subscriber, None]] = {}
+        self._patterns: dict[str, dict[Subscriber, None]] = {}
+        self._index = _PatternIndex()
+        self._client_channels: dict[Subscriber, dict[str, None]] = {}
+        self._client_patterns: dict[Subscriber, dict[str, None]] = {}
+
+    @property
+    def num_channels(self) -> int:
+        return len(self._channels)
+
+    @property
+    def num_patterns(self) -> int:
+        return len(self._patterns)
+
+    def subscription_count(self, client: Subscriber) -> int:
+        return len(self._client_channels.get(client, ())) + len(self._client_patterns.get(client, ()))
+
+    def channels(self, client: Subscriber) -> list[str]:
+        return list(self._client_channels.get(client, ()))
+
+    def patterns(self, client: Subscriber) -> list[str]:
+        return list(self._client_patterns.get(client, ()))
+
+    def active_channels(self) -> list[str]:
+        return list(self._channels)
+
+    def num_subscribers(self, channel: str) -> int:
+        return len(self._channels.get(channel, ()))
+
+    def subscribe(self, client: Subscriber, channel: str) -> bool:
+        # Returns whether the client wasn't already subscribed
+        subscribed = self._client_channels.setdefault(client, {})
+        if channel in subscribed:
+            return False
+
+        subscribed[channel] = None
+        self._channels.setdefault(channel, {})[client] = None
+        return True
+
+    def unsubscribe(self, client: Subscriber, channel: str) -> bool:
+        subscribed = self._client_channels.get(client)
+        if subscribed is None or channel not in subscribed:
+            return False
+
+        del subscribed[channel]
+        if not subscribed:
+            del self._client_channels[client]
+        subscribers = self._channels[channel]
+        del subscribers[client]
+        if not subscribers:
+            del self._channels[channel]
+        return True
+
+    def psubscribe(self, client: Subscriber, pattern: str) -> bool:
+        subscribed = self._client_patterns.setdefault(client, {})
+        if pattern in subscribed:
+            return False
+
+        subscribed[pattern] = None
+        subscribers = self._patterns.get(pattern)
+        if subscribers is None:
+            subscribers = self._patterns[pattern] = {}
+            self._index.add(pattern)
+        subscribers[client] = None
+        return True
+
+    def punsubscribe(self, client: Subscriber, pattern: str) -> bool:
+        subscribed = self._client_patterns.get(client)
+        if subscribed is None or pattern not in subscribed:
+            return False
+
+        del subscribed[pattern]
+        if not subscribed:
+            del self._client_patterns[client]
+        subscribers = self._patterns[pattern]
+        del subscribers[client]
+        if not subscribers:
+            del self._patterns[pattern]
+            self._index.remove(pattern)
+        return True
+
+    def remove(self, client: Subscriber) -> None:
+        # Drops every subscription of a client that has disconnected
+        for channel in self.channels(client):
+            self.unsubscribe(client, channel)
+        for pattern in self.patterns(client):
+            self.punsubscribe(client, pattern)
+
+    def publish(self, channel: str, message: str) -> int:
+        # Each frame is encoded once and the same bytes are queued for every
+        # subscriber. Returns the number of deliveries, counting a client once
+        # per matching subscription as Redis does
+        receivers = 0
+        subscribers = self._channels.get(channel)
+        if subscribers:
+            frame = message_frame(channel, message)
+            for client in subscribers:
+                client.deliver(frame)
+            receivers += len(subscribers)
+
+        if self._patterns:
+            tail = None
+            for pattern in self._index.matches(channel):
+                if tail is None:
+                    tail = _bulk(channel.encode()) + _bulk(message.encode())
+                frame = b"*4\r\n$8\r\npmessage\r\n" + _bulk(pattern.encode()) + tail
+                subscribers = self._patterns[pattern]
+                for client in subscribers:
+                    client.deliver(frame)
+                receivers += len(subscribers)
+
+        return receivers
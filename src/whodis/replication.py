@@ -0,0 +1,634 @@
+import asyncio
+import os
+import secrets
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from enum import Enum, StrEnum, auto
+from typing import Protocol, cast
+
+from src.whodis.commands import CommandError
+from src.whodis.config import OutputBufferLimit
+from src.whodis.deserialise import parse_message
+from src.whodis.serialise import encode_command
+from src.whodis.shared import IncompleteMessageError, InvalidMessageError
+from src.whodis.snapshot import SnapshotError, Snapshotter
+from src.whodis.stats import ServerStats
+
+# A replica acknowledges its offset this often, and a primary with replicas
+# sends a PING through the stream this often, so each can tell the other is
+# still there, as Redis's repl-ping-replica-period
+REPLICA_ACK_INTERVAL = 1.0
+PRIMARY_PING_INTERVAL = 10.0
+# Seconds between attempts to connect to an unreachable primary
+RECONNECT_INTERVAL = 1.0
+
+# A replication ID that matches no other, as Redis uses for replid2
+_NO_REPLID = "0" * 40
+_PING = encode_command(["PING"])
+
+
+def _new_replid() -> str:
+    return secrets.token_hex(20)
+
+
+class ReplicationBacklog:
+    # The most recent bytes of the replication stream in a fixed-size circular
+    # buffer, so a replica that reconnects can be sent just what it missed.
+    # Offsets count bytes of the stream from 1, as Redis's
+    def __init__(self, size: int, offset: int = 0) -> None:
+        self.size = size
+        self._buffer = bytearray(size)
+        # Where the next byte goes
+        self._idx = 0
+        # The offset of the last byte fed, and how many bytes are held
+        self.offset = offset
+        self.histlen = 0
+
+    @property
+    def first_offset(self) -> int:
+        return self.offset - self.histlen + 1
+
+    def feed(self, data: bytes | bytearray) -> None:
+        n = len(data)
+        size = self.size
+        self.offset += n
+        self.histlen = min(self.histlen + n, size)
+        if n >= size:
+            self._buffer[:] = data[n - size :]
+            self._idx = 0
+            return
+
+        end = self._idx + n
+        if end <= size:
+            self._buffer[self._idx : end] = data
+        else:
+            split = size - self._idx
+            self._buffer[self._idx :] = data[:split]
+            self._buffer[: n - split] = data[split:]
+        self._idx = end % size
+
+    def read_from(self, offset: int) -> bytes | None:
+        # The stream from offset to the end, or None if any of it has been
+        # overwritten
+        if not self.first_offset <= offset <= self.offset + 1:
+            return None
+
+        count = self.offset - offset + 1
+        start = (self._idx - count) % self.size
+        if start + count <= self.size:
+            return bytes(self._buffer[start : start + count])
+
+        return bytes(self._buffer[start:]) + bytes(self._buffer[: count - (self.size - start)])
+
+
+class ReplicaConnection(Protocol):
+    # A client connection that a replica has turned into its replication link
+    output_limit: OutputBufferLimit
+    # As announced by REPLCONF listening-port
+    listening_port: int
+
+    @property
+    def closed(self) -> bool: ...
+
+    @property
+    def peer_host(self) -> str: ...
+
+    @property
+    def unsent_bytes(self) -> int: ...
+
+    def deliver(self, frame: bytes) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class ReplicaState(StrEnum):
+    # Waiting for a snapshot to be started, waiting for it to be written, and
+    # receiving the stream, as Redis's wait_bgsave, send_bulk and online
+    WAIT_BGSAVE_START = "wait_bgsave"
+    WAIT_BGSAVE_END = "send_bulk"
+    ONLINE = "online"
+
+
+@dataclass(eq=False)
+class Replica:
+    conn: ReplicaConnection
+    state: ReplicaState
+    ack_offset: int = 0
+    ack_time: float = field(default_factory=time.monotonic)
+    # The stream since the snapshot was taken, sent once the snapshot has been
+    stream: bytearray = field(default_factory=bytearray)
+    # While the snapshot is still in the output buffer, the bytes queued
+    # behind it; output buffer limits only apply once it has been sent
+    queued_after_snapshot: int | None = None
+
+
+class _LinkState(Enum):
+    # Waiting for the replies to REPLCONF and PSYNC
+    HANDSHAKE = auto()
+    # Receiving the snapshot of a full resync
+    TRANSFER = auto()
+    # Receiving the stream of write commands
+    STREAMING = auto()
+
+
+class PrimaryLink(asyncio.Protocol):
+    # A replica's connection to its primary
+    def __init__(self, replication: "Replication") -> None:
+        self._replication = replication
+        self._transport: asyncio.Transport | None = None
+        self._buffer = bytearray()
+        self.state = _LinkState.HANDSHAKE
+        # The handshake's replies still to come, for REPLCONF then PSYNC
+        self._handshake_replies = 2
+        self._full_resync: tuple[str, int] | None = None
+        self._snapshot_size: int | None = None
+        self.last_io = time.monotonic()
+
+    @property
+    def streaming(self) -> bool:
+        return self.state == _LinkState.STREAMING
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = cast("asyncio.Transport", transport)
+        self._transport.write(self._replication.handshake(self))
+
+    def connection_lost(self, exc: Exception | None) -> None:  # noqa: ARG002
+        self._transport = None
+        self._replication.link_lost(self)
+
+    def send(self, data: bytes) -> None:
+        if self._transport is not None:
+            self._transport.write(data)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def data_received(self, data: bytes) -> None:
+        self.last_io = time.monotonic()
+        self._replication.stats.repl_input_bytes += len(data)
+        self._buffer += data
+        try:
+            self._process()
+        except (InvalidMessageError, SnapshotError, ValueError) as e:
+            # The stream cannot be followed after anything unexpected, so the
+            # replica reconnects and resynchronises
+            print(f"Replication link error: {e}")  # noqa: T201
+            self.close()
+
+    def _process(self) -> None:
+        while self._transport is not None:
+            if self.state == _LinkState.HANDSHAKE:
+                line = self._read_line()
+                if line is None:
+                    return
+                self._handshake_reply(line)
+            elif self.state == _LinkState.TRANSFER:
+                if not self._receive_snapshot():
+                    return
+            else:
+                self._receive_stream()
+                return
+
+    def _read_line(self) -> str | None:
+        end = self._buffer.find(b"\r\n")
+        if end < 0:
+            return None
+
+        line = self._buffer[:end].decode()
+        del self._buffer[: end + 2]
+        return line
+
+    def _handshake_reply(self, line: str) -> None:
+        if line.startswith("-"):
+            msg = f"primary refused {'REPLCONF' if self._handshake_replies == 2 else 'PSYNC'}: {line[1:]}"  # noqa: PLR2004
+            raise ValueError(msg)
+
+        self._handshake_replies -= 1
+        if self._handshake_replies:
+            return
+
+        reply = line[1:].split()
+        if reply[0] == "FULLRESYNC":
+            self._full_resync = (reply[1], int(reply[2]))
+            self.state = _LinkState.TRANSFER
+        elif reply[0] == "CONTINUE":
+            self._replication.continued(reply[1] if len(reply) > 1 else None)
+            self.state = _LinkState.STREAMING
+        else:
+            msg = f"unexpected reply to PSYNC: {line}"
+            raise ValueError(msg)
+
+    def _receive_snapshot(self) -> bool:
+        # Returns True once the whole snapshot has arrived and been loaded
+        if self._snapshot_size is None:
+            line = self._read_line()
+            if line is None:
+                return False
+            if not line.startswith("$"):
+                msg = f"unexpected snapshot header: {line}"
+                raise ValueError(msg)
+            self._snapshot_size = int(line[1:])
+
+        size = self._snapshot_size
+        if len(self._buffer) < size or self._full_resync is None:
+            return False
+
+        with memoryview(self._buffer) as view, view[:size] as snapshot:
+            self._replication.full_sync(*self._full_resync, snapshot)
+        del self._buffer[:size]
+        self.state = _LinkState.STREAMING
+        return True
+
+    def _receive_stream(self) -> None:
+        # Commands are applied one at a time, and then passed on together to
+        # this replica's own backlog and replicas
+        buffer = self._buffer
+        pos = 0
+        try:
+            while pos < len(buffer):
+                result = parse_message(buffer, pos)
+                if not isinstance(result.data, list):
+                    msg = f"unexpected data in the replication stream: {result.data!r}"
+                    raise InvalidMessageError(msg)
+                self._replication.apply(cast("list[str]", result.data))
+                pos += result.bytes_consumed
+        except IncompleteMessageError:
+            pass
+        finally:
+            if pos:
+                self._replication.feed(bytes(buffer[:pos]))
+                self._replication.flush()
+                del buffer[:pos]
+
+
+class Replication:
+    # Both sides of replication. As a primary, write commands are fed into a
+    # backlog and to each online replica; a replica that asks to resume from an
+    # offset still in the backlog is sent the rest of it (a partial resync),
+    # and any other is sent a snapshot followed by the stream from when it was
+    # taken (a full resync). As a replica, the stream from the primary is
+    # applied to the keyspace and passed on unchanged to its own replicas, so
+    # offsets are the same all the way down a chain
+    def __init__(  # noqa: PLR0913
+        self,
+        snapshots: Snapshotter,
+        stats: ServerStats,
+        apply: Callable[[list[str]], None],
+        on_full_sync: Callable[[], None],
+        backlog_size: int = 1024 * 1024,
+        timeout: float = 60,
+        replica_output_limit: OutputBufferLimit = OutputBufferLimit(),  # noqa: B008
+    ) -> None:
+        self._snapshots = snapshots
+        self.stats = stats
+        self._apply = apply
+        self._on_full_sync = on_full_sync
+        self.backlog_size = backlog_size
+        self.timeout = timeout
+        self.replica_output_limit = replica_output_limit
+        # The history this server's data belongs to, and the one it belonged to
+        # before it was last promoted, which it can still resume replicas of up
+        # to second_offset, as Redis's replid2
+        self.replid = _new_replid()
+        self.replid2 = _NO_REPLID
+        self.second_offset = -1
+        # Only created once a replica connects, so a server without replicas
+        # doesn't encode its writes
+        self.backlog: ReplicationBacklog | None = None
+        self._replicas: dict[ReplicaConnection, Replica] = {}
+        # The stream fed since the last flush
+        self._outgoing = bytearray()
+        self._last_ping = time.monotonic()
+        # Set when this server is a replica
+        self.primary: tuple[str, int] | None = None
+        self._listening_port = 0
+        self.link: PrimaryLink | None = None
+        self._connecting: asyncio.Task[None] | None = None
+        self._last_connect = 0.0
+        self._link_down_since = time.monotonic()
+        self._last_ack = 0.0
+
+    @property
+    def is_replica(self) -> bool:
+        return self.primary is not None
+
+    @property
+    def offset(self) -> int:
+        return 0 if self.backlog is None else self.backlog.offset
+
+    @property
+    def replicas(self) -> list[Replica]:
+        return list(self._replicas.values())
+
+    def feed(self, entry: bytes) -> None:
+        # Adds to the stream: a write command run here, or part of the stream
+        # from this server's own primary
+        if self.backlog is None:
+            return
+
+        self.backlog.feed(entry)
+        if self._replicas:
+            self._outgoing += entry
+
+    def flush(self) -> None:
+        # Sends what has been fed since the last flush, which the server does
+        # once per event loop iteration, so replicas are sent one write for
+        # many commands. Replicas still waiting for a snapshot to be started
+        # are sent none of it, as the snapshot will include it
+        if not self._outgoing:
+            return
+
+        data = bytes(self._outgoing)
+        self._outgoing = bytearray()
+        for replica in self._replicas.values():
+            if replica.state == ReplicaState.ONLINE:
+                self._send(replica, data)
+            elif replica.state == ReplicaState.WAIT_BGSAVE_END:
+                replica.stream += data
+
+    def psync(self, conn: ReplicaConnection, replid: str, offset: int) -> bytes:
+        # Registers a replica and returns its reply; a full resync is started
+        # by cron(), which sends the reply once the snapshot has been started
+        if self.is_replica and (self.link is None or not self.link.streaming):
+            msg = "NOMASTERLINK Can't SYNC while not connected with my master"
+            raise CommandError(msg)
+
+        # The backlog already holds anything not yet flushed to other replicas
+        self.flush()
+        backlog = self._ensure_backlog()
+        if (replid == self.replid or (replid == self.replid2 and offset <= self.second_offset)) and (
+            missed := backlog.read_from(offset)
+        ) is not None:
+            self.stats.sync_partial_ok += 1
+            replica = Replica(conn, ReplicaState.ONLINE, ack_offset=offset - 1)
+            self._replicas[conn] = replica
+            conn.output_limit = self.replica_output_limit
+            self.stats.repl_output_bytes += len(missed)
+            return b"+CONTINUE %s\r\n%s" % (self.replid.encode(), missed)
+
+        if replid != "?":
+            self.stats.sync_partial_err += 1
+        self.stats.sync_full += 1
+        # No limit applies until the snapshot has been sent
+        conn.output_limit = OutputBufferLimit()
+        self._replicas[conn] = Replica(conn, ReplicaState.WAIT_BGSAVE_START)
+        return b""
+
+    def ack(self, conn: ReplicaConnection, offset: int) -> None:
+        replica = self._replicas.get(conn)
+        if replica is not None:
+            replica.ack_offset = offset
+            replica.ack_time = time.monotonic()
+
+    def replicate(self, host: str, port: int, listening_port: int) -> None:
+        # As REPLICAOF host port. The data and offset kept so far are offered
+        # to the new primary, which may be able to carry on from them
+        self._drop_link()
+        self.primary = (host, port)
+        self._listening_port = listening_port
+        self._link_down_since = time.monotonic()
+        self._disconnect_replicas()
+        self._connect()
+
+    def promote(self) -> None:
+        # As REPLICAOF NO ONE. The data is kept, under a new replication ID;
+        # replicas of the old primary that caught up to the same offset can
+        # still resume from this server with a partial resync
+        if self.primary is None:
+            return
+
+        self._drop_link()
+        self.primary = None
+        self._shift_replid(_new_replid())
+
+    def handshake(self, link: PrimaryLink) -> bytes:
+        # Sent by a replica once connected to its primary
+        self.link = link
+        self._last_ack = time.monotonic()
+        # Offers the data this server already has, which may be enough to
+        # resume from, or asks for a full resync if it has none
+        replid, offset = ("?", -1) if self.backlog is None else (self.replid, self.backlog.offset + 1)
+        return encode_command(["REPLCONF", "listening-port", str(self._listening_port)]) + encode_command(
+            ["PSYNC", replid, str(offset)],
+        )
+
+    def full_sync(self, replid: str, offset: int, snapshot: memoryview) -> None:
+        # Replaces the data with the primary's snapshot. A background save
+        # still running would overwrite the snapshot file with the old data
+        self._disconnect_replicas()
+        self._snapshots.close()
+        path = self._snapshots.path
+        temp = path.with_name(f"temp-sync-{os.getpid()}-{path.name}")
+        temp.write_bytes(snapshot)
+        temp.replace(path)
+        self._snapshots.keyspace.clear()
+        self._snapshots.load()
+
+        self.replid = replid
+        self.replid2 = _NO_REPLID
+        self.second_offset = -1
+        self.backlog = ReplicationBacklog(self.backlog_size, offset)
+        self._on_full_sync()
+
+    def continued(self, replid: str | None) -> None:
+        # A partial resync was accepted; the primary may have a new ID if it
+        # was promoted since
+        if replid is not None and replid != self.replid:
+            self._shift_replid(replid)
+            self._disconnect_replicas()
+
+    def apply(self, cmd: list[str]) -> None:
+        self._apply(cmd)
+
+    def link_lost(self, link: PrimaryLink) -> None:
+        if link is self.link:
+            self.link = None
+            self._link_down_since = time.monotonic()
+
+    def cron(self, *, can_fork: bool) -> None:
+        now = time.monotonic()
+        self._check_replicas(now)
+        if can_fork and any(r.state == ReplicaState.WAIT_BGSAVE_START for r in self._replicas.values()):
+            self._start_sync()
+
+        if self.primary is None:
+            if self._replicas and now - self._last_ping >= PRIMARY_PING_INTERVAL:
+                self._last_ping = now
+                self.feed(_PING)
+                self.flush()
+            return
+
+        link = self.link
+        if link is None:
+            if self._connecting is None and now - self._last_connect >= RECONNECT_INTERVAL:
+                self._connect()
+        elif now - link.last_io > self.timeout:
+            print(f"Timed out waiting for primary {self.primary[0]}:{self.primary[1]}")  # noqa: T201
+            link.close()
+        elif link.streaming and now - self._last_ack >= REPLICA_ACK_INTERVAL:
+            self._last_ack = now
+            link.send(encode_command(["REPLCONF", "ACK", str(self.offset)]))
+
+    def snapshot_finished(self, *, saved: bool) -> None:
+        # Sends a completed snapshot to the replicas waiting for it, followed by
+        # the stream since it was taken
+        self.flush()
+        waiting = [r for r in self._replicas.values() if r.state == ReplicaState.WAIT_BGSAVE_END]
+        if not waiting:
+            return
+
+        if not saved:
+            for replica in waiting:
+                replica.conn.close()
+            return
+
+        snapshot = self._snapshots.path.read_bytes()
+        header = b"$%d\r\n" % len(snapshot)
+        for replica in waiting:
+            replica.state = ReplicaState.ONLINE
+            replica.ack_time = time.monotonic()
+            self._send(replica, header)
+            self._send(replica, snapshot)
+            replica.queued_after_snapshot = 0
+            if replica.stream:
+                self._send(replica, bytes(replica.stream))
+                replica.stream = bytearray()
+
+    def close(self) -> None:
+        self._drop_link()
+        self.primary = None
+
+    def info(self) -> dict[str, object]:
+        # The INFO replication section
+        now = time.monotonic()
+        section: dict[str, object] = {"role": "slave" if self.primary is not None else "master"}
+        if self.primary is not None:
+            link = self.link
+            section["master_host"], section["master_port"] = self.primary
+            section["master_link_status"] = "up" if link is not None and link.streaming else "down"
+            section["master_last_io_seconds_ago"] = -1 if link is None else int(now - link.last_io)
+            section["master_sync_in_progress"] = int(link is not None and not link.streaming)
+            section["slave_repl_offset"] = self.offset
+            if link is None or not link.streaming:
+                section["master_link_down_since_seconds"] = int(now - self._link_down_since)
+            section["slave_read_only"] = 1
+
+        section["connected_slaves"] = len(self._replicas)
+        for i, replica in enumerate(self._replicas.values()):
+            conn = replica.conn
+            section[f"slave{i}"] = (
+                f"ip={conn.peer_host},port={conn.listening_port},state={replica.state},"
+                f"offset={replica.ack_offset},lag={int(now - replica.ack_time)}"
+            )
+        backlog = self.backlog
+        section.update(
+            {
+                "master_replid": self.replid,
+                "master_replid2": self.replid2,
+                "master_repl_offset": self.offset,
+                "second_repl_offset": self.second_offset,
+                "repl_backlog_active": int(backlog is not None),
+                "repl_backlog_size": self.backlog_size,
+                "repl_backlog_first_byte_offset": 0 if backlog is None else backlog.first_offset,
+                "repl_backlog_histlen": 0 if backlog is None else backlog.histlen,
+            },
+        )
+        return section
+
+    def metrics(self) -> dict[str, float]:
+        # Gauges for the Prometheus endpoint. Lag is the furthest behind of the
+        # online replicas, in bytes not yet acknowledged and in seconds since
+        # the last acknowledgement; throughput is the rate of the byte counters
+        now = time.monotonic()
+        online = [r for r in self._replicas.values() if r.state == ReplicaState.ONLINE]
+        gauges: dict[str, float] = {
+            "connected_replicas": len(self._replicas),
+            "repl_offset_bytes": self.offset,
+            "replica_lag_bytes": max((self.offset - r.ack_offset for r in online), default=0),
+            "replica_lag_seconds": max((now - r.ack_time for r in online), default=0),
+        }
+        if self.primary is not None:
+            link = self.link
+            gauges["master_link_up"] = int(link is not None and link.streaming)
+            gauges["master_last_io_seconds"] = -1 if link is None else now - link.last_io
+        return gauges
+
+    def _ensure_backlog(self) -> ReplicationBacklog:
+        if self.backlog is None:
+            self.backlog = ReplicationBacklog(self.backlog_size)
+        return self.backlog
+
+    def _send(self, replica: Replica, data: bytes) -> None:
+        self.stats.repl_output_bytes += len(data)
+        if replica.queued_after_snapshot is not None:
+            replica.queued_after_snapshot += len(data)
+        replica.conn.deliver(data)
+
+    def _start_sync(self) -> None:
+        # Replicas waiting for a full resync share one snapshot, and are sent
+        # the stream from the offset it was taken at
+        self.flush()
+        if not self._snapshots.start_background_save():
+            return
+
+        reply = b"+FULLRESYNC %s %d\r\n" % (self.replid.encode(), self.offset)
+        for replica in self._replicas.values():
+            if replica.state == ReplicaState.WAIT_BGSAVE_START:
+                replica.state = ReplicaState.WAIT_BGSAVE_END
+                replica.ack_offset = self.offset
+                self._send(replica, reply)
+
+    def _check_replicas(self, now: float) -> None:
+        for conn, replica in list(self._replicas.items()):
+            if conn.closed:
+                del self._replicas[conn]
+            elif replica.state == ReplicaState.ONLINE and now - replica.ack_time > self.timeout:
+                print(f"Disconnecting timed out replica {conn.peer_host}:{conn.listening_port}")  # noqa: T201
+                conn.close()
+                del self._replicas[conn]
+            elif replica.queued_after_snapshot is not None and conn.unsent_bytes <= replica.queued_after_snapshot:
+                # The snapshot has been sent, so the usual limit applies
+                replica.queued_after_snapshot = None
+                conn.output_limit = self.replica_output_limit
+
+    def _shift_replid(self, replid: str) -> None:
+        # The old ID stays valid for the offsets it reached
+        self.replid2 = self.replid
+        self.second_offset = self.offset + 1
+        self.replid = replid
+
+    def _connect(self) -> None:
+        if self.primary is None:
+            return
+
+        self._last_connect = time.monotonic()
+        self._connecting = asyncio.get_running_loop().create_task(self._open_link(*self.primary))
+
+    async def _open_link(self, host: str, port: int) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_connection(lambda: PrimaryLink(self), host, port)
+        except OSError as e:
+            print(f"Error connecting to primary {host}:{port}: {e}")  # noqa: T201
+        finally:
+            # Unless this attempt was cancelled and another has replaced it
+            if self._connecting is asyncio.current_task():
+                self._connecting = None
+
+    def _drop_link(self) -> None:
+        if self._connecting is not None:
+            self._connecting.cancel()
+            self._connecting = None
+        if self.link is not None:
+            self.link.close()
+            self.link = None
+
+    def _disconnect_replicas(self) -> None:
+        # Replicas can't follow a change of history, so they reconnect and
+        # resynchronise
+        for conn in self._replicas:
+            conn.close()
+        self._replicas.clear()
+        self._outgoing = bytearray()
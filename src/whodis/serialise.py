@@ -3,6 +3,8 @@ from enum import Enum, auto
 
 from src.whodis.shared import CRLF, RESPDataType
 
+_CRLF = CRLF.encode()
+
 
 class Kind(Enum):
     PROTOCOL = auto()
@@ -21,47 +23,152 @@ class SerialiseError(ValueError):
 
 
 def serialise(data: RESPDataType, kind: Kind = Kind.NON_PROTOCOL) -> SerialiseResult:
-    if isinstance(data, str):
-        if kind == Kind.PROTOCOL:
-            return _serialise_simple_string(data)
-
-        if kind == Kind.NON_PROTOCOL:
-            return _serialise_bulk_string(data)
-
-        return _serialise_error(data)
-
-    if isinstance(data, list):
-        return _serialise_array(data, kind)
-
-    if isinstance(data, int):  # pyright: ignore[reportUnnecessaryIsInstance]
-        return _serialise_integer(data)
+    writer = ReplyWriter()
+    writer.write(data, kind)
+    message = writer.getvalue()
+    return SerialiseResult(message.decode(), len(message))
 
-    error = f"Message could not be serialised: unsupported data {type(data)}"
-    raise SerialiseError(error)
 
+# Replies that never change are encoded once, so the server's hot path can send
+# them without building a new message each time
+OK_REPLY = b"+OK\r\n"
+PONG_REPLY = b"+PONG\r\n"
+NULL_BULK_REPLY = b"$-1\r\n"
+EMPTY_BULK_REPLY = b"$0\r\n\r\n"
+EMPTY_ARRAY_REPLY = b"*0\r\n"
+NULL_ARRAY_REPLY = b"*-1\r\n"
 
-def _serialise_simple_string(data: str) -> SerialiseResult:
-    message = f"+{data}{CRLF}"
-    return SerialiseResult(message, len(message))
+# Mirrors Redis's shared integers, covering counters, lengths and flags
+SHARED_INTEGERS = 10_000
+_INTEGER_REPLIES = tuple(f":{i}{CRLF}".encode() for i in range(SHARED_INTEGERS))
 
+_SIMPLE_STRING_REPLIES = {
+    "OK": OK_REPLY,
+    "PONG": PONG_REPLY,
+}
 
-def _serialise_bulk_string(data: str) -> SerialiseResult:
-    message = f"${len(data)}{CRLF}{data}{CRLF}"
-    return SerialiseResult(message, len(message))
 
+def encode_reply(data: RESPDataType, kind: Kind = Kind.NON_PROTOCOL) -> bytes:
+    if isinstance(data, int) and 0 <= data < SHARED_INTEGERS:
+        return _INTEGER_REPLIES[data]
 
-def _serialise_error(data: str) -> SerialiseResult:
-    message = f"-{data}{CRLF}"
-    return SerialiseResult(message, len(message))
-
-
-def _serialise_array(data: list[RESPDataType], kind: Kind) -> SerialiseResult:
-    parts = [f"*{len(data)}{CRLF}"]
-    parts.extend(serialise(d, kind).message for d in data)
-    message = "".join(parts)
-    return SerialiseResult(message, len(message))
-
-
-def _serialise_integer(data: int) -> SerialiseResult:
-    message = f":{data!s}{CRLF}"
-    return SerialiseResult(message, len(message))
+    if isinstance(data, str):
+        if kind == Kind.PROTOCOL and data in _SIMPLE_STRING_REPLIES:
+            return _SIMPLE_STRING_REPLIES[data]
+
+        if not data and kind == Kind.NON_PROTOCOL:
+            return EMPTY_BULK_REPLY
+
+    if isinstance(data, list) and not data:
+        return EMPTY_ARRAY_REPLY
+
+    writer = ReplyWriter()
+    writer.write(data, kind)
+    return writer.getvalue()
+
+
+def encode_command(args: list[str]) -> bytes:
+    # A command as an array of bulk strings, as clients send them; cheaper
+    # than the general encode_reply for logging and forwarding commands
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg.encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+
+    return b"".join(parts)
+
+
+class ReplyWriter:
+    # Bulk values at least this large are passed through as their own segment
+    # rather than being copied into the buffer
+    LARGE_BULK_BYTES = 16 * 1024
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._segments: list[bytes | bytearray | memoryview] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size + len(self._buffer)
+
+    def write(self, data: RESPDataType, kind: Kind = Kind.NON_PROTOCOL) -> None:
+        if isinstance(data, str):
+            if kind == Kind.PROTOCOL:
+                self.write_simple_string(data)
+            elif kind == Kind.NON_PROTOCOL:
+                self.write_bulk_string(data)
+            else:
+                self.write_error(data)
+            return
+
+        if isinstance(data, list):
+            self.write_array_header(len(data))
+            for d in data:
+                self.write(d, kind)
+            return
+
+        if isinstance(data, int):  # pyright: ignore[reportUnnecessaryIsInstance]
+            self.write_integer(data)
+            return
+
+        error = f"Message could not be serialised: unsupported data {type(data)}"
+        raise SerialiseError(error)
+
+    def write_raw(self, reply: bytes) -> None:
+        self._buffer += reply
+
+    def write_simple_string(self, data: str) -> None:
+        self._buffer += b"+%s\r\n" % data.encode()
+
+    def write_error(self, data: str) -> None:
+        self._buffer += b"-%s\r\n" % data.encode()
+
+    def write_bulk_string(self, data: str | bytes) -> None:
+        value = data.encode() if isinstance(data, str) else data
+        if len(value) < self.LARGE_BULK_BYTES:
+            self._buffer += b"$%d\r\n%s\r\n" % (len(value), value)
+            return
+
+        self._buffer += b"$%d\r\n" % len(value)
+        self._push_segment(value)
+        self._buffer += _CRLF
+
+    def write_null(self) -> None:
+        self._buffer += NULL_BULK_REPLY
+
+    def write_integer(self, data: int) -> None:
+        if 0 <= data < SHARED_INTEGERS:
+            self._buffer += _INTEGER_REPLIES[data]
+        else:
+            self._buffer += b":%d\r\n" % data
+
+    def write_array_header(self, num_elements: int) -> None:
+        self._buffer += b"*%d\r\n" % num_elements
+
+    def take(self) -> list[bytes | bytearray | memoryview]:
+        # Hands the written segments over (e.g. to transport.writelines, which
+        # sends them with a single sendmsg) and starts a fresh buffer, as the
+        # receiver may hold on to them
+        if self._buffer:
+            self._segments.append(self._buffer)
+
+        segments = self._segments
+        self._buffer = bytearray()
+        self._segments = []
+        self._size = 0
+        return segments
+
+    def getvalue(self) -> bytes:
+        if not self._segments:
+            return bytes(self._buffer)
+
+        return b"".join([*self._segments, self._buffer])
+
+    def _push_segment(self, value: bytes | bytearray | memoryview) -> None:
+        if self._buffer:
+            self._segments.append(self._buffer)
+            self._size += len(self._buffer)
+            self._buffer = bytearray()
+
+        self._segments.append(value)
+        self._size += len(value)
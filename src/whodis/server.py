@@ -1,21 +1,177 @@
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import itertools
+import os
+import resource
+import signal
 import socket
 import threading
-from typing import cast
+import time
+from collections import deque
+from collections.abc import Callable
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
 
-from src.whodis.commands import UnsupportedCommandError, handle_command
-from src.whodis.deserialise import InvalidMessageError, deserialise
-from src.whodis.serialise import Kind, SerialiseError, serialise
-from src.whodis.shared import RESPDataType
+from src.whodis.aof import AppendFsync, AppendOnlyFile, with_absolute_expiry
+from src.whodis.commands import (
+    COMMAND_TABLE,
+    CommandError,
+    CommandSpec,
+    UnsupportedCommandError,
+    build_command_table,
+    command_keys,
+    handle_command,
+)
+from src.whodis.config import (
+    Config,
+    OutputBufferLimit,
+    parse_memory,
+    parse_output_buffer_limit,
+    parse_save_points,
+)
+from src.whodis.datatypes import EncodingLimits
+from src.whodis.deserialise import RequestReader
+from src.whodis.eviction import EvictingKeyspace, EvictionPolicy
+from src.whodis.glob import compile_glob
+from src.whodis.keyspace import Keyspace, KeyStore
+from src.whodis.pubsub import PubSub, subscription_frame
+from src.whodis.replication import Replication
+from src.whodis.serialise import OK_REPLY, Kind, ReplyWriter, SerialiseError, encode_command, encode_reply
+from src.whodis.sharding import DEFAULT_SHARDS, ShardedKeyspace
+from src.whodis.shared import BulkLengthError, InvalidMessageError, LineLengthError, RESPDataType
+from src.whodis.snapshot import Snapshotter
+from src.whodis.stats import (
+    InfoSection,
+    ServerStats,
+    SlowLog,
+    command_stats_section,
+    error_stats_section,
+    format_info,
+    latency_stats_section,
+    render_prometheus,
+)
+from src.whodis.workers import PeerRouter, Supervisor, WorkerTopology, reuseport_socket
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+_ERR_INVALID_ENCODING = encode_reply("ERR invalid encoding", kind=Kind.ERROR)
+_ERR_INVALID_REQUEST = encode_reply("ERR invalid request", kind=Kind.ERROR)
+_ERR_INVALID_BULK_LENGTH = encode_reply("ERR Protocol error: invalid bulk length", kind=Kind.ERROR)
+_ERR_INVALID_REPLY = encode_reply("ERR reply could not be serialised", kind=Kind.ERROR)
+_ERR_NOT_STRING_ARRAY = encode_reply("ERR command must be an array of strings", kind=Kind.ERROR)
+_ERR_UNSUPPORTED_COMMAND = encode_reply("ERR unsupported command", kind=Kind.ERROR)
+_ERR_WORKER_UNAVAILABLE = encode_reply("ERR worker unavailable", kind=Kind.ERROR)
+_ERR_MAX_CLIENTS = encode_reply("ERR max number of clients reached", kind=Kind.ERROR)
+
+# Seconds between runs of background tasks such as active expiry, matching
+# Redis's default hz of 10
+_CRON_INTERVAL = 0.1
+# Seconds to wait before accepting again after accepting a connection failed
+_ACCEPT_RETRY_DELAY = 1.0
+# File descriptors kept free of clients for listeners, persistence and
+# replication, as Redis's CONFIG_MIN_RESERVED_FDS
+_RESERVED_FDS = 32
+
+# Sections of INFO with no arguments, as in Redis; commandstats and
+# latencystats are only included when asked for or with INFO all
+_DEFAULT_INFO_SECTIONS = (
+    "server",
+    "clients",
+    "memory",
+    "persistence",
+    "stats",
+    "replication",
+    "cpu",
+    "errorstats",
+    "keyspace",
+)
+_ALL_INFO_SECTIONS = (*_DEFAULT_INFO_SECTIONS[:-1], "commandstats", "latencystats", "keyspace")
+_SLOWLOG_DEFAULT_COUNT = 10
+
+# The only commands a client can send while subscribed, as in Redis's RESP2
+_SUBSCRIBED_MODE_COMMANDS = frozenset({"SUBSCRIBE", "UNSUBSCRIBE", "PSUBSCRIBE", "PUNSUBSCRIBE", "PING"})
+
+# Reading from a client pauses while this many bytes of its replies are waiting
+# to be sent, and resumes once they have drained below the low-water mark, so
+# a client that doesn't read can't make the server buffer without bound
+_OUTPUT_HIGH_WATER = 1024 * 1024
+_OUTPUT_LOW_WATER = 256 * 1024
+
+# Bytes read from a socket at a time, as asyncio reads for data_received()
+_READ_BUFFER_SIZE = 256 * 1024
+
+_METRICS_RESPONSE_HEADER = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+    b"Content-Length: %d\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+# A reply that is still being produced by another worker
+Pending = asyncio.Future[bytes]
+Segments = list[bytes | bytearray | memoryview]
+RequestHandler = Callable[[RESPDataType, ReplyWriter, "_ClientProtocol"], Pending | None]
 
 
 class WhodisServer:
-    def __init__(self, host: str = "", port: int = 6379) -> None:
+    def __init__(
+        self,
+        host: str = "",
+        port: int = 6379,
+        config: Config | None = None,
+        *,
+        topology: WorkerTopology | None = None,
+    ) -> None:
         self.host = host
         self.port = port
+        self.config = config or Config()
+        # Set when running as one of several workers, each owning a partition
+        # of the keyspace
+        self.topology = topology
+        # Commands that act on the server rather than the keyspace are added
+        # to the shared table
+        self._commands = {**COMMAND_TABLE, **build_command_table(self._server_commands())}
+        self._router = PeerRouter(topology, self._commands) if topology is not None else None
+        self._stats = ServerStats(
+            self._commands,
+            latency_tracking=self.config.latency_tracking,
+            slowlog=SlowLog(self.config.slowlog_log_slower_than, self.config.slowlog_max_len),
+        )
         self._bound_port: int | None = None
+        self._bound_metrics_port: int | None = None
         self._stop_event = threading.Event()
         self.server_ready = threading.Event()
         self._server_thread: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._shutdown: asyncio.Future[None] | None = None
+        self._connections: set[_ClientProtocol] = set()
+        # Links from other workers, kept apart so they don't count as clients
+        self._peer_connections: set[_ClientProtocol] = set()
+        # Lowered at startup if the open files limit can't be raised to fit it
+        self._maxclients = self.config.maxclients
+        self._pubsub = PubSub()
+        # The client whose request is being run, or None for one forwarded by
+        # another worker
+        self._client: _ClientProtocol | None = None
+        self._keyspace = self._create_keyspace()
+        self._cron_handle: asyncio.TimerHandle | None = None
+        self._aof: AppendOnlyFile | None = None
+        self._snapshots = Snapshotter(self._data_path(self.config.dbfilename), self._keyspace, self.config.save)
+        self._replication = Replication(
+            self._snapshots,
+            self._stats,
+            self._apply_replicated,
+            self._replicated_full_sync,
+            self.config.repl_backlog_size,
+            self.config.repl_timeout,
+            self.config.client_output_buffer_limit_replica,
+        )
+        # Resolved once writes made in this loop iteration are on disk
+        self._commit: Pending | None = None
+        self._before_sleep_scheduled = False
 
     def start(self) -> None:
         self._server_thread = threading.Thread(target=self._run, daemon=True)
@@ -24,6 +180,11 @@ class WhodisServer:
 
     def stop(self) -> None:
         self._stop_event.set()
+        if self._loop is not None:
+            # The loop may already have finished if the server failed to start
+            with contextlib.suppress(RuntimeError):
+                self._loop.call_soon_threadsafe(self._wake_shutdown)
+
         if self._server_thread is not None:
             self._server_thread.join(timeout=1)
 
@@ -35,69 +196,1372 @@ class WhodisServer:
 
         return self._bound_port
 
+    @property
+    def bound_metrics_port(self) -> int | None:
+        return self._bound_metrics_port
+
+    def _create_keyspace(self) -> Keyspace:
+        if not self.config.maxmemory:
+            return Keyspace(encoding_limits=self.config.encoding_limits)
+
+        return EvictingKeyspace(
+            self.config.maxmemory,
+            self.config.maxmemory_policy,
+            self.config.maxmemory_samples,
+            encoding_limits=self.config.encoding_limits,
+            on_evict=self._propagate_eviction,
+        )
+
+    def _server_commands(self) -> list[CommandSpec]:
+        return [
+            CommandSpec("BGREWRITEAOF", self._handle_bgrewriteaof, 1),
+            CommandSpec("SAVE", self._handle_save, 1),
+            CommandSpec("BGSAVE", self._handle_bgsave, 1),
+            CommandSpec("LASTSAVE", self._handle_lastsave, 1),
+            CommandSpec("INFO", self._handle_info, -1),
+            CommandSpec("SLOWLOG", self._handle_slowlog, -2),
+            CommandSpec("PING", self._handle_ping, -1),
+            CommandSpec("SUBSCRIBE", self._handle_subscribe, -2),
+            CommandSpec("UNSUBSCRIBE", self._handle_unsubscribe, -1),
+            CommandSpec("PSUBSCRIBE", self._handle_psubscribe, -2),
+            CommandSpec("PUNSUBSCRIBE", self._handle_punsubscribe, -1),
+            CommandSpec("PUBLISH", self._handle_publish, 3),
+            CommandSpec("PUBSUB", self._handle_pubsub, -2),
+            CommandSpec("REPLICAOF", self._handle_replicaof, 3),
+            CommandSpec("SLAVEOF", self._handle_replicaof, 3),
+            CommandSpec("PSYNC", self._handle_psync, 3),
+            CommandSpec("REPLCONF", self._handle_replconf, -1),
+        ]
+
+    def _data_path(self, filename: str) -> Path:
+        # Each worker persists its own partition
+        path = Path(filename)
+        if self.topology is None:
+            return path
+
+        return path.with_stem(f"{path.stem}-{self.topology.worker_id}")
+
     def _run(self) -> None:
-        with socket.socket() as s:
+        loop = asyncio.new_event_loop()
+        self._shutdown = loop.create_future()
+        self._loop = loop
+        try:
+            loop.run_until_complete(self._serve())
+        finally:
+            loop.close()
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        self._load_data()
+        self._maxclients = _fit_open_files_limit(self.config.maxclients)
+
+        if self.topology is None:
+            s = socket.socket()
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind((self.host, self.port))
-            self._bound_port = s.getsockname()[1]
-            s.listen(5)
+        else:
+            s = reuseport_socket()
+        s.bind((self.host, self.port))
+        s.setblocking(False)  # noqa: FBT003
+        self._bound_port = s.getsockname()[1]
+
+        # Every connection reads into the same buffer, as reads are handled
+        # one at a time
+        read_buffer = bytearray(_READ_BUFFER_SIZE)
+        server = await loop.create_server(
+            lambda: self._create_client(read_buffer),
+            sock=s,
+            backlog=self.config.tcp_backlog,
+        )
+        unix_server = await self._start_unix_server(read_buffer)
+        peer_server = None
+        if self.topology is not None:
+            # Commands forwarded by other workers have already been routed
+            peer_server = await loop.create_unix_server(
+                lambda: _ClientProtocol(
+                    self._peer_connections,
+                    self._handle_peer_request,
+                    self._commit_barrier,
+                    self._stats,
+                    RequestReader(read_buffer, self.config.proto_max_bulk_len),
+                ),
+                self.topology.socket_path(self.topology.worker_id),
+            )
+        metrics_server = await self._start_metrics_server()
+
+        async with server:
             print(f"Server running on port {self._bound_port}")
+            if self.config.replicaof is not None and self.topology is None:
+                self._replication.replicate(*self.config.replicaof, self._bound_port)
             self.server_ready.set()
+            self._cron_handle = loop.call_later(_CRON_INTERVAL, self._cron)
+
+            # stop() may have been called before the loop was published
+            if not self._stop_event.is_set() and self._shutdown is not None:
+                await self._shutdown
+
+            self._cron_handle.cancel()
+            server.close()
+            if unix_server is not None:
+                unix_server.close()
+            if peer_server is not None:
+                peer_server.close()
+            if metrics_server is not None:
+                metrics_server.close()
+            if self._router is not None:
+                self._router.close()
+            self._replication.close()
+            self._close_data()
+            for conn in [*self._connections, *self._peer_connections]:
+                conn.close()
+
+    def _create_client(self, read_buffer: bytearray) -> "_ClientProtocol":
+        return _ClientProtocol(
+            self._connections,
+            self._handle_request,
+            self._commit_barrier,
+            self._stats,
+            RequestReader(read_buffer, self.config.proto_max_bulk_len),
+            self.config.client_output_buffer_limit,
+            self._pubsub,
+            self.config.client_output_buffer_limit_pubsub,
+            maxclients=self._maxclients,
+            idle_timeout=self.config.timeout,
+            keepalive=self.config.tcp_keepalive,
+        )
+
+    async def _start_unix_server(self, read_buffer: bytearray) -> asyncio.Server | None:
+        # Clients on the same host can skip TCP altogether. The socket is served
+        # alongside the TCP one, and removed again when the server is closed
+        if self.config.unixsocket is None:
+            return None
+
+        path = self._data_path(self.config.unixsocket)
+        server = await asyncio.get_running_loop().create_unix_server(
+            lambda: self._create_client(read_buffer),
+            path,
+            backlog=self.config.tcp_backlog,
+        )
+        if self.config.unixsocketperm is not None:
+            path.chmod(self.config.unixsocketperm)
+        return server
+
+    async def _start_metrics_server(self) -> asyncio.Server | None:
+        if self.config.metrics_port is None:
+            return None
+
+        # Workers each serve their own metrics, on consecutive ports
+        port = self.config.metrics_port
+        if port and self.topology is not None:
+            port += self.topology.worker_id
+        s = socket.create_server((self.host, port))
+        server = await asyncio.start_server(self._serve_metrics, sock=s)
+        self._bound_metrics_port = s.getsockname()[1]
+        return server
+
+    async def _serve_metrics(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Any request gets the metrics; Prometheus only ever asks for them
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        gauges = {
+            "connected_clients": len(self._connections),
+            "keys": len(self._keyspace),
+            "expires": self._keyspace.volatile_count,
+            "used_memory_bytes": self._keyspace.used_memory,
+            "uptime_seconds": int(time.time() - self._stats.started_at),
+            **self._replication.metrics(),
+        }
+        body = render_prometheus(self._stats, gauges).encode()
+        writer.write(_METRICS_RESPONSE_HEADER % len(body) + body)
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
+
+    def _load_data(self) -> None:
+        # As in Redis, the AOF is preferred when enabled, as it is the more
+        # up to date of the two
+        if self.config.appendonly:
+            self._aof = AppendOnlyFile(self._data_path(self.config.appendfilename), self.config.appendfsync)
+            self._aof.load(self._keyspace, self._commands)
+        elif self._snapshots.path.exists():
+            self._snapshots.load()
+
+    def _close_data(self) -> None:
+        if self._aof is not None:
+            self._aof.close()
+
+        self._snapshots.close()
+        if self.config.save:
+            self._snapshots.save()
+
+    def _cron(self) -> None:
+        # Background housekeeping, run between client events so each task must
+        # keep its work bounded
+        self._keyspace.active_expire_cycle()
+        self._stats.aggregate()
+        # Soft limits are also enforced on clients that have stopped reading
+        # and so aren't being sent anything new
+        now = time.monotonic()
+        for conn in list(self._connections):
+            conn.check_output_limit(now)
+        if self._aof is not None:
+            aof = self._aof
+            # Also runs the everysec fsync when there have been no new writes
+            aof.flush()
+            aof.poll_rewrite()
+            if not self._snapshots.in_progress and aof.should_rewrite(
+                self.config.auto_aof_rewrite_min_size,
+                self.config.auto_aof_rewrite_percentage,
+            ):
+                aof.start_rewrite(self._keyspace)
+
+        # Only one child at a time, as each can double memory use in the worst
+        # case (every page copied on write)
+        saving = self._snapshots.in_progress
+        saved = self._snapshots.poll()
+        if saving and not self._snapshots.in_progress:
+            self._replication.snapshot_finished(saved=saved)
+        if self._snapshots.should_save() and not self._child_running():
+            self._snapshots.start_background_save()
+        self._replication.cron(can_fork=not self._child_running())
+        if self._loop is not None:
+            self._cron_handle = self._loop.call_later(_CRON_INTERVAL, self._cron)
+
+    def _wake_shutdown(self) -> None:
+        if self._shutdown is not None and not self._shutdown.done():
+            self._shutdown.set_result(None)
+
+    def _handle_request(self, data: RESPDataType, out: ReplyWriter, client: "_ClientProtocol") -> Pending | None:
+        # Returns a future for the reply if the command was forwarded to the
+        # worker that owns its keys
+        self._client = client
+        try:
+            normalised = _normalise_input(data)
+        except TypeError:
+            out.write_raw(_ERR_NOT_STRING_ARRAY)
+            self._stats.record_error("ERR")
+            return None
+
+        refusal = self._refusal(normalised, client)
+        if refusal is not None:
+            out.write_error(refusal)
+            self._stats.record_error(refusal)
+            return None
+
+        if self._router is not None:
+            try:
+                owner = self._router.route(normalised)
+            except UnsupportedCommandError:
+                out.write_raw(_ERR_UNSUPPORTED_COMMAND)
+                self._stats.record_error("ERR")
+                return None
+            except CommandError as e:
+                out.write_error(str(e))
+                self._stats.record_error(str(e))
+                return None
+
+            if owner is not None:
+                return self._router.forward(owner, normalised)
+
+        self._execute(normalised, out)
+        return None
+
+    def _refusal(self, cmd: list[str], client: "_ClientProtocol") -> str | None:
+        # Why a command can't be run in the client's or server's current mode
+        if not cmd:
+            return None
+
+        if client.subscribed and cmd[0].upper() not in _SUBSCRIBED_MODE_COMMANDS:
+            return (
+                f"ERR Can't execute '{cmd[0].lower()}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING "
+                "are allowed in this context"
+            )
+
+        if self._replication.is_replica:
+            spec = self._commands.get(cmd[0]) or self._commands.get(cmd[0].upper())
+            if spec is not None and spec.write:
+                return "READONLY You can't write against a read only replica."
+
+        return None
+
+    def _handle_peer_request(self, data: RESPDataType, out: ReplyWriter, client: "_ClientProtocol") -> None:  # noqa: ARG002
+        self._client = None
+        try:
+            normalised = _normalise_input(data)
+        except TypeError:
+            out.write_raw(_ERR_NOT_STRING_ARRAY)
+            self._stats.record_error("ERR")
+            return
+
+        self._execute(normalised, out)
+
+    def _execute(self, cmd: list[str], out: ReplyWriter) -> None:
+        dirty = self._keyspace.dirty
+        start = time.perf_counter_ns()
+        try:
+            handle_command(self._keyspace, cmd, out, self._commands)
+        except UnsupportedCommandError:
+            out.write_raw(_ERR_UNSUPPORTED_COMMAND)
+            self._stats.record_error("ERR")
+            return
+        except CommandError as e:
+            out.write_error(str(e))
+            self._stats.record_error(str(e))
+            self._stats.record_failure(cmd)
+        except SerialiseError:
+            self._stats.serialise_errors += 1
+            raise
+        self._stats.record_command(cmd, time.perf_counter_ns() - start)
+
+        # As in Redis, a command is logged and replicated if it changed the
+        # keyspace. It is encoded once for both, and not at all with neither
+        if self._keyspace.dirty == dirty or (self._aof is None and self._replication.backlog is None):
+            return
+
+        entry = encode_command(with_absolute_expiry(cmd, self._keyspace))
+        if self._aof is not None:
+            self._aof.feed_encoded(entry)
+            self._schedule_before_sleep()
+        if not self._replication.is_replica:
+            self._replication.feed(entry)
+            self._schedule_before_sleep()
+
+    def _propagate_eviction(self, key: str) -> None:
+        # As in Redis, an evicted key is logged and replicated as a DEL, ahead
+        # of the command that needed the memory, so the AOF and replicas don't
+        # keep keys this server no longer has
+        if self._aof is None and self._replication.backlog is None:
+            return
+
+        entry = encode_command(["DEL", key])
+        if self._aof is not None:
+            self._aof.feed_encoded(entry)
+            self._schedule_before_sleep()
+        if not self._replication.is_replica:
+            self._replication.feed(entry)
+            self._schedule_before_sleep()
+
+    def _apply_replicated(self, cmd: list[str]) -> None:
+        # A write from this replica's primary, which is logged as if run here.
+        # As Redis's replica-ignore-maxmemory, a replica doesn't evict keys
+        # itself, but is sent the primary's evictions as DELs
+        dirty = self._keyspace.dirty
+        with contextlib.suppress(CommandError, UnsupportedCommandError):
+            handle_command(self._keyspace, cmd, ReplyWriter(), COMMAND_TABLE, evict=False)
+        if self._aof is not None and self._keyspace.dirty != dirty:
+            self._aof.feed(with_absolute_expiry(cmd, self._keyspace))
+            self._schedule_before_sleep()
+
+    def _replicated_full_sync(self) -> None:
+        # The old log no longer describes the data, which now comes from the
+        # primary's snapshot
+        if self._aof is not None:
+            self._aof.cancel_rewrite()
+            self._aof.start_rewrite(self._keyspace)
+
+    def _schedule_before_sleep(self) -> None:
+        # Runs after every event from this loop iteration has been handled
+        if not self._before_sleep_scheduled and self._loop is not None:
+            self._before_sleep_scheduled = True
+            self._loop.call_soon(self._before_sleep)
+
+    def _before_sleep(self) -> None:
+        self._before_sleep_scheduled = False
+        if self._aof is not None:
+            self._aof.flush()
+        self._replication.flush()
+
+        if self._commit is not None:
+            self._commit.set_result(b"")
+            self._commit = None
+
+    def _commit_barrier(self) -> Pending | None:
+        # With appendfsync always, replies are held back until the writes made
+        # in this iteration have been synced
+        if self._aof is None or self._aof.fsync != AppendFsync.ALWAYS or not self._aof.pending:
+            return None
+
+        if self._commit is None and self._loop is not None:
+            self._commit = self._loop.create_future()
+        return self._commit
+
+    def _handle_bgrewriteaof(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        if self._aof is None:
+            msg = "ERR append only file is not enabled"
+            raise CommandError(msg)
+
+        if self._snapshots.in_progress:
+            msg = "ERR Background save in progress, can't rewrite the append only file right now"
+            raise CommandError(msg)
+
+        if not self._aof.start_rewrite(self._keyspace):
+            msg = "ERR Background append only file rewriting already in progress"
+            raise CommandError(msg)
+
+        out.write_simple_string("Background append only file rewriting started")
+
+    def _handle_save(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        if self._snapshots.in_progress:
+            msg = "ERR Background save already in progress"
+            raise CommandError(msg)
+
+        self._snapshots.save()
+        out.write_raw(OK_REPLY)
+
+    def _handle_bgsave(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        if self._aof is not None and self._aof.rewrite_in_progress:
+            msg = "ERR Background append only file rewriting in progress, can't save right now"
+            raise CommandError(msg)
+
+        if not self._snapshots.start_background_save():
+            msg = "ERR Background save already in progress"
+            raise CommandError(msg)
+
+        out.write_simple_string("Background saving started")
+
+    def _handle_lastsave(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        out.write_integer(self._snapshots.lastsave)
+
+    def _handle_info(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        builders = {
+            "server": ("Server", self._info_server),
+            "clients": (
+                "Clients",
+                lambda: {"connected_clients": len(self._connections), "maxclients": self._maxclients},
+            ),
+            "memory": ("Memory", self._info_memory),
+            "persistence": ("Persistence", self._info_persistence),
+            "stats": ("Stats", self._info_stats),
+            "replication": ("Replication", self._replication.info),
+            "cpu": ("CPU", self._info_cpu),
+            "commandstats": ("Commandstats", lambda: command_stats_section(self._stats)),
+            "errorstats": ("Errorstats", lambda: error_stats_section(self._stats)),
+            "latencystats": ("Latencystats", lambda: latency_stats_section(self._stats)),
+            "keyspace": ("Keyspace", lambda: self._info_keyspace(self._keyspace)),
+        }
+        requested = [arg.lower() for arg in args[1:]] or ["default"]
+        names: list[str] = []
+        for name in requested:
+            if name == "default":
+                names += _DEFAULT_INFO_SECTIONS
+            elif name in {"all", "everything"}:
+                names += _ALL_INFO_SECTIONS
+            elif name in builders:
+                names.append(name)
+
+        sections = {builders[name][0]: builders[name][1]() for name in dict.fromkeys(names)}
+        out.write_bulk_string(format_info(sections))
+
+    def _info_server(self) -> InfoSection:
+        uptime = int(time.time() - self._stats.started_at)
+        section: dict[str, object] = {
+            "process_id": os.getpid(),
+            "tcp_port": self._bound_port,
+            "uptime_in_seconds": uptime,
+            "uptime_in_days": uptime // 86400,
+            "hz": round(1 / _CRON_INTERVAL),
+        }
+        if self.topology is not None:
+            section["worker_id"] = self.topology.worker_id
+            section["workers"] = self.topology.num_workers
+        return section
+
+    def _info_memory(self) -> InfoSection:
+        return {
+            "used_memory": self._keyspace.used_memory,
+            "maxmemory": self.config.maxmemory,
+            "maxmemory_policy": self.config.maxmemory_policy,
+        }
+
+    def _info_persistence(self) -> InfoSection:
+        aof = self._aof
+        section: dict[str, object] = {
+            "rdb_changes_since_last_save": self._snapshots.changes_since_save,
+            "rdb_bgsave_in_progress": int(self._snapshots.in_progress),
+            "rdb_last_save_time": self._snapshots.lastsave,
+            "aof_enabled": int(aof is not None),
+            "aof_rewrite_in_progress": int(aof is not None and aof.rewrite_in_progress),
+        }
+        if aof is not None:
+            section["aof_current_size"] = aof.size
+            section["aof_base_size"] = aof.base_size
+            section["aof_rewrites"] = aof.rewrites
+        return section
+
+    def _info_stats(self) -> InfoSection:
+        stats = self._stats
+        return {
+            "total_connections_received": stats.total_connections_received,
+            "total_commands_processed": stats.total_commands_processed,
+            "total_net_input_bytes": stats.net_input_bytes,
+            "total_net_output_bytes": stats.net_output_bytes,
+            "evicted_keys": getattr(self._keyspace, "evicted_keys", 0),
+            "total_error_replies": stats.error_replies.total(),
+            "total_protocol_errors": stats.protocol_errors,
+            "total_serialise_errors": stats.serialise_errors,
+            "client_output_buffer_limit_disconnections": stats.output_buffer_disconnections,
+            "rejected_connections": stats.rejected_connections,
+            "client_timeout_disconnections": stats.timeout_disconnections,
+            "slowlog_len": len(stats.slowlog),
+            "pubsub_channels": self._pubsub.num_channels,
+            "pubsub_patterns": self._pubsub.num_patterns,
+            "sync_full": stats.sync_full,
+            "sync_partial_ok": stats.sync_partial_ok,
+            "sync_partial_err": stats.sync_partial_err,
+            "total_net_repl_input_bytes": stats.repl_input_bytes,
+            "total_net_repl_output_bytes": stats.repl_output_bytes,
+        }
+
+    def _info_cpu(self) -> InfoSection:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {"used_cpu_sys": f"{usage.ru_stime:.6f}", "used_cpu_user": f"{usage.ru_utime:.6f}"}
+
+    def _info_keyspace(self, keyspace: Keyspace) -> InfoSection:
+        if not len(keyspace):
+            return {}
+
+        return {"db0": f"keys={len(keyspace)},expires={keyspace.volatile_count},avg_ttl=0"}
+
+    def _handle_slowlog(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        slowlog = self._stats.slowlog
+        subcommand = args[1].upper()
+        if subcommand == "GET" and len(args) <= 3:  # noqa: PLR2004
+            count = _SLOWLOG_DEFAULT_COUNT
+            if len(args) == 3:  # noqa: PLR2004
+                try:
+                    count = int(args[2])
+                except ValueError as e:
+                    msg = "ERR value is not an integer or out of range"
+                    raise CommandError(msg) from e
+
+            entries = slowlog.get(count)
+            out.write_array_header(len(entries))
+            for entry in entries:
+                out.write_array_header(4)
+                out.write_integer(entry.id)
+                out.write_integer(entry.timestamp)
+                out.write_integer(entry.duration_us)
+                out.write_array_header(len(entry.args))
+                for arg in entry.args:
+                    out.write_bulk_string(arg)
+        elif subcommand == "LEN" and len(args) == 2:  # noqa: PLR2004
+            out.write_integer(len(slowlog))
+        elif subcommand == "RESET" and len(args) == 2:  # noqa: PLR2004
+            slowlog.reset()
+            out.write_raw(OK_REPLY)
+        else:
+            msg = f"ERR unknown subcommand or wrong number of arguments for '{args[1]}'"
+            raise CommandError(msg)
+
+    def _handle_ping(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:
+        if self._client is None or not self._client.subscribed:
+            COMMAND_TABLE["PING"].handler(keyspace, args, out)
+            return
+
+        # Subscribed clients are sent a pong in the form of a message, so it
+        # can be told apart from the messages arriving with it
+        if len(args) > 2:  # noqa: PLR2004
+            msg = "ERR wrong number of arguments for 'ping' command"
+            raise CommandError(msg)
+
+        out.write_array_header(2)
+        out.write_bulk_string("pong")
+        out.write_bulk_string(args[1] if len(args) == 2 else "")  # noqa: PLR2004
+
+    def _subscriber(self, args: list[str]) -> "_ClientProtocol":
+        if self._client is None:
+            msg = f"ERR {args[0].upper()} is not allowed between workers"
+            raise CommandError(msg)
+
+        return self._client
+
+    def _handle_subscribe(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        client = self._subscriber(args)
+        for channel in args[1:]:
+            self._pubsub.subscribe(client, channel)
+            out.write_raw(subscription_frame(b"subscribe", channel, self._pubsub.subscription_count(client)))
+        client.subscribed = True
+
+    def _handle_psubscribe(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        client = self._subscriber(args)
+        for pattern in args[1:]:
+            self._pubsub.psubscribe(client, pattern)
+            out.write_raw(subscription_frame(b"psubscribe", pattern, self._pubsub.subscription_count(client)))
+        client.subscribed = True
+
+    def _handle_unsubscribe(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        # With no channels, unsubscribes from all of them
+        client = self._subscriber(args)
+        self._unsubscribe(client, args[1:] or self._pubsub.channels(client), b"unsubscribe", out)
+
+    def _handle_punsubscribe(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        client = self._subscriber(args)
+        self._unsubscribe(client, args[1:] or self._pubsub.patterns(client), b"punsubscribe", out)
+
+    def _unsubscribe(self, client: "_ClientProtocol", names: list[str], kind: bytes, out: ReplyWriter) -> None:
+        unsubscribe = self._pubsub.unsubscribe if kind == b"unsubscribe" else self._pubsub.punsubscribe
+        count = self._pubsub.subscription_count(client)
+        if not names:
+            # Still replies once when there was nothing to unsubscribe from
+            out.write_raw(subscription_frame(kind, None, count))
+        for name in names:
+            unsubscribe(client, name)
+            count = self._pubsub.subscription_count(client)
+            out.write_raw(subscription_frame(kind, name, count))
+        client.subscribed = count > 0
+
+    def _handle_publish(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        receivers = self._pubsub.publish(args[1], args[2])
+        # As in Redis Cluster, the message is passed on to the other workers,
+        # and the reply counts only the subscribers of this one
+        if self._router is not None and self._client is not None:
+            self._router.broadcast(args)
+        out.write_integer(receivers)
+
+    def _handle_pubsub(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        subcommand = args[1].upper()
+        if subcommand == "CHANNELS" and len(args) <= 3:  # noqa: PLR2004
+            channels = self._pubsub.active_channels()
+            if len(args) == 3:  # noqa: PLR2004
+                regex = compile_glob(args[2])
+                channels = [channel for channel in channels if regex.fullmatch(channel)]
+            out.write_array_header(len(channels))
+            for channel in channels:
+                out.write_bulk_string(channel)
+        elif subcommand == "NUMSUB":
+            out.write_array_header(2 * (len(args) - 2))
+            for channel in args[2:]:
+                out.write_bulk_string(channel)
+                out.write_integer(self._pubsub.num_subscribers(channel))
+        elif subcommand == "NUMPAT" and len(args) == 2:  # noqa: PLR2004
+            out.write_integer(self._pubsub.num_patterns)
+        else:
+            msg = f"ERR unknown subcommand or wrong number of arguments for '{args[1]}'"
+            raise CommandError(msg)
+
+    def _handle_replicaof(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        self._check_replication_supported()
+        if args[1].upper() == "NO" and args[2].upper() == "ONE":
+            self._replication.promote()
+            out.write_raw(OK_REPLY)
+            return
 
-            s.settimeout(0.5)
-            while not self._stop_event.is_set():
+        try:
+            port = int(args[2])
+        except ValueError as e:
+            msg = "ERR Invalid master port"
+            raise CommandError(msg) from e
+
+        if self._replication.primary == (args[1], port):
+            out.write_simple_string("OK Already connected to specified master")
+            return
+
+        self._replication.replicate(args[1], port, self.bound_port)
+        out.write_raw(OK_REPLY)
+
+    def _handle_psync(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        self._check_replication_supported()
+        client = self._subscriber(args)
+        try:
+            offset = int(args[2])
+        except ValueError as e:
+            msg = "ERR value is not an integer or out of range"
+            raise CommandError(msg) from e
+
+        # A full resync's reply is sent once its snapshot has been started
+        reply = self._replication.psync(client, args[1], offset)
+        client.replica = True
+        if reply:
+            out.write_raw(reply)
+
+    def _handle_replconf(self, keyspace: KeyStore, args: list[str], out: ReplyWriter) -> None:  # noqa: ARG002
+        client = self._subscriber(args)
+        # A replica's acknowledgement of its offset, which has no reply
+        if len(args) == 3 and args[1].upper() == "ACK":  # noqa: PLR2004
+            with contextlib.suppress(ValueError):
+                self._replication.ack(client, int(args[2]))
+            return
+
+        if len(args) % 2 == 0:
+            msg = "ERR syntax error"
+            raise CommandError(msg)
+
+        # Other options are accepted and ignored, as Redis does with unknown capabilities
+        for option, value in zip(args[1::2], args[2::2], strict=True):
+            if option.lower() == "listening-port":
                 try:
-                    conn, addr = s.accept()
-                except TimeoutError:
-                    continue
+                    client.listening_port = int(value)
+                except ValueError as e:
+                    msg = "ERR value is not an integer or out of range"
+                    raise CommandError(msg) from e
+        out.write_raw(OK_REPLY)
+
+    def _check_replication_supported(self) -> None:
+        if self.topology is not None:
+            msg = "ERR replication is not supported with several workers"
+            raise CommandError(msg)
+
+    def _child_running(self) -> bool:
+        return self._snapshots.in_progress or (self._aof is not None and self._aof.rewrite_in_progress)
+
+
+def _normalise_input(data: RESPDataType) -> list[str]:
+    if isinstance(data, str):
+        data = [data]
+
+    if not isinstance(data, list) or not all(isinstance(d, str) for d in data):
+        msg = "Data is not a list of strings"
+        raise TypeError(msg)
+
+    return cast("list[str]", data)
+
+
+class _ClientProtocol(asyncio.BufferedProtocol):
+    def __init__(  # noqa: PLR0913
+        self,
+        connections: set["_ClientProtocol"],
+        handle_request: RequestHandler,
+        commit_barrier: Callable[[], Pending | None],
+        stats: ServerStats,
+        requests: RequestReader,
+        output_limit: OutputBufferLimit = OutputBufferLimit(),  # noqa: B008
+        pubsub: PubSub | None = None,
+        pubsub_output_limit: OutputBufferLimit = OutputBufferLimit(),  # noqa: B008
+        *,
+        maxclients: int = 0,
+        idle_timeout: int = 0,
+        keepalive: int = 0,
+    ) -> None:
+        self._connections = connections
+        self._handle_request = handle_request
+        self._commit_barrier = commit_barrier
+        self._stats = stats
+        # Holds any partial request until the rest of it arrives
+        self._requests = requests
+        self.output_limit = output_limit
+        self._pubsub = pubsub
+        self._pubsub_output_limit = pubsub_output_limit
+        # Connections refused once there are this many clients; 0 for no limit
+        self._maxclients = maxclients
+        self._idle_timeout = idle_timeout
+        # Seconds before keepalive probes are sent on TCP connections; 0 never
+        self._keepalive = keepalive
+        # Whether the client has any channel or pattern subscriptions
+        self.subscribed = False
+        # Whether the client is a replica being fed the replication stream
+        self.replica = False
+        self._last_interaction = 0.0
+        self._idle_timer: asyncio.TimerHandle | None = None
+        # The port a replica announced with REPLCONF listening-port
+        self.listening_port = 0
+        self._peername: object = None
+        # When the output buffer went over the soft limit, if it still is
+        self._over_soft_limit_since: float | None = None
+        self._transport: asyncio.Transport | None = None
+        # Replies queued behind one still being produced by another worker, so
+        # that they are sent in request order
+        self._pending: deque[Pending | Segments] = deque()
+        self._closing = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        if self._maxclients and len(self._connections) >= self._maxclients:
+            # Told why, as in Redis, rather than just hung up on
+            self._stats.rejected_connections += 1
+            cast("asyncio.Transport", transport).write(_ERR_MAX_CLIENTS)
+            transport.close()
+            return
+
+        self._transport = cast("asyncio.Transport", transport)
+        self._transport.set_write_buffer_limits(high=_OUTPUT_HIGH_WATER, low=_OUTPUT_LOW_WATER)
+        self._connections.add(self)
+        self._stats.total_connections_received += 1
+        self._peername = transport.get_extra_info("peername")
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in {socket.AF_INET, socket.AF_INET6}:
+            _configure_tcp(sock, self._keepalive)
+        if self._idle_timeout:
+            self._last_interaction = time.monotonic()
+            self._idle_timer = asyncio.get_running_loop().call_later(self._idle_timeout, self._check_idle)
+        print(f"Connected by {self._peername}")
+
+    def connection_lost(self, exc: Exception | None) -> None:  # noqa: ARG002
+        self._connections.discard(self)
+        self._transport = None
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self.subscribed and self._pubsub is not None:
+            self._pubsub.remove(self)
+            self.subscribed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._transport is None
+
+    @property
+    def peer_host(self) -> str:
+        return str(self._peername[0]) if isinstance(self._peername, tuple) else ""
+
+    @property
+    def unsent_bytes(self) -> int:
+        return 0 if self._transport is None else self._transport.get_write_buffer_size()
 
-                with conn:
-                    print(f"Connected by {addr}")
-                    while True:
-                        data = conn.recv(1024)
-                        if not data:
-                            break  # client disconnected
+    def pause_writing(self) -> None:
+        # Replies are backing up, so stop taking requests until they drain
+        if self._transport is not None:
+            self._transport.pause_reading()
 
-                        response = self._handle_request(data)
-                        conn.sendall(response)
+    def resume_writing(self) -> None:
+        if self._transport is not None:
+            self._transport.resume_reading()
 
-    def _handle_request(self, data: bytes) -> bytes:
+    def check_output_limit(self, now: float | None = None) -> None:
+        # Disconnects the client if its unsent replies are over the hard limit,
+        # or have been over the soft limit for long enough
+        if self._transport is None:
+            return
+
+        size = self._transport.get_write_buffer_size()
+        limit = self._pubsub_output_limit if self.subscribed else self.output_limit
+        if limit.hard and size > limit.hard:
+            self._abort_over_limit(size)
+        elif limit.soft and size > limit.soft:
+            now = time.monotonic() if now is None else now
+            if self._over_soft_limit_since is None:
+                self._over_soft_limit_since = now
+            elif now - self._over_soft_limit_since >= limit.soft_seconds:
+                self._abort_over_limit(size)
+        else:
+            self._over_soft_limit_since = None
+
+    def get_buffer(self, sizehint: int) -> memoryview:  # noqa: ARG002
+        return self._requests.get_buffer()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        if self._transport is None:
+            return
+
+        self._stats.net_input_bytes += nbytes
+        if self._idle_timeout:
+            self._last_interaction = time.monotonic()
+        requests = self._requests
+        requests.buffer_updated(nbytes)
+        # Replies for every command in this read are gathered and sent together
+        out = ReplyWriter()
+        queued = len(self._pending)
         try:
-            deserialised = deserialise(data.decode()).data
+            while (request := requests.next_request()) is not None:
+                forwarded = self._handle_request(request, out, self)
+                if forwarded is not None:
+                    self._pending.append(out.take())
+                    self._pending.append(forwarded)
+                    forwarded.add_done_callback(self._reply_ready)
         except UnicodeDecodeError:
-            return serialise("ERR invalid encoding", kind=Kind.ERROR).message.encode()
+            self._stats.protocol_errors += 1
+            out.write_raw(_ERR_INVALID_ENCODING)
+            self._close_after_write(out)
+            return
+        except BulkLengthError:
+            self._stats.protocol_errors += 1
+            out.write_raw(_ERR_INVALID_BULK_LENGTH)
+            self._close_after_write(out)
+            return
+        except LineLengthError as e:
+            self._stats.protocol_errors += 1
+            out.write_raw(encode_reply(f"ERR Protocol error: {e}", kind=Kind.ERROR))
+            self._close_after_write(out)
+            return
         except InvalidMessageError:
-            return serialise("ERR invalid request", kind=Kind.ERROR).message.encode()
+            # The stream cannot be resynchronised after a malformed message
+            self._stats.protocol_errors += 1
+            out.write_raw(_ERR_INVALID_REQUEST)
+            self._close_after_write(out)
+            return
+        except SerialiseError:
+            # Nor after a reply that was only partly written
+            out.write_raw(_ERR_INVALID_REPLY)
+            self._close_after_write(out)
+            return
+
+        self._send(out, queued)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def _check_idle(self) -> None:
+        # Each client has a single timer, set for when it would have been idle
+        # for the timeout. Requests don't move it; when it fires after there
+        # have been some, it is set again for the new deadline, so a busy client
+        # costs a timer at most once per timeout rather than once per request
+        self._idle_timer = None
+        if self._transport is None:
+            return
+
+        now = time.monotonic()
+        deadline = self._last_interaction + self._idle_timeout
+        if now < deadline or self.subscribed or self.replica:
+            delay = deadline - now if now < deadline else self._idle_timeout
+            self._idle_timer = asyncio.get_running_loop().call_later(delay, self._check_idle)
+            return
+
+        print(f"Closing idle client {self._peername}")  # noqa: T201
+        self._stats.timeout_disconnections += 1
+        self.close()
+
+    def deliver(self, frame: bytes) -> None:
+        # A message published to one of the client's subscriptions. It is only
+        # added to the client's output buffer, so a subscriber that is slow to
+        # read holds up no one else, and is dropped once over its limit
+        if self._transport is None:
+            return
+
+        if self._pending:
+            # Behind replies that aren't ready to be sent yet
+            self._pending.append([frame])
+            self._flush()
+        else:
+            # A single write() is cheaper than _write() for one segment
+            self._stats.net_output_bytes += len(frame)
+            self._transport.write(frame)
+            if self._transport.get_write_buffer_size():
+                self.check_output_limit()
+
+    def _send(self, out: ReplyWriter, queued: int) -> None:
+        # Sends the replies to a read, or queues them if earlier ones are not
+        # ready yet. Those from queued onwards belong to this read
+        barrier = self._commit_barrier()
+        if barrier is not None:
+            # Holds back this read's replies, and any queued behind them
+            self._pending.insert(queued, barrier)
+            barrier.add_done_callback(self._reply_ready)
+
+        if self._pending:
+            if out:
+                self._pending.append(out.take())
+            self._flush()
+        elif out and self._transport is not None:
+            self._stats.net_output_bytes += len(out)
+            self._write(self._transport, out.take())
+
+    def _write(self, transport: asyncio.Transport, segments: list[bytes | bytearray | memoryview]) -> None:
+        if transport.get_write_buffer_size():
+            # writelines() doesn't apply the transport's flow control, as
+            # write() does, so once replies are backing up they go through
+            # write(), which pauses reading over the high-water mark. Neither
+            # tries to send anything while the buffer isn't empty
+            for segment in segments:
+                transport.write(segment)
+        else:
+            transport.writelines(segments)
+        self.check_output_limit()
+
+    def _abort_over_limit(self, size: int) -> None:
+        if self._transport is None:
+            return
+
+        peer = self._transport.get_extra_info("peername")
+        print(f"Closing {peer} for exceeding its output buffer limit ({size} bytes unsent)")  # noqa: T201
+        self._stats.output_buffer_disconnections += 1
+        self._pending.clear()
+        # Discards the unsent replies rather than waiting for them to drain
+        self._transport.abort()
+        self._transport = None
+
+    def _close_after_write(self, out: ReplyWriter) -> None:
+        self._pending.append(out.take())
+        self._closing = True
+        self._flush()
+
+    def _reply_ready(self, reply: Pending) -> None:
+        # Replies from a peer usually arrive together, so the first callback to
+        # run sends them all and the rest find nothing to do
+        if self._pending and self._pending[0] is reply:
+            self._flush()
+
+    def _flush(self) -> None:
+        # Writes queued replies up to the first one that is not ready yet
+        pending = self._pending
+        ready: Segments = []
+        while pending:
+            head = pending[0]
+            if isinstance(head, asyncio.Future):
+                if not head.done():
+                    break
+                if head.cancelled() or head.exception() is not None:
+                    ready.append(_ERR_WORKER_UNAVAILABLE)
+                else:
+                    ready.append(head.result())
+            else:
+                ready += head
+            pending.popleft()
+
+        if self._transport is None:
+            return
+
+        if ready:
+            self._stats.net_output_bytes += sum(len(segment) for segment in ready)
+            self._write(self._transport, ready)
+            if self._transport is None:
+                return
+        if self._closing and not pending:
+            self._transport.close()
+
+
+class ThreadedServer:
+    # Serves the keyspace commands from a pool of threads, each running an
+    # event loop for the connections it is handed, over a keyspace split into
+    # shards with a lock each. Threads only wait for one another when they
+    # want the same shard, so on a free-threaded build they run in parallel;
+    # with the GIL they take turns as any threads do. Persistence, replication,
+    # pub/sub and the server commands are left to WhodisServer
+    def __init__(
+        self,
+        host: str = "",
+        port: int = 6379,
+        config: Config | None = None,
+        *,
+        threads: int = 4,
+        shards: int = DEFAULT_SHARDS,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.config = config or Config()
+        self.num_threads = threads
+        self.num_shards = shards
+        self.keyspace = ShardedKeyspace(shards, self._create_shard)
+        self._threads: list[_ServingThread] = []
+        self._listener: socket.socket | None = None
+        self._accepting: concurrent.futures.Future[None] | None = None
+        self._bound_port: int | None = None
+
+    @property
+    def bound_port(self) -> int:
+        if self._bound_port is None:
+            msg = "Server not started"
+            raise RuntimeError(msg)
+
+        return self._bound_port
+
+    @property
+    def total_connections_received(self) -> int:
+        return sum(thread.stats.total_connections_received for thread in self._threads)
+
+    def start(self) -> None:
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(self.config.tcp_backlog)
+        listener.setblocking(False)  # noqa: FBT003
+        self._listener = listener
+        self._bound_port = listener.getsockname()[1]
+
+        # The first thread expires keys, as cron does on the event loop
+        self._threads = [
+            _ServingThread(f"whodis-thread-{i}", self.keyspace, self.config, expire_keys=i == 0)
+            for i in range(self.num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self._accepting = asyncio.run_coroutine_threadsafe(self._accept(listener), self._threads[0].loop)
+        print(f"Server running on port {self._bound_port} with {self.num_threads} threads")  # noqa: T201
+
+    def stop(self) -> None:
+        if self._accepting is not None:
+            self._accepting.cancel()
+        for thread in self._threads:
+            thread.stop()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _create_shard(self) -> Keyspace:
+        # Keys hash evenly across the shards, so each is given an equal share
+        # of maxmemory and evicts from its own keys
+        if not self.config.maxmemory:
+            return Keyspace(encoding_limits=self.config.encoding_limits)
+
+        return EvictingKeyspace(
+            max(self.config.maxmemory // self.num_shards, 1),
+            self.config.maxmemory_policy,
+            self.config.maxmemory_samples,
+            encoding_limits=self.config.encoding_limits,
+        )
+
+    async def _accept(self, listener: socket.socket) -> None:
+        # Runs on the first thread, handing connections to each thread in turn
+        loop = asyncio.get_running_loop()
+        for thread in itertools.cycle(self._threads):
+            try:
+                conn, _ = await loop.sock_accept(listener)
+            except OSError as e:
+                # e.g. out of file descriptors, which may pass once clients leave
+                print(f"Error accepting a connection: {e}")  # noqa: T201
+                await asyncio.sleep(_ACCEPT_RETRY_DELAY)
+                continue
+
+            thread.adopt(conn)
+
+
+def _keys_to_lock(cmd: list[str]) -> list[str] | None:
+    # Commands without keys may touch any of them, as SCAN does, so they lock
+    # every shard. PING alone touches none
+    keys = command_keys(cmd)
+    if keys or cmd[0].upper() == "PING":
+        return keys
+
+    return None
+
+
+class _ServingThread:
+    # One of ThreadedServer's threads, with its own event loop, connections,
+    # read buffer and stats, sharing only the keyspace
+    def __init__(self, name: str, keyspace: ShardedKeyspace, config: Config, *, expire_keys: bool) -> None:
+        self.keyspace = keyspace
+        self.config = config
+        self.expire_keys = expire_keys
+        self.loop = asyncio.new_event_loop()
+        # Counts connections, bytes and errors; commands aren't recorded, as
+        # their durations are only aggregated for INFO
+        self.stats = ServerStats(COMMAND_TABLE)
+        self.connections: set[_ClientProtocol] = set()
+        self._read_buffer = bytearray(_READ_BUFFER_SIZE)
+        self._adopting: set[asyncio.Task[tuple[asyncio.Transport, asyncio.BaseProtocol]]] = set()
+        self._cron_handle: asyncio.TimerHandle | None = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        # The loop has already been closed if the thread has finished
+        with contextlib.suppress(RuntimeError):
+            self.loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join(timeout=1)
 
+    def adopt(self, sock: socket.socket) -> None:
+        # Called from the accepting thread
         try:
-            normalised = self._normalise_input(deserialised)
-        except TypeError:
-            return serialise("ERR command must be an array of strings", kind=Kind.ERROR).message.encode()
+            self.loop.call_soon_threadsafe(self._adopt, sock)
+        except RuntimeError:
+            sock.close()
 
+    def _run(self) -> None:
+        self._cron_handle = self.loop.call_later(_CRON_INTERVAL, self._cron)
         try:
-            handled = handle_command(normalised)
-        except UnsupportedCommandError:
-            return serialise("ERR unsupported command", kind=Kind.ERROR).message.encode()
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def _shutdown(self) -> None:
+        if self._cron_handle is not None:
+            self._cron_handle.cancel()
+        for conn in list(self.connections):
+            conn.close()
+        # Stopping on the next iteration lets the connections finish closing
+        self.loop.call_soon(self.loop.stop)
+
+    def _cron(self) -> None:
+        if self.expire_keys:
+            self.keyspace.active_expire_cycle()
+        now = time.monotonic()
+        for conn in list(self.connections):
+            conn.check_output_limit(now)
+        self._cron_handle = self.loop.call_later(_CRON_INTERVAL, self._cron)
+
+    def _adopt(self, sock: socket.socket) -> None:
+        task = self.loop.create_task(self.loop.connect_accepted_socket(self._create_protocol, sock))
+        # Held until done, as the loop only keeps a weak reference to tasks
+        self._adopting.add(task)
+        task.add_done_callback(self._adopting.discard)
+
+    def _create_protocol(self) -> "_ClientProtocol":
+        return _ClientProtocol(
+            self.connections,
+            self._handle_request,
+            _no_commit_barrier,
+            self.stats,
+            RequestReader(self._read_buffer, self.config.proto_max_bulk_len),
+            self.config.client_output_buffer_limit,
+            idle_timeout=self.config.timeout,
+            keepalive=self.config.tcp_keepalive,
+        )
+
+    def _handle_request(self, data: RESPDataType, out: ReplyWriter, client: "_ClientProtocol") -> None:  # noqa: ARG002
+        try:
+            cmd = _normalise_input(data)
+        except TypeError:
+            out.write_raw(_ERR_NOT_STRING_ARRAY)
+            self.stats.record_error("ERR")
+            return
 
-        # PING/PONG is a special case where PING could be sent as a simple
-        # string or a bulk string, but the response should be a simple string
-        kind = Kind.PROTOCOL if handled == "PONG" else Kind.NON_PROTOCOL
         try:
-            return serialise(handled, kind=kind).message.encode()
+            with self.keyspace.locked(_keys_to_lock(cmd)) as keyspace:
+                handle_command(keyspace, cmd, out)
+        except UnsupportedCommandError:
+            out.write_raw(_ERR_UNSUPPORTED_COMMAND)
+            self.stats.record_error("ERR")
+        except CommandError as e:
+            out.write_error(str(e))
+            self.stats.record_error(str(e))
         except SerialiseError:
-            return serialise("ERR serialisation failed", kind=Kind.ERROR).message.encode()
+            self.stats.serialise_errors += 1
+            raise
 
-    def _normalise_input(self, data: RESPDataType) -> list[str]:
-        if isinstance(data, str):
-            data = [data]
 
-        if not isinstance(data, list) or not all(isinstance(d, str) for d in data):
-            msg = "Data is not a list of strings"
-            raise TypeError(msg)
+def _no_commit_barrier() -> None:
+    # Nothing is persisted, so replies are never held back
+    return
 
-        return cast("list[str]", data)
 
+def _configure_tcp(sock: socket.socket, keepalive: int) -> None:
+    # asyncio only disables Nagle's algorithm on sockets created for TCP by
+    # name, which accepted ones aren't. Replies are written whole, so there is
+    # nothing to gain from holding them back for more
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if not keepalive:
+        return
 
-if __name__ == "__main__":
-    server = WhodisServer()
+    # As Redis's anetKeepAlive: probes start after the connection has been
+    # idle for that many seconds, and a peer that misses three is given up on
+    # about one more interval later
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(keepalive // 3, 1))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+def _fit_open_files_limit(maxclients: int) -> int:
+    # Raises the open files limit to fit maxclients where allowed, and
+    # otherwise lowers maxclients to fit the limit, as Redis does, so that
+    # clients are refused with an error rather than failing to be accepted
+    needed = maxclients + _RESERVED_FDS
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return maxclients
+
+    target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+    with contextlib.suppress(ValueError, OSError):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        soft = target
+    if soft >= needed:
+        return maxclients
+
+    fitted = max(soft - _RESERVED_FDS, 1)
+    print(f"maxclients lowered from {maxclients} to {fitted} to fit the open files limit of {soft}")  # noqa: T201
+    return fitted
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="A Redis-inspired server")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--workers", type=int, default=1, help="processes to run, each owning part of the keyspace")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="threads to serve clients from, sharing a keyspace split into locked shards",
+    )
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="keyspace shards with --threads")
+    parser.add_argument("--unixsocket", help="also serve clients on this Unix socket")
+    parser.add_argument("--unixsocketperm", type=lambda v: int(v, 8), help="octal permissions, e.g. 700")
+    parser.add_argument("--tcp-backlog", type=int, default=Config.tcp_backlog)
+    parser.add_argument("--tcp-keepalive", type=int, default=Config.tcp_keepalive, help="seconds; 0 disables")
+    parser.add_argument("--maxclients", type=int, default=Config.maxclients)
+    parser.add_argument("--timeout", type=int, default=Config.timeout, help="idle client timeout in seconds; 0 never")
+    parser.add_argument("--maxmemory", type=parse_memory, default=0)
+    parser.add_argument("--maxmemory-policy", type=EvictionPolicy, default=EvictionPolicy.NOEVICTION)
+    parser.add_argument("--maxmemory-samples", type=int, default=5)
+    parser.add_argument("--appendonly", choices=["yes", "no"], default="no")
+    parser.add_argument("--appendfilename", default="appendonly.aof")
+    parser.add_argument("--appendfsync", type=AppendFsync, default=AppendFsync.EVERYSEC)
+    parser.add_argument("--dbfilename", default="dump.wdb")
+    parser.add_argument("--save", type=parse_save_points, default=(), help='save points, e.g. "3600 1 300 100"')
+    parser.add_argument(
+        "--client-output-buffer-limit",
+        type=parse_output_buffer_limit,
+        default=Config.client_output_buffer_limit,
+        help='hard limit, soft limit and soft seconds, e.g. "256mb 64mb 60"',
+    )
+    parser.add_argument(
+        "--client-output-buffer-limit-pubsub",
+        type=parse_output_buffer_limit,
+        default=Config.client_output_buffer_limit_pubsub,
+        help="as --client-output-buffer-limit, for clients subscribed to channels or patterns",
+    )
+    parser.add_argument(
+        "--client-output-buffer-limit-replica",
+        type=parse_output_buffer_limit,
+        default=Config.client_output_buffer_limit_replica,
+        help="as --client-output-buffer-limit, for replicas",
+    )
+    parser.add_argument("--replicaof", nargs=2, metavar=("HOST", "PORT"), help="start as a replica of this primary")
+    parser.add_argument("--repl-backlog-size", type=parse_memory, default=Config.repl_backlog_size)
+    parser.add_argument("--repl-timeout", type=int, default=Config.repl_timeout)
+    for field in dataclasses.fields(EncodingLimits):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=int, default=field.default)
+    parser.add_argument("--proto-max-bulk-len", type=parse_memory, default=Config.proto_max_bulk_len)
+    parser.add_argument("--latency-tracking", choices=["yes", "no"], default="yes")
+    parser.add_argument("--slowlog-log-slower-than", type=int, default=10_000, help="microseconds; negative disables")
+    parser.add_argument("--slowlog-max-len", type=int, default=128)
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on this port (consecutive ports with several workers)",
+    )
+    args = parser.parse_args(argv)
+    if args.workers > 1 and args.threads > 1:
+        parser.error("--workers and --threads can't be used together")
+
+    config = Config(
+        maxmemory=args.maxmemory,
+        maxmemory_policy=args.maxmemory_policy,
+        maxmemory_samples=args.maxmemory_samples,
+        appendonly=args.appendonly == "yes",
+        appendfilename=args.appendfilename,
+        appendfsync=args.appendfsync,
+        dbfilename=args.dbfilename,
+        save=args.save,
+        client_output_buffer_limit=args.client_output_buffer_limit,
+        client_output_buffer_limit_pubsub=args.client_output_buffer_limit_pubsub,
+        client_output_buffer_limit_replica=args.client_output_buffer_limit_replica,
+        replicaof=None if args.replicaof is None else (args.replicaof[0], int(args.replicaof[1])),
+        repl_backlog_size=args.repl_backlog_size,
+        repl_timeout=args.repl_timeout,
+        unixsocket=args.unixsocket,
+        unixsocketperm=args.unixsocketperm,
+        tcp_backlog=args.tcp_backlog,
+        tcp_keepalive=args.tcp_keepalive,
+        maxclients=args.maxclients,
+        timeout=args.timeout,
+        proto_max_bulk_len=args.proto_max_bulk_len,
+        encoding_limits=EncodingLimits(
+            **{field.name: getattr(args, field.name) for field in dataclasses.fields(EncodingLimits)},
+        ),
+        latency_tracking=args.latency_tracking == "yes",
+        slowlog_log_slower_than=args.slowlog_log_slower_than,
+        slowlog_max_len=args.slowlog_max_len,
+        metrics_port=args.metrics_port,
+    )
+    server: WhodisServer | Supervisor | ThreadedServer
+    if args.workers > 1:
+        server = Supervisor(args.host, args.port, args.workers, config)
+    elif args.threads > 1:
+        server = ThreadedServer(args.host, args.port, config, threads=args.threads, shards=args.shards)
+    else:
+        server = WhodisServer(args.host, args.port, config)
+
+    # Block the signals before any threads start so only this one receives them
+    signals = {signal.SIGTERM, signal.SIGINT}
+    signal.pthread_sigmask(signal.SIG_BLOCK, signals)
     server.start()
+    signal.sigwait(signals)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
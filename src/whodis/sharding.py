@@ -0,0 +1,148 @@
+import contextlib
+import threading
+from collections.abc import Callable, Iterator
+
+from src.whodis.datatypes import Collection
+from src.whodis.keyspace import (
+    ACTIVE_EXPIRE_MAX_SAMPLES,
+    ACTIVE_EXPIRE_TIME_BUDGET,
+    Entry,
+    ExpireCycleResult,
+    Keyspace,
+    KeyStore,
+    Value,
+)
+
+# Enough shards that threads working on different keys rarely want the same
+# lock, while a command spanning every shard (SCAN) takes few enough locks
+DEFAULT_SHARDS = 64
+
+
+class ShardedKeyspace:
+    # The keyspace split by key hash into shards, each an ordinary Keyspace
+    # with a lock of its own, so commands on keys in different shards can run
+    # at the same time on different threads
+    def __init__(self, num_shards: int, create_shard: Callable[[], Keyspace]) -> None:
+        self.shards = [create_shard() for _ in range(num_shards)]
+        self._locks = [threading.Lock() for _ in range(num_shards)]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    @property
+    def volatile_count(self) -> int:
+        return sum(shard.volatile_count for shard in self.shards)
+
+    @property
+    def used_memory(self) -> int:
+        return sum(shard.used_memory for shard in self.shards)
+
+    def shard_index(self, key: str) -> int:
+        # str caches its hash, so a key is only ever hashed once
+        return hash(key) % len(self.shards)
+
+    @contextlib.contextmanager
+    def locked(self, keys: list[str] | None) -> Iterator[KeyStore]:
+        # Holds the locks of the shards with any of the keys for as long as a
+        # command runs, on the keyspace it should run against. None takes every
+        # lock, for commands that may touch any key, and no keys takes none, for
+        # commands that touch no key at all
+        if keys is not None and len(keys) == 1:
+            index = hash(keys[0]) % len(self.shards)
+            with self._locks[index]:
+                yield self.shards[index]
+            return
+
+        indices = range(len(self.shards)) if keys is None else sorted({self.shard_index(key) for key in keys})
+        if len(indices) == 1:
+            with self._locks[indices[0]]:
+                yield self.shards[indices[0]]
+            return
+
+        # Locks are always taken in shard order, so two commands can never each
+        # be holding a lock the other is waiting for
+        locks = [self._locks[index] for index in indices]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield _ShardGroup(self.shards, indices)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def active_expire_cycle(
+        self,
+        max_samples: int = ACTIVE_EXPIRE_MAX_SAMPLES,
+        time_budget: float = ACTIVE_EXPIRE_TIME_BUDGET,
+    ) -> ExpireCycleResult:
+        # Each shard is given its share of the budget, and only its own lock is
+        # held while it is sampled
+        sampled = expired = 0
+        per_shard = max(max_samples // len(self.shards), 1)
+        for shard, lock in zip(self.shards, self._locks, strict=True):
+            with lock:
+                result = shard.active_expire_cycle(per_shard, time_budget / len(self.shards))
+            sampled += result.sampled
+            expired += result.expired
+
+        return ExpireCycleResult(sampled=sampled, expired=expired)
+
+
+class _ShardGroup:
+    # Several locked shards presented to a command with keys in each of them,
+    # as the KeyStore commands run against. Only the per-key operations and
+    # SCAN are passed on; whole-keyspace operations such as expiry cycles and
+    # eviction sampling are run on the shards themselves
+    def __init__(self, shards: list[Keyspace], indices: range | list[int]) -> None:
+        self.encoding_limits = shards[0].encoding_limits
+        self._shards = shards
+        self._indices = indices
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._shard(key)
+
+    def now_ms(self) -> int:
+        return self._shards[self._indices[0]].now_ms()
+
+    def get(self, key: str) -> Value | None:
+        return self._shard(key).get(key)
+
+    def set(self, key: str, value: str | Value, expire_at: int | None = None, *, keep_ttl: bool = False) -> None:
+        self._shard(key).set(key, value, expire_at, keep_ttl=keep_ttl)
+
+    def collection_changed(self, key: str, value: Collection, old_size: int) -> None:
+        self._shard(key).collection_changed(key, value, old_size)
+
+    def delete_many(self, keys: list[str], *, lazy: bool = False) -> int:
+        return sum(self._shard(key).delete_many([key], lazy=lazy) for key in keys)
+
+    def memory_usage(self, key: str) -> int | None:
+        return self._shard(key).memory_usage(key)
+
+    def get_expire(self, key: str) -> int | None:
+        return self._shard(key).get_expire(key)
+
+    def expire(self, key: str, expire_at: int) -> bool:
+        return self._shard(key).expire(key, expire_at)
+
+    def persist(self, key: str) -> bool:
+        return self._shard(key).persist(key)
+
+    def perform_evictions(self) -> None:
+        for index in self._indices:
+            self._shards[index].perform_evictions()
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[tuple[str, Entry]]]:
+        # The cursor carries the shard being scanned in its low part, and that
+        # shard's own cursor in the rest; each call scans one shard
+        num_shards = len(self._shards)
+        index, shard_cursor = cursor % num_shards, cursor // num_shards
+        shard_cursor, entries = self._shards[index].scan(shard_cursor, count)
+        if shard_cursor:
+            return shard_cursor * num_shards + index, entries
+
+        # A finished shard moves the scan on to the start of the next one
+        return (index + 1 if index + 1 < num_shards else 0), entries
+
+    def _shard(self, key: str) -> Keyspace:
+        return self._shards[hash(key) % len(self._shards)]
@@ -6,3 +6,18 @@ RESPDataType = int | str | list["RESPDataType"]
 
 class InvalidMessageError(ValueError):
     pass
+
+
+class IncompleteMessageError(InvalidMessageError):
+    pass
+
+
+class BulkLengthError(InvalidMessageError):
+    # A bulk string longer than the server accepts, refused from its header
+    pass
+
+
+class LineLengthError(InvalidMessageError):
+    # A header line still without its CRLF once over the longest accepted; the
+    # message is Redis's protocol error for it
+    pass
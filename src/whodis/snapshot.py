@@ -0,0 +1,294 @@
+import functools
+import mmap
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from src.whodis.datatypes import Collection, EncodingLimits, Hash, List, Set, ZSet
+from src.whodis.forking import child_exit_code, fork_child, kill_child
+from src.whodis.keyspace import Keyspace, value_bytes
+
+# A snapshot is a header, one length-prefixed record per key, and an end marker
+# followed by a CRC32 of everything before it:
+#
+#   header:  MAGIC, version (u16)
+#   record:  type (u8), key length (u32), value length or element count (u32),
+#            [expiry in ms since the epoch (i64)], key, value or elements
+#   element: length (u32), data
+#   end:     END (u8), CRC32 (u32)
+#
+# The low bit of a record's type is set if it has an expiry. A hash's elements
+# alternate between fields and values, and a sorted set's between members and
+# scores (f64). Integers and floats are little-endian. Records are
+# decoded straight from a memory map, which is much faster than replaying
+# commands
+MAGIC = b"WHODIS"
+VERSION = 3
+# Earlier versions are the same, but hold fewer types: version 1 only strings,
+# and version 2 no sorted sets
+_READABLE_VERSIONS = frozenset({1, 2, VERSION})
+
+_EXPIRING = 1
+_TYPE_STRING = 0
+_TYPE_HASH = 2
+_TYPE_LIST = 4
+_TYPE_SET = 6
+_TYPE_ZSET = 8
+_COLLECTION_TYPES = {Hash: _TYPE_HASH, List: _TYPE_LIST, Set: _TYPE_SET, ZSet: _TYPE_ZSET}
+_END = 0xFF
+
+_HEADER = struct.Struct("<6sH")
+_RECORD = struct.Struct("<BII")
+_RECORD_EXPIRING = struct.Struct("<BIIq")
+_ELEMENT = struct.Struct("<I")
+_SCORE = struct.Struct("<d")
+_TRAILER = struct.Struct("<BI")
+_CRC = struct.Struct("<I")
+
+# Records are gathered into chunks of about this size before being written
+_WRITE_CHUNK_BYTES = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshotter:
+    # Saves a keyspace to a snapshot file, either in place (SAVE) or from a
+    # forked child that sees the keyspace as it was at the fork (BGSAVE), and
+    # tracks the changes made since the last save
+    def __init__(
+        self,
+        path: str | Path,
+        keyspace: Keyspace,
+        save_points: tuple[tuple[int, int], ...] = (),
+    ) -> None:
+        self.path = Path(path)
+        self.keyspace = keyspace
+        self.save_points = save_points
+        self.lastsave = int(time.time())
+        self._dirty_at_save = keyspace.dirty
+        self._child: int | None = None
+        self._dirty_at_fork = 0
+
+    @property
+    def in_progress(self) -> bool:
+        return self._child is not None
+
+    @property
+    def changes_since_save(self) -> int:
+        return self.keyspace.dirty - self._dirty_at_save
+
+    def load(self) -> int:
+        loaded = load_snapshot(self.path, self.keyspace)
+        self._dirty_at_save = self.keyspace.dirty
+        return loaded
+
+    def save(self) -> None:
+        save_snapshot(self.path, self.keyspace)
+        self._saved(self.keyspace.dirty)
+
+    def start_background_save(self) -> bool:
+        if self._child is not None:
+            return False
+
+        self._dirty_at_fork = self.keyspace.dirty
+        self._child = fork_child(functools.partial(save_snapshot, self.path, self.keyspace))
+        return True
+
+    def poll(self) -> bool:
+        # Returns True once a background save has completed successfully
+        if self._child is None:
+            return False
+
+        code = child_exit_code(self._child)
+        if code is None:
+            return False
+
+        self._child = None
+        if code != 0:
+            print(f"Background save failed with exit code {code}")  # noqa: T201
+            return False
+
+        # Changes made while the child was writing are not in the snapshot
+        self._saved(self._dirty_at_fork)
+        return True
+
+    def should_save(self) -> bool:
+        # As Redis's save points: after at least changes changes and seconds
+        # seconds since the last save
+        if self._child is not None:
+            return False
+
+        elapsed = time.time() - self.lastsave
+        changes = self.changes_since_save
+        return any(changes >= min_changes and elapsed >= seconds for seconds, min_changes in self.save_points)
+
+    def close(self) -> None:
+        if self._child is not None:
+            kill_child(self._child)
+            self._child = None
+
+    def _saved(self, dirty: int) -> None:
+        self._dirty_at_save = dirty
+        self.lastsave = int(time.time())
+
+
+def save_snapshot(path: str | Path, keyspace: Keyspace) -> None:
+    # Writes to a temporary file that is renamed over the old snapshot, so a
+    # crash part way through leaves the previous snapshot intact
+    path = Path(path)
+    temp = path.with_name(f"temp-{os.getpid()}-{path.name}")
+    now = keyspace.now_ms()
+    crc = 0
+    with temp.open("wb") as f:
+        chunk = bytearray(_HEADER.pack(MAGIC, VERSION))
+        for key, entry in keyspace.items():
+            expire_at = entry.expire_at
+            if expire_at is not None and expire_at <= now:
+                continue
+
+            key_data = key.encode()
+            value = entry.value
+            if isinstance(value, int | bytes):
+                record_type = _TYPE_STRING
+                value_data = value_bytes(value)
+                length = len(value_data)
+            else:
+                record_type = _COLLECTION_TYPES[type(value)]
+                value_data, length = _pack_elements(value)
+
+            if expire_at is None:
+                chunk += _RECORD.pack(record_type, len(key_data), length)
+            else:
+                chunk += _RECORD_EXPIRING.pack(record_type | _EXPIRING, len(key_data), length, expire_at)
+            chunk += key_data
+            chunk += value_data
+
+            if len(chunk) >= _WRITE_CHUNK_BYTES:
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+                chunk = bytearray()
+
+        chunk.append(_END)
+        crc = zlib.crc32(chunk, crc)
+        chunk += _CRC.pack(crc)
+        f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+    temp.replace(path)
+
+
+def load_snapshot(path: str | Path, keyspace: Keyspace) -> int:
+    # Adds the keys in a snapshot to the keyspace, skipping any that have
+    # expired since it was written, and returns the number of keys read
+    with Path(path).open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if len(data) < _HEADER.size + _TRAILER.size:
+            msg = f"Snapshot {path} is truncated"
+            raise SnapshotError(msg)
+
+        magic, version = _HEADER.unpack_from(data)
+        if magic != MAGIC or version not in _READABLE_VERSIONS:
+            msg = f"{path} is not a snapshot of a supported version"
+            raise SnapshotError(msg)
+
+        end, crc = _TRAILER.unpack_from(data, len(data) - _TRAILER.size)
+        with memoryview(data)[: -_CRC.size] as checked:
+            valid = end == _END and zlib.crc32(checked) == crc
+        if not valid:
+            msg = f"Snapshot {path} is corrupt"
+            raise SnapshotError(msg)
+
+        return _load_records(data, _HEADER.size, len(data) - _TRAILER.size, keyspace)
+
+
+def _pack_elements(value: Collection) -> tuple[bytes, int]:
+    elements: list[bytes]
+    if isinstance(value, Hash):
+        elements = [item for pair in value.items() for item in pair]
+    elif isinstance(value, ZSet):
+        elements = [item for member, score in value.items() for item in (member, _SCORE.pack(score))]
+    else:
+        elements = list(value)
+    pack = _ELEMENT.pack
+    return b"".join(pack(len(element)) + element for element in elements), len(elements)
+
+
+def _load_records(data: mmap.mmap, pos: int, end: int, keyspace: Keyspace) -> int:
+    now = keyspace.now_ms()
+    unpack_record, unpack_expiring = _RECORD.unpack_from, _RECORD_EXPIRING.unpack_from
+    loaded = 0
+    try:
+        while pos < end:
+            record_type = data[pos]
+            if record_type & ~_EXPIRING not in {_TYPE_STRING, _TYPE_HASH, _TYPE_LIST, _TYPE_SET, _TYPE_ZSET}:
+                msg = f"Unknown record type {record_type} at offset {pos}"
+                raise SnapshotError(msg)
+
+            if record_type & _EXPIRING:
+                _, key_length, length, expire_at = unpack_expiring(data, pos)
+                pos += _RECORD_EXPIRING.size
+            else:
+                _, key_length, length = unpack_record(data, pos)
+                expire_at = None
+                pos += _RECORD.size
+
+            key = data[pos : pos + key_length].decode()
+            pos += key_length
+            value: bytes | Collection
+            if record_type & ~_EXPIRING == _TYPE_STRING:
+                value = data[pos : pos + length]
+                pos += length
+            else:
+                value, pos = _load_collection(data, pos, record_type & ~_EXPIRING, length, keyspace.encoding_limits)
+            if expire_at is None or expire_at > now:
+                keyspace.set(key, value, expire_at)
+            loaded += 1
+    except (struct.error, UnicodeDecodeError) as e:
+        msg = f"Invalid record at offset {pos}"
+        raise SnapshotError(msg) from e
+
+    if pos != end:
+        msg = "Records overrun the end of the snapshot"
+        raise SnapshotError(msg)
+
+    return loaded
+
+
+def _load_collection(
+    data: mmap.mmap,
+    pos: int,
+    record_type: int,
+    count: int,
+    limits: EncodingLimits,
+) -> tuple[Collection, int]:
+    unpack_element = _ELEMENT.unpack_from
+    elements = []
+    for _ in range(count):
+        (length,) = unpack_element(data, pos)
+        pos += _ELEMENT.size
+        elements.append(data[pos : pos + length])
+        pos += length
+
+    # Built as the commands would, so each gets the encoding its size calls for
+    collection: Collection
+    if record_type == _TYPE_HASH:
+        collection = Hash()
+        for field, value in zip(elements[::2], elements[1::2], strict=True):
+            collection.set(field, value, limits)
+    elif record_type == _TYPE_LIST:
+        collection = List()
+        collection.push_right(elements, limits)
+    elif record_type == _TYPE_ZSET:
+        collection = ZSet()
+        for member, score in zip(elements[::2], elements[1::2], strict=True):
+            collection.add(member, _SCORE.unpack(score)[0], limits)
+    else:
+        collection = Set()
+        for member in elements:
+            collection.add(member, limits)
+
+    return collection, pos
@@ -0,0 +1,319 @@
+import itertools
+import math
+import operator
+import time
+from collections import Counter, deque
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+
+# Latencies are kept in log-linear buckets, as in HdrHistogram: exact below
+# _SUB_BUCKETS, then _SUB_BUCKETS / 2 buckets for each power of two, so every
+# recorded value is within about 3% of its bucket's lower bound
+_SUB_BUCKET_BITS = 6
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_HALF_SUB_BUCKETS = _SUB_BUCKETS >> 1
+# Values above this many nanoseconds (about 18 minutes) share the last bucket
+_MAX_TRACKABLE_NS = 2**40
+_NUM_BUCKETS = (_MAX_TRACKABLE_NS.bit_length() - _SUB_BUCKET_BITS + 2) * _HALF_SUB_BUCKETS
+_LAST_BUCKET = _NUM_BUCKETS - 1
+# Latencies waiting to be added to a histogram are first grouped to this many
+# bits, which is finer than the buckets for all but the smallest latencies
+_PENDING_SHIFT = 4
+
+# Percentiles reported by INFO latencystats, as Redis's latency-tracking-info-percentiles
+LATENCY_PERCENTILES = (50.0, 99.0, 99.9)
+
+# As Redis, slow log entries keep at most this many arguments, each truncated
+_SLOWLOG_MAX_ARGS = 32
+_SLOWLOG_MAX_ARG_LENGTH = 128
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_BUCKETS:
+        return value
+
+    shift = value.bit_length() - _SUB_BUCKET_BITS
+    return shift * _HALF_SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_lower_bound(index: int) -> int:
+    if index < _SUB_BUCKETS:
+        return index
+
+    shift, top = divmod(index, _HALF_SUB_BUCKETS)
+    return (top + _HALF_SUB_BUCKETS) << (shift - 1)
+
+
+class LatencyHistogram:
+    # Counts of nanosecond latencies, which can be recorded in constant time
+    # and answer any percentile to within the bucket precision
+    __slots__ = ("counts",)
+
+    def __init__(self) -> None:
+        self.counts = [0] * _NUM_BUCKETS
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def record(self, value: int, count: int = 1) -> None:
+        self.counts[min(_bucket_index(value), _LAST_BUCKET)] += count
+
+    def percentile(self, percent: float) -> int:
+        # The lower bound of the bucket holding the given percentile
+        target = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return _bucket_lower_bound(index)
+
+        return 0
+
+    def reset(self) -> None:
+        self.counts = [0] * _NUM_BUCKETS
+
+
+@dataclass(slots=True)
+class CommandStats:
+    name: str
+    calls: int = 0
+    total_ns: int = 0
+    failed_calls: int = 0
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # Durations recorded since the last aggregate()
+    pending: list[int] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class SlowLogEntry:
+    id: int
+    # Seconds since the epoch at which the command ran
+    timestamp: int
+    duration_us: int
+    args: list[str]
+
+
+class SlowLog:
+    # Commands that took longer than a threshold, newest first, as Redis's
+    # SLOWLOG. A negative threshold disables it
+    def __init__(self, slower_than_us: int = 10_000, max_len: int = 128) -> None:
+        self.slower_than_ns = slower_than_us * 1000
+        self._entries: deque[SlowLogEntry] = deque(maxlen=max_len)
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, cmd: list[str], duration_ns: int) -> None:
+        args = [arg if len(arg) <= _SLOWLOG_MAX_ARG_LENGTH else _truncated(arg) for arg in cmd[:_SLOWLOG_MAX_ARGS]]
+        if len(cmd) > _SLOWLOG_MAX_ARGS:
+            args[-1] = f"... ({len(cmd) - _SLOWLOG_MAX_ARGS + 1} more arguments)"
+
+        self._entries.appendleft(SlowLogEntry(self._next_id, int(time.time()), duration_ns // 1000, args))
+        self._next_id += 1
+
+    def get(self, count: int | None = None) -> list[SlowLogEntry]:
+        entries = list(self._entries)
+        return entries if count is None or count < 0 else entries[:count]
+
+    def reset(self) -> None:
+        self._entries.clear()
+
+
+def _truncated(arg: str) -> str:
+    extra = len(arg) - _SLOWLOG_MAX_ARG_LENGTH
+    return f"{arg[:_SLOWLOG_MAX_ARG_LENGTH]}... ({extra} more bytes)"
+
+
+class ServerStats:
+    # Counters for INFO. Recording a command only appends its duration to a
+    # list, and the lists are aggregated in bulk by the server's cron, which
+    # counts them with builtins rather than bytecode, keeping the cost per
+    # command to a small fraction of the command itself
+    def __init__(
+        self,
+        command_names: Iterable[str],
+        *,
+        latency_tracking: bool = True,
+        slowlog: SlowLog | None = None,
+    ) -> None:
+        self.started_at = time.time()
+        self.latency_tracking = latency_tracking
+        self.slowlog = slowlog if slowlog is not None else SlowLog()
+        # One comparison per command, whether or not the slow log is enabled
+        self._slowlog_threshold_ns = self.slowlog.slower_than_ns if self.slowlog.slower_than_ns >= 0 else math.inf
+        # Keyed by both upper and lower case names, as the command table is
+        self._commands: dict[str, CommandStats] = {}
+        for name in command_names:
+            stats = self._commands.setdefault(name.lower(), CommandStats(name.lower()))
+            self._commands[name.upper()] = stats
+        self._pending = {name: stats.pending for name, stats in self._commands.items()}
+        self._unique = sorted({id(stats): stats for stats in self._commands.values()}.values(), key=lambda s: s.name)
+        self.total_connections_received = 0
+        # Connections refused for being over maxclients, and clients closed for
+        # being idle for longer than the timeout
+        self.rejected_connections = 0
+        self.timeout_disconnections = 0
+        self.net_input_bytes = 0
+        self.net_output_bytes = 0
+        # Requests that could not be parsed, and replies that could not be encoded
+        self.protocol_errors = 0
+        self.serialise_errors = 0
+        # Clients disconnected for not reading their replies
+        self.output_buffer_disconnections = 0
+        # Bytes of the replication stream sent to replicas and received from a
+        # primary, and the resyncs served
+        self.repl_output_bytes = 0
+        self.repl_input_bytes = 0
+        self.sync_full = 0
+        self.sync_partial_ok = 0
+        self.sync_partial_err = 0
+        # Error replies by their prefix, e.g. ERR or WRONGTYPE
+        self.error_replies: Counter[str] = Counter()
+
+    @property
+    def total_commands_processed(self) -> int:
+        return sum(stats.calls for stats in self.command_stats())
+
+    def record_command(self, cmd: list[str], duration_ns: int) -> None:
+        pending = self._pending.get(cmd[0])
+        if pending is None:
+            pending = self._pending.get(cmd[0].upper())
+            if pending is None:
+                return
+
+        pending.append(duration_ns)
+        if duration_ns > self._slowlog_threshold_ns:
+            self.slowlog.add(cmd, duration_ns)
+
+    def record_failure(self, cmd: list[str]) -> None:
+        stats = self._commands.get(cmd[0]) or self._commands.get(cmd[0].upper())
+        if stats is not None:
+            stats.failed_calls += 1
+
+    def aggregate(self) -> None:
+        for stats in self._unique:
+            pending = stats.pending
+            if not pending:
+                continue
+
+            stats.calls += len(pending)
+            stats.total_ns += sum(pending)
+            if self.latency_tracking:
+                grouped = Counter(map(operator.rshift, pending, itertools.repeat(_PENDING_SHIFT)))
+                for value, count in grouped.items():
+                    stats.histogram.record(value << _PENDING_SHIFT, count)
+            pending.clear()
+
+    def record_error(self, message: str) -> None:
+        self.error_replies[message.split(" ", 1)[0]] += 1
+
+    def command_stats(self) -> list[CommandStats]:
+        # Commands that have been called, once each, in name order
+        self.aggregate()
+        return [stats for stats in self._unique if stats.calls]
+
+    def reset(self) -> None:
+        # As CONFIG RESETSTAT
+        for stats in self._unique:
+            stats.calls = stats.total_ns = stats.failed_calls = 0
+            stats.histogram.reset()
+            stats.pending.clear()
+        self.total_connections_received = 0
+        self.rejected_connections = self.timeout_disconnections = 0
+        self.net_input_bytes = self.net_output_bytes = 0
+        self.protocol_errors = self.serialise_errors = 0
+        self.output_buffer_disconnections = 0
+        self.repl_output_bytes = self.repl_input_bytes = 0
+        self.sync_full = self.sync_partial_ok = self.sync_partial_err = 0
+        self.error_replies.clear()
+
+
+InfoSection = Mapping[str, object]
+
+
+def format_info(sections: Mapping[str, InfoSection]) -> str:
+    # INFO's format: a "# Title" line, then field:value lines, per section
+    parts = []
+    for title, fields in sections.items():
+        lines = [f"# {title}", *(f"{name}:{value}" for name, value in fields.items())]
+        parts.append("\r\n".join(lines) + "\r\n")
+
+    return "\r\n".join(parts)
+
+
+def command_stats_section(stats: ServerStats) -> dict[str, str]:
+    section = {}
+    for command in stats.command_stats():
+        usec = command.total_ns // 1000
+        section[f"cmdstat_{command.name}"] = (
+            f"calls={command.calls},usec={usec},usec_per_call={usec / command.calls:.2f},"
+            f"failed_calls={command.failed_calls}"
+        )
+
+    return section
+
+
+def latency_stats_section(stats: ServerStats) -> dict[str, str]:
+    section = {}
+    for command in stats.command_stats():
+        if command.histogram.count:
+            section[f"latency_percentiles_usec_{command.name}"] = ",".join(
+                f"p{percent:g}={command.histogram.percentile(percent) / 1000:.3f}" for percent in LATENCY_PERCENTILES
+            )
+
+    return section
+
+
+def error_stats_section(stats: ServerStats) -> dict[str, str]:
+    return {f"errorstat_{prefix}": f"count={count}" for prefix, count in sorted(stats.error_replies.items())}
+
+
+def render_prometheus(stats: ServerStats, gauges: Mapping[str, float]) -> str:
+    # The Prometheus text exposition format. Latencies are exported as
+    # summaries, as the histogram buckets are too fine to export directly
+    lines = []
+    for name, value in gauges.items():
+        lines += [f"# TYPE whodis_{name} gauge", f"whodis_{name} {value}"]
+
+    counters = {
+        "connections_received_total": stats.total_connections_received,
+        "rejected_connections_total": stats.rejected_connections,
+        "timeout_disconnections_total": stats.timeout_disconnections,
+        "commands_processed_total": stats.total_commands_processed,
+        "net_input_bytes_total": stats.net_input_bytes,
+        "net_output_bytes_total": stats.net_output_bytes,
+        "protocol_errors_total": stats.protocol_errors,
+        "serialise_errors_total": stats.serialise_errors,
+        "output_buffer_disconnections_total": stats.output_buffer_disconnections,
+        "repl_output_bytes_total": stats.repl_output_bytes,
+        "repl_input_bytes_total": stats.repl_input_bytes,
+        "sync_full_total": stats.sync_full,
+        "sync_partial_ok_total": stats.sync_partial_ok,
+        "sync_partial_err_total": stats.sync_partial_err,
+    }
+    for name, value in counters.items():
+        lines += [f"# TYPE whodis_{name} counter", f"whodis_{name} {value}"]
+
+    lines.append("# TYPE whodis_error_replies_total counter")
+    lines += [
+        f'whodis_error_replies_total{{prefix="{prefix}"}} {count}' for prefix, count in stats.error_replies.items()
+    ]
+
+    commands = stats.command_stats()
+    lines.append("# TYPE whodis_command_failed_calls_total counter")
+    lines += [f'whodis_command_failed_calls_total{{cmd="{c.name}"}} {c.failed_calls}' for c in commands]
+    lines.append("# TYPE whodis_command_duration_seconds summary")
+    for command in commands:
+        label = f'cmd="{command.name}"'
+        if command.histogram.count:
+            lines += [
+                f'whodis_command_duration_seconds{{{label},quantile="{percent / 100:g}"}} '
+                f"{command.histogram.percentile(percent) / 1e9:.9f}"
+                for percent in LATENCY_PERCENTILES
+            ]
+        lines.append(f"whodis_command_duration_seconds_sum{{{label}}} {command.total_ns / 1e9:.9f}")
+        lines.append(f"whodis_command_duration_seconds_count{{{label}}} {command.calls}")
+
+    return "\n".join(lines) + "\n"
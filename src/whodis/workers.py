@@ -0,0 +1,328 @@
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.context import SpawnProcess
+from multiprocessing.synchronize import Event
+from typing import cast
+
+from src.whodis.commands import CommandError, CommandTable, command_keys
+from src.whodis.config import Config
+from src.whodis.deserialise import find_reply_end
+from src.whodis.serialise import encode_command
+from src.whodis.shared import IncompleteMessageError
+
+# As in Redis Cluster, keys map to one of 16384 slots by CRC16, and each worker
+# owns a contiguous range of slots
+HASH_SLOTS = 16384
+
+WORKER_START_TIMEOUT = 10.0
+WORKER_STOP_TIMEOUT = 5.0
+
+
+def _crc16_table() -> tuple[int, ...]:
+    # CRC-16/XMODEM (polynomial 0x1021), the variant Redis Cluster uses
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xFFFF)
+
+    return tuple(table)
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[((crc >> 8) ^ byte) & 0xFF]
+
+    return crc
+
+
+def key_slot(key: str) -> int:
+    # Only the part of a key inside the first non-empty {...} is hashed, so
+    # related keys can be kept together with hash tags, e.g. {user:1}:name
+    data = key.encode()
+    start = data.find(b"{")
+    if start != -1:
+        end = data.find(b"}", start + 1)
+        if end > start + 1:
+            data = data[start + 1 : end]
+
+    return crc16(data) % HASH_SLOTS
+
+
+@dataclass(frozen=True)
+class WorkerTopology:
+    worker_id: int
+    num_workers: int
+    # Where each worker listens for commands forwarded by the others
+    socket_dir: str
+
+    def owner(self, key: str) -> int:
+        return key_slot(key) * self.num_workers // HASH_SLOTS
+
+    def socket_path(self, worker_id: int) -> str:
+        return os.path.join(self.socket_dir, f"worker-{worker_id}.sock")  # noqa: PTH118
+
+
+class PeerRouter:
+    # Sends commands for keys owned by other workers to them over Unix sockets,
+    # keeping one pipelined connection per peer
+    def __init__(self, topology: WorkerTopology, table: CommandTable | None = None) -> None:
+        self.topology = topology
+        self._table = table
+        self._links: dict[int, _PeerLink] = {}
+        self._connecting: dict[int, asyncio.Future[_PeerLink]] = {}
+
+    def route(self, cmd: list[str]) -> int | None:
+        # Returns the worker to forward a command to, or None to run it here
+        keys = command_keys(cmd, self._table)
+        if not keys:
+            return None
+
+        owner = self.topology.owner(keys[0])
+        if any(self.topology.owner(key) != owner for key in keys[1:]):
+            msg = "CROSSSLOT Keys in request don't hash to the same worker"
+            raise CommandError(msg)
+
+        return None if owner == self.topology.worker_id else owner
+
+    def forward(self, worker_id: int, cmd: list[str]) -> asyncio.Future[bytes]:
+        payload = encode_command(cmd)
+        link = self._links.get(worker_id)
+        if link is not None and not link.closed:
+            return link.request(payload)
+
+        return asyncio.ensure_future(self._forward_when_connected(worker_id, payload))
+
+    def broadcast(self, cmd: list[str]) -> None:
+        # Sends a command to every other worker without waiting for the replies
+        for worker_id in range(self.topology.num_workers):
+            if worker_id != self.topology.worker_id:
+                self.forward(worker_id, cmd).add_done_callback(_discard_reply)
+
+    def close(self) -> None:
+        for link in self._links.values():
+            link.close()
+
+    async def _forward_when_connected(self, worker_id: int, payload: bytes) -> bytes:
+        # Requests that arrive while a connection is being made share it
+        connecting = self._connecting.get(worker_id)
+        if connecting is None:
+            connecting = asyncio.ensure_future(self._connect(worker_id))
+            self._connecting[worker_id] = connecting
+            connecting.add_done_callback(lambda _: self._connecting.pop(worker_id, None))
+
+        link = await asyncio.shield(connecting)
+        return await link.request(payload)
+
+    async def _connect(self, worker_id: int) -> "_PeerLink":
+        loop = asyncio.get_running_loop()
+        _, link = await loop.create_unix_connection(_PeerLink, self.topology.socket_path(worker_id))
+        self._links[worker_id] = link
+        return link
+
+
+def _discard_reply(reply: asyncio.Future[bytes]) -> None:
+    # Retrieves any exception so that it isn't logged as never retrieved
+    if not reply.cancelled():
+        reply.exception()
+
+
+class _PeerLink(asyncio.Protocol):
+    def __init__(self) -> None:
+        self._transport: asyncio.Transport | None = None
+        self._waiters: deque[asyncio.Future[bytes]] = deque()
+        self._buffer = bytearray()
+        self._outgoing = bytearray()
+        self.closed = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = cast("asyncio.Transport", transport)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.closed = True
+        self._transport = None
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(exc or ConnectionError("Worker connection closed"))
+
+    def data_received(self, data: bytes) -> None:
+        # Replies come back in request order, so each one answers the oldest
+        # outstanding request
+        buffer = self._buffer
+        buffer += data
+        pos = 0
+        try:
+            while pos < len(buffer):
+                end = find_reply_end(buffer, pos)
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(bytes(buffer[pos:end]))
+                pos = end
+        except IncompleteMessageError:
+            pass
+
+        del buffer[:pos]
+
+    def request(self, payload: bytes) -> asyncio.Future[bytes]:
+        waiter = asyncio.get_running_loop().create_future()
+        if self._transport is None:
+            waiter.set_exception(ConnectionError("Worker connection closed"))
+            return waiter
+
+        # Requests made while handling one client read are sent together, once
+        # the loop gets round to it
+        if not self._outgoing:
+            waiter.get_loop().call_soon(self._send)
+        self._outgoing += payload
+        self._waiters.append(waiter)
+        return waiter
+
+    def _send(self) -> None:
+        if self._transport is not None:
+            self._transport.write(self._outgoing)
+        self._outgoing = bytearray()
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+
+class Supervisor:
+    # Runs a WhodisServer in each of num_workers processes. Every worker binds
+    # the same port with SO_REUSEPORT, so the kernel spreads connections across
+    # them, and owns one partition of the keyspace
+    def __init__(self, host: str = "", port: int = 6379, num_workers: int = 2, config: Config | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.config = config or Config()
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list[SpawnProcess] = []
+        self._socket_dir: str | None = None
+        self._reserved: socket.socket | None = None
+        self._bound_port: int | None = None
+        self._stopping = threading.Event()
+        self._wake_reader, self._wake_writer = multiprocessing.Pipe(duplex=False)
+        self._monitor: threading.Thread | None = None
+
+    @property
+    def bound_port(self) -> int:
+        if self._bound_port is None:
+            msg = "Supervisor not started"
+            raise RuntimeError(msg)
+
+        return self._bound_port
+
+    @property
+    def worker_pids(self) -> list[int | None]:
+        return [process.pid for process in self._processes]
+
+    def start(self) -> None:
+        self._socket_dir = tempfile.mkdtemp(prefix="whodis-workers-")
+        # Holding a bound (but not listening) socket reserves the port, which
+        # lets every worker join it when an ephemeral port is requested
+        self._reserved = reuseport_socket()
+        self._reserved.bind((self.host, self.port))
+        self._bound_port = self._reserved.getsockname()[1]
+
+        self._processes = [self._spawn(worker_id) for worker_id in range(self.num_workers)]
+        self._monitor = threading.Thread(target=self._supervise, name="whodis-supervisor", daemon=True)
+        self._monitor.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake_writer.send(None)
+        if self._monitor is not None:
+            self._monitor.join(timeout=WORKER_STOP_TIMEOUT)
+
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+        for process in self._processes:
+            process.join(timeout=WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+        if self._reserved is not None:
+            self._reserved.close()
+
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def _spawn(self, worker_id: int) -> SpawnProcess:
+        if self._socket_dir is None:
+            msg = "Supervisor not started"
+            raise RuntimeError(msg)
+
+        topology = WorkerTopology(worker_id, self.num_workers, self._socket_dir)
+        ready = self._context.Event()
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.host, self.bound_port, self.config, topology, ready),
+            name=f"whodis-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        if not ready.wait(timeout=WORKER_START_TIMEOUT):
+            process.kill()
+            msg = f"Worker {worker_id} failed to start"
+            raise RuntimeError(msg)
+
+        return process
+
+    def _supervise(self) -> None:
+        # Restarts workers that exit unexpectedly. A restarted worker reloads
+        # its partition from its own AOF when appendonly is on, or else from
+        # its last snapshot, so it loses writes made since that was saved; with
+        # neither, it starts empty
+        while not self._stopping.is_set():
+            sentinels = [process.sentinel for process in self._processes]
+            multiprocessing.connection.wait([*sentinels, self._wake_reader])
+            if self._stopping.is_set():
+                return
+
+            for worker_id, process in enumerate(self._processes):
+                if not process.is_alive():
+                    process.join()
+                    self._processes[worker_id] = self._spawn(worker_id)
+
+
+def reuseport_socket() -> socket.socket:
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    return s
+
+
+def _run_worker(host: str, port: int, config: Config, topology: WorkerTopology, ready: Event) -> None:
+    # Imported here as the server module depends on this one
+    from src.whodis.server import WhodisServer  # noqa: PLC0415
+
+    # Signals are handled by this (main) thread only, after the server thread
+    # has started with them blocked
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+    server = WhodisServer(host, port, config, topology=topology)
+    server.start()
+    if not server.server_ready.is_set():
+        return
+
+    ready.set()
+    signal.sigwait({signal.SIGTERM, signal.SIGINT})
+    server.stop()